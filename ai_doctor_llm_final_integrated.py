@@ -1,11 +1,24 @@
 # ai_doctor_llm_final_integrated.py
-import requests
+import httpx
 import json
+import asyncio
 import getpass
 import os
+import time
 from dotenv import load_dotenv 
 from prediction_validator import PredictionValidator
 from medical_diagnostic_workflow import MedicalDiagnosticWorkflow
+from model_registry import disease_model_registry
+from llm_client import provider_client
+from llm_cache import PartialResponse, llm_cache
+from intake_state import intake_state_from_history, observe_message
+from symptom_extractor import RED_FLAG_TERMS
+from hard_rules import hard_rules
+from prediction_cache import prediction_cache
+from service_executors import ExecutorSaturated, inference_executor
+from document_summarizer import document_summarizer, estimate_tokens
+from document_index import document_index
+from service_metrics import metrics
 #local host: http://localhost:8000
 load_dotenv()
 
@@ -20,11 +33,11 @@ GEMINI_MODEL = "gemini-2.5-flash"
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "google/gemini-2.0-flash-001")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 HF_API_KEY = os.getenv("HF_API_KEY")
 HF_MODEL = "meta-llama/Llama-2-7b-chat-hf" 
-HF_API_URL = "https://api-inference.huggingface.co/models/{model}"  
+HF_API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/{model}")  
 
 # Local Model Config (Ollama or Llamafile)
 LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL", "http://127.0.0.1:8000/v1")  # Ollama API
@@ -594,68 +607,24 @@ def answer_followup_question(user_question: str, diagnosis_data: dict) -> str:
 def get_diagnosis_from_ml_model(clinical_text: str, token: str):
     """
     Directly calls the ML model for diagnosis without HTTP roundtrip.
+    The model is loaded once per process by model_registry and reused across diagnoses.
     Falls back to inference-based diagnosis if model is not available.
     """
     try:
-        # Import here to avoid circular imports
-        from transformers import AutoTokenizer, AutoModelForSequenceClassification
-        import torch
-        import os
-        import numpy as np
-        
-        MODEL_DIR = "medimate-disease-model"
-        BASE_MODEL = "emilyalsentzer/Bio_ClinicalBERT"
-        
-        # Check if model directory exists
-        if not os.path.exists(MODEL_DIR):
-            print(f"[INFO] Model directory not found: {MODEL_DIR}")
+        ml_model = disease_model_registry.get()
+        if ml_model is None:
+            print(f"[INFO] ML model unavailable: {disease_model_registry.last_error}")
             print("[INFO] Using inference-based diagnosis instead...")
             return get_fallback_diagnosis(clinical_text)
         
         try:
-            # Load Labels
-            label_file = os.path.join(MODEL_DIR, "label_classes.npy")
-            if not os.path.exists(label_file):
-                print(f"[INFO] Label file not found: {label_file}")
-                print("[INFO] Using inference-based diagnosis instead...")
-                return get_fallback_diagnosis(clinical_text)
-                
-            labels = np.load(label_file, allow_pickle=True).tolist()
-            id2label_map = {i: label for i, label in enumerate(labels)}
-            
-            # Load Tokenizer & Model
-            print(f"[ML MODEL] Loading tokenizer from {BASE_MODEL}...")
-            tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-            
-            print(f"[ML MODEL] Loading model from {MODEL_DIR}...")
-            ml_model = AutoModelForSequenceClassification.from_pretrained(
-                MODEL_DIR, 
-                local_files_only=True,
-                num_labels=len(labels),
-                ignore_mismatched_sizes=True
-            )
-            ml_model.eval()
-            
-            # Tokenize input
+            # Tokenize input and get prediction
             print(f"[ML MODEL] Processing text: {clinical_text[:100]}...")
-            inputs = tokenizer(
-                clinical_text,
-                return_tensors="pt",
-                truncation=True,
-                max_length=128,
-                padding=True
-            )
-            
-            # Get prediction
-            with torch.no_grad():
-                outputs = ml_model(**inputs)
-                logits = outputs.logits
-                predictions = torch.softmax(logits, dim=-1)
-                predicted_class = torch.argmax(predictions, dim=-1).item()
-                confidence = predictions[0][predicted_class].item()
+            prediction = ml_model.predict([clinical_text])[0]
+            confidence = prediction["confidence"]
             
             # Map prediction to label
-            predicted_disease = id2label_map.get(predicted_class, "Unknown")
+            predicted_disease = prediction["label"] or "Unknown"
             
             print(f"[ML MODEL] Prediction: {predicted_disease} (confidence: {confidence:.2%})")
             
@@ -667,7 +636,7 @@ def get_diagnosis_from_ml_model(clinical_text: str, token: str):
             }
             
         except Exception as e:
-            print(f"[ML MODEL ERROR] Failed to load/run model: {str(e)}")
+            print(f"[ML MODEL ERROR] Failed to run model: {str(e)}")
             print(f"[INFO] Falling back to inference-based diagnosis...")
             return get_fallback_diagnosis(clinical_text)
             
@@ -827,27 +796,116 @@ def generate_phase2_diagnosis_response(disease: str, severity: str, symptoms: li
     return "".join(response_parts)
 
 # --- TOOL 1B: PREDICTION VALIDATION AND ERROR CORRECTION ---
-def validate_and_correct_prediction(prediction_result: dict, 
-                                    symptoms: list, 
-                                    duration: str, 
-                                    severity: str) -> dict:
+# How long a diagnosis turn waits for the AI check before answering without it (<= 0: no limit)
+AI_VALIDATION_BUDGET_SECONDS = float(os.getenv("AI_VALIDATION_BUDGET_SECONDS", "8"))
+# AI checks running at once across the process; past it, a diagnosis goes out without one
+AI_VALIDATION_MAX_IN_FLIGHT = int(os.getenv("AI_VALIDATION_MAX_IN_FLIGHT", "32"))
+
+NO_AI_VALIDATION = {"match": None, "suggested": None, "confidence": "unknown"}
+
+_validation_tasks = set()  # AI checks still running (tasks are only weakly referenced by the loop)
+
+
+async def ai_validate_diagnosis(disease: str, symptoms: list, duration: str, severity: str) -> dict:
     """
-    Validates ML prediction against training data patterns.
-    If prediction is incorrect, attempts to auto-correct it using AI and training data.
+    Ask Gemini to validate if ML diagnosis matches the symptoms. Returns gracefully on timeout.
     
-    THREE-STAGE VALIDATION:
-    1. Hard rules - catch obviously impossible diagnoses
-    2. Validator confidence - compare against training data patterns
-    3. AI secondary check - Gemini validates diagnosis vs collected symptoms
-    
-    Returns:
-        {
-            "disease": str,
-            "severity": str,
-            "was_corrected": bool,
-            "correction_reason": str,
-            "validation_report": dict
+    Runs as a task next to the reply (start_prediction_validation); cancelling the
+    task drops the provider request mid-stream.
+    """
+    try:
+        symptom_list = ", ".join(symptoms) if symptoms else "unknown"
+        validation_prompt = (
+            f"A patient reported these symptoms:\n"
+            f"- Symptoms: {symptom_list}\n"
+            f"- Duration: {duration}\n"
+            f"- Severity: {severity}\n\n"
+            f"The ML model predicted: {disease}\n\n"
+            f"Question: Does this diagnosis match the reported symptoms?\n"
+            f"Reply in this format:\n"
+            f"MATCH: YES/NO\n"
+            f"CONFIDENCE: high/medium/low\n"
+            f"IF NO, SUGGEST: [alternative diagnosis]\n"
+            f"REASON: [brief explanation]\n"
+        )
+
+        print(f"\n[AI VALIDATION] Asking Gemini to validate '{disease}'...")
+
+        if LLM_PROVIDER == "openrouter":
+            response_text = await call_openrouter_api(
+                [{"role": "user", "parts": [{"text": validation_prompt}]}],
+                system_prompt="You are a medical diagnosis validator. Check if diagnoses match reported symptoms."
+            )
+        elif LLM_PROVIDER == "local":
+            response_text = await call_local_model_api([{"role": "user", "parts": [{"text": validation_prompt}]}])
+        elif LLM_PROVIDER == "huggingface":
+            response_text = await call_huggingface_api([{"role": "user", "parts": [{"text": validation_prompt}]}])
+        else:
+            if not gemini_client:
+                print("[AI VALIDATION] Gemini client not available, skipping AI validation")
+                return dict(NO_AI_VALIDATION)
+            response_text = await call_gemini_api([{"role": "user", "parts": [{"text": validation_prompt}]}])
+        
+        # Check if response is empty
+        if not response_text:
+            print("[AI VALIDATION] Empty response, skipping validation")
+            return dict(NO_AI_VALIDATION)
+
+        # Parse AI response
+        result = {
+            "match": None,
+            "suggested": None,
+            "confidence": "unknown",
+            "reason": ""
         }
+
+        if response_text:
+            lower_response = response_text.lower()
+
+            # Extract MATCH status
+            if "match:" in lower_response:
+                match_part = lower_response.split("match:")[1].split("\n")[0].strip()
+                result["match"] = "yes" in match_part
+
+            # Extract SUGGESTION
+            if "suggest:" in lower_response:
+                suggest_part = lower_response.split("suggest:")[1].split("\n")[0].strip()
+                if "[" in suggest_part:
+                    result["suggested"] = suggest_part.split("[")[1].split("]")[0].strip()
+                else:
+                    result["suggested"] = suggest_part.strip()
+
+            # Extract CONFIDENCE
+            if "confidence:" in lower_response:
+                conf_part = lower_response.split("confidence:")[1].split("\n")[0].strip().lower()
+                if conf_part in ["high", "medium", "low", "unknown"]:
+                    result["confidence"] = conf_part
+
+            # Extract REASON
+            if "reason:" in lower_response:
+                reason_part = lower_response.split("reason:")[1].strip()
+                result["reason"] = reason_part[:200]
+
+        print(f"[AI VALIDATION RESULT] Match: {result['match']}, Confidence: {result['confidence']}")
+        return result
+
+    except httpx.TimeoutException:
+        print(f"[AI VALIDATION TIMEOUT] API took too long, skipping validation")
+        return dict(NO_AI_VALIDATION)
+    except httpx.ConnectError:
+        print(f"[AI VALIDATION ERROR] Cannot connect to API, skipping validation")
+        return dict(NO_AI_VALIDATION)
+    except Exception as e:
+        print(f"[AI VALIDATION ERROR] {str(e)}, skipping validation")
+        return dict(NO_AI_VALIDATION)
+
+def _check_prediction_rules(prediction_result: dict, symptoms: list, duration: str, severity: str):
+    """
+    Stages 1 and 2 (validator, hard rules, low-confidence correction).
+    
+    Returns (result, None) when one of them decides the outcome on its own, or
+    (None, context) when the AI check is still needed; context is what
+    _apply_ai_validation needs to finish the job.
     """
     global validator
     
@@ -867,7 +925,7 @@ def validate_and_correct_prediction(prediction_result: dict,
                 "was_corrected": False,
                 "correction_reason": "Validator initialization failed",
                 "validation_report": {}
-            }
+            }, None
     
     predicted_disease = prediction_result.get("disease", "Unknown")
     predicted_severity = prediction_result.get("severity", "mild")
@@ -880,101 +938,6 @@ def validate_and_correct_prediction(prediction_result: dict,
         predicted_disease=predicted_disease
     )
     
-    # STAGE 3: AI SECONDARY VALIDATION (with timeout protection)
-    # Ask Gemini if the ML diagnosis makes sense for the collected symptoms
-    def ai_validate_diagnosis(disease: str, symptoms: list, duration: str, severity: str) -> dict:
-        """Ask Gemini to validate if ML diagnosis matches the symptoms. Returns gracefully on timeout."""
-        try:
-            symptom_list = ", ".join(symptoms) if symptoms else "unknown"
-            validation_prompt = (
-                f"A patient reported these symptoms:\n"
-                f"- Symptoms: {symptom_list}\n"
-                f"- Duration: {duration}\n"
-                f"- Severity: {severity}\n\n"
-                f"The ML model predicted: {disease}\n\n"
-                f"Question: Does this diagnosis match the reported symptoms?\n"
-                f"Reply in this format:\n"
-                f"MATCH: YES/NO\n"
-                f"CONFIDENCE: high/medium/low\n"
-                f"IF NO, SUGGEST: [alternative diagnosis]\n"
-                f"REASON: [brief explanation]\n"
-            )
-            
-            print(f"\n[AI VALIDATION] Asking Gemini to validate '{disease}'...")
-            
-            if LLM_PROVIDER == "openrouter":
-                response_text = call_openrouter_api(
-                    [{"role": "user", "parts": [{"text": validation_prompt}]}],
-                    system_prompt="You are a medical diagnosis validator. Check if diagnoses match reported symptoms."
-                )
-            elif LLM_PROVIDER == "local":
-                response_text = call_local_model_api([{"role": "user", "parts": [{"text": validation_prompt}]}])
-            elif LLM_PROVIDER == "huggingface":
-                response_text = call_huggingface_api([{"role": "user", "parts": [{"text": validation_prompt}]}])
-            else:
-                if not gemini_client:
-                    print("[AI VALIDATION] Gemini client not available, skipping AI validation")
-                    return {"match": None, "suggested": None, "confidence": "unknown"}
-                response = gemini_client.models.generate_content(
-                    model=GEMINI_MODEL,
-                    contents=[{"role": "user", "parts": [{"text": validation_prompt}]}],
-                )
-                response_text = response.text
-            
-            # Check if response is empty
-            if not response_text:
-                print("[AI VALIDATION] Empty response, skipping validation")
-                return {"match": None, "suggested": None, "confidence": "unknown"}
-            
-            # Parse AI response
-            result = {
-                "match": None,
-                "suggested": None,
-                "confidence": "unknown",
-                "reason": ""
-            }
-            
-            if response_text:
-                lower_response = response_text.lower()
-                
-                # Extract MATCH status
-                if "match:" in lower_response:
-                    match_part = lower_response.split("match:")[1].split("\n")[0].strip()
-                    result["match"] = "yes" in match_part
-                
-                # Extract SUGGESTION
-                if "suggest:" in lower_response:
-                    suggest_part = lower_response.split("suggest:")[1].split("\n")[0].strip()
-                    if "[" in suggest_part:
-                        result["suggested"] = suggest_part.split("[")[1].split("]")[0].strip()
-                    else:
-                        result["suggested"] = suggest_part.strip()
-                
-                # Extract CONFIDENCE
-                if "confidence:" in lower_response:
-                    conf_part = lower_response.split("confidence:")[1].split("\n")[0].strip().lower()
-                    if conf_part in ["high", "medium", "low", "unknown"]:
-                        result["confidence"] = conf_part
-                
-                # Extract REASON
-                if "reason:" in lower_response:
-                    reason_part = lower_response.split("reason:")[1].strip()
-                    result["reason"] = reason_part[:200]
-            
-            print(f"[AI VALIDATION RESULT] Match: {result['match']}, Confidence: {result['confidence']}")
-            return result
-            
-        except requests.exceptions.Timeout:
-            print(f"[AI VALIDATION TIMEOUT] API took too long, skipping validation")
-            return {"match": None, "suggested": None, "confidence": "unknown"}
-        except requests.exceptions.ConnectionError:
-            print(f"[AI VALIDATION ERROR] Cannot connect to API, skipping validation")
-            return {"match": None, "suggested": None, "confidence": "unknown"}
-        except Exception as e:
-            print(f"[AI VALIDATION ERROR] {str(e)}, skipping validation")
-            return {"match": None, "suggested": None, "confidence": "unknown"}
-    
-    
     print(f"\n[VALIDATION] Confidence Score: {validation_result['confidence']:.2f}")
     print(f"[VALIDATION] Match Type: {validation_result['match_type']}")
     print(f"[VALIDATION] Reasoning: {validation_result['reasoning']}")
@@ -994,152 +957,25 @@ def validate_and_correct_prediction(prediction_result: dict,
     # Convert validation_result to Python types
     validation_result_clean = convert_numpy_types(validation_result)
     
-    # RUN AI SECONDARY VALIDATION (with timeout and error protection)
-    try:
-        ai_validation = ai_validate_diagnosis(predicted_disease, symptoms, duration, severity)
-    except Exception as e:
-        print(f"[CRITICAL ERROR] AI validation function failed: {str(e)}")
-        # Fallback: skip AI validation and continue with other checks
-        ai_validation = {"match": None, "suggested": None, "confidence": "unknown"}
-    
     # ==================== HARD RULES: IMPOSSIBLE DIAGNOSES ====================
-    # Prevent obviously wrong diagnoses that violate medical logic
+    # Prevent obviously wrong diagnoses that violate medical logic (hard_rules.json)
     
     print(f"\n[HARD RULES CHECK] Validating prediction: {predicted_disease}")
     print(f"Symptoms list: {symptoms}")
     print(f"Duration: {duration}")
     print(f"Severity: {severity}")
     
-    # Rule 1: Appendicitis REQUIRES abdominal pain
-    if predicted_disease.lower() == "appendicitis" and "abdominal pain" not in [s.lower() for s in symptoms] and "pain" not in [s.lower() for s in symptoms]:
-        print(f"[HARD RULE VIOLATION] Appendicitis requires abdominal pain, not just {symptoms}")
-        # Find most likely disease from symptoms
-        if symptoms and symptoms[0].lower() == "fever":
-            corrected_disease = "Influenza" if len(symptoms) > 1 else "Viral Fever"
-        else:
-            corrected_disease = validation_result_clean.get("suggested_disease", "Influenza")
-        
+    decision = hard_rules.evaluate(predicted_disease, predicted_severity, symptoms, duration, severity,
+                                   validation_result_clean)
+    if decision:
+        print(decision.log)
         return {
-            "disease": corrected_disease,
-            "severity": predicted_severity,
-            "was_corrected": True,
-            "correction_reason": f"Safety rule: {predicted_disease} requires abdominal pain, but patient only has {symptoms}. Corrected to {corrected_disease}.",
+            "disease": decision.disease,
+            "severity": decision.severity,
+            "was_corrected": decision.was_corrected,
+            "correction_reason": decision.reason,
             "validation_report": validation_result_clean
-        }
-    
-    # Rule 2: Dengue requires fever + SEVERE body aches/joint pain (NOT slight/mild), AND duration must be 12+ hours
-    if predicted_disease.lower() == "dengue":
-        has_fever = any(s.lower() in ["fever", "high fever"] for s in symptoms)
-        has_body_ache = any(s.lower() in ["body ache", "body aches", "joint pain", "joint ache", "pain"] for s in symptoms)
-        has_only_headache = "headache" in [s.lower() for s in symptoms] and not has_body_ache
-        duration_short = "hour" in duration.lower() or "less than" in duration.lower()
-        
-        # CRITICAL: Check if pain severity contradicts Dengue
-        # User said "slight body pain" or severity is only "mild" = NOT dengue (dengue requires severe pain)
-        is_pain_mild = severity.lower() == "mild"
-        user_said_slight = any(word in str(symptoms).lower() for word in ["slight", "little", "bit"])
-        
-        # Dengue should NOT be diagnosed if:
-        # 1. Patient only has headache (no body aches), OR
-        # 2. Symptoms only started <12 hours ago, OR
-        # 3. Less than 2 symptoms, OR
-        # 4. User explicitly said "slight" pain AND severity is mild
-        if (len(symptoms) < 2) or (has_only_headache) or (duration_short) or (is_pain_mild and user_said_slight):
-            print(f"[HARD RULE VIOLATION] Dengue requires fever+SEVERE body aches. Found: {symptoms} (severity: {severity}), Duration: {duration}")
-            corrected_disease = "Viral Fever"
-            
-            return {
-                "disease": corrected_disease,
-                "severity": predicted_severity,
-                "was_corrected": True,
-                "correction_reason": f"Safety rule: Dengue requires fever + SEVERE body aches for 12+ hours. Patient has {symptoms} with {severity} severity for {duration}. Corrected to Viral Fever.",
-                "validation_report": validation_result_clean
-            }
-
-    # Rule 2b: Viral Fever requires fever symptom; if absent, redirect to allergy-like diagnosis
-    if predicted_disease.lower() == "viral fever":
-        has_fever = any(s.lower() in ["fever", "high fever"] for s in symptoms)
-        if not has_fever:
-            print(f"[HARD RULE VIOLATION] Viral Fever requires fever. Patient symptoms: {symptoms}")
-            corrected_disease = "Allergic Rhinitis"
-            return {
-                "disease": corrected_disease,
-                "severity": predicted_severity,
-                "was_corrected": True,
-                "correction_reason": "Safety rule: Viral Fever requires fever symptom. No fever mentioned; redirected to allergy-like diagnosis.",
-                "validation_report": validation_result_clean
-            }
-    
-    # === MENINGITIS EMERGENCY RULE (CRITICAL) ===
-    # Meningitis triad: fever + severe headache + neck stiffness/light sensitivity
-    # This is LIFE-THREATENING and requires IMMEDIATE ER, NOT just doctor visit
-    has_fever = any(s.lower() in ["fever", "high fever"] for s in symptoms)
-    has_severe_headache = "headache" in [s.lower() for s in symptoms] and severity.lower() in ["severe", "7", "8", "9", "10"]
-    has_neck_stiffness = any(s.lower() in ["neck stiffness", "stiff neck"] for s in symptoms)
-    has_light_sensitivity = any(s.lower() in ["sensitivity to light", "light sensitivity", "photophobia"] for s in symptoms)
-    has_other_symptoms = len(symptoms) > 2  # Additional symptoms mentioned
-    
-    # Meningitis pattern: fever + severe headache + (neck stiffness OR light sensitivity)
-    if has_fever and has_severe_headache and (has_neck_stiffness or has_light_sensitivity):
-        print(f"[MENINGITIS EMERGENCY] CRITICAL PATTERN DETECTED!")
-        print(f"Symptoms: {symptoms}, Severity: {severity}, Duration: {duration}")
-        print(f"Fever: {has_fever}, Severe Headache: {has_severe_headache}, Neck Stiffness: {has_neck_stiffness}, Light Sensitivity: {has_light_sensitivity}")
-        
-        # Override ANY diagnosis with emergency meningitis warning
-        return {
-            "disease": "MENINGITIS_EMERGENCY",
-            "severity": "CRITICAL",
-            "was_corrected": True,
-            "correction_reason": "CRITICAL: Meningitis pattern detected (fever + severe headache + light sensitivity/neck stiffness). This is a medical emergency.",
-            "validation_report": validation_result_clean
-        }
-    
-    
-    # Rule 3: Pneumonia is ALWAYS at least MODERATE severity (never mild) - requires urgent doctor visit
-    # Yellow phlegm + cough + fever = bacterial infection, needs antibiotics
-    if predicted_disease.lower() == "pneumonia":
-        has_yellow_phlegm = any("yellow" in s.lower() or "phlegm" in s.lower() for s in symptoms)
-        has_cough = any("cough" in s.lower() for s in symptoms)
-        has_fever = any("fever" in s.lower() for s in symptoms)
-        
-        # Pneumonia with respiratory symptoms MUST be moderate or severe, never mild
-        if has_cough and (has_fever or has_yellow_phlegm):
-            # Force severity to at least MODERATE for pneumonia cases
-            if predicted_severity.lower() == "mild":
-                print(f"[SEVERITY CORRECTION] Pneumonia diagnosed as mild - correcting to moderate (requires doctor visit)")
-                predicted_severity = "moderate"
-        
-        return {
-            "disease": predicted_disease,
-            "severity": predicted_severity,
-            "was_corrected": False,
-            "correction_reason": "Pneumonia severity adjusted if needed",
-            "validation_report": validation_result_clean
-        }
-    
-    # Rule 4: Anxiety Attack REQUIRES psychiatric/stress symptoms - NOT respiratory symptoms
-    # Anxiety Attack should NOT be diagnosed for cold, cough, sore throat, etc.
-    if predicted_disease.lower() == "anxiety attack" or predicted_disease.lower() == "anxiety":
-        respiratory_symptoms = ["cough", "runny nose", "sore throat", "cold", "sneeze", "congestion"]
-        has_respiratory = any(s.lower() in respiratory_symptoms for s in symptoms)
-        
-        if has_respiratory:
-            print(f"[HARD RULE VIOLATION] Anxiety Attack cannot be diagnosed for respiratory symptoms. Patient has {symptoms}")
-            # For respiratory symptoms, suggest appropriate diagnosis
-            if "cough" in [s.lower() for s in symptoms]:
-                corrected_disease = "Common Cold"
-            elif "sore throat" in [s.lower() for s in symptoms]:
-                corrected_disease = "Pharyngitis"
-            else:
-                corrected_disease = "Common Cold"
-            
-            return {
-                "disease": corrected_disease,
-                "severity": predicted_severity,
-                "was_corrected": True,
-                "correction_reason": f"Safety rule: Anxiety Attack cannot cause respiratory symptoms like {symptoms}. Corrected to {corrected_disease}.",
-                "validation_report": validation_result_clean
-            }
+        }, None
     
     # ALSO: Check if confidence is low and validator has a suggestion
     confidence = validation_result_clean.get("confidence", 1.0)
@@ -1157,7 +993,24 @@ def validate_and_correct_prediction(prediction_result: dict,
             "was_corrected": True,
             "correction_reason": f"Prediction confidence too low ({confidence:.0%}). ML model suggested '{predicted_disease}', but validator indicates '{corrected_disease}' is more likely for {symptoms}.",
             "validation_report": validation_result_clean
-        }
+        }, None
+    
+    return None, {
+        "symptoms": symptoms,
+        "predicted_disease": predicted_disease,
+        "predicted_severity": predicted_severity,
+        "confidence": confidence,
+        "validation_result_clean": validation_result_clean,
+    }
+
+
+def _apply_ai_validation(ai_validation: dict, context: dict) -> dict:
+    """Stage 3 (AI secondary check) and the validator's own correction, after _check_prediction_rules."""
+    symptoms = context["symptoms"]
+    predicted_disease = context["predicted_disease"]
+    predicted_severity = context["predicted_severity"]
+    confidence = context["confidence"]
+    validation_result_clean = context["validation_result_clean"]
     
     # ==================== STAGE 3: AI SECONDARY VALIDATION ====================
     # If AI says the diagnosis doesn't match symptoms, use AI's suggestion
@@ -1221,8 +1074,145 @@ def validate_and_correct_prediction(prediction_result: dict,
         "validation_report": validation_result_clean
     }
 
+class PendingValidation:
+    """
+    A prediction check whose AI stage may still be running as an asyncio task.
+    
+    decided is set when the deterministic stages settled the outcome (no LLM
+    call was made). Otherwise result() waits for the AI answer until the
+    deadline, then finishes the check without it and cancels the task.
+    complete tells whether the outcome had everything it asked for (rules
+    decided, or the AI answered), i.e. whether it may be cached.
+    """
+    
+    def __init__(self, decided: dict = None, context: dict = None, task=None, deadline=None):
+        self.decided = decided
+        self.context = context
+        self.task = task
+        self.deadline = deadline
+        self._result = decided
+        self.ai_answered = False
+    
+    @property
+    def needs_ai(self) -> bool:
+        return self.decided is None
+    
+    @property
+    def complete(self) -> bool:
+        return self.decided is not None or self.ai_answered
+    
+    async def result(self) -> dict:
+        if self._result is not None:
+            return self._result
+        ai_validation = dict(NO_AI_VALIDATION)
+        if self.task is not None:
+            waited = time.perf_counter()
+            timeout = None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+            try:
+                done, _ = await asyncio.wait({self.task}, timeout=timeout)
+            except asyncio.CancelledError:
+                self.cancel()  # the turn itself was cancelled (client gone)
+                raise
+            if not done:
+                print(f"[AI VALIDATION TIMEOUT] No answer within the {AI_VALIDATION_BUDGET_SECONDS:g}s budget, continuing without it")
+                metrics.inc("ai_validation.budget_exceeded")
+                self.cancel()
+            elif self.task.exception() is not None:
+                print(f"[CRITICAL ERROR] AI validation function failed: {str(self.task.exception())}")
+            else:
+                ai_validation = self.task.result()
+            metrics.observe("ai_validation.wait_seconds", time.perf_counter() - waited)
+            self.ai_answered = ai_validation.get("match") is not None
+        self._result = _apply_ai_validation(ai_validation, self.context)
+        return self._result
+    
+    def cancel(self):
+        """Stop waiting for the AI check and drop its provider request."""
+        if self.task is not None:
+            self.task.cancel()
+
+
+def _forget_validation(task):
+    _validation_tasks.discard(task)
+    metrics.set_gauge("ai_validation.in_flight", len(_validation_tasks))
+
+
+async def start_prediction_validation(prediction_result: dict, symptoms: list, duration: str, severity: str) -> PendingValidation:
+    """
+    Run the deterministic stages now (on the inference pool; they are CPU work)
+    and, only if they leave the outcome open, start the AI check as a task so the
+    caller can prepare its reply meanwhile. Await .result() on the returned
+    PendingValidation for the outcome.
+    """
+    decided, context = await inference_executor.run(_check_prediction_rules, prediction_result, symptoms, duration,
+                                                    severity)
+    if decided is not None:
+        print("[AI VALIDATION] Outcome decided by rules, skipping AI validation")
+        metrics.inc("ai_validation.skipped")
+        return PendingValidation(decided=decided)
+    
+    if len(_validation_tasks) >= AI_VALIDATION_MAX_IN_FLIGHT:
+        print(f"[AI VALIDATION] {len(_validation_tasks)} checks already in flight, continuing without AI validation")
+        metrics.inc("ai_validation.rejected")
+        return PendingValidation(context=context)
+    task = asyncio.ensure_future(ai_validate_diagnosis(context["predicted_disease"], symptoms, duration, severity))
+    _validation_tasks.add(task)
+    task.add_done_callback(_forget_validation)
+    metrics.set_gauge("ai_validation.in_flight", len(_validation_tasks))
+    metrics.inc("ai_validation.started")
+    deadline = time.monotonic() + AI_VALIDATION_BUDGET_SECONDS if AI_VALIDATION_BUDGET_SECONDS > 0 else None
+    return PendingValidation(context=context, task=task, deadline=deadline)
+
+
+async def validate_and_correct_prediction(prediction_result: dict, 
+                                          symptoms: list, 
+                                          duration: str, 
+                                          severity: str) -> dict:
+    """
+    Validates ML prediction against training data patterns.
+    If prediction is incorrect, attempts to auto-correct it using AI and training data.
+    
+    THREE-STAGE VALIDATION:
+    1. Hard rules - catch obviously impossible diagnoses
+    2. Validator confidence - compare against training data patterns
+    3. AI secondary check - Gemini validates diagnosis vs collected symptoms
+       (only when stages 1-2 did not decide; bounded by AI_VALIDATION_BUDGET_SECONDS)
+    
+    Returns:
+        {
+            "disease": str,
+            "severity": str,
+            "was_corrected": bool,
+            "correction_reason": str,
+            "validation_report": dict
+        }
+    """
+    return await (await start_prediction_validation(prediction_result, symptoms, duration, severity)).result()
+
+# --- TOOL 1A: GEMINI SDK WRAPPER ---
+@llm_cache.cached("gemini", GEMINI_MODEL)
+async def call_gemini_api(messages: list):
+    """
+    Calls Gemini through the SDK's async client. Errors propagate to the caller, as with
+    the inline calls this replaces.
+    
+    Args:
+        messages: List of message dicts with 'role' and 'parts' keys (Gemini format)
+        
+    Returns:
+        response_text: The model's response
+    """
+    response = await gemini_client.aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=messages,
+    )
+    return response.text
+
 # --- TOOL 1B: HUGGING FACE API WRAPPER ---
-def call_huggingface_api(messages: list):
+# Every provider call goes through llm_cache (llm_cache.py): repeated prompts are answered
+# from memory / disk. Callers can pass diagnosis= and cache_messages= to scope the key.
+@llm_cache.cached("huggingface", HF_MODEL)
+async def call_huggingface_api(messages: list):
     """
     Calls Hugging Face Inference API with text-generation endpoint.
     
@@ -1275,7 +1265,7 @@ def call_huggingface_api(messages: list):
         api_url = HF_API_URL.format(model=HF_MODEL.replace("/", "%2F"))
         print(f"[HF DEBUG] API URL: {api_url}")
         
-        response = requests.post(
+        response = await provider_client.post(
             api_url,
             headers=headers,
             json=payload,
@@ -1315,24 +1305,74 @@ def call_huggingface_api(messages: list):
             print(f"[HF ERROR] Unexpected response format: {result}")
             return None
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"[HF ERROR] Request timeout (60s). Model might be loading...")
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"[HF ERROR] API Error: {str(e)}")
         return None
     except Exception as e:
         print(f"[HF ERROR] Unexpected error: {str(e)}")
         return None
 
+# --- STREAMING HELPER (OpenAI-compatible chat completions) ---
+async def _stream_openai_completion(api_url: str, payload: dict, headers: dict, timeout: float, on_token, tag: str):
+    """
+    POST a chat completion with stream=True and pass each text delta to on_token
+    as it arrives (Server-Sent Events, "data: {...}" lines ending with "data: [DONE]").
+    
+    Returns the full response text, or None on an HTTP error. A timeout before the
+    first token is re-raised so the caller's retry logic still applies; a stream that
+    ends early (timeout after the first token, no [DONE]) returns the text received so
+    far as a PartialResponse, which llm_cache does not store.
+    """
+    pieces = []
+    done = False
+    try:
+        async with provider_client.stream(api_url, json=dict(payload, stream=True), headers=headers,
+                                          timeout=timeout) as response:
+            print(f"[{tag} DEBUG] Response status: {response.status_code} (streaming)")
+            if response.status_code != 200:
+                await response.aread()
+                print(f"[{tag} ERROR] HTTP {response.status_code}: {response.text}")
+                return None
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    done = True
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                choices = chunk.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    # Clean up special tokens
+                    delta = delta.replace("<|eot_id|>", "").replace("<|end_header_id|>", "")
+                    pieces.append(delta)
+                    on_token(delta)
+    except httpx.TimeoutException:
+        if not pieces:
+            raise
+        print(f"[{tag} WARN] Stream timed out after {len(pieces)} chunks, keeping partial response")
+    
+    response_text = "".join(pieces).strip()
+    print(f"[{tag} RESPONSE]: {response_text[:100]}...")
+    return response_text if done else PartialResponse(response_text)
+
 # --- TOOL 1C: OPENROUTER API WRAPPER (Gemini 2.0 Flash) ---
-def call_openrouter_api(messages: list, system_prompt: str = None):
+@llm_cache.cached("openrouter", OPENROUTER_MODEL)
+async def call_openrouter_api(messages: list, system_prompt: str = None, on_token=None):
     """
     Calls OpenRouter API for fastest Gemini 2.0 Flash responses.
     
     Args:
         messages: List of message dicts with 'role' and 'parts' keys (Gemini format)
         system_prompt: Optional system prompt to include as first message
+        on_token: Optional callback; if set, the response is streamed and each text chunk is passed to it
         
     Returns:
         response_text: The assistant's response
@@ -1384,14 +1424,17 @@ def call_openrouter_api(messages: list, system_prompt: str = None):
         for attempt in range(max_retries):
             try:
                 print(f"[OPENROUTER DEBUG] Attempt {attempt + 1}/{max_retries}, timeout={timeout_seconds}s")
-                response = requests.post(
+                if on_token:
+                    return await _stream_openai_completion(OPENROUTER_API_URL, payload, headers, timeout_seconds,
+                                                           on_token, "OPENROUTER")
+                response = await provider_client.post(
                     OPENROUTER_API_URL,
                     json=payload,
                     headers=headers,
                     timeout=timeout_seconds
                 )
                 break  # Success, exit retry loop
-            except requests.exceptions.Timeout:
+            except httpx.TimeoutException:
                 if attempt < max_retries - 1:
                     print(f"[OPENROUTER WARN] Timeout on attempt {attempt + 1}, retrying...")
                     timeout_seconds += 30  # Increase timeout for next attempt
@@ -1422,10 +1465,10 @@ def call_openrouter_api(messages: list, system_prompt: str = None):
             print(f"[OPENROUTER ERROR] Unexpected response format: {result}")
             return None
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"[OPENROUTER ERROR] Request timeout (30s).")
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"[OPENROUTER ERROR] API Error: {str(e)}")
         return None
     except Exception as e:
@@ -1433,13 +1476,51 @@ def call_openrouter_api(messages: list, system_prompt: str = None):
         return None
         return None
 
+# --- TOOL 1E: DOCUMENT SUMMARY CALLS ---
+async def call_summary_llm(system_prompt: str, prompt: str, on_token=None):
+    """One summarizer call (document_summarizer.py) to the configured provider; None on failure."""
+    if LLM_PROVIDER == "gemini" and gemini_client:
+        return await call_gemini_api([{"role": "user", "parts": [{"text": system_prompt + "\n\n" + prompt}]}])
+    if LLM_PROVIDER == "openrouter":
+        return await call_openrouter_api([{"role": "user", "parts": [{"text": prompt}]}],
+                                   system_prompt=system_prompt, on_token=on_token)
+    return None
+
+def summary_llm_available() -> bool:
+    """Whether call_summary_llm can reach the configured provider (not for local / huggingface)."""
+    return (LLM_PROVIDER == "gemini" and gemini_client is not None) or LLM_PROVIDER == "openrouter"
+
+def summary_provider_key() -> str:
+    """Provider and model the chunk summaries come from (part of their cache key)."""
+    model = GEMINI_MODEL if LLM_PROVIDER == "gemini" else OPENROUTER_MODEL
+    return f"{LLM_PROVIDER}:{model}"
+
+SUMMARIZE_PATTERNS = ["summarize", "summary", "recap", "analyze", "explain the", "what is in"]
+
+def wants_file_summary(user_input: str, attached_files) -> bool:
+    """Whether this turn asks for a summary of the files attached to it."""
+    lower_input = user_input.lower().strip()
+    return bool(attached_files) and any(pattern in lower_input for pattern in SUMMARIZE_PATTERNS)
+
+def start_summary_prefetch(user_input: str, attached_files):
+    """
+    A document_summarizer ChunkPrefetcher for the text of the attached files when this
+    turn will summarize them (None otherwise), so the backend can start the chunk
+    summaries while the files are still being read.
+    """
+    if not wants_file_summary(user_input, attached_files) or not summary_llm_available():
+        return None
+    return document_summarizer.prefetcher(call_summary_llm, summary_provider_key())
+
 # --- TOOL 1D: LOCAL MODEL API WRAPPER (Ollama/Llamafile) ---
-def call_local_model_api(messages: list):
+@llm_cache.cached("local", LOCAL_MODEL_NAME)
+async def call_local_model_api(messages: list, on_token=None):
     """
     Calls local LLM via Ollama API (compatible with llamafile).
     
     Args:
         messages: List of message dicts with 'role' and 'parts' keys (Gemini format)
+        on_token: Optional callback; if set, the response is streamed and each text chunk is passed to it
         
     Returns:
         response_text: The assistant's response
@@ -1479,7 +1560,10 @@ def call_local_model_api(messages: list):
         api_url = f"{LOCAL_MODEL_URL}/chat/completions"
         print(f"[LOCAL DEBUG] API URL: {api_url}")
         
-        response = requests.post(
+        if on_token:
+            return await _stream_openai_completion(api_url, payload, None, 120, on_token, "LOCAL")
+        
+        response = await provider_client.post(
             api_url,
             json=payload,
             timeout=120  # Local models can be slower
@@ -1507,15 +1591,15 @@ def call_local_model_api(messages: list):
             print(f"[LOCAL ERROR] Unexpected response format: {result}")
             return None
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(f"[LOCAL ERROR] Request timeout (120s). Is Ollama running?")
         print(f"[LOCAL ERROR] Try: ollama serve")
         return None
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print(f"[LOCAL ERROR] Cannot connect to {LOCAL_MODEL_URL}")
         print(f"[LOCAL ERROR] Make sure Ollama is running: ollama serve")
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"[LOCAL ERROR] API Error: {str(e)}")
         return None
     except Exception as e:
@@ -1523,7 +1607,8 @@ def call_local_model_api(messages: list):
         return None
 
 # --- TOOL 2: GEMINI QUESTIONING, FORMATTING, AND SYNTHESIS (The Brain) ---
-def llm_process_conversation(conversation_history, user_input, auth_token, diagnosis_data=None, attached_files=None, file_content=None):
+async def llm_process_conversation(conversation_history, user_input, auth_token, diagnosis_data=None, attached_files=None,
+                                   file_content=None, on_token=None, on_diagnosis=None, intake_state=None):
     """
     AGENTIC AI WORKFLOW - Orchestrates Gemini (UX) and ML Model (Diagnosis Authority)
     
@@ -1547,6 +1632,22 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
     - ML diagnosis is the authoritative source
     
     KEY PRINCIPLE: ML Model is the DIAGNOSIS AUTHORITY, not Gemini alone
+    
+    STREAMING (optional, used by /chat_with_ai_stream):
+    - on_token(text): called with LLM text as it arrives, for replies that are returned
+      verbatim (follow-up answers, file summaries). Intake replies are inspected for red
+      flags / ML triggers before use, so they are not streamed.
+    - on_diagnosis(dict): called with the raw ML result as soon as the model returns
+      ("validated": False), then with the validated diagnosis ("validated": True).
+    The return value is unchanged and remains the authoritative response.
+    
+    CONCURRENCY: provider calls are awaited on the caller's event loop (llm_client.py);
+    the ML model and the prediction checks run on the inference pool, whose
+    ExecutorSaturated is raised to the caller.
+    
+    INTAKE STATE (optional): intake_state is the conversation's incremental intake summary
+    (intake_state.py) covering conversation_history. Only the current message is scanned;
+    without it the summary is rebuilt from the whole history.
     """
     
     try:
@@ -1564,10 +1665,6 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
         ]
         lower_input = user_input.lower().strip()
         
-        # Include the current user message for downstream checks without mutating the original history
-        history_with_current = list(conversation_history)
-        history_with_current.append({"role": "user", "parts": [{"text": user_input}]})
-        
         # If no diagnosis yet and input matches non-medical pattern, reject it
         if diagnosis_data is None and any(pattern in lower_input for pattern in non_medical_patterns):
             return ("I am MediMate, your medical assistant. I'm here to help you understand your health and get a medical diagnosis. "
@@ -1575,8 +1672,7 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
         
         # ==================== SPECIAL HANDLING FOR SUMMARIZATION REQUESTS ====================
         # If user is asking to summarize/analyze attached files, handle specially
-        summarize_patterns = ["summarize", "summary", "recap", "analyze", "explain the", "what is in"]
-        if attached_files and len(attached_files) > 0 and any(pattern in lower_input for pattern in summarize_patterns):
+        if wants_file_summary(user_input, attached_files):
             file_list = ", ".join([f"{f.get('name', 'Unknown')}" for f in attached_files])
             acknowledgment = f"I've received your {len(attached_files)} file(s): {file_list}. "
             
@@ -1590,29 +1686,20 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                     "Keep it in simple, patient-friendly language."
                 )
                 
-                # Build the prompt with file content (limit to first 10000 chars to avoid token limits)
-                file_content_limited = file_content[:10000] if len(file_content) > 10000 else file_content
-                summary_prompt = f"User request: {user_input}\n\n{file_content_limited}"
-                
-                # Send to LLM for summarization
+                # Long documents are summarized chunk by chunk and the chunk summaries combined
+                # (document_summarizer.py) instead of cutting the text at a fixed length
                 try:
-                    if LLM_PROVIDER == "gemini" and gemini_client:
-                        summary_response = gemini_client.generate_content(
-                            [{"role": "user", "parts": [{"text": summary_system + "\n\n" + summary_prompt}]}]
+                    if summary_llm_available():
+                        if on_token and LLM_PROVIDER == "openrouter":
+                            on_token(acknowledgment)
+                        summary_text = await document_summarizer.summarize(
+                            call_summary_llm, summary_provider_key(), file_content, user_input, summary_system,
+                            on_token=on_token if LLM_PROVIDER == "openrouter" else None
                         )
-                        summary_text = summary_response.text if hasattr(summary_response, 'text') else str(summary_response)
                         if summary_text and summary_text.strip():
                             return acknowledgment + summary_text, None
-                        else:
+                        elif LLM_PROVIDER == "gemini":
                             return acknowledgment + "I received your file but couldn't generate a summary.", None
-                    elif LLM_PROVIDER == "openrouter":
-                        # Pass messages in Gemini format (with parts) and system prompt separately
-                        gemini_format_messages = [
-                            {"role": "user", "parts": [{"text": summary_prompt}]}
-                        ]
-                        summary_text = call_openrouter_api(gemini_format_messages, system_prompt=summary_system)
-                        if summary_text and summary_text.strip():
-                            return acknowledgment + summary_text, None
                         else:
                             return acknowledgment + "I received your file but couldn't generate a summary. Please try again.", None
                 except Exception as e:
@@ -1726,8 +1813,17 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                 
                 # Add file content context for follow-up questions
                 if file_content and file_content.strip() and not (attached_files and len(attached_files) > 0):
-                    # Only add file context if we have stored content and no NEW files are attached
-                    user_message_text = user_input + "\n\n" + file_content
+                    # Only add file context if we have stored content and no NEW files are attached.
+                    # A long document is not sent in full every turn: only the chunks that match the
+                    # question (document_index.py), or its cached chunk summaries when none do
+                    context = await document_index.context_for(
+                        file_content, user_input,
+                        fallback=lambda text: document_summarizer.document_context(
+                            call_summary_llm if summary_llm_available() else None, summary_provider_key(), text))
+                    user_message_text = user_input + "\n\n" + context
+                    history_tokens = sum(estimate_tokens(msg["parts"][0]["text"]) for msg in contents)
+                    print(f"[RETRIEVAL] Prompt tokens (est.): {history_tokens + estimate_tokens(user_input + file_content)} "
+                          f"with the whole document -> {history_tokens + estimate_tokens(user_message_text)}")
                 
                 contents.append({"role": "user", "parts": [{"text": user_message_text}]})
             
@@ -1748,17 +1844,17 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
             try:
                 if LLM_PROVIDER == "openrouter":
                     print(f"[OPENROUTER DEBUG] Calling OpenRouter with {len(contents)} messages + system prompt")
-                    gemini_text = call_openrouter_api(contents, system_prompt)
+                    gemini_text = await call_openrouter_api(contents, system_prompt)
                     if not gemini_text:
                         return "I'm having trouble processing your message. Please check your OpenRouter API key.", None
                 elif LLM_PROVIDER == "local":
                     print(f"[LOCAL DEBUG] Calling local model with {len(contents)} messages")
-                    gemini_text = call_local_model_api(contents)
+                    gemini_text = await call_local_model_api(contents)
                     if not gemini_text:
                         return "I'm having trouble processing your message. Please check if Llamafile is running.", None
                 elif LLM_PROVIDER == "huggingface":
                     print(f"[HF DEBUG] Calling Hugging Face API with {len(contents)} messages")
-                    gemini_text = call_huggingface_api(contents)
+                    gemini_text = await call_huggingface_api(contents)
                     if not gemini_text:
                         return "I'm having trouble processing your message. Please try again in a moment.", None
                 else:
@@ -1766,12 +1862,7 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                     if not gemini_client:
                         return "LLM service not available. Please try again.", None
                     print(f"[GEMINI DEBUG] Calling Gemini API with {len(contents)} messages")
-                    response = gemini_client.models.generate_content(
-                        model=GEMINI_MODEL,
-                        contents=contents,
-                    )
-                    gemini_text = response.text
-                    gemini_text = response.text
+                    gemini_text = await call_gemini_api(contents)
             except Exception as e:
                 print(f"[LLM ERROR] API Call Error: {str(e)}")
                 print(f"Error Type: {type(e).__name__}")
@@ -1787,36 +1878,29 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                 )
                 return error_msg, None
             
-            # Safely get response text (only for Gemini)
+            # Empty response check (only for Gemini; the other providers return None above)
             if LLM_PROVIDER == "gemini":
-                try:
-                    gemini_text = response.text
-                    if not gemini_text or gemini_text.strip() == "":
-                        print(f"[WARNING] Empty response from Gemini")
-                        return "I'm having trouble understanding. Could you provide more details about your symptoms?", None
-                except Exception as e:
-                    print(f"[ERROR] Could not extract text from response: {str(e)}")
-                    return "Error processing response. Please try again.", None
+                if not gemini_text or gemini_text.strip() == "":
+                    print(f"[WARNING] Empty response from Gemini")
+                    return "I'm having trouble understanding. Could you provide more details about your symptoms?", None
             
             print(f"\n[RESPONSE]: {gemini_text[:100]}...")
             
             # ==================== RED FLAG DETECTION (STATE 3) ====================
+            # Intake summary of the FULL conversation including the current message: the stored
+            # state advanced by this message only (intake_state.py), not a re-scan of the history
+            if intake_state is None:
+                intake_state = intake_state_from_history(conversation_history)
+            intake = observe_message(intake_state, "user", user_input)
+            conversation_flags = intake["flags"]
+            
             # SPECIAL HANDLING: BLEEDING/NOSEBLEED - Check for duration > 5 minutes
-            bleeding_keywords = ["nosebleed", "nose bleed", "bleeding nose", "blood from nose", "bleeding in nose", "epistaxis", "bleeding", "bleed"]
-            # Check FULL conversation history, not just current message
-            full_conversation = " ".join([msg.get("parts", [{}])[0].get("text", "") for msg in history_with_current]).lower()
-            has_bleeding = any(kw in full_conversation for kw in bleeding_keywords)
+            has_bleeding = conversation_flags["bleeding"]
             
             if has_bleeding:
                 # Check if bleeding has been ongoing for MORE than 5 minutes
-                conversation_text = " ".join([msg.get("parts", [{}])[0].get("text", "") for msg in history_with_current]).lower()
-                
-                # Look for time indicators
-                bleeding_prolonged = False
-                prolonged_indicators = ["10 min", "10min", "15 min", "20 min", "30 min", "hour", "hours", "more than 5", ">5", "5+", "won't stop", "won't stop bleeding", "continuous"]
-                
-                if any(indicator in conversation_text for indicator in prolonged_indicators):
-                    bleeding_prolonged = True
+                # (time indicators such as "10 min", "hours", "won't stop")
+                bleeding_prolonged = conversation_flags["prolonged_bleeding"]
                 
                 # If bleeding duration >5 minutes = CRITICAL emergency
                 if bleeding_prolonged:
@@ -1882,13 +1966,8 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                     }
                     return severe_response, severe_diagnosis
             
-            # GENERAL RED FLAGS
-            red_flags = [
-                "severe chest pain", "chest pain", "difficulty breathing", "can't breathe",
-                "vomiting blood", "blood in vomit", "blood in stool", "fainting", "fainted",
-                "confused", "confusion", "severe abdominal pain", "severe pain",
-                "high fever", "103", "104", "105", "106"
-            ]
+            # GENERAL RED FLAGS (current message only)
+            red_flags = RED_FLAG_TERMS
             
             has_red_flag = any(flag in user_input.lower() for flag in red_flags)
             
@@ -1919,15 +1998,8 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
             
             has_clinical_json = "CLINICAL_JSON:" in gemini_text or "ready_to_diagnose" in gemini_text.lower()
             
-            # Build conversation text from history_with_current (includes current message)
-            conversation_text = " ".join([msg.get("parts", [{}])[0].get("text", "") for msg in history_with_current])
-            
-            has_symptom_patterns = any(keyword in conversation_text.lower() for keyword in [
-                'day', 'week', 'month', 'hours', 'fever', 'cough', 'pain', 'ache',
-                'terrible', 'mild', 'moderate', 'severe', 'bad', 'hurts', 'ache',
-                'sick', 'vomit', 'nausea', 'diarrhea', 'rash', 'itchy', 'swollen',
-                'difficulty', 'trouble breathing', 'weak', 'tired', 'fatigue'
-            ])
+            # Whole conversation including the current message, from the intake state
+            has_symptom_patterns = conversation_flags["symptom_patterns"]
             
             # ==================== CONFIRMATION DETECTION (STATE 4) ====================
             # Check if user confirmed the details (required before ML)
@@ -1967,16 +2039,15 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
             # ML calling logic - REQUIRE STATE 4 CONFIRMATION
             # 1. AI explicitly says it's ready (has_clinical_json), OR
             # 2. User confirms the details they gave (user_confirmed after STATE 2 details)
-            ai_message_count = sum(1 for msg in conversation_history if msg.get("role") == "model")
+            ai_message_count = intake["ai_messages"]
             has_multiple_exchanges = ai_message_count >= 1  # Changed from >= 2 to >= 1 to allow faster diagnosis
             
             # Check if conversation history contains ANY symptoms (include current user turn)
-            conversation_text = " ".join([msg.get("parts", [{}])[0].get("text", "") for msg in history_with_current])
-            has_symptoms_in_history = any(s in conversation_text.lower() for s in ['fever', 'cough', 'pain', 'ache', 'rash', 'nausea', 'vomit', 'cold', 'flu', 'sore', 'throat', 'nosebleed', 'bleeding', 'headache', 'diarrhea', 'vomiting'])
+            has_symptoms_in_history = conversation_flags["symptoms"]
             
             # Check if we have CRITICAL SYMPTOM INFO: main symptom + duration + severity
-            has_duration = any(d in conversation_text.lower() for d in ['day', 'days', 'week', 'weeks', 'hour', 'hours', 'minute', 'minutes', 'month', 'months', 'min', 'mins', 'hr', 'hrs'])
-            has_severity = any(s in conversation_text.lower() for s in ['mild', 'moderate', 'severe', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10'])
+            has_duration = conversation_flags["duration"]
+            has_severity = conversation_flags["severity"]
             has_critical_info = has_symptoms_in_history and has_duration and has_severity
             
             # CRITICAL: Only call ML if:
@@ -1998,124 +2069,13 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                 # AI Agent will FORMAT the JSON itself from conversation history
                 print(f"[AGENT] Forcing ML call - extracting symptoms from conversation...")
                 
-                # Build clinical summary from conversation history
-                symptoms_list = []
-                duration = "unknown"
-                severity = "mild"  # Default severity; latest stated severity wins
-                
-                # Get the last AI message (which contains the confirmed summary)
-                ai_summary = ""
-                for msg in reversed(conversation_history):
-                    if msg.get("role") == "model":
-                        ai_summary = msg.get("parts", [{}])[0].get("text", "").lower()
-                        break
-                
-                # Extract from ONLY user messages (all of them, including the current turn)
-                for msg in history_with_current:
-                    role = msg.get("role", "")
-                    text = msg.get("parts", [{}])[0].get("text", "").lower()
-                    
-                    # ONLY process USER messages, skip AI responses
-                    if role != "user":
-                        continue
-                    
-                    # Extract severity; prefer the latest user-stated severity (override earlier values)
-                    if any(sev in text for sev in ['very bad', 'extremely', 'really bad', 'terrible', 'severe']):
-                        severity = 'severe'
-                    elif any(sev in text for sev in ['moderate', '5', '6', '7', 'somewhat bad', 'pretty bad']):
-                        severity = 'moderate'
-                    elif any(sev in text for sev in ['mild', '1', '2', '3', 'little', 'slight', 'bit']):
-                        severity = 'mild'
-                    
-                    # CRITICAL: Check for symptom DENIALS first - user explicitly saying NO/DON'T HAVE
-                    # But only skip if it's ONLY denials (user confirming no other symptoms is valid)
-                    has_denial = False
-                    denial_keywords = [
-                        "no cough", "no sore throat", "no fatigue", "no nausea", "no body ache",
-                        "no body aches", "no aches", "no pain", "no rash", "no cold", "no runny nose", "no cold symptoms",
-                        "don't have cough", "don't have sore throat", "don't have fatigue", "don't have body aches",
-                        "don't have aches", "don't have pain", "i do not have", "no tired", "no chills"
-                    ]
-                    # Check if message contains ONLY denials/negations (no positive symptom mentions)
-                    symptom_keywords = ["cough", "sore", "fever", "pain", "ache", "rash", "nausea", "vomit", "cold", "runny", "sneeze", "breathless", "wheez", "chest", "phlegm", "nosebleed", "diarrhea", "loose", "motion", "stool", "stomach", "abdominal", "constipation", "bowel"]
-                    has_positive_symptom = any(sym in text for sym in symptom_keywords)
-                    
-                    # Only skip messages that have denial + no positive symptoms
-                    if any(denial in text for denial in denial_keywords) and not has_positive_symptom:
-                        has_denial = True
-                        continue  # Skip this message - it contains only denials
-                    
-                    # Extract symptoms - look for actual mentions, only if NOT denied
-                    if 'cough' in text and not any(deny in text for deny in ['no cough', 'no cough', "don't have cough"]): 
-                        symptoms_list.append('cough')
-                    if ('productive cough' in text or ('cough' in text and 'phlegm' in text)) and not any(deny in text for deny in ['no cough', "don't have cough"]):
-                        symptoms_list.append('productive cough')
-                    if ('phlegm' in text or 'sputum' in text) and not any(deny in text for deny in ["no phlegm", "no sputum"]):
-                        symptoms_list.append('phlegm')
-                    if (('yellow' in text) and ('phlegm' in text or 'sputum' in text)) and not any(deny in text for deny in ["no phlegm", "no sputum"]):
-                        symptoms_list.append('yellow phlegm')
-                    if ('nosebleed' in text or 'nose bleed' in text or 'bleeding in nose' in text or 'bleeding nose' in text or 'blood from nose' in text or 'epistaxis' in text) and not any(deny in text for deny in ['no nosebleed', "no bleeding", "no blood"]):
-                        symptoms_list.append('nosebleed')
-                    if ('sneeze' in text or 'sneezing' in text) and not any(deny in text for deny in ['no sneeze', 'no sneezing']):
-                        symptoms_list.append('sneezing')
-                    if ('runny nose' in text or 'runny' in text) and not any(deny in text for deny in ['no runny nose', "don't have runny nose"]): 
-                        symptoms_list.append('runny nose')
-                    if ('sore throat' in text or ('sore' in text and 'throat' in text)) and not any(deny in text for deny in ['no sore throat', "don't have sore throat"]): 
-                        symptoms_list.append('sore throat')
-                    if 'fever' in text and not any(deny in text for deny in ['no fever', "don't have fever"]): 
-                        symptoms_list.append('fever')
-                    if any(p in text for p in ['pain', 'ache', 'hurt', 'body ache']) and not any(deny in text for deny in ['no pain', 'no ache', 'no body ache', 'no body aches', "don't have pain", "don't have aches"]): 
-                        symptoms_list.append('pain')
-                    if 'rash' in text and not any(deny in text for deny in ['no rash', "don't have rash"]): 
-                        symptoms_list.append('rash')
-                    if any(n in text for n in ['nausea', 'vomit']) and not any(deny in text for deny in ['no nausea', "don't have nausea"]): 
-                        symptoms_list.append('nausea')
-                    if 'chills' in text and not any(deny in text for deny in ['no chills', "don't have chills"]): 
-                        symptoms_list.append('chills')
-                    if ('body ache' in text or 'body aches' in text) and not any(deny in text for deny in ['no body ache', 'no body aches', 'no aches', "don't have body aches"]): 
-                        symptoms_list.append('body aches')
-                    if 'cold' in text and not any(deny in text for deny in ['no cold', "don't have cold"]): 
-                        symptoms_list.append('cold')
-                    if (any(f in text for f in ['fatigue', 'tired', 'tiredness'])) and not any(deny in text for deny in ['no fatigue', 'no tired', "don't have fatigue"]): 
-                        symptoms_list.append('fatigue')
-                    if any(b in text for b in ['shortness of breath', 'breathless', 'difficulty breathing', 'cant breathe', "can't breathe", 'hard to breathe']) and not any(deny in text for deny in ['no breathlessness', 'no shortness of breath']):
-                        symptoms_list.append('shortness of breath')
-                    if 'wheez' in text and not any(deny in text for deny in ['no wheeze', 'no wheezing']):
-                        symptoms_list.append('wheezing')
-                    if 'chest pain' in text and not any(deny in text for deny in ['no chest pain']):
-                        symptoms_list.append('chest pain')
-                    if 'congestion' in text and not any(deny in text for deny in ['no congestion']):
-                        symptoms_list.append('congestion')
-                    if any(d in text for d in ['diarrhea', 'loose motion', 'loose stool', 'loose motions']) and not any(deny in text for deny in ['no diarrhea', 'no loose motion']):
-                        symptoms_list.append('diarrhea')
-                    if any(a in text for a in ['abdominal pain', 'stomach pain', 'belly pain', 'stomach ache']) and not any(deny in text for deny in ['no stomach pain', 'no abdominal pain']):
-                        symptoms_list.append('abdominal pain')
-                    if 'constipation' in text and not any(deny in text for deny in ['no constipation']):
-                        symptoms_list.append('constipation')
-                    if any(v in text for v in ['vomiting', 'vomit']) and not any(deny in text for deny in ['no vomiting', 'no vomit']):
-                        symptoms_list.append('vomiting')
-                    if ('dizziness' in text or 'dizzy' in text or 'vertigo' in text) and not any(deny in text for deny in ['no dizziness', 'no dizzy']):
-                        symptoms_list.append('dizziness')
-                    if 'itching' in text or 'itchy' in text and not any(deny in text for deny in ['no itching', 'no itchy']):
-                        symptoms_list.append('itching')
-                    
-                    # Extract duration ONLY from user input
-                    if any(time in text for time in ['day', 'week', 'month', 'hour']):
-                        words = text.split()
-                        for j, word in enumerate(words):
-                            if word in ['day', 'days', 'week', 'weeks', 'month', 'months', 'hour', 'hours']:
-                                if j > 0:
-                                    duration = f"{words[j-1]} {word}"
-                                    break
-                
-                # Deduplicate symptoms and remove duplicates while preserving order
-                seen = set()
-                unique_symptoms = []
-                for symptom in symptoms_list:
-                    if symptom.lower() not in seen:
-                        seen.add(symptom.lower())
-                        unique_symptoms.append(symptom)
-                symptoms_list = unique_symptoms
+                # Clinical summary from the intake state: symptoms from ALL user messages
+                # (including the current turn, de-duplicated, unless denied in the same message),
+                # the latest "<n> <unit>" duration and the latest stated severity (default mild).
+                # The keyword tables and their quirks live in symptom_extractor.py.
+                symptoms_list = list(intake["symptoms"])
+                duration = intake["duration"]
+                severity = intake["severity"]
                 
                 print(f"[DEBUG] Final symptoms after deduplication: {symptoms_list}")
                 
@@ -2144,20 +2104,45 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                     print(f"[AGENT] Clinical Summary: {clinical_summary}")
                     print(f"[AGENT] Symptoms: {symptoms_list}, Duration: {duration}, Severity: {severity}")
                     
-                    # FORCE ML call with extracted data
-                    print(f"[AGENT] >>> CALLING ML MODEL WITH DETAILED SUMMARY <<<")
-                    prediction_result = get_diagnosis_from_ml_model(clinical_summary, auth_token)
-                    
-                    print(f"[ML Model Called] - Prediction Result: {prediction_result}")
+                    # Same canonical intake (symptoms, duration bucket, severity) and model as an
+                    # earlier patient: reuse that prediction and its validation (prediction_cache.py)
+                    cached = prediction_cache.get(symptoms_list, duration, severity)
+                    if cached:
+                        prediction_result, validated_result = cached
+                        print(f"[PREDICTION CACHE] Hit: {validated_result['disease']}, skipping ML model and validation")
+                    else:
+                        # FORCE ML call with extracted data
+                        print(f"[AGENT] >>> CALLING ML MODEL WITH DETAILED SUMMARY <<<")
+                        prediction_result = await inference_executor.run(get_diagnosis_from_ml_model, clinical_summary,
+                                                                         auth_token)
+                        print(f"[ML Model Called] - Prediction Result: {prediction_result}")
+                    if on_diagnosis and prediction_result:
+                        on_diagnosis(dict(prediction_result, validated=False))
                     
                     if prediction_result and prediction_result.get("disease"):
-                        # VALIDATION: Check prediction against training data
-                        validated_result = validate_and_correct_prediction(
-                            prediction_result,
-                            symptoms=symptoms_list,
-                            duration=duration,
-                            severity=severity
-                        )
+                        # VALIDATION: Check prediction against training data. Rules run now; if they
+                        # leave the outcome open the AI check runs in the background meanwhile
+                        if cached:
+                            pending_validation = PendingValidation(decided=validated_result)
+                        else:
+                            pending_validation = await start_prediction_validation(
+                                prediction_result,
+                                symptoms=symptoms_list,
+                                duration=duration,
+                                severity=severity
+                            )
+                        speculative_response = None
+                        if pending_validation.needs_ai:
+                            # Most AI checks confirm the ML diagnosis, so prepare that reply while waiting
+                            speculative_response = (prediction_result["disease"], generate_phase2_diagnosis_response(
+                                disease=prediction_result["disease"],
+                                severity=severity,
+                                symptoms=symptoms_list,
+                                duration=duration
+                            ))
+                        validated_result = await pending_validation.result()
+                        if not cached and pending_validation.complete and prediction_result.get("status") == "success":
+                            prediction_cache.put(symptoms_list, duration, severity, prediction_result, validated_result)
                         
                         disease = validated_result["disease"]
                         ml_severity = validated_result["severity"]
@@ -2182,14 +2167,19 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                         }
                         
                         print(f"[AGENT] ML Diagnosis: {disease} ({final_severity})")
+                        if on_diagnosis:
+                            on_diagnosis(dict(diagnosis_data, validated=True))
                         
                         # === PHASE 2: Generate doctor-style explanation with education ===
-                        phase2_response = generate_phase2_diagnosis_response(
-                            disease=disease,
-                            severity=final_severity,
-                            symptoms=symptoms_list,
-                            duration=duration
-                        )
+                        if speculative_response and speculative_response[0] == disease:
+                            phase2_response = speculative_response[1]
+                        else:
+                            phase2_response = generate_phase2_diagnosis_response(
+                                disease=disease,
+                                severity=final_severity,
+                                symptoms=symptoms_list,
+                                duration=duration
+                            )
                         
                         # Add medical disclaimer
                         medical_disclaimer = (
@@ -2218,13 +2208,15 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                     print(f"[Medimate]: Calling ML Model for diagnosis...")
                     
                     # Step 2: CALL ML MODEL with formatted data
-                    prediction_result = get_diagnosis_from_ml_model(clinical_summary, auth_token)
+                    prediction_result = await inference_executor.run(get_diagnosis_from_ml_model, clinical_summary, auth_token)
+                    if on_diagnosis and prediction_result:
+                        on_diagnosis(dict(prediction_result, validated=False))
                     
                     print(f"[ML Model Called] - Prediction Result: {prediction_result}")
                     
                     if prediction_result and prediction_result.get("disease"):
                         # VALIDATION: Check prediction against training data
-                        validated_result = validate_and_correct_prediction(
+                        validated_result = await validate_and_correct_prediction(
                             prediction_result,
                             symptoms=symptoms_data.get("symptoms", []),
                             duration=symptoms_data.get("duration", ""),
@@ -2249,6 +2241,9 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                             "validation_report": validated_result.get("validation_report", {})
                         }
                         
+                        if on_diagnosis:
+                            on_diagnosis(dict(diagnosis_data, validated=True))
+                        
                         # Step 3: SYNTHESIS - Gemini explains ML output to user
                         synthesis_system_prompt = (
                             "You are a friendly medical assistant explaining a diagnosis to a regular person.\n"
@@ -2272,18 +2267,15 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                         )
                         
                         try:
-                            synthesis_response = gemini_client.models.generate_content(
-                                model=GEMINI_MODEL,
-                                contents=[
-                                    {"role": "user", "parts": [{"text": synthesis_system_prompt + "\n\n" + synthesis_content}]}
-                                ],
-                            )
+                            synthesis_text = await call_gemini_api([
+                                {"role": "user", "parts": [{"text": synthesis_system_prompt + "\n\n" + synthesis_content}]}
+                            ])
                         except Exception as e:
                             print(f"Gemini Synthesis Error: {str(e)}")
                             return "GEMINI_ERROR", None
                         
                         # Build comprehensive response with validation analysis
-                        final_response = f"{synthesis_response.text}\n\n"
+                        final_response = f"{synthesis_text}\n\n"
                         
                         # Add validation analysis section
                         validation_report = validated_result.get("validation_report", {})
@@ -2433,25 +2425,31 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                         print(f"[ERROR] Invalid follow-up part at message {idx}: {part}")
                         return "Error processing your question. Please try again.", diagnosis_data
             
+            # Response cache key: the diagnosis, the follow-up prompt and the question, not the
+            # chat history, so the same question about the same diagnosis is answered once
+            cache_scope = {
+                "diagnosis": diagnosis_data,
+                "cache_messages": [
+                    {"role": "user", "parts": [{"text": followup_system_prompt}]},
+                    {"role": "user", "parts": [{"text": user_input}]},
+                ],
+            }
+            
             try:
                 if LLM_PROVIDER == "openrouter":
-                    follow_up_text = call_openrouter_api(contents)
+                    follow_up_text = await call_openrouter_api(contents, on_token=on_token, **cache_scope)
                     if not follow_up_text:
                         return "I'm having trouble processing your follow-up question. Please try again in a moment.", diagnosis_data
                 elif LLM_PROVIDER == "local":
-                    follow_up_text = call_local_model_api(contents)
+                    follow_up_text = await call_local_model_api(contents, on_token=on_token, **cache_scope)
                     if not follow_up_text:
                         return "I'm having trouble processing your follow-up question. Please try again in a moment.", diagnosis_data
                 elif LLM_PROVIDER == "huggingface":
-                    follow_up_text = call_huggingface_api(contents)
+                    follow_up_text = await call_huggingface_api(contents, **cache_scope)
                     if not follow_up_text:
                         return "I'm having trouble processing your follow-up question. Please try again in a moment.", diagnosis_data
                 else:
-                    response = gemini_client.models.generate_content(
-                        model=GEMINI_MODEL,
-                        contents=contents,
-                    )
-                    follow_up_text = response.text
+                    follow_up_text = await call_gemini_api(contents, **cache_scope)
                 
                 if not follow_up_text or follow_up_text.strip() == "":
                     print(f"[WARNING] Empty response from LLM")
@@ -2468,6 +2466,8 @@ def llm_process_conversation(conversation_history, user_input, auth_token, diagn
                 )
                 return error_msg, diagnosis_data
 
+    except ExecutorSaturated:
+        raise  # the backend answers 503
     except Exception as e:
         print(f"[CRITICAL ERROR] Gemini Error: {str(e)}")
         print(f"Error Type: {type(e).__name__}")
@@ -2490,6 +2490,8 @@ def ai_doctor_conversation_loop(auth_token):
     # Start the conversation history
     conversation_history = []
     diagnosis_data = None  # Will store the diagnosis once made
+    # One event loop for the whole session, so provider connections are kept alive between turns
+    loop = asyncio.new_event_loop()
 
     while True:
         user_input = input("\n👤 You: ").strip()
@@ -2500,6 +2502,8 @@ def ai_doctor_conversation_loop(auth_token):
                 print("\n" + "="*70)
                 validator.print_validation_report()
             print("\n🏥 Medimate: Thank you for using Medimate. Take care and stay healthy!")
+            loop.run_until_complete(provider_client.aclose())
+            loop.close()
             break
         
         if user_input.lower() == "new":
@@ -2532,12 +2536,12 @@ def ai_doctor_conversation_loop(auth_token):
         conversation_history.append({"role": "user", "parts": [{"text": user_input}]})
 
         # 3. Process the conversation with diagnosis_data awareness
-        response_text, diagnosis_data = llm_process_conversation(
+        response_text, diagnosis_data = loop.run_until_complete(llm_process_conversation(
             conversation_history, 
             user_input, 
             auth_token,
             diagnosis_data=diagnosis_data
-        )
+        ))
         
         # 4. Handle errors
         if response_text == "GEMINI_ERROR":
@@ -2556,12 +2560,12 @@ def ai_doctor_conversation_loop(auth_token):
                 
                 if prediction_result:
                     # VALIDATION: Check prediction against training data
-                    validated_result = validate_and_correct_prediction(
+                    validated_result = loop.run_until_complete(validate_and_correct_prediction(
                         prediction_result,
                         symptoms=[],  # Not parsed in manual mode
                         duration="",
                         severity="mild"
-                    )
+                    ))
                     
                     disease = validated_result["disease"]
                     severity = validated_result["severity"]
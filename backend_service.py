@@ -1,40 +1,53 @@
 # backend_service.py (FINAL FULL VERSION)
 import os
-import numpy as np
+import asyncio
 import json
 import base64
 from datetime import timedelta, datetime
 from typing import Annotated, Optional, Dict, List
 
 # --- FastAPI and Pydantic Imports ---
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware  # IMPORT CORS
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, ConfigDict
-import torch
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from jose import jwt, JWTError
 
 # --- ML Model Imports ---
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+# The classifier, tokenizer and label map are loaded once per process by the registry
+from model_registry import disease_model_registry, split_combined_label
+from inference_batcher import predict_disease_text_async
+from service_executors import ExecutorSaturated, auth_executor, executor_stats, inference_executor, pdf_executor
+from service_metrics import TimingMiddleware, metrics
+from llm_client import provider_client
+from llm_cache import llm_cache
+from prediction_cache import prediction_cache
+from conversation_store import conversation_store
+from intake_state import intake_state_from_history, observe_message
 
 # --- DATABASE and AUTH Imports ---
 # Ensure user_model.py and auth_utils.py are in the same folder
-from user_model import create_db_tables, get_db, User, HealthRecord, Base, Engine
+from user_model import create_db_tables, get_db, User, HealthRecord, Base, Engine, SessionLocal
 from auth_utils import hash_password, verify_password
 
 # --- PDF PROCESSING ---
-try:
-    import pdfplumber
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
+# Pages are extracted in a process pool and cached per page by content hash (document_ingest.py)
+from document_ingest import PDF_AVAILABLE, document_ingestor
+# Uploads are streamed to disk by POST /files and referenced by id in ChatRequest.files
+from upload_store import UploadError, UploadTooLarge, upload_store
+from document_summarizer import document_summarizer
+from document_index import document_index
+if not PDF_AVAILABLE:
     print("[WARN] pdfplumber not available. File summarization will be limited.")
 
 # --- GEMINI AI IMPORTS ---
 try:
-    from ai_doctor_llm_final_integrated import llm_process_conversation
+    from ai_doctor_llm_final_integrated import llm_process_conversation, start_summary_prefetch
     GEMINI_AVAILABLE = True
 except ImportError:
     GEMINI_AVAILABLE = False
@@ -44,20 +57,18 @@ except ImportError:
 SECRET_KEY = "YOUR_SUPER_SECRET_AND_LONG_KEY_CHANGE_THIS"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440 # 24 hours
-MODEL_DIR = "medimate-disease-model"
-BASE_MODEL = "emilyalsentzer/Bio_ClinicalBERT"
-
-# --- GLOBAL OBJECTS ---
-tokenizer = None
-ml_model = None
-id2label_map = None
+WARM_MODELS_ON_STARTUP = os.getenv("WARM_MODELS_ON_STARTUP", "1") == "1"
+PREDICT_BATCH_CHUNK_SIZE = int(os.getenv("PREDICT_BATCH_CHUNK_SIZE", "32"))  # texts per forward pass
+PREDICT_BATCH_MAX_TEXTS = int(os.getenv("PREDICT_BATCH_MAX_TEXTS", "10000"))  # per request
 
 # --- CONVERSATION STATE MANAGEMENT ---
-# Structure: conversations[user_id] = {
+# conversation_store.get(user_id) -> {
 #     "history": [{...messages...}],
-#     "diagnosis": {...diagnosis_data...} or None
+#     "diagnosis": {...diagnosis_data...} or None,
+#     "file_content": extracted file text or None,
+#     "intake": incremental intake summary (intake_state.py)
 # }
-conversations: Dict[int, Dict] = {}
+# Bounded in-memory LRU by default, or shared SQLite rows (CONVERSATION_STORE=sqlite)
 
 # --- STARTUP EVENT ---
 from contextlib import asynccontextmanager
@@ -67,15 +78,21 @@ async def lifespan(app: FastAPI):
     # Startup
     startup_event()
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    document_ingestor.shutdown()
+    await provider_client.aclose()
 
 def startup_event():
-    global tokenizer, ml_model, id2label_map
-    
     # 1. Init Database
     Base.metadata.create_all(bind=Engine)
     print("Database ready.")
 
+    # 2. Warm the shared ML model so the first diagnosis doesn't pay the load cost
+    if WARM_MODELS_ON_STARTUP:
+        print(f"Loading ML Model from: {disease_model_registry.model_dir}...")
+        if disease_model_registry.warm():
+            print("ML Model loaded successfully!")
+
 # --- APP SETUP ---
 app = FastAPI(title="Medimate Backend", version="2.0", lifespan=lifespan)
 
@@ -88,8 +105,19 @@ app.add_middleware(
     allow_headers=["*"], # Allows all headers
 )
 
+# --- TIME-TO-FIRST-BYTE METRICS (http.<path>.ttfb_seconds on /metrics) ---
+app.add_middleware(
+    TimingMiddleware,
+    paths=["/chat_with_ai", "/chat_with_ai_stream", "/predict_disease", "/predict_disease_batch"]
+)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    # A worker pool is full; shed load instead of queueing without bound
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # --- DATA MODELS ---
 class Token(BaseModel):
     access_token: str
@@ -98,6 +126,9 @@ class Token(BaseModel):
 class PredictRequest(BaseModel):
     text: str
 
+class BatchPredictRequest(BaseModel):
+    texts: List[str]
+
 class UserCreate(BaseModel):
     username: str
     password: str
@@ -107,7 +138,9 @@ class ChatRequest(BaseModel):
     """Request model for /chat_with_ai endpoint"""
     message: str
     conversation_id: Optional[str] = None
-    files: Optional[List[Dict]] = None  # List of file metadata: {name, size, type, content}
+    # Attached files: {file_id} of a POST /files upload, or (older clients) {name, size, type, content}
+    # with the content base64-encoded
+    files: Optional[List[Dict]] = None
 
 class ChatResponse(BaseModel):
     """Response model for /chat_with_ai endpoint"""
@@ -123,25 +156,17 @@ class ChatResponse(BaseModel):
     )
 
 # --- FILE HELPER FUNCTIONS ---
-def extract_text_from_pdf(file_data: bytes) -> str:
+def extract_text_from_pdf(file_data, digest: Optional[str] = None, on_text=None) -> str:
     """
-    Extract text content from PDF bytes.
-    Used to provide file content context to the AI.
+    Extract text content from PDF bytes or an uploaded file's path (first PDF_MAX_PAGES
+    pages, see document_ingest.py). Used to provide file content context to the AI.
+    on_text gets each page's text as soon as it is extracted.
     """
     if not PDF_AVAILABLE:
         return "[PDF content extraction not available]"
     
     try:
-        import io
-        pdf_file = io.BytesIO(file_data)
-        text = ""
-        with pdfplumber.open(pdf_file) as pdf:
-            for page_num, page in enumerate(pdf.pages[:5]):  # Limit to first 5 pages
-                text += f"\n--- Page {page_num + 1} ---\n"
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text
-        return text.strip() if text.strip() else "[PDF has no readable text]"
+        return document_ingestor.extract_text(file_data, digest, on_text)
     except Exception as e:
         print(f"[ERROR] PDF extraction failed: {e}")
         return f"[Unable to read PDF: {str(e)}]"
@@ -172,79 +197,70 @@ def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session
         raise credentials_exception
     return user
 
-
-    # 2. Load Model
-    print(f"Loading ML Model from: {MODEL_DIR}...")
-    try:
-        # Load Labels
-        labels = np.load(os.path.join(MODEL_DIR, "label_classes.npy"), allow_pickle=True).tolist()
-        id2label_map = {i: label for i, label in enumerate(labels)}
-        
-        # Load Tokenizer & Model
-        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-        ml_model = AutoModelForSequenceClassification.from_pretrained(
-            MODEL_DIR, 
-            local_files_only=True,
-            num_labels=len(labels),
-            ignore_mismatched_sizes=True # Fixes the shape warning temporarily
-        )
-        ml_model.eval() # Set to evaluation mode
-        print("ML Model loaded successfully!")
-    except Exception as e:
-        print(f"WARNING: Model load failed. Did you run training? Error: {e}")
-
-# --- ENDPOINTS ---
-
-@app.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
+def _create_user(db: Session, user: UserCreate) -> bool:
+    """Insert a new user; returns False if the username is taken. Runs on the auth pool (bcrypt)."""
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
+        return False
     
     new_user = User(username=user.username, hashed_password=hash_password(user.password), email=user.email)
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    return True
+
+def _authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    """Return the user if the password matches. Runs on the auth pool (bcrypt)."""
+    user = db.query(User).filter(User.username == username).first()
+    if not user or not verify_password(password, user.hashed_password):
+        return None
+    return user
+
+def _save_health_record(db: Session, user_id: int, diagnosis: str, severity: str, raw_ehr_text: str):
+    new_record = HealthRecord(
+        user_id=user_id,
+        diagnosis=diagnosis,
+        severity=severity,
+        raw_ehr_text=raw_ehr_text
+    )
+    db.add(new_record)
+    db.commit()
+
+# --- ENDPOINTS ---
+# Endpoints are async; blocking work goes to the bounded pools in service_executors
+# (bcrypt -> auth, torch -> inference/batcher, pdfplumber -> pdf, LLM conversation -> llm).
+# Short SQLite writes use Starlette's default threadpool.
+
+@app.post("/register")
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    if not await auth_executor.run(_create_user, db, user):
+        raise HTTPException(status_code=400, detail="Username already registered")
     return {"message": "User created successfully"}
 
 @app.post("/login", response_model=Token)
-def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)):
+    user = await auth_executor.run(_authenticate_user, db, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
     access_token = create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/predict_disease")
-def predict_disease(request: PredictRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def predict_disease(request: PredictRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    ml_model = disease_model_registry.get()
     if not ml_model:
         raise HTTPException(status_code=503, detail="ML Model not loaded")
     
-    # Run Inference
-    inputs = tokenizer(request.text, return_tensors="pt", truncation=True, padding=True, max_length=128)
-    with torch.no_grad():
-        outputs = ml_model(**inputs)
-        logits = outputs.logits
-        predicted_id = torch.argmax(logits, dim=1).item()
+    # Run Inference (coalesced with concurrent requests into one forward pass)
+    prediction = await predict_disease_text_async(request.text)
     
     # Decode Result
-    combined_label = id2label_map.get(predicted_id, "Unknown_mild")
-    try:
-        disease, severity = combined_label.rsplit('_', 1)
-    except ValueError:
-        disease = combined_label
-        severity = "unknown"
+    combined_label = prediction["label"] or "Unknown_mild"
+    disease, severity = split_combined_label(combined_label)
     
     # Save to History
-    new_record = HealthRecord(
-        user_id=current_user.id,
-        diagnosis=disease,
-        severity=severity,
-        raw_ehr_text=request.text
-    )
-    db.add(new_record)
-    db.commit()
+    await run_in_threadpool(_save_health_record, db, current_user.id, disease, severity, request.text)
     
     return {
         "disease": disease, 
@@ -253,38 +269,24 @@ def predict_disease(request: PredictRequest, current_user: User = Depends(get_cu
     }
 
 @app.post("/predict_disease_with_gemini")
-def predict_disease_with_gemini(request: PredictRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def predict_disease_with_gemini(request: PredictRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Enhanced endpoint that uses ML model directly for diagnosis.
     The frontend or CLI can call this for disease prediction.
     """
+    ml_model = disease_model_registry.get()
     if not ml_model:
         raise HTTPException(status_code=503, detail="ML Model not loaded")
     
-    # Run Inference
-    inputs = tokenizer(request.text, return_tensors="pt", truncation=True, padding=True, max_length=128)
-    with torch.no_grad():
-        outputs = ml_model(**inputs)
-        logits = outputs.logits
-        predicted_id = torch.argmax(logits, dim=1).item()
+    # Run Inference (coalesced with concurrent requests into one forward pass)
+    prediction = await predict_disease_text_async(request.text)
     
     # Decode Result
-    combined_label = id2label_map.get(predicted_id, "Unknown_mild")
-    try:
-        disease, severity = combined_label.rsplit('_', 1)
-    except ValueError:
-        disease = combined_label
-        severity = "unknown"
+    combined_label = prediction["label"] or "Unknown_mild"
+    disease, severity = split_combined_label(combined_label)
     
     # Save to History
-    new_record = HealthRecord(
-        user_id=current_user.id,
-        diagnosis=disease,
-        severity=severity,
-        raw_ehr_text=request.text
-    )
-    db.add(new_record)
-    db.commit()
+    await run_in_threadpool(_save_health_record, db, current_user.id, disease, severity, request.text)
     
     # Provide advice based on severity
     advice_map = {
@@ -300,47 +302,204 @@ def predict_disease_with_gemini(request: PredictRequest, current_user: User = De
         "advice": advice_map.get(severity, "Consult a healthcare professional.")
     }
 
-# --- NEW ENDPOINT: /chat_with_ai ---
-# This endpoint integrates Gemini AI conversation flow with ML prediction
-@app.post("/chat_with_ai", response_model=ChatResponse)
-def chat_with_ai(
-    request: ChatRequest,
+# --- BATCH PREDICTION: /predict_disease_batch ---
+def _is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "")
+    return "ndjson" in content_type or "jsonl" in content_type
+
+async def _read_ndjson_texts(request: Request) -> List:
+    """
+    Parse an NDJSON body line by line as it arrives and return [(index, text, error), ...].
+    Each line is either a JSON string or an object with a "text" field. The body is never
+    held in memory as one string; only the parsed texts are kept.
+
+    This must run before the StreamingResponse starts: once it does, Starlette listens on
+    the receive channel for client disconnects and the body can no longer be read.
+    """
+    def parse_line(index: int, line: bytes):
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            return index, None, f"invalid JSON: {e}"
+        text = item.get("text") if isinstance(item, dict) else item
+        if not isinstance(text, str):
+            return index, None, "each line must be a JSON string or an object with a 'text' field"
+        return index, text, None
+
+    items = []
+    buffer = b""
+    async for body_chunk in request.stream():
+        buffer += body_chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                items.append(parse_line(len(items), line))
+        if len(items) > PREDICT_BATCH_MAX_TEXTS:
+            raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_TEXTS} texts per request")
+    if buffer.strip():
+        items.append(parse_line(len(items), buffer))
+    if len(items) > PREDICT_BATCH_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_TEXTS} texts per request")
+    return items
+
+def _bulk_insert_health_records(rows: List[Dict]):
+    """Write all HealthRecord rows of a batch with one executemany INSERT and one commit."""
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(insert(HealthRecord), rows)
+        db.commit()
+    finally:
+        db.close()
+
+@app.post("/predict_disease_batch")
+async def predict_disease_batch(request: Request, current_user: User = Depends(get_current_user)):
+    """
+    Classify many clinical narratives in one request.
+
+    Body: {"texts": [...]} or an NDJSON stream (Content-Type: application/x-ndjson).
+    The JWT is decoded and the user looked up once. Texts are tokenized and run through
+    the model in chunks of PREDICT_BATCH_CHUNK_SIZE, and each chunk's results are streamed
+    back as NDJSON lines as soon as it finishes:
+        {"index": 0, "disease": "...", "severity": "...", "confidence": 0.93}
+    HealthRecord rows for the whole request are written with one bulk insert, followed
+    by a final {"done": true, "count": N, "saved": N} line.
+    """
+    ml_model = disease_model_registry.get()
+    if not ml_model:
+        raise HTTPException(status_code=503, detail="ML Model not loaded")
+
+    if _is_ndjson(request):
+        items = await _read_ndjson_texts(request)
+    else:
+        try:
+            payload = BatchPredictRequest(**(await request.json()))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Expected {{\"texts\": [...]}} or an NDJSON body: {e}")
+        if len(payload.texts) > PREDICT_BATCH_MAX_TEXTS:
+            raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_TEXTS} texts per request")
+        items = [(index, text, None) for index, text in enumerate(payload.texts)]
+
+    user_id = current_user.id
+    rows: List[Dict] = []
+
+    async def run_chunk(chunk) -> str:
+        predictions = await inference_executor.run(ml_model.predict, [text for _, text in chunk], 128, len(chunk))
+        lines = []
+        for (index, text), prediction in zip(chunk, predictions):
+            disease, severity = split_combined_label(prediction["label"] or "Unknown_mild")
+            rows.append({"user_id": user_id, "diagnosis": disease, "severity": severity, "raw_ehr_text": text})
+            lines.append(json.dumps({
+                "index": index,
+                "disease": disease,
+                "severity": severity,
+                "confidence": round(prediction["confidence"], 4)
+            }) + "\n")
+        metrics.inc("predict_batch.texts", len(chunk))
+        return "".join(lines)
+
+    async def stream_results():
+        count = 0
+        chunk = []
+        for index, text, error in items:
+            if error is not None:
+                yield json.dumps({"index": index, "error": error}) + "\n"
+                continue
+            count += 1
+            chunk.append((index, text))
+            if len(chunk) >= PREDICT_BATCH_CHUNK_SIZE:
+                yield await run_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield await run_chunk(chunk)
+
+        # One bulk insert for the whole request instead of a commit per text
+        await run_in_threadpool(_bulk_insert_health_records, rows)
+        yield json.dumps({"done": True, "count": count, "saved": len(rows)}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# --- FILE UPLOADS ---
+@app.post("/files")
+async def upload_file(
+    request: Request,
+    name: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Integrated chat endpoint that manages multi-turn conversation with Gemini AI.
-    
-    FLOW:
-    1. User sends symptom message
-    2. Gemini asks clarifying questions (if needed)
-    3. Once symptoms are complete, Gemini calls ML model
-    4. Gemini explains the diagnosis
-    5. User can ask follow-up questions
-    
-    Conversation state is maintained per user in memory.
-    Diagnosis is returned when prediction is complete.
+    Upload one file for the chat, streamed to disk (upload_store.py).
+
+    Body: multipart/form-data with the file in a "file" field, or the raw file bytes
+    with its name in ?name=. Returns {"file_id", "name", "type", "size", "sha256"};
+    send {"file_id": ...} in ChatRequest.files to attach it. 413 over UPLOAD_MAX_BYTES.
     """
-    
-    if not GEMINI_AVAILABLE:
-        return ChatResponse(
-            response="❌ Gemini AI is not configured. Using fallback mode.",
-            diagnosis=None,
-            conversation_complete=False,
-            error="GEMINI_NOT_AVAILABLE"
-        )
-    
     user_id = current_user.id
+    db.close()  # nothing else to read; don't hold a pooled connection for the whole upload
     
-    # Initialize conversation state for this user if not exists
-    if user_id not in conversations:
-        conversations[user_id] = {
-            "history": [],
-            "diagnosis": None,
-            "file_content": None  # Store extracted file content for follow-up questions
-        }
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > upload_store.max_bytes + 64 * 1024:
+        metrics.inc("uploads.rejected")
+        raise HTTPException(status_code=413, detail=f"File is over the {upload_store.max_bytes} byte limit")
+    try:
+        stored = await upload_store.save(user_id, request.headers.get("content-type", ""), request.stream(), name)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return stored.public()
+
+@app.delete("/files/{file_id}")
+def delete_file(file_id: str, current_user: User = Depends(get_current_user)):
+    """Delete one of the user's uploads before it expires"""
+    if not upload_store.delete(file_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Unknown file id")
+    return {"deleted": file_id}
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def _extract_file_text(filename: str, file_data, digest: Optional[str] = None, on_text=None) -> str:
+    """
+    Text of one attachment (bytes, or the path of an upload) for the AI, by file type.
+    on_text, if given, is called on the event loop with the text as it is read (PDFs
+    page by page), e.g. a summary prefetcher.
+    """
+    if filename.lower().endswith('.pdf'):
+        page_text = None
+        if on_text is not None:
+            on_text(f"[{filename}]\n")
+            loop = asyncio.get_running_loop()
+            page_text = lambda part: loop.call_soon_threadsafe(on_text, part)  # from the pdf worker thread
+        text = await pdf_executor.run(extract_text_from_pdf, file_data, digest, page_text)
+        return f"[{filename}]\n{text}"
+    elif filename.lower().endswith(('.txt', '.md')):
+        if not isinstance(file_data, bytes):
+            file_data = await run_in_threadpool(_read_file, file_data)
+        text = file_data.decode('utf-8', errors='ignore')
+        if on_text is not None:
+            on_text(f"[{filename}]\n{text}")
+        return f"[{filename}]\n{text}"
+    else:
+        return f"[{filename}] - File type not directly readable"
+
+# --- NEW ENDPOINT: /chat_with_ai ---
+# This endpoint integrates Gemini AI conversation flow with ML prediction
+FILE_CONTENT_HEADER = "\n\n---FILE CONTENT---\n"
+FILE_CONTENT_SEPARATOR = "\n\n"
+
+async def _prepare_chat_turn(request: ChatRequest, current_user: User):
+    """
+    Load (or create) the user's conversation state, extract text from attached files
+    and build the keyword arguments for llm_process_conversation.
+    Shared by /chat_with_ai and /chat_with_ai_stream.
+    """
+    user_id = current_user.id
     
-    conversation_state = conversations[user_id]
+    # Load conversation state for this user (a fresh one if none is stored or it expired)
+    conversation_state = await run_in_threadpool(conversation_store.get, user_id)
     conversation_history = conversation_state["history"]
     existing_diagnosis = conversation_state["diagnosis"]
     existing_file_content = conversation_state.get("file_content")  # Get previously extracted file content
@@ -349,15 +508,41 @@ def chat_with_ai(
     print(f"[BACKEND DEBUG] existing_diagnosis: {existing_diagnosis}")
     print(f"[BACKEND DEBUG] conversation_history length: {len(conversation_history)}")
     print(f"[BACKEND DEBUG] Files attached: {len(request.files) if request.files else 0}")
-    if request.files:
-        print(f"[BACKEND DEBUG] File details: {request.files}")
     
-    # Extract text from attached files if present
+    # Attached files: uploads referenced by id, or inline base64 content from older clients.
+    # Only their metadata goes on to the AI and into the logs.
+    attached_files = None
     file_content_summary = None
     if request.files and len(request.files) > 0:
+        attached_files = []
         extracted_texts = []
+        # A turn that asks for a summary of its files starts the chunk summaries while the
+        # files are still being read (fed the same text as file_content_summary below)
+        prefetcher = start_summary_prefetch(request.message, request.files) if GEMINI_AVAILABLE else None
+        on_text = prefetcher.feed if prefetcher is not None else None
+        if prefetcher is not None:
+            prefetcher.feed(FILE_CONTENT_HEADER)
         for file_info in request.files:
+            if file_info.get('file_id'):
+                stored = upload_store.get(file_info['file_id'], user_id)
+                if stored is None:
+                    raise HTTPException(status_code=404, detail=f"Unknown or expired file id: {file_info['file_id']}")
+                attached_files.append({"name": stored.name, "size": stored.size, "type": stored.content_type,
+                                       "file_id": stored.file_id})
+                if prefetcher is not None and extracted_texts:
+                    prefetcher.feed(FILE_CONTENT_SEPARATOR)
+                try:
+                    extracted_texts.append(await _extract_file_text(stored.name, stored.path, stored.sha256, on_text))
+                except ExecutorSaturated:
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Failed to extract content from {stored.name}: {e}")
+                    extracted_texts.append(f"[{stored.name}] - Error reading file: {str(e)}")
+                continue
+            attached_files.append({k: file_info.get(k) for k in ("name", "size", "type")})
             if file_info.get('content'):
+                if prefetcher is not None and extracted_texts:
+                    prefetcher.feed(FILE_CONTENT_SEPARATOR)
                 try:
                     # Decode base64 content
                     # Handle both standard base64 and data URI formats
@@ -370,22 +555,21 @@ def chat_with_ai(
                     filename = file_info.get('name', 'unknown')
                     
                     # Try to extract text based on file type
-                    if filename.lower().endswith('.pdf'):
-                        text = extract_text_from_pdf(file_bytes)
-                        extracted_texts.append(f"[{filename}]\n{text}")
-                    elif filename.lower().endswith(('.txt', '.md')):
-                        text = file_bytes.decode('utf-8', errors='ignore')
-                        extracted_texts.append(f"[{filename}]\n{text}")
-                    else:
-                        extracted_texts.append(f"[{filename}] - File type not directly readable")
+                    extracted_texts.append(await _extract_file_text(filename, file_bytes, on_text=on_text))
+                except ExecutorSaturated:
+                    raise
                 except Exception as e:
                     print(f"[ERROR] Failed to extract content from {file_info.get('name')}: {e}")
                     extracted_texts.append(f"[{file_info.get('name')}] - Error reading file: {str(e)}")
         
         if extracted_texts:
-            file_content_summary = "\n\n---FILE CONTENT---\n" + "\n\n".join(extracted_texts) + "\n---END FILE CONTENT---"
+            file_content_summary = (FILE_CONTENT_HEADER + FILE_CONTENT_SEPARATOR.join(extracted_texts)
+                                    + "\n---END FILE CONTENT---")
             # STORE the extracted content in conversation state for follow-up questions
             conversation_state["file_content"] = file_content_summary
+            # Index it now for follow-up questions (document_index.py)
+            await run_in_threadpool(document_index.build, file_content_summary)
+            await run_in_threadpool(conversation_store.save, user_id, conversation_state)
             print(f"[INFO] Extracted text from {len(extracted_texts)} file(s) and stored for follow-up questions")
     else:
         # Use previously stored file content if no new files attached
@@ -406,72 +590,219 @@ def chat_with_ai(
         print(f"Token creation error: {e}")
         auth_token = None
     
-    try:
-        # Call Gemini AI conversation handler
-        ai_response, updated_diagnosis = llm_process_conversation(
-            conversation_history=conversation_history,
-            user_input=request.message,
-            auth_token=auth_token,
-            diagnosis_data=existing_diagnosis,
-            attached_files=request.files,  # Pass file metadata to AI
-            file_content=file_content_summary  # Pass extracted file content
+    llm_kwargs = {
+        "conversation_history": conversation_history,
+        "user_input": request.message,
+        "auth_token": auth_token,
+        "diagnosis_data": existing_diagnosis,
+        "attached_files": attached_files,  # Pass file metadata to AI
+        "file_content": file_content_summary,  # Pass extracted file content
+        "intake_state": conversation_state.get("intake")  # Intake summary of the history so far
+    }
+    return conversation_state, llm_kwargs
+
+async def _finish_chat_turn(db: Session, user_id: int, conversation_state: Dict, message: str,
+                            ai_response, updated_diagnosis) -> ChatResponse:
+    """Record the turn in the conversation history, save a new diagnosis and build the response."""
+    existing_diagnosis = conversation_state["diagnosis"]
+    
+    # Note: ai_response now returns user-friendly error messages instead of "GEMINI_ERROR"
+    # No need to check for specific error strings - just proceed with the response
+    
+    # Advance the intake summary by this turn's two messages (rebuilt once for
+    # conversations stored before it existed), then update conversation history
+    intake = conversation_state.get("intake") or intake_state_from_history(conversation_state["history"])
+    intake = observe_message(intake, "user", message)
+    conversation_state["intake"] = observe_message(intake, "model", str(ai_response))
+    conversation_state["history"].append({
+        "role": "user",
+        "parts": [{"text": message}]
+    })
+    conversation_state["history"].append({
+        "role": "model",
+        "parts": [{"text": str(ai_response)}]  # Ensure it's a string
+    })
+    
+    # Update diagnosis if available
+    if updated_diagnosis:
+        conversation_state["diagnosis"] = updated_diagnosis
+        # Save to database
+        await run_in_threadpool(
+            _save_health_record,
+            db,
+            user_id,
+            updated_diagnosis.get("disease", "Unknown"),
+            updated_diagnosis.get("severity", "unknown"),
+            updated_diagnosis.get("summary", "")
         )
-        
-        # Note: ai_response now returns user-friendly error messages instead of "GEMINI_ERROR"
-        # No need to check for specific error strings - just proceed with the response
-        
-        # Update conversation history
-        conversation_history.append({
-            "role": "user",
-            "parts": [{"text": request.message}]
-        })
-        conversation_history.append({
-            "role": "model",
-            "parts": [{"text": str(ai_response)}]  # Ensure it's a string
-        })
-        
-        # Update diagnosis if available
-        if updated_diagnosis:
-            conversation_state["diagnosis"] = updated_diagnosis
-            # Save to database
-            new_record = HealthRecord(
-                user_id=user_id,
-                diagnosis=updated_diagnosis.get("disease", "Unknown"),
-                severity=updated_diagnosis.get("severity", "unknown"),
-                raw_ehr_text=updated_diagnosis.get("summary", "")
-            )
-            db.add(new_record)
-            db.commit()
-        
-        # Determine if conversation is complete (diagnosis has been made)
-        is_complete = updated_diagnosis is not None
-        
-        # Ensure diagnosis is JSON-serializable
-        diagnosis_to_return = updated_diagnosis if updated_diagnosis else existing_diagnosis
-        
+    
+    await run_in_threadpool(conversation_store.save, user_id, conversation_state)
+    
+    # Determine if conversation is complete (diagnosis has been made)
+    is_complete = updated_diagnosis is not None
+    
+    # Ensure diagnosis is JSON-serializable
+    diagnosis_to_return = updated_diagnosis if updated_diagnosis else existing_diagnosis
+    
+    return ChatResponse(
+        response=ai_response,
+        diagnosis=diagnosis_to_return,
+        conversation_complete=is_complete,
+        error=None
+    )
+
+@app.post("/chat_with_ai", response_model=ChatResponse)
+async def chat_with_ai(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Integrated chat endpoint that manages multi-turn conversation with Gemini AI.
+    
+    FLOW:
+    1. User sends symptom message
+    2. Gemini asks clarifying questions (if needed)
+    3. Once symptoms are complete, Gemini calls ML model
+    4. Gemini explains the diagnosis
+    5. User can ask follow-up questions
+    
+    Conversation state is kept per user in conversation_store (bounded, expiring).
+    Diagnosis is returned when prediction is complete.
+    """
+    
+    if not GEMINI_AVAILABLE:
         return ChatResponse(
-            response=ai_response,
-            diagnosis=diagnosis_to_return,
-            conversation_complete=is_complete,
-            error=None
+            response="❌ Gemini AI is not configured. Using fallback mode.",
+            diagnosis=None,
+            conversation_complete=False,
+            error="GEMINI_NOT_AVAILABLE"
         )
+    
+    user_id = current_user.id
+    # Hand the pooled DB connection back before the long PDF/LLM awaits; otherwise every
+    # in-flight chat pins one and a few dozen slow LLM calls exhaust the pool. The loaded
+    # user stays readable, and the session reconnects if the diagnosis is saved below.
+    db.close()
+    
+    conversation_state, llm_kwargs = await _prepare_chat_turn(request, current_user)
+    
+    try:
+        # Call Gemini AI conversation handler (a coroutine: provider calls wait on the
+        # event loop, not in a thread, so slow providers cannot exhaust a worker pool)
+        ai_response, updated_diagnosis = await llm_process_conversation(**llm_kwargs)
+        return await _finish_chat_turn(db, user_id, conversation_state, request.message, ai_response, updated_diagnosis)
         
+    except ExecutorSaturated:
+        raise
     except Exception as e:
         print(f"Chat error: {str(e)}")
         return ChatResponse(
             response=f"❌ Error: {str(e)}",
-            diagnosis=existing_diagnosis,
+            diagnosis=conversation_state["diagnosis"],
             conversation_complete=False,
             error=str(e)
         )
 
+# --- STREAMING VARIANT: /chat_with_ai_stream (Server-Sent Events) ---
+def _sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/chat_with_ai_stream")
+async def chat_with_ai_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Same conversation flow as /chat_with_ai, streamed as Server-Sent Events.
+
+    Events:
+      token      {"text": "..."}    LLM text as it arrives. Follow-up answers and file
+                                    summaries stream token by token; intake replies are
+                                    checked for red flags / ML triggers first and arrive whole.
+      diagnosis  {...}              the ML diagnosis, as soon as the model has returned
+      done       ChatResponse       the final response (authoritative full text)
+      error      {"error": "..."}
+    """
+    if not GEMINI_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Gemini AI is not configured")
+    
+    user_id = current_user.id
+    db.close()  # see chat_with_ai
+    
+    conversation_state, llm_kwargs = await _prepare_chat_turn(request, current_user)
+    
+    events: asyncio.Queue = asyncio.Queue()
+    
+    # Called on the event loop by the conversation task as text / diagnoses arrive
+    def on_token(text: str):
+        if text:
+            events.put_nowait(("token", {"text": text}))
+    
+    def on_diagnosis(diagnosis: Dict):
+        events.put_nowait(("diagnosis", diagnosis))
+    
+    llm_task = asyncio.ensure_future(
+        llm_process_conversation(on_token=on_token, on_diagnosis=on_diagnosis, **llm_kwargs)
+    )
+    llm_task.add_done_callback(lambda _: events.put_nowait(("finished", None)))
+    
+    async def stream_events():
+        streamed_tokens = False
+        try:
+            while True:
+                event, data = await events.get()
+                if event == "finished":
+                    break
+                streamed_tokens = streamed_tokens or event == "token"
+                yield _sse_event(event, data)
+        finally:
+            # Client went away mid-stream: drop the provider requests of this turn
+            llm_task.cancel()
+        
+        try:
+            ai_response, updated_diagnosis = llm_task.result()
+        except Exception as e:
+            print(f"Chat stream error: {str(e)}")
+            yield _sse_event("error", {"error": str(e)})
+            return
+        
+        if not streamed_tokens:
+            # This turn's reply was not produced by a streaming provider call
+            yield _sse_event("token", {"text": str(ai_response)})
+        final = await _finish_chat_turn(db, user_id, conversation_state, request.message, ai_response, updated_diagnosis)
+        yield _sse_event("done", final.model_dump())
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- METRICS ---
+@app.get("/metrics")
+def get_metrics():
+    """JSON snapshot of in-process metrics (model load time, memory footprint, ...)"""
+    return {
+        "models": {"disease": disease_model_registry.stats()},
+        "executors": executor_stats(),
+        "llm_http": provider_client.stats(),
+        "conversations": conversation_store.stats(),
+        "llm_cache": llm_cache.stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "documents": document_ingestor.stats(),
+        "uploads": upload_store.stats(),
+        "summaries": document_summarizer.stats(),
+        "retrieval": document_index.stats(),
+        **metrics.snapshot()
+    }
+
 # --- HELPER: Clear conversation state (for testing/logout)
 @app.post("/clear_conversation")
 def clear_conversation(current_user: User = Depends(get_current_user)):
     """Clear conversation history for current user"""
-    user_id = current_user.id
-    if user_id in conversations:
-        del conversations[user_id]
+    conversation_store.delete(current_user.id)
     return {"message": "Conversation cleared", "username": current_user.username}
 
 # --- SERVE FRONTEND STATIC FILES ---
@@ -0,0 +1,117 @@
+# bench_async_load.py
+"""
+Load test: latency of /login and /predict_disease while LLM calls are slow.
+
+The real conversation handler is replaced with one that waits --llm-delay
+seconds (like a slow OpenRouter response on the async provider client).
+For each level of concurrent slow /chat_with_ai calls, a fixed number of
+"fast" clients hammer /predict_disease and /login and their p50/p99 latency is
+reported. These numbers should stay flat as the number of stuck LLM calls
+grows, and every slow chat should complete once per delay: a waiting provider
+call holds no worker thread, so there is no LLM pool to fill up and answer 503.
+
+Requests go through httpx's in-process ASGI transport, so no server is needed.
+Run it from the repo root (it uses ./medimate.db and the disease model dir).
+
+Usage:
+  python bench_async_load.py
+  python bench_async_load.py --llm-delay 2 --slow 0 16 64 --fast 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import backend_service
+
+BENCH_USER = {"username": "bench_load_user", "password": "bench-password"}
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+def make_slow_llm(delay):
+    async def slow_llm_process_conversation(conversation_history, user_input, auth_token, diagnosis_data=None,
+                                            attached_files=None, file_content=None, intake_state=None):
+        await asyncio.sleep(delay)  # like a slow provider awaited on the async client
+        return "Thanks, tell me more about your symptoms.", None
+    return slow_llm_process_conversation
+
+
+async def slow_chat_client(client, headers, stop, completed):
+    while not stop.is_set():
+        response = await client.post("/chat_with_ai", json={"message": "I have a headache"}, headers=headers)
+        if response.status_code == 200:
+            completed.append(1)
+
+
+async def fast_client(client, headers, stop, latencies):
+    form = {"username": BENCH_USER["username"], "password": BENCH_USER["password"]}
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        if i % 4 == 3:
+            await client.post("/login", data=form)
+            latencies["login"].append(time.perf_counter() - start)
+        else:
+            await client.post("/predict_disease", json={"text": "fever and cough for 3 days"}, headers=headers)
+            latencies["predict"].append(time.perf_counter() - start)
+        i += 1
+
+
+async def run_level(client, headers, slow, fast, duration):
+    stop = asyncio.Event()
+    latencies = {"predict": [], "login": []}
+    completed = []
+    tasks = [asyncio.create_task(slow_chat_client(client, headers, stop, completed)) for _ in range(slow)]
+    # Let the slow calls occupy their workers before measuring
+    await asyncio.sleep(0.2 if slow else 0)
+    tasks += [asyncio.create_task(fast_client(client, headers, stop, latencies)) for _ in range(fast)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, len(completed)
+
+
+async def main_async(args):
+    backend_service.startup_event()
+    backend_service.GEMINI_AVAILABLE = True
+    backend_service.llm_process_conversation = make_slow_llm(args.llm_delay)
+
+    transport = httpx.ASGITransport(app=backend_service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/register", json=BENCH_USER)
+        response = await client.post("/login", data=BENCH_USER)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        print(f"\nLLM delay {args.llm_delay}s, {args.fast} fast clients, {args.duration}s per level")
+        print(f"{'slow LLM':>9}{'predict n':>11}{'p50 ms':>9}{'p99 ms':>9}{'login n':>9}{'p50 ms':>9}{'p99 ms':>9}{'chats':>7}")
+        print("-" * 72)
+        for slow in args.slow:
+            latencies, chats = await run_level(client, headers, slow, args.fast, args.duration)
+            predict, login = latencies["predict"], latencies["login"]
+            print(f"{slow:>9}{len(predict):>11}{percentile(predict, 50) * 1000:>9.1f}{percentile(predict, 99) * 1000:>9.1f}"
+                  f"{len(login):>9}{percentile(login, 50) * 1000:>9.1f}{percentile(login, 99) * 1000:>9.1f}{chats:>7}")
+
+    print("\nslow LLM = concurrent /chat_with_ai calls waiting on the LLM; chats = how many of them completed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-delay", type=float, default=2.0)
+    parser.add_argument("--slow", type=int, nargs="+", default=[0, 8, 32, 64])
+    parser.add_argument("--fast", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_batching.py
+"""
+Throughput vs. concurrency benchmark for the disease classifier on CPU.
+
+Compares one forward pass per request (what /predict_disease did before)
+with the MicroBatcher in inference_batcher.py, at several concurrency levels.
+
+Usage:
+  python bench_batching.py
+  python bench_batching.py --requests 256 --concurrency 1 4 16 32 --window-ms 5 --max-batch 16
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_batcher import MicroBatcher
+from model_registry import disease_model_registry
+from service_metrics import metrics
+
+SAMPLE_TEXTS = [
+    "Patient presents with fever and cough for 3 days. Symptoms are moderate in severity.",
+    "Patient presents with a headache for 2 hours. Symptoms are mild in severity.",
+    "Patient presents with fever, body aches and chills for 4 days. Symptoms are severe in severity.",
+    "Patient presents with sore throat and runny nose for 1 day. Symptoms are mild in severity.",
+    "Patient presents with abdominal pain, nausea and vomiting for 12 hours. Symptoms are severe in severity.",
+    "Patient presents with cough, phlegm and shortness of breath for 5 days. Symptoms are moderate in severity.",
+]
+
+
+def run_load(predict_one, total_requests, concurrency):
+    """Fire total_requests calls from `concurrency` threads; return (seconds, per-request latencies)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        predict_one(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total_requests)))
+    return time.perf_counter() - start, latencies
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=16)
+    args = parser.parse_args()
+
+    model = disease_model_registry.warm()
+    if model is None:
+        raise SystemExit(f"Model not available: {disease_model_registry.last_error}")
+
+    # Warm-up pass so the first measurement doesn't include lazy init
+    model.predict(SAMPLE_TEXTS)
+
+    print(f"\nRequests per run: {args.requests}  window={args.window_ms}ms  max_batch={args.max_batch}")
+    print(f"{'mode':<10}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'avg batch':>11}")
+    print("-" * 57)
+    for concurrency in args.concurrency:
+        seconds, latencies = run_load(lambda text: model.predict([text]), args.requests, concurrency)
+        print(f"{'unbatched':<10}{concurrency:>6}{args.requests / seconds:>10.1f}"
+              f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}{1:>11.1f}")
+
+        metrics.reset()
+        batcher = MicroBatcher(lambda texts: model.predict(texts, batch_size=len(texts)),
+                               max_batch_size=args.max_batch, max_wait_ms=args.window_ms, name="bench")
+        seconds, latencies = run_load(batcher.predict, args.requests, concurrency)
+        batcher.stop()
+        batch_sizes = metrics.histogram("batcher.bench.batch_size") or {}
+        print(f"{'batched':<10}{concurrency:>6}{args.requests / seconds:>10.1f}"
+              f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}"
+              f"{(batch_sizes.get('mean') or 0):>11.1f}")
+
+    print("\nLatency in milliseconds per request; avg batch = texts per forward pass.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_chat_ttfb.py
+"""
+Time-to-first-byte: /chat_with_ai vs /chat_with_ai_stream.
+
+Starts llm_stub_server.py and the backend with uvicorn in this process (the
+stub streams word-sized tokens with --token-delay between them), walks one
+user through intake to a diagnosis, then asks the same follow-up question
+through both endpoints. It prints client-side TTFB and total time, plus the
+server-side http.<path>.ttfb_seconds histograms from /metrics.
+
+Run it from the repo root (it uses ./medimate.db and the disease model dir).
+
+Usage:
+  python bench_chat_ttfb.py
+  python bench_chat_ttfb.py --rounds 10 --token-delay 0.03
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import httpx
+import uvicorn
+
+STUB_PORT = 8766
+BACKEND_PORT = 8767
+BENCH_USER = {"username": "bench_ttfb_user", "password": "bench-password"}
+
+# Point the conversation handler at the stub before it is imported
+os.environ.setdefault("LLM_PROVIDER", "local")
+os.environ.setdefault("LOCAL_MODEL_URL", f"http://127.0.0.1:{STUB_PORT}/v1")
+
+import llm_stub_server  # noqa: E402
+import backend_service  # noqa: E402
+
+
+def start_server(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def timed_request(client, path, message, headers):
+    start = time.perf_counter()
+    first_byte = None
+    with client.stream("POST", path, json={"message": message}, headers=headers) as response:
+        for chunk in response.iter_bytes():
+            if first_byte is None and chunk:
+                first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    llm_stub_server.STUB_TOKEN_DELAY_SECONDS = args.token_delay
+    servers = [start_server(llm_stub_server.app, STUB_PORT), start_server(backend_service.app, BACKEND_PORT)]
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{BACKEND_PORT}", timeout=120) as client:
+        client.post("/register", json=BENCH_USER)
+        token = client.post("/login", data=BENCH_USER).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        client.post("/clear_conversation", headers=headers)
+        for message in ["I have fever and cough", "for 3 days", "moderate"]:
+            client.post("/chat_with_ai", json={"message": message}, headers=headers)
+
+        print(f"\nFollow-up question, {args.rounds} rounds, stub token delay {args.token_delay * 1000:.0f} ms")
+        print(f"{'endpoint':<22}{'ttfb ms':>10}{'total ms':>10}")
+        print("-" * 42)
+        for path in ["/chat_with_ai", "/chat_with_ai_stream"]:
+            results = [timed_request(client, path, "What should I eat?", headers) for _ in range(args.rounds)]
+            ttfb = sorted(r[0] for r in results)[len(results) // 2]
+            total = sorted(r[1] for r in results)[len(results) // 2]
+            print(f"{path:<22}{ttfb * 1000:>10.1f}{total * 1000:>10.1f}")
+
+        histograms = client.get("/metrics").json()["histograms"]
+        print("\nServer-side (median):")
+        for name, histogram in sorted(histograms.items()):
+            if name.startswith("http./chat_with_ai") and name.endswith("ttfb_seconds"):
+                print(f"  {name:<42}{histogram['p50'] * 1000:>8.1f} ms  (n={histogram['count']})")
+
+    for server in servers:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
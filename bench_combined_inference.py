@@ -0,0 +1,144 @@
+# bench_combined_inference.py
+"""
+Latency and memory of combined_inference.py per COMBINED_MODE, against the
+two-model path it replaced (ner_extract + classify_text per text, each
+tokenizing the text and running its own encoder).
+
+Every mode runs in a fresh Python process so its memory is its own: the
+weights held after importing combined_inference (loading the models) and the
+resident set growth from before that import to the end of the timed runs
+(weights are memory-mapped, so they count once inference has touched them).
+Timed per text on --texts distinct clinical summaries (encoding caches
+emptied before each pass):
+
+ - two calls    ner_extract(text) + classify_text(text)
+ - analyze      analyze([text])
+ - batch        analyze(texts) with --batch-size, texts/s
+
+Entities and predictions of every mode are compared with the separate mode's
+two calls.
+
+multihead only applies when the NER model holds the classifier's encoder
+weights; otherwise that run falls back to shared. With --random-model the script builds a random
+Bio_ClinicalBERT-sized classifier and NER model that share their encoder
+weights (a shared-encoder checkpoint) in a temporary directory, so all three
+modes can be timed without trained models.
+
+Usage:
+  python bench_combined_inference.py
+  python bench_combined_inference.py --ner-dir medimate-ner-output --disease-dir medimate-disease-model
+  python bench_combined_inference.py --random-model --base-model emilyalsentzer/Bio_ClinicalBERT --texts 64
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench_inference_backends import build_random_model
+
+MODES = ("separate", "shared", "multihead")
+
+PROBE = """
+import json, random, sys, time
+import torch
+from transformers import AutoModelForSequenceClassification, AutoModelForTokenClassification, AutoTokenizer
+import model_runtime, token_cache  # imported before measuring: only the models count
+from service_metrics import process_rss_bytes
+from bench_inference_backends import make_texts
+texts, batch_size = make_texts(random.Random(int(sys.argv[1])), int(sys.argv[2])), int(sys.argv[3])
+before = process_rss_bytes()
+import combined_inference as ci
+import gc; gc.collect()
+report = {"mode": "multihead" if ci.multihead is not None else "shared" if ci.shared_tokens else "separate",
+          "weights": sum(p.numel() * p.element_size() for m in {ci.cls_model, ci.ner_model or ci.multihead.ner_head}
+                         for p in list(m.parameters()) + list(m.buffers()))}
+ci.analyze(make_texts(random.Random(0), 8))  # warm-up
+
+def timed(run):
+    ci.ner_encoder.clear(); ci.cls_encoder.clear()
+    start = time.perf_counter()
+    out = run()
+    return time.perf_counter() - start, out
+
+seconds, two_calls = timed(lambda: [(ci.ner_extract(t) or ci.fallback_simple_symptoms(t), ci.classify_text(t)) for t in texts])
+report["two_calls_ms"] = seconds / len(texts) * 1000
+seconds, single = timed(lambda: [ci.analyze([t])[0] for t in texts])
+report["analyze_ms"] = seconds / len(texts) * 1000
+seconds, batched = timed(lambda: ci.analyze(texts, batch_size=batch_size))
+report["batch_per_s"] = len(texts) / seconds
+report["rss_delta"] = process_rss_bytes() - before
+report["results"] = [[[(e["type"], e["text"]) for e in r["entities"]], r["prediction"]["label"]] for r in batched]
+report["two_call_results"] = [[[(e["type"], e["text"]) for e in ents], pred["label"]] for ents, pred in two_calls]
+print(json.dumps(report))
+"""
+
+
+def build_shared_encoder_models(workdir, base_model):
+    """Random classifier and NER model with one encoder's weights, tokenizer saved with each."""
+    from transformers import AutoModelForSequenceClassification, AutoModelForTokenClassification, AutoTokenizer, BertConfig
+
+    disease_dir, ner_dir = os.path.join(workdir, "disease"), os.path.join(workdir, "ner")
+    build_random_model(disease_dir, base_model)
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    labels = ["O", "B-SYM", "I-SYM", "B-DUR", "I-DUR", "B-SEV", "I-SEV"]
+    config = BertConfig.from_pretrained(disease_dir, id2label=dict(enumerate(labels)),
+                                        label2id={l: i for i, l in enumerate(labels)})
+    ner = AutoModelForTokenClassification.from_config(config)
+    encoder = AutoModelForSequenceClassification.from_pretrained(disease_dir).base_model.state_dict()
+    ner.base_model.load_state_dict({k: v for k, v in encoder.items() if not k.startswith("pooler.")}, strict=False)
+    ner.save_pretrained(ner_dir)
+    for path in (disease_dir, ner_dir):
+        tokenizer.save_pretrained(path)
+    return disease_dir, ner_dir
+
+
+def run_mode(mode, disease_dir, ner_dir, args):
+    env = dict(os.environ, COMBINED_MODE=mode, DISEASE_MODEL_DIR=os.path.abspath(disease_dir),
+               NER_MODEL_DIR=os.path.abspath(ner_dir))
+    if args.threads:
+        env["OMP_NUM_THREADS"] = str(args.threads)
+    out = subprocess.run([sys.executable, "-c", PROBE, str(args.seed), str(args.texts), str(args.batch_size)],
+                         capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(f"{mode} failed:\n{out.stderr[-2000:]}")
+    for line in out.stdout.splitlines():
+        if line.startswith("[COMBINED]"):
+            print(line)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--disease-dir", default=os.getenv("DISEASE_MODEL_DIR", "medimate-disease-model"))
+    parser.add_argument("--ner-dir", default=os.getenv("NER_MODEL_DIR", "medimate-ner-output"))
+    parser.add_argument("--base-model", default=os.getenv("DISEASE_BASE_MODEL", "emilyalsentzer/Bio_ClinicalBERT"))
+    parser.add_argument("--random-model", action="store_true", help="time random shared-encoder models of Bio_ClinicalBERT's size")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--texts", type=int, default=48)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0, help="OMP_NUM_THREADS for the runs (0 = library default)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        disease_dir, ner_dir = args.disease_dir, args.ner_dir
+        if args.random_model:
+            disease_dir, ner_dir = build_shared_encoder_models(workdir, args.base_model)
+        reports = [(mode, run_mode(mode, disease_dir, ner_dir, args)) for mode in args.modes]
+
+    reference = reports[0][1]["two_call_results"]
+    print(f"\n{'mode':<11}{'ran as':<11}{'RSS MB':>12}{'weights MB':>12}{'two calls ms':>14}{'analyze ms':>12}"
+          f"{f'batch {args.batch_size} /s':>13}{'agree':>8}")
+    print("-" * 93)
+    for mode, report in reports:
+        agree = sum(a == b for a, b in zip(reference, report["results"])) / len(reference)
+        print(f"{mode:<11}{report['mode']:<11}{report['rss_delta'] / 1e6:>12.1f}{report['weights'] / 1e6:>12.1f}"
+              f"{report['two_calls_ms']:>14.2f}{report['analyze_ms']:>12.2f}{report['batch_per_s']:>13.1f}{agree:>8.1%}")
+    print(f"\n{args.texts} texts; agreement: entities and label vs {reports[0][0]}'s ner_extract + classify_text")
+
+
+if __name__ == "__main__":
+    main()
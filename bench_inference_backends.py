@@ -0,0 +1,136 @@
+# bench_inference_backends.py
+"""
+Disease classifier latency and throughput per inference backend (model_runtime.py).
+
+Loads the classifier through ModelRegistry once per backend (pytorch,
+torchscript, onnx, int8) and times DiseaseModel.predict on clinical summaries:
+median and p95 latency for single texts (one diagnosis), then texts/s at
+larger batch sizes. Predictions are compared with the PyTorch backend's.
+
+The exported artifacts must exist (python export_disease_model.py,
+python quantize_models.py). With --random-model the script instead builds a
+randomly initialised classifier of Bio_ClinicalBERT's size (12 layers, hidden
+768) in a temporary directory and exports and quantizes it first (skipping the
+accuracy gate), for timing without trained weights; predictions are then
+meaningless but still have to agree across backends (int8 only mostly).
+
+Usage:
+  python bench_inference_backends.py
+  python bench_inference_backends.py --random-model --base-model emilyalsentzer/Bio_ClinicalBERT --threads 4
+  python bench_inference_backends.py --backends pytorch onnx --batch-sizes 8 32 --rounds 50
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from model_registry import BASE_MODEL, MODEL_DIR, ModelRegistry
+from model_runtime import (
+    BACKENDS, ONNXRUNTIME_AVAILABLE, artifact_path, quantize_int8, save_int8, weights_fingerprint, write_sidecar,
+)
+
+SYMPTOMS = ["fever", "cough", "headache", "body ache", "sore throat", "runny nose", "nausea", "vomiting",
+            "abdominal pain", "joint pain", "rash", "fatigue", "dizziness", "chest pain", "shortness of breath"]
+DURATIONS = ["6 hours", "2 days", "3 days", "1 week", "2 weeks"]
+
+
+def make_texts(rng, count):
+    texts = []
+    for _ in range(count):
+        symptoms = rng.sample(SYMPTOMS, rng.randint(1, 6))
+        symptom_text = symptoms[0] if len(symptoms) == 1 else ", ".join(symptoms[:-1]) + f" and {symptoms[-1]}"
+        texts.append(f"Patient presents with {symptom_text} for {rng.choice(DURATIONS)}. "
+                     f"Symptoms are {rng.choice(['mild', 'moderate', 'severe'])} in severity.")
+    return texts
+
+
+def build_random_model(model_dir, base_model, num_labels=40):
+    from transformers import AutoTokenizer, BertConfig, BertForSequenceClassification
+
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    config = BertConfig(vocab_size=max(len(tokenizer), 28996), num_labels=num_labels)
+    BertForSequenceClassification(config).eval().save_pretrained(model_dir)
+    np.save(os.path.join(model_dir, "label_classes.npy"), np.array([f"Disease {i}_mild" for i in range(num_labels)]))
+
+
+def publish_int8_unchecked(model_dir):
+    """quantize_models.py without the accuracy gate, which random weights cannot meaningfully pass."""
+    from transformers import AutoModelForSequenceClassification
+
+    path = artifact_path(model_dir, "int8")
+    save_int8(quantize_int8(AutoModelForSequenceClassification.from_pretrained(model_dir)), path)
+    write_sidecar(path, {"format": "int8", "weights": weights_fingerprint(model_dir),
+                         "accuracy_gate": {"passed": True, "evaluated_on": "nothing (benchmark model)"}})
+
+
+def time_backend(registry, texts, batch_sizes, rounds):
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = registry.warm()
+    model.predict(texts[:8])  # warm-up (graph optimization, allocator)
+    single = []
+    for text in texts[:rounds]:
+        start = time.perf_counter()
+        model.predict([text])
+        single.append(time.perf_counter() - start)
+    single.sort()
+    throughput = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        model.predict(texts, batch_size=batch_size)
+        throughput[batch_size] = len(texts) / (time.perf_counter() - start)
+    labels = [p["label_id"] for p in model.predict(texts, batch_size=32)]
+    return model.backend, single[len(single) // 2], single[int(len(single) * 0.95) - 1], throughput, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--threads", type=int, default=0, help="DISEASE_INFERENCE_THREADS (0 = library default)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[8, 32])
+    parser.add_argument("--texts", type=int, default=128)
+    parser.add_argument("--rounds", type=int, default=30, help="single-text predictions timed per backend")
+    parser.add_argument("--random-model", action="store_true", help="time a random Bio_ClinicalBERT-sized model")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    backends = [b for b in args.backends if b != "onnx" or ONNXRUNTIME_AVAILABLE]
+    texts = make_texts(random.Random(args.seed), args.texts)
+    with tempfile.TemporaryDirectory() as workdir:
+        model_dir = args.model_dir
+        if args.random_model:
+            from export_disease_model import FORMATS, export
+
+            model_dir = workdir
+            build_random_model(model_dir, args.base_model)
+            export(model_dir, [b for b in backends if b in FORMATS], base_model=args.base_model)
+            if "int8" in backends:
+                publish_int8_unchecked(model_dir)
+
+        rows = []
+        for backend in backends:
+            registry = ModelRegistry(model_dir, args.base_model, backend=backend, threads=args.threads)
+            rows.append((backend, registry.stats, time_backend(registry, texts, args.batch_sizes, args.rounds)))
+
+    reference = rows[0][2][4]
+    print(f"\n{'backend':<13}{'ran as':<13}{'load s':>8}{'weights MB':>12}{'p50 ms':>9}{'p95 ms':>9}"
+          + "".join(f"{f'batch {b} /s':>14}" for b in args.batch_sizes) + f"{'agree':>8}")
+    print("-" * (72 + 14 * len(args.batch_sizes)))
+    for backend, stats, (ran_as, p50, p95, throughput, labels) in rows:
+        info = stats()
+        agree = sum(a == b for a, b in zip(reference, labels)) / len(labels)
+        print(f"{backend:<13}{ran_as:<13}{info['load_seconds']:>8.2f}{info['param_bytes'] / 1e6:>12.1f}"
+              f"{p50 * 1000:>9.2f}{p95 * 1000:>9.2f}"
+              + "".join(f"{throughput[b]:>14.1f}" for b in args.batch_sizes) + f"{agree:>8.1%}")
+    print(f"\n{len(texts)} texts, threads={args.threads or 'default'}, agreement vs {rows[0][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# bench_llm_cache.py
+"""
+LLM response cache (llm_cache.py) on simulated follow-up traffic.
+
+Follow-up questions are drawn with skewed popularity from a set of question
+templates, each asked in several surface forms (case, punctuation, spacing,
+small typos), about a handful of diagnoses. The provider is a fake that sleeps
+--latency seconds and answers with the template id, so a cached answer can be
+checked against the question it was served for.
+
+For each configuration the script reports the hit rate per tier, wrong answers
+(a similar-tier hit for a different question), mean time per call, and the
+cache's own overhead on a hit and on a miss:
+
+  off            no cache
+  memory+disk    exact tiers
+  restart        a new process on the same SQLite file (disk tier only warm)
+  similar        exact tiers plus the similar tier at --similarity
+
+Usage:
+  python bench_llm_cache.py
+  python bench_llm_cache.py --calls 400 --latency 0.02 --similarity 0.85
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from llm_cache import LLMResponseCache
+from service_metrics import metrics
+
+QUESTIONS = [
+    "is it contagious", "what can i eat", "how long will it last", "can i go to work",
+    "what medicine should i take", "should i see a doctor", "can i exercise", "is it serious",
+    "how do i know if it gets worse", "can my children catch it", "should i drink more water",
+    "can i take paracetamol", "when will the fever go away", "do i need antibiotics",
+]
+DISEASES = [("Common Cold", "mild"), ("Influenza", "moderate"), ("Dengue", "severe"), ("Migraine", "mild")]
+
+
+def surface_form(rng, question):
+    text = question
+    roll = rng.random()
+    if roll < 0.3:
+        text = text.capitalize() + "?"
+    elif roll < 0.5:
+        text = text.upper()
+    elif roll < 0.6:
+        text = "  " + text.replace(" ", "  ") + " ?"
+    elif roll < 0.7 and len(text) > 6:
+        i = rng.randrange(1, len(text) - 1)
+        text = text[:i] + text[i + 1:]  # typo: dropped character
+    elif roll < 0.8:
+        text = "please tell me " + text
+    return text
+
+
+def make_calls(rng, count):
+    weights = [1.0 / (rank + 1) for rank in range(len(QUESTIONS))]
+    calls = []
+    for _ in range(count):
+        template = rng.choices(range(len(QUESTIONS)), weights)[0]
+        disease, severity = rng.choice(DISEASES)
+        calls.append((template, surface_form(rng, QUESTIONS[template]), {"disease": disease, "severity": severity}))
+    return calls
+
+
+async def run(cache, calls, latency):
+    async def fake_provider(messages, system_prompt=None, on_token=None):
+        await asyncio.sleep(latency)
+        return f"answer to question {messages[-1]['template']}"
+
+    call = cache.cached("bench", "fake-model")(fake_provider)
+    metrics.reset()
+    wrong = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for template, text, diagnosis in calls:
+            messages = [{"role": "user", "parts": [{"text": f"Follow-up prompt for {diagnosis['disease']}"}]},
+                        {"role": "user", "parts": [{"text": text}], "template": template}]
+            answer = await call(messages, diagnosis=diagnosis)
+            if answer != f"answer to question {template}":
+                wrong += 1
+    elapsed = time.perf_counter() - start
+    return cache.stats(), wrong, elapsed / len(calls)
+
+
+async def overhead(cache, repeat=2000):
+    """Cache cost per call on a hit and on a miss (provider time excluded)."""
+    async def provider(messages, system_prompt=None, on_token=None):
+        return "x" * 400
+
+    call = cache.cached("bench", "overhead")(provider)
+    messages = [{"role": "user", "parts": [{"text": "what can i eat with influenza"}]}]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await call(messages)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await call(messages)
+        hit = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for i in range(repeat // 10):
+            await call([{"role": "user", "parts": [{"text": f"question number {i}"}]}])
+        miss = (time.perf_counter() - start) / (repeat // 10)
+    return hit, miss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake provider seconds per call")
+    parser.add_argument("--similarity", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    calls = make_calls(random.Random(args.seed), args.calls)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "llm_cache.db")
+        configs = [
+            ("off", LLMResponseCache(enabled=False, db_path=None)),
+            ("memory+disk", LLMResponseCache(db_path=db_path, similarity=0)),
+            ("restart", LLMResponseCache(db_path=db_path, similarity=0)),
+            ("similar", LLMResponseCache(db_path=os.path.join(workdir, "similar.db"), similarity=args.similarity)),
+        ]
+        for name, cache in configs:
+            stats, wrong, per_call = asyncio.run(run(cache, calls, args.latency))
+            rows.append((name, stats, wrong, per_call))
+        hit_cost, miss_cost = asyncio.run(overhead(LLMResponseCache(db_path=os.path.join(workdir, "overhead.db"))))
+
+    print(f"\n{'config':<13}{'hit rate':>9}{'memory':>8}{'disk':>6}{'similar':>9}{'wrong':>7}{'ms/call':>9}")
+    print("-" * 61)
+    for name, stats, wrong, per_call in rows:
+        hits = stats["hits"]
+        print(f"{name:<13}{stats['hit_rate']:>9.1%}{hits['memory']:>8}{hits['disk']:>6}{hits['similar']:>9}"
+              f"{wrong:>7}{per_call * 1000:>9.2f}")
+    print(f"\n{args.calls} calls, fake provider {args.latency * 1000:.0f} ms, similarity threshold {args.similarity}")
+    print(f"cache overhead: {hit_cost * 1e6:.1f} us per hit, {miss_cost * 1e6:.1f} us per miss "
+          f"(lookup + store, each in a worker thread)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench_llm_client.py
+"""
+Provider-call overhead: bare requests.post vs the pooled llm_client.
+
+Starts llm_stub_server.py in-process and makes the same chat-completion call
+with both clients, sequentially and with several calls in flight (threads for
+requests, coroutines on one event loop for the pooled async client). It
+reports latency, how many TCP connections the stub saw, and the llm_http
+metrics (handshakes, pool saturation).
+
+Against a remote HTTPS provider the saving per call is one TCP + TLS
+handshake (often 50-200 ms). Against the local stub only the TCP part shows.
+
+Usage:
+  python bench_llm_client.py
+  python bench_llm_client.py --calls 200 --concurrency 8 --max-per-host 4
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+
+import llm_stub_server
+from llm_client import ProviderClient
+from service_metrics import metrics
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "I have a fever and a cough"}]}
+
+
+def start_stub(port):
+    llm_stub_server.STUB_TOKEN_DELAY_SECONDS = 0  # measure client overhead, not generation time
+    server = uvicorn.Server(uvicorn.Config(llm_stub_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def run_requests(url, calls, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        response = requests.post(url, json=PAYLOAD, timeout=30)
+        response.raise_for_status()
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(calls)))
+    return time.perf_counter() - start, latencies
+
+
+async def run_pooled(client, url, calls, concurrency):
+    latencies = []
+    running = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with running:
+            start = time.perf_counter()
+            response = await client.post(url, json=PAYLOAD, timeout=30)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-per-host", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = start_stub(args.port)
+    url = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    client = ProviderClient(max_per_host=args.max_per_host)
+    loop = asyncio.new_event_loop()  # one loop for every pooled run, so its connections are reused
+
+    runs = {
+        "requests": lambda concurrency: run_requests(url, args.calls, concurrency),
+        "pooled": lambda concurrency: loop.run_until_complete(run_pooled(client, url, args.calls, concurrency)),
+    }
+
+    print(f"\n{args.calls} calls per run, pooled client capped at {args.max_per_host} connections per host")
+    print(f"{'client':<10}{'in flight':>10}{'calls/s':>10}{'mean ms':>10}{'p99 ms':>9}{'conns':>7}{'saturated':>11}")
+    print("-" * 67)
+    for concurrency in args.concurrency:
+        for name, run in runs.items():
+            metrics.reset()
+            llm_stub_server.stats["connections"].clear()
+            seconds, latencies = run(concurrency)
+            p99 = sorted(latencies)[int(0.99 * (len(latencies) - 1))]
+            connections = len(llm_stub_server.stats["connections"])
+            saturated = int(metrics.get_counter("llm_http.pool_saturated")) if name == "pooled" else "-"
+            print(f"{name:<10}{concurrency:>10}{args.calls / seconds:>10.1f}{statistics.mean(latencies) * 1000:>10.2f}"
+                  f"{p99 * 1000:>9.2f}{connections:>7}{saturated:>11}")
+
+    print(f"\npooled tcp_connects (last run): {int(metrics.get_counter('llm_http.tcp_connects'))}")
+    print("conns = distinct TCP connections seen by the stub server.")
+    loop.run_until_complete(client.aclose())
+    loop.close()
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+# bench_ner_batch.py
+"""
+Batched NER with vectorized span decoding (ner_decode.py) vs the per-text,
+per-token loops it replaced.
+
+The loops of combined_inference.ner_extract and inference_test.model_entities
+as they were before ner_decode.py are copied below (loop_decode_entities,
+loop_model_entities) as the reference; the model calls are unchanged. The
+script:
+
+ 1. checks that combined_inference.ner_extract_batch returns exactly the
+    entities of the loop (types, texts, confidences, order) for every text, at
+    every batch size; with --inference-test the same for
+    inference_test.model_entities_batch (it loads ./medimate-ner-output)
+ 2. times span decoding alone on the same tag probabilities: the loop per
+    text vs decode_entities per batch
+ 3. times end to end (tokenize, forward pass, decode): ner_extract per text
+    through the loop vs ner_extract_batch at each --batch-sizes, texts/s
+
+Texts are clinical summaries and free-form complaints of mixed length. The
+model comes from NER_MODEL_DIR; with --random-model a randomly initialised
+Bio_ClinicalBERT-sized NER model is built first (random tags make plenty of
+spans to compare).
+
+Usage:
+  python bench_ner_batch.py
+  python bench_ner_batch.py --ner-dir medimate-ner-output --inference-test
+  python bench_ner_batch.py --random-model --base-model emilyalsentzer/Bio_ClinicalBERT --texts 256
+"""
+
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+import torch
+import torch.nn.functional as F
+
+from bench_inference_backends import make_texts
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+COMPLAINTS = [
+    "I have fever and sore throat since 2 days.",
+    "Severe chest pain and breathlessness.",
+    "Mild headache today.",
+    "Vomiting since last night and severe stomach pain for 1 hour.",
+    "my kid has had a runny nose, mild cough and a slight temperature for about three days now, no rash",
+    "Sharp pain in the lower right abdomen since this morning, nausea, lost appetite, fever 38.5",
+]
+
+ci = None  # combined_inference, imported once NER_MODEL_DIR is set
+it = None  # inference_test, with --inference-test
+
+
+# ---- the loops before ner_decode.py (reference) ----
+
+def loop_decode_entities(text, encoding, probs, topk=None):
+    offsets = list(encoding.offsets)
+    word_ids = list(encoding.word_ids)
+    preds = probs.argmax(-1).cpu().tolist()
+
+    # get tokens (string form) from the encoding's input ids
+    tokens = ci.ner_tokenizer.convert_ids_to_tokens(encoding.ids.tolist())
+
+    # Build spans by merging B-/I- tags using preds and word_ids
+    spans = []
+    cur = None  # [start_word_index, end_word_index, label_type, max_conf, token_indices]
+    for i, wid in enumerate(word_ids if word_ids else [None]*len(preds)):
+        if wid is None:
+            if cur:
+                spans.append(cur); cur = None
+            continue
+        label = ci.ner_id2label.get(preds[i], "O")
+        conf = float(probs[i, preds[i]].cpu().item())
+        if label == "O":
+            if cur:
+                spans.append(cur); cur = None
+            continue
+        if "-" in label:
+            prefix, typ = label.split("-", 1)
+        else:
+            prefix, typ = "B", label
+        if prefix == "B" or cur is None or cur[2] != typ:
+            if cur:
+                spans.append(cur)
+            cur = [wid, wid, typ, conf, [i]]
+        else:
+            cur[1] = wid
+            cur[3] = max(cur[3], conf)
+            cur[4].append(i)
+    if cur:
+        spans.append(cur)
+
+    # group token indices by word id to extract original text spans using offsets
+    grouped = {}
+    for ti, wid in enumerate(word_ids if word_ids else []):
+        if wid is None:
+            continue
+        grouped.setdefault(wid, []).append(ti)
+
+    # reconstruct word_texts from offsets (use original text)
+    original = text
+    max_word = max([w for w in (word_ids or []) if w is not None], default=-1)
+    word_texts = []
+    for wid in range(max_word + 1):
+        if wid not in grouped:
+            word_texts.append("")
+            continue
+        idxs = grouped[wid]
+        if offsets and len(offsets) > 0:
+            s = offsets[idxs[0]][0]
+            e = offsets[idxs[-1]][1]
+            piece = original[s:e].strip()
+            if not piece:
+                piece = ci.ner_tokenizer.convert_tokens_to_string([tokens[t] for t in idxs]).strip()
+        else:
+            piece = ci.ner_tokenizer.convert_tokens_to_string([tokens[t] for t in idxs]).strip()
+        word_texts.append(piece)
+
+    out = []
+    for s, e, typ, conf, token_idxs in spans:
+        s = max(0, s); e = min(e, len(word_texts) - 1)
+        ent_text = " ".join([w for w in word_texts[s:e+1] if w]).strip()
+        ent_text = re.sub(r"\s+", " ", ent_text)
+        out.append({"type": typ, "text": ent_text, "conf": round(conf, 3)})
+
+    out = sorted(out, key=lambda x: x["conf"], reverse=True)
+    if topk:
+        out = out[:topk]
+    return out
+
+
+
+def loop_model_entities(text, max_length=256):
+    encoding = it.tokenizer(
+        text,
+        return_tensors="pt",
+        truncation=True,
+        max_length=max_length,
+        return_offsets_mapping=True,
+    )
+
+    offsets = encoding["offset_mapping"][0].tolist()
+    word_ids = encoding.word_ids(batch_index=0)
+
+    model_inputs = {}
+    for k, v in encoding.items():
+        if k in ("input_ids", "attention_mask", "token_type_ids"):
+            model_inputs[k] = v
+
+    with torch.no_grad():
+        logits = it.model(**model_inputs).logits[0]
+        probs = F.softmax(logits, dim=-1)
+        preds = probs.argmax(-1).tolist()
+
+    # Merge subword tokens to whole words
+    entities = []
+    cur = None
+
+    for i, wid in enumerate(word_ids):
+        if wid is None:
+            if cur:
+                entities.append(cur); cur = None
+            continue
+
+        label = it.id2label[preds[i]]
+        conf = float(probs[i, preds[i]])
+
+        if label == "O":
+            if cur:
+                entities.append(cur); cur = None
+            continue
+
+        prefix, etype = label.split("-", 1)
+
+        if prefix == "B" or cur is None or cur[2] != etype:
+            if cur:
+                entities.append(cur)
+            cur = [wid, wid, etype, conf]
+        else:
+            cur[1] = wid
+            if conf > cur[3]:
+                cur[3] = conf
+
+    if cur:
+        entities.append(cur)
+
+    # WORD RECONSTRUCTION
+    input_text = text
+    grouped = {}
+    for token_idx, wid in enumerate(word_ids):
+        if wid is None: continue
+        grouped.setdefault(wid, []).append(token_idx)
+
+    max_word = max([w for w in word_ids if w is not None])
+    word_texts = []
+    for wid in range(max_word + 1):
+        if wid not in grouped:
+            word_texts.append("")
+            continue
+        idxs = grouped[wid]
+        s = offsets[idxs[0]][0]
+        e = offsets[idxs[-1]][1]
+        word_texts.append(input_text[s:e])
+
+    # Final structured entities
+    final = []
+    for start, end, typ, conf in entities:
+        ent_text = " ".join(word_texts[start:end+1]).strip()
+        final.append({
+            "entity": typ,
+            "text": ent_text,
+            "confidence": round(conf, 3)
+        })
+
+    return final
+
+
+def make_corpus(rng, count):
+    texts = make_texts(rng, count)
+    for i in range(0, count, 4):
+        words = " ".join(rng.choice(COMPLAINTS) for _ in range(rng.randint(1, 6)))
+        texts[i] = words
+    return texts
+
+
+def check_parity(texts, batch_sizes):
+    reference = [loop_decode_entities(t, *one_probs(t)) for t in texts]
+    for batch_size in batch_sizes:
+        batched = ci.ner_extract_batch(texts, batch_size=batch_size)
+        bad = [t for t, a, b in zip(texts, reference, batched) if a != b]
+        if bad:
+            raise SystemExit(f"combined_inference: batch size {batch_size} differs from the loop on {len(bad)} texts, "
+                             f"e.g. {bad[0]!r}")
+    spans = sum(len(r) for r in reference)
+    print(f"combined_inference: identical entities at batch sizes {batch_sizes} ({len(texts)} texts, {spans} spans)")
+    if it is not None:
+        reference = [loop_model_entities(t) for t in texts]
+        for batch_size in batch_sizes:
+            if it.model_entities_batch(texts, batch_size=batch_size) != reference:
+                raise SystemExit(f"inference_test: batch size {batch_size} differs from the loop")
+        print(f"inference_test: identical entities at batch sizes {batch_sizes} "
+              f"({sum(len(r) for r in reference)} spans)")
+
+
+def one_probs(text):
+    """The encoding and (seq_len, num_labels) tag probabilities of one text, as ner_extract computed them."""
+    encodings, _, inputs = ci.encode(ci.ner_encoder, [text])
+    return encodings[0], F.softmax(ci.ner_logits(inputs)[0], dim=-1)
+
+
+def time_decode(texts, batch_size):
+    """Seconds per text decoding the same probabilities: (loop, vectorized)."""
+    loop = vectorized = 0.0
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        encodings, mask, inputs = ci.encode(ci.ner_encoder, batch)
+        probs = F.softmax(ci.ner_logits(inputs), dim=-1)
+        rows = mask.bool()
+        start = time.perf_counter()
+        for row, (text, encoding) in enumerate(zip(batch, encodings)):
+            loop_decode_entities(text, encoding, probs[row][rows[row]])
+        middle = time.perf_counter()
+        ci.decode_entities(batch, encodings, probs, mask)
+        vectorized += time.perf_counter() - middle
+        loop += middle - start
+    return loop / len(texts), vectorized / len(texts)
+
+
+def time_end_to_end(fn, texts):
+    ci.ner_encoder.clear()
+    start = time.perf_counter()
+    fn(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    global ci, it
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ner-dir", default=os.getenv("NER_MODEL_DIR", "medimate-ner-output"))
+    parser.add_argument("--base-model", default=os.getenv("DISEASE_BASE_MODEL", "emilyalsentzer/Bio_ClinicalBERT"))
+    parser.add_argument("--random-model", action="store_true", help="time a random Bio_ClinicalBERT-sized NER model")
+    parser.add_argument("--inference-test", action="store_true", help="also check inference_test.model_entities_batch")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--texts", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    texts = make_corpus(random.Random(args.seed), args.texts)
+    with tempfile.TemporaryDirectory() as workdir:
+        ner_dir = args.ner_dir
+        if args.random_model:
+            from bench_combined_inference import build_shared_encoder_models
+
+            disease_dir, ner_dir = build_shared_encoder_models(workdir, args.base_model)
+            os.environ["DISEASE_MODEL_DIR"] = disease_dir
+        os.environ.update(NER_MODEL_DIR=os.path.abspath(ner_dir), COMBINED_MODE="separate")
+        import combined_inference
+
+        ci = combined_inference
+        if args.inference_test:
+            import inference_test
+
+            it = inference_test
+        run(texts, args.batch_sizes)
+
+
+def run(texts, batch_sizes):
+    ci.ner_extract_batch(texts[:8])  # warm-up
+    check_parity(texts, batch_sizes)
+
+    loop_rate = time_end_to_end(lambda batch: [loop_decode_entities(t, *one_probs(t)) for t in batch], texts)
+    print(f"\n{'batch':<8}{'decode loop ms':>16}{'decode vec ms':>15}{'speedup':>9}{'texts/s':>10}{'vs loop':>9}")
+    print("-" * 67)
+    for batch_size in batch_sizes:
+        loop, vectorized = time_decode(texts, batch_size)
+        rate = time_end_to_end(lambda batch: ci.ner_extract_batch(batch, batch_size=batch_size), texts)
+        print(f"{batch_size:<8}{loop * 1000:>16.3f}{vectorized * 1000:>15.3f}{loop / vectorized:>8.1f}x"
+              f"{rate:>10.1f}{rate / loop_rate:>8.1f}x")
+    print(f"\nloop (ner_extract per text, per-token decode): {loop_rate:.1f} texts/s; "
+          f"{len(texts)} texts, {torch.get_num_threads()} threads")
+
+if __name__ == "__main__":
+    main()
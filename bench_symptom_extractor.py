@@ -0,0 +1,309 @@
+# bench_symptom_extractor.py
+"""
+Intake keyword extraction: the original `in`-cascade vs symptom_extractor.
+
+The cascade that llm_process_conversation ran before symptom_extractor.py is
+copied below verbatim (cascade_extract / cascade_flags) as the reference. The
+script:
+
+ 1. builds a regression corpus of user messages from every table term, denial
+    phrases, digits and filler text (plus a few hand-written conversations),
+    and checks that the compiled extractor returns exactly what the cascade
+    returns: symptoms (order and repeats), duration, severity, and every
+    conversation-level flag; and that the incremental intake state
+    (intake_state.py) built message by message agrees with re-scanning,
+    including the denial phrases it records
+ 2. times both per message, for several message lengths and keyword densities
+ 3. times one intake turn at several conversation lengths: re-scanning the
+    whole history (joined text + every user message) vs advancing the intake
+    state by the new message
+
+Usage:
+  python bench_symptom_extractor.py
+  python bench_symptom_extractor.py --corpus 20000 --lengths 40 200 1000 5000 --densities 0.05 0.25
+  python bench_symptom_extractor.py --turns 5 20 80
+"""
+
+import argparse
+import random
+import time
+
+from intake_state import intake_state_from_history, observe_message
+from symptom_extractor import CONVERSATION_FLAGS, symptom_extractor
+
+FILLER = ("i", "have", "had", "a", "the", "since", "and", "my", "it", "is", "was", "feel", "been",
+          "really", "not", "do", "got", "also", "but", "yesterday", "today", "morning", "night")
+
+CONVERSATIONS = [
+    ["I have fever and cough", "for 3 days", "moderate"],
+    ["my nose is bleeding", "it won't stop for 10 min"],
+    ["I feel dizzy and itchy, no itching though", "since 2 weeks", "no"],
+    ["no cough, no sore throat", "I do not have fever either", "pretty bad headache for 5 hours"],
+    ["Loose motions and stomach ache", "no vomiting", "mild, 1 day"],
+    ["I have a productive cough with yellow phlegm", "very bad", "yes"],
+    ["shortness of breath and wheezing", "can't breathe well at night for a week", "severe"],
+    # conversation flag terms spanning two messages of the joined text
+    ["it has been more than", "5 minutes and my nose is still bleeding"],
+    ["my nose won't", "stop, started 10", "min ago"],
+]
+
+
+# --------------------------------------------------------------------------
+# Reference: the cascade as it was in llm_process_conversation
+# --------------------------------------------------------------------------
+
+def cascade_extract(history_with_current):
+    symptoms_list = []
+    duration = "unknown"
+    severity = "mild"
+    for msg in history_with_current:
+        role = msg.get("role", "")
+        text = msg.get("parts", [{}])[0].get("text", "").lower()
+        if role != "user":
+            continue
+        if any(sev in text for sev in ['very bad', 'extremely', 'really bad', 'terrible', 'severe']):
+            severity = 'severe'
+        elif any(sev in text for sev in ['moderate', '5', '6', '7', 'somewhat bad', 'pretty bad']):
+            severity = 'moderate'
+        elif any(sev in text for sev in ['mild', '1', '2', '3', 'little', 'slight', 'bit']):
+            severity = 'mild'
+        denial_keywords = [
+            "no cough", "no sore throat", "no fatigue", "no nausea", "no body ache",
+            "no body aches", "no aches", "no pain", "no rash", "no cold", "no runny nose", "no cold symptoms",
+            "don't have cough", "don't have sore throat", "don't have fatigue", "don't have body aches",
+            "don't have aches", "don't have pain", "i do not have", "no tired", "no chills"
+        ]
+        symptom_keywords = ["cough", "sore", "fever", "pain", "ache", "rash", "nausea", "vomit", "cold", "runny", "sneeze", "breathless", "wheez", "chest", "phlegm", "nosebleed", "diarrhea", "loose", "motion", "stool", "stomach", "abdominal", "constipation", "bowel"]
+        has_positive_symptom = any(sym in text for sym in symptom_keywords)
+        if any(denial in text for denial in denial_keywords) and not has_positive_symptom:
+            continue
+        if 'cough' in text and not any(deny in text for deny in ['no cough', 'no cough', "don't have cough"]):
+            symptoms_list.append('cough')
+        if ('productive cough' in text or ('cough' in text and 'phlegm' in text)) and not any(deny in text for deny in ['no cough', "don't have cough"]):
+            symptoms_list.append('productive cough')
+        if ('phlegm' in text or 'sputum' in text) and not any(deny in text for deny in ["no phlegm", "no sputum"]):
+            symptoms_list.append('phlegm')
+        if (('yellow' in text) and ('phlegm' in text or 'sputum' in text)) and not any(deny in text for deny in ["no phlegm", "no sputum"]):
+            symptoms_list.append('yellow phlegm')
+        if ('nosebleed' in text or 'nose bleed' in text or 'bleeding in nose' in text or 'bleeding nose' in text or 'blood from nose' in text or 'epistaxis' in text) and not any(deny in text for deny in ['no nosebleed', "no bleeding", "no blood"]):
+            symptoms_list.append('nosebleed')
+        if ('sneeze' in text or 'sneezing' in text) and not any(deny in text for deny in ['no sneeze', 'no sneezing']):
+            symptoms_list.append('sneezing')
+        if ('runny nose' in text or 'runny' in text) and not any(deny in text for deny in ['no runny nose', "don't have runny nose"]):
+            symptoms_list.append('runny nose')
+        if ('sore throat' in text or ('sore' in text and 'throat' in text)) and not any(deny in text for deny in ['no sore throat', "don't have sore throat"]):
+            symptoms_list.append('sore throat')
+        if 'fever' in text and not any(deny in text for deny in ['no fever', "don't have fever"]):
+            symptoms_list.append('fever')
+        if any(p in text for p in ['pain', 'ache', 'hurt', 'body ache']) and not any(deny in text for deny in ['no pain', 'no ache', 'no body ache', 'no body aches', "don't have pain", "don't have aches"]):
+            symptoms_list.append('pain')
+        if 'rash' in text and not any(deny in text for deny in ['no rash', "don't have rash"]):
+            symptoms_list.append('rash')
+        if any(n in text for n in ['nausea', 'vomit']) and not any(deny in text for deny in ['no nausea', "don't have nausea"]):
+            symptoms_list.append('nausea')
+        if 'chills' in text and not any(deny in text for deny in ['no chills', "don't have chills"]):
+            symptoms_list.append('chills')
+        if ('body ache' in text or 'body aches' in text) and not any(deny in text for deny in ['no body ache', 'no body aches', 'no aches', "don't have body aches"]):
+            symptoms_list.append('body aches')
+        if 'cold' in text and not any(deny in text for deny in ['no cold', "don't have cold"]):
+            symptoms_list.append('cold')
+        if (any(f in text for f in ['fatigue', 'tired', 'tiredness'])) and not any(deny in text for deny in ['no fatigue', 'no tired', "don't have fatigue"]):
+            symptoms_list.append('fatigue')
+        if any(b in text for b in ['shortness of breath', 'breathless', 'difficulty breathing', 'cant breathe', "can't breathe", 'hard to breathe']) and not any(deny in text for deny in ['no breathlessness', 'no shortness of breath']):
+            symptoms_list.append('shortness of breath')
+        if 'wheez' in text and not any(deny in text for deny in ['no wheeze', 'no wheezing']):
+            symptoms_list.append('wheezing')
+        if 'chest pain' in text and not any(deny in text for deny in ['no chest pain']):
+            symptoms_list.append('chest pain')
+        if 'congestion' in text and not any(deny in text for deny in ['no congestion']):
+            symptoms_list.append('congestion')
+        if any(d in text for d in ['diarrhea', 'loose motion', 'loose stool', 'loose motions']) and not any(deny in text for deny in ['no diarrhea', 'no loose motion']):
+            symptoms_list.append('diarrhea')
+        if any(a in text for a in ['abdominal pain', 'stomach pain', 'belly pain', 'stomach ache']) and not any(deny in text for deny in ['no stomach pain', 'no abdominal pain']):
+            symptoms_list.append('abdominal pain')
+        if 'constipation' in text and not any(deny in text for deny in ['no constipation']):
+            symptoms_list.append('constipation')
+        if any(v in text for v in ['vomiting', 'vomit']) and not any(deny in text for deny in ['no vomiting', 'no vomit']):
+            symptoms_list.append('vomiting')
+        if ('dizziness' in text or 'dizzy' in text or 'vertigo' in text) and not any(deny in text for deny in ['no dizziness', 'no dizzy']):
+            symptoms_list.append('dizziness')
+        if 'itching' in text or 'itchy' in text and not any(deny in text for deny in ['no itching', 'no itchy']):
+            symptoms_list.append('itching')
+        if any(time in text for time in ['day', 'week', 'month', 'hour']):
+            words = text.split()
+            for j, word in enumerate(words):
+                if word in ['day', 'days', 'week', 'weeks', 'month', 'months', 'hour', 'hours']:
+                    if j > 0:
+                        duration = f"{words[j-1]} {word}"
+                        break
+    return symptoms_list, duration, severity
+
+
+def cascade_flags(full_conversation):
+    return {
+        "bleeding": any(kw in full_conversation for kw in ["nosebleed", "nose bleed", "bleeding nose", "blood from nose", "bleeding in nose", "epistaxis", "bleeding", "bleed"]),
+        "prolonged_bleeding": any(indicator in full_conversation for indicator in ["10 min", "10min", "15 min", "20 min", "30 min", "hour", "hours", "more than 5", ">5", "5+", "won't stop", "won't stop bleeding", "continuous"]),
+        "symptom_patterns": any(keyword in full_conversation for keyword in [
+            'day', 'week', 'month', 'hours', 'fever', 'cough', 'pain', 'ache',
+            'terrible', 'mild', 'moderate', 'severe', 'bad', 'hurts', 'ache',
+            'sick', 'vomit', 'nausea', 'diarrhea', 'rash', 'itchy', 'swollen',
+            'difficulty', 'trouble breathing', 'weak', 'tired', 'fatigue'
+        ]),
+        "symptoms": any(s in full_conversation for s in ['fever', 'cough', 'pain', 'ache', 'rash', 'nausea', 'vomit', 'cold', 'flu', 'sore', 'throat', 'nosebleed', 'bleeding', 'headache', 'diarrhea', 'vomiting']),
+        "duration": any(d in full_conversation for d in ['day', 'days', 'week', 'weeks', 'hour', 'hours', 'minute', 'minutes', 'month', 'months', 'min', 'mins', 'hr', 'hrs']),
+        "severity": any(s in full_conversation for s in ['mild', 'moderate', 'severe', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10']),
+    }
+
+
+# --------------------------------------------------------------------------
+
+def table_terms():
+    terms = set(symptom_extractor.matcher.terms)
+    for flag_terms in CONVERSATION_FLAGS.values():
+        terms.update(flag_terms)
+    return sorted(terms)
+
+
+def make_message(rng, terms, words, density=0.25):
+    """`words` pieces: table terms, "<n> <unit>", denials and filler; `density` scales the first three."""
+    parts = []
+    for _ in range(words):
+        roll = rng.random() * 0.25 / density
+        if roll < 0.25:
+            parts.append(rng.choice(terms))
+        elif roll < 0.3:
+            parts.append(f"{rng.randint(1, 12)} {rng.choice(['day', 'days', 'week', 'hours', 'months'])}")
+        elif roll < 0.35:
+            parts.append(rng.choice(["no", "don't have", "i do not have"]) + " " + rng.choice(terms))
+        else:
+            parts.append(rng.choice(FILLER))
+    text = " ".join(parts)
+    return text.capitalize() if rng.random() < 0.3 else text
+
+
+def as_history(messages):
+    history = []
+    for text in messages:
+        history.append({"role": "user", "parts": [{"text": text}]})
+        history.append({"role": "model", "parts": [{"text": "How long have you had the fever? Any other symptoms?"}]})
+    return history[:-1]
+
+
+def expected_denials(history):
+    """Denial phrases of the tables found in the user messages, first use first (plain substring checks)."""
+    denials = []
+    for msg in history:
+        if msg.get("role", "") != "user":
+            continue
+        text = msg.get("parts", [{}])[0].get("text", "").lower()
+        denials += [d for d in symptom_extractor._denial_terms if d in text and d not in denials]
+    return denials
+
+
+def check_parity(corpus_size, seed):
+    rng = random.Random(seed)
+    terms = table_terms()
+    conversations = [as_history(c) for c in CONVERSATIONS]
+    for _ in range(corpus_size):
+        conversations.append(as_history([make_message(rng, terms, rng.randint(1, 14)) for _ in range(rng.randint(1, 4))]))
+
+    mismatches = []
+    for history in conversations:
+        expected = cascade_extract(history)
+        actual = symptom_extractor.extract(history)
+        full = " ".join(m.get("parts", [{}])[0].get("text", "") for m in history).lower()
+        if expected != actual or cascade_flags(full) != symptom_extractor.conversation_flags_for(full):
+            mismatches.append(history)
+            continue
+        intake = intake_state_from_history(history)
+        symptoms, duration, severity = expected
+        if (intake["symptoms"], intake["duration"], intake["severity"], intake["flags"], intake["ai_messages"],
+                intake["denials"]) != \
+                (list(dict.fromkeys(symptoms)), duration, severity, cascade_flags(full),
+                 sum(1 for m in history if m["role"] == "model"), expected_denials(history)):
+            mismatches.append(history)
+    assert set(CONVERSATION_FLAGS) == set(cascade_flags("")), "flag tables out of sync"
+    return len(conversations), mismatches
+
+
+def time_per_message(fn, messages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for history in messages:
+            fn(history)
+        best = min(best, (time.perf_counter() - start) / len(messages))
+    return best
+
+
+def rescan_turn(history):
+    """What llm_process_conversation did per intake turn before intake_state.py."""
+    full = " ".join(m.get("parts", [{}])[0].get("text", "") for m in history).lower()
+    flags = symptom_extractor.conversation_flags_for(full)
+    ai_messages = sum(1 for m in history if m.get("role") == "model")
+    return symptom_extractor.extract(history), flags, ai_messages
+
+
+def time_per_turn(rng, terms, turns, repeat):
+    """(re-scan us, incremental us) for the last turn of a `turns`-turn conversation."""
+    messages = [make_message(rng, terms, 14, 0.1) for _ in range(turns)]
+    history = as_history(messages)
+    before = intake_state_from_history(history[:-1])
+    rescan = incremental = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(20):
+            rescan_turn(history)
+        rescan = min(rescan, (time.perf_counter() - start) / 20)
+        start = time.perf_counter()
+        for _ in range(20):
+            observe_message(before, "user", messages[-1])
+        incremental = min(incremental, (time.perf_counter() - start) / 20)
+    return rescan, incremental
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=5000, help="generated conversations for the parity check")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[40, 200, 1000, 5000], help="message length in chars")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.05, 0.25],
+                        help="share of message pieces that are keywords (timing only)")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 80, 320],
+                        help="conversation lengths (user messages) for the per-turn timing")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    checked, mismatches = check_parity(args.corpus, args.seed)
+    print(f"\nParity: {checked - len(mismatches)}/{checked} conversations identical to the cascade")
+    for history in mismatches[:3]:
+        print("  MISMATCH:", [m["parts"][0]["text"] for m in history if m["role"] == "user"])
+
+    rng = random.Random(args.seed)
+    terms = table_terms()
+    print(f"\n{'chars':>7}{'terms':>7}{'cascade us':>12}{'compiled us':>13}{'speedup':>9}")
+    print("-" * 48)
+    for density in args.densities:
+        for length in args.lengths:
+            messages = []
+            for _ in range(args.messages):
+                text = ""
+                while len(text) < length:
+                    text += " " + make_message(rng, terms, 8, density)
+                messages.append([{"role": "user", "parts": [{"text": text[:length]}]}])
+            cascade = time_per_message(cascade_extract, messages, 3)
+            compiled = time_per_message(symptom_extractor.extract, messages, 3)
+            print(f"{length:>7}{density:>7.0%}{cascade * 1e6:>12.1f}{compiled * 1e6:>13.1f}{cascade / compiled:>8.1f}x")
+    print("\nus = per user message (symptoms + severity + duration), best of 3;"
+          "\nterms = share of message pieces that are table terms, durations or denials.")
+
+    print(f"\n{'turns':>7}{'re-scan us':>12}{'incremental us':>16}{'speedup':>9}")
+    print("-" * 44)
+    for turns in args.turns:
+        rescan, incremental = time_per_turn(rng, terms, turns, 3)
+        print(f"{turns:>7}{rescan * 1e6:>12.1f}{incremental * 1e6:>16.1f}{rescan / incremental:>8.1f}x")
+    print("\nus = per user turn: intake summary including the new message, best of 3.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# bench_symptom_match.py
+"""
+PredictionValidator._find_exact_matches: inverted index vs full scan.
+
+Builds synthetic training sets shaped like medimate_option1_train_8000.jsonl
+(label / symptoms / severity, ~40 diseases, 3-6 symptoms per record, some
+case and whitespace noise) at several sizes. For each size it checks that the
+indexed matcher returns exactly the scan's top-3 (labels, weights and order),
+then reports per-query latency for both.
+
+Usage:
+  python bench_symptom_match.py
+  python bench_symptom_match.py --sizes 8000 100000 1000000 --queries 200 --scan-queries 20
+"""
+
+import argparse
+import random
+import time
+
+from prediction_validator import PredictionValidator
+
+SEVERITIES = ["mild", "moderate", "severe"]
+
+
+def make_vocabulary(rng, num_diseases=40, num_symptoms=160):
+    symptoms = [f"symptom {i}" for i in range(num_symptoms)]
+    common = symptoms[:12]  # fever, cough, ... style symptoms shared by many diseases
+    profiles = {}
+    for d in range(num_diseases):
+        profile = rng.sample(symptoms[12:], 6) + rng.sample(common, 2)
+        profiles[f"Disease {d}"] = profile
+    return profiles
+
+
+def make_records(rng, profiles, count):
+    diseases = list(profiles)
+    records = []
+    for _ in range(count):
+        disease = rng.choice(diseases)
+        symptoms = rng.sample(profiles[disease], rng.randint(3, 6))
+        if rng.random() < 0.1:
+            symptoms[0] = " " + symptoms[0].upper()  # cleaning noise, as in hand-edited data
+        records.append({
+            "label": disease + (" " if rng.random() < 0.05 else ""),
+            "symptoms": symptoms,
+            "severity": rng.choice(SEVERITIES).capitalize() if rng.random() < 0.1 else rng.choice(SEVERITIES),
+        })
+    return records
+
+
+def make_queries(rng, profiles, count):
+    diseases = list(profiles)
+    queries = []
+    for _ in range(count):
+        symptoms = rng.sample(profiles[rng.choice(diseases)], rng.randint(2, 5))
+        if rng.random() < 0.2:
+            symptoms.append("unseen symptom")
+        queries.append(([s.strip().lower() for s in symptoms], rng.choice(SEVERITIES)))
+    return queries
+
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    results = [fn(symptoms, severity) for symptoms, severity in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scan-queries", type=int, default=20, help="queries timed with the (slow) full scan")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    profiles = make_vocabulary(rng)
+    queries = make_queries(rng, profiles, args.queries)
+
+    rows = []
+    for size in args.sizes:
+        validator = PredictionValidator()
+        validator.training_data = make_records(random.Random(size), profiles, size)
+        start = time.perf_counter()
+        validator._build_symptom_indices()
+        build_seconds = time.perf_counter() - start
+
+        index_seconds, index_results = time_per_query(validator._find_exact_matches, queries)
+        scan_queries = queries[:args.scan_queries]
+        scan_seconds, scan_results = time_per_query(validator._find_exact_matches_scan, scan_queries)
+
+        mismatches = sum(1 for a, b in zip(index_results, scan_results) if a != b)
+        rows.append((size, build_seconds, scan_seconds, index_seconds, mismatches, len(scan_queries)))
+
+    print(f"\n{'records':>9}{'build s':>9}{'scan ms':>10}{'index ms':>10}{'speedup':>9}{'parity':>12}")
+    print("-" * 59)
+    for size, build_seconds, scan_seconds, index_seconds, mismatches, checked in rows:
+        parity = "ok" if mismatches == 0 else f"{mismatches} diff"
+        print(f"{size:>9}{build_seconds:>9.2f}{scan_seconds * 1000:>10.2f}{index_seconds * 1000:>10.3f}"
+              f"{scan_seconds / index_seconds:>8.0f}x{parity + f' ({checked})':>12}")
+    print("\nbuild s = all validator indices; ms = per query; parity = top-3 identical to the scan on N queries.")
+
+
+if __name__ == "__main__":
+    main()
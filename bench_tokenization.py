@@ -0,0 +1,132 @@
+# bench_tokenization.py
+"""
+Tokenizer share of end-to-end classifier (and NER) latency, with and without
+the encoding cache and length-bucketed padding of token_cache.py.
+
+Builds a pool of --distinct clinical summaries in the llm_process_conversation
+format and sends --requests of them (drawn with repetition, as re-checks and
+repeat visits do) through DiseaseModel.predict, one text per call and in
+batches of --batch-size. Each configuration starts with an empty cache:
+
+ - tokenizer       every call tokenized with padding=True (TOKEN_CACHE=0)
+ - cache           encoding cache, padded to the longest text
+ - cache+buckets   encoding cache, padded to TOKEN_PAD_BUCKETS
+
+The tokenizer time is the tokenizer.disease.seconds histogram. With --ner-dir
+the same is done for the NER model (the ner_extract encoding, which also needs
+word ids and offsets, then the forward pass).
+
+Usage:
+  python bench_tokenization.py
+  python bench_tokenization.py --model-dir medimate-disease-model --ner-dir medimate-ner-output
+  python bench_tokenization.py --random-model --base-model emilyalsentzer/Bio_ClinicalBERT --requests 200
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import tempfile
+import time
+
+import torch
+
+from bench_inference_backends import build_random_model, make_texts
+from model_registry import BASE_MODEL, MAX_LENGTH, MODEL_DIR, ModelRegistry
+from model_runtime import BACKENDS
+from service_metrics import metrics
+from token_cache import TOKEN_PAD_BUCKETS, CachedTokenizer
+
+CONFIGS = [("tokenizer", False, ()), ("cache", True, ()), ("cache+buckets", True, TOKEN_PAD_BUCKETS)]
+
+
+def run_classifier(model, requests, batch_size, enabled, buckets):
+    model.encoder = CachedTokenizer(model.tokenizer, "disease", MAX_LENGTH, enabled=enabled, buckets=buckets)
+    metrics.reset()
+    rows = {}
+    for label, size in (("single", 1), (f"batch {batch_size}", batch_size)):
+        before = (metrics.histogram("tokenizer.disease.seconds") or {"sum": 0.0})["sum"]
+        start = time.perf_counter()
+        for i in range(0, len(requests), size):
+            model.predict(requests[i:i + size], batch_size=size)
+        total = time.perf_counter() - start
+        rows[label] = (total, metrics.histogram("tokenizer.disease.seconds")["sum"] - before)
+    return rows, model.encoder.stats()["hit_rate"]
+
+
+def run_ner(tokenizer, model, requests, enabled):
+    """ner_extract's encoding (ids, word ids, offsets) and forward pass, per text."""
+    encoder = CachedTokenizer(tokenizer, "ner", max_length=256, enabled=enabled)
+    tokenize = forward = 0.0
+    with torch.no_grad():
+        for text in requests:
+            start = time.perf_counter()
+            if enabled:
+                inputs = encoder.pad([encoder.encode(text)])  # the encoding carries word ids and offsets
+            else:
+                enc = tokenizer(text, return_offsets_mapping=True, return_tensors="pt", truncation=True, max_length=256)
+                enc.word_ids(batch_index=0)
+                enc.pop("offset_mapping")[0].tolist()
+                inputs = dict(enc)
+            middle = time.perf_counter()
+            model(**inputs)
+            tokenize += middle - start
+            forward += time.perf_counter() - middle
+    return tokenize + forward, tokenize
+
+
+def print_rows(title, results, count):
+    print(f"\n{title}")
+    print(f"{'config':<16}{'calls':<12}{'ms/text':>10}{'tokenizer ms':>14}{'share':>8}{'hit rate':>10}")
+    print("-" * 70)
+    for config, rows, hit_rate in results:
+        for label, (total, tokenize) in rows.items():
+            hits = f"{hit_rate:.0%}" if hit_rate is not None else "-"
+            print(f"{config:<16}{label:<12}{total / count * 1000:>10.3f}{tokenize / count * 1000:>14.3f}"
+                  f"{tokenize / total:>8.1%}{hits:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--backend", choices=BACKENDS, default="pytorch", help="DISEASE_INFERENCE_BACKEND (artifact must exist)")
+    parser.add_argument("--ner-dir", help="NER model directory (tokenizer included) to time as well")
+    parser.add_argument("--random-model", action="store_true", help="time a random Bio_ClinicalBERT-sized classifier")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--distinct", type=int, default=60, help="distinct summaries the requests are drawn from")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pool = make_texts(rng, args.distinct)
+    requests = [rng.choice(pool) for _ in range(args.requests)]
+    with tempfile.TemporaryDirectory() as workdir:
+        model_dir = args.model_dir
+        if args.random_model:
+            model_dir = workdir
+            build_random_model(model_dir, args.base_model)
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = ModelRegistry(model_dir, args.base_model, backend=args.backend).warm()
+        model.predict(make_texts(random.Random(args.seed + 1), 16))  # warm-up, texts outside the pool
+
+        results = []
+        for config, enabled, buckets in CONFIGS:
+            rows, hit_rate = run_classifier(model, requests, args.batch_size, enabled, buckets)
+            results.append((config, rows, hit_rate))
+    print_rows(f"Disease classifier: {len(requests)} requests over {len(pool)} distinct summaries", results,
+               len(requests))
+
+    if args.ner_dir:
+        from transformers import AutoModelForTokenClassification, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(args.ner_dir, use_fast=True)
+        ner_model = AutoModelForTokenClassification.from_pretrained(args.ner_dir).eval()
+        results = [(config, {"single": run_ner(tokenizer, ner_model, requests, enabled)}, None)
+                   for config, enabled, _ in CONFIGS[:2]]
+        print_rows("NER (ner_extract encoding + forward pass)", results, len(requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# bench_validation_pipeline.py
+"""
+Diagnosis-turn latency: AI validation always in line vs the rules-first pipeline.
+
+Builds a PredictionValidator from synthetic training data with the disease
+names the hard rules know about, starts llm_stub_server.py in this process
+(every reply takes --llm-latency seconds) and checks a mix of ML predictions,
+some right and some wrong, two ways:
+
+  serial     the old order: ai_validate_diagnosis(), then the rules, then the
+             AI-dependent corrections (every prediction costs one LLM call)
+  pipeline   start_prediction_validation(): rules first, the LLM only when they
+             leave the outcome open, running while the phase-2 reply is built,
+             and abandoned after AI_VALIDATION_BUDGET_SECONDS
+
+It reports mean and p95 time per turn, LLM calls made, how many outcomes the
+two ways disagree on, and the ai_validation.* counters. Run once with a budget
+above --llm-latency (outcomes must match) and once below it (turns are capped).
+
+Usage:
+  python bench_validation_pipeline.py
+  python bench_validation_pipeline.py --cases 60 --llm-latency 0.3 --budget 0.1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+STUB_PORT = 8768
+
+# Point the provider calls at the stub (and keep its answers out of the response cache)
+os.environ.setdefault("LLM_PROVIDER", "local")
+os.environ.setdefault("LOCAL_MODEL_URL", f"http://127.0.0.1:{STUB_PORT}/v1")
+os.environ["LLM_CACHE"] = "0"
+
+import llm_stub_server  # noqa: E402
+import ai_doctor_llm_final_integrated as ai_doctor  # noqa: E402
+from prediction_validator import PredictionValidator  # noqa: E402
+from service_metrics import metrics  # noqa: E402
+
+PROFILES = {
+    "Common Cold": ["cough", "runny nose", "sore throat", "sneezing", "congestion"],
+    "Influenza": ["fever", "cough", "body ache", "fatigue", "headache"],
+    "Dengue": ["fever", "body ache", "joint pain", "headache", "rash"],
+    "Viral Fever": ["fever", "fatigue", "headache", "body ache"],
+    "Pneumonia": ["cough", "fever", "yellow phlegm", "chest pain", "shortness of breath"],
+    "Migraine": ["headache", "nausea", "sensitivity to light", "dizziness"],
+    "Appendicitis": ["abdominal pain", "nausea", "vomiting", "fever"],
+    "Anxiety Attack": ["palpitations", "shortness of breath", "sweating", "dizziness"],
+    "Gastroenteritis": ["diarrhea", "vomiting", "nausea", "abdominal pain"],
+    "Allergic Rhinitis": ["sneezing", "runny nose", "itchy eyes", "congestion"],
+}
+SEVERITIES = ["mild", "moderate", "severe"]
+DURATIONS = ["2 days", "5 days", "1 week", "6 hours"]
+
+
+def write_datasets(workdir, rng):
+    paths = []
+    for name, count in [("train", 2000), ("val", 200), ("test", 200)]:
+        path = os.path.join(workdir, f"synthetic_{name}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for _ in range(count):
+                disease = rng.choice(list(PROFILES))
+                symptoms = rng.sample(PROFILES[disease], rng.randint(2, len(PROFILES[disease])))
+                f.write(json.dumps({"label": disease, "symptoms": symptoms, "severity": rng.choice(SEVERITIES)}) + "\n")
+        paths.append(path)
+    return paths
+
+
+def make_cases(rng, count):
+    cases = []
+    for _ in range(count):
+        disease = rng.choice(list(PROFILES))
+        symptoms = rng.sample(PROFILES[disease], rng.randint(2, len(PROFILES[disease])))
+        predicted = disease if rng.random() < 0.7 else rng.choice(list(PROFILES))
+        cases.append(({"disease": predicted, "severity": rng.choice(SEVERITIES)}, symptoms,
+                      rng.choice(DURATIONS), rng.choice(SEVERITIES)))
+    return cases
+
+
+async def serial(prediction, symptoms, duration, severity):
+    ai_validation = await ai_doctor.ai_validate_diagnosis(prediction["disease"], symptoms, duration, severity)
+    decided, context = ai_doctor._check_prediction_rules(prediction, symptoms, duration, severity)
+    return decided or ai_doctor._apply_ai_validation(ai_validation, context)
+
+
+async def pipeline(prediction, symptoms, duration, severity):
+    pending = await ai_doctor.start_prediction_validation(prediction, symptoms, duration, severity)
+    if pending.needs_ai:
+        ai_doctor.generate_phase2_diagnosis_response(prediction["disease"], severity, symptoms, duration)
+    return await pending.result()
+
+
+async def run(check, cases):
+    metrics.reset()
+    requests_before = llm_stub_server.stats["requests"]
+    times, outcomes = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for case in cases:
+            start = time.perf_counter()
+            outcomes.append((await check(*case))["disease"])
+            times.append(time.perf_counter() - start)
+    counters = {name: int(metrics.get_counter(f"ai_validation.{name}"))
+                for name in ("started", "skipped", "budget_exceeded")}
+    times.sort()
+    return {
+        "mean": sum(times) / len(times),
+        "p95": times[int(len(times) * 0.95) - 1],
+        "llm_calls": llm_stub_server.stats["requests"] - requests_before,
+        "outcomes": outcomes,
+        "counters": counters,
+    }
+
+
+async def run_all(cases, args):
+    roomy_budget = args.llm_latency * 10
+    rows = []
+    ai_doctor.AI_VALIDATION_BUDGET_SECONDS = roomy_budget
+    rows.append(("serial", await run(serial, cases)))
+    rows.append((f"pipeline {roomy_budget:g}s", await run(pipeline, cases)))
+    ai_doctor.AI_VALIDATION_BUDGET_SECONDS = args.budget
+    rows.append((f"pipeline {args.budget:g}s", await run(pipeline, cases)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        while ai_doctor._validation_tasks:
+            await asyncio.sleep(0.05)  # abandoned checks finish being cancelled
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=40)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub seconds before each reply")
+    parser.add_argument("--budget", type=float, default=0.05, help="AI_VALIDATION_BUDGET_SECONDS for the capped run")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    llm_stub_server.STUB_DELAY_SECONDS = args.llm_latency
+    llm_stub_server.STUB_TOKEN_DELAY_SECONDS = 0
+    server = uvicorn.Server(uvicorn.Config(llm_stub_server.app, host="127.0.0.1", port=STUB_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ai_doctor.validator = PredictionValidator(*write_datasets(workdir, rng), use_index_cache=False)
+    cases = make_cases(rng, args.cases)
+
+    rows = asyncio.run(run_all(cases, args))
+    server.should_exit = True
+
+    baseline = rows[0][1]["outcomes"]
+    print(f"\n{'mode':<18}{'mean ms':>9}{'p95 ms':>9}{'LLM calls':>11}{'differ':>8}{'skipped':>9}{'over budget':>13}")
+    print("-" * 77)
+    for name, result in rows:
+        differ = sum(a != b for a, b in zip(baseline, result["outcomes"]))
+        counters = result["counters"]
+        print(f"{name:<18}{result['mean'] * 1000:>9.1f}{result['p95'] * 1000:>9.1f}{result['llm_calls']:>11}"
+              f"{differ:>8}{counters['skipped']:>9}{counters['budget_exceeded']:>13}")
+    print(f"\n{args.cases} predictions, stub LLM latency {args.llm_latency * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
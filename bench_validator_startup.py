@@ -0,0 +1,125 @@
+# bench_validator_startup.py
+"""
+PredictionValidator startup: JSONL parse + index build vs the compiled index.
+
+Writes synthetic train / val / test JSONL files (same shape as the
+medimate_option1_* datasets, see bench_symptom_match.py) to a temp directory,
+then times PredictionValidator(...) in fresh processes:
+
+  rebuild   use_index_cache=False (the old path: json.loads + all indices)
+  compile   first run with the cache: old path + compiling and writing the index
+  mmap      later runs: memory-mapped compiled index, datasets not parsed
+
+It also checks in-process that a validator restored from the compiled index
+has the same maps and gives the same validate_prediction() results as a
+freshly built one.
+
+Usage:
+  python bench_validator_startup.py
+  python bench_validator_startup.py --sizes 8000 100000 --queries 200
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+import validator_index
+from bench_symptom_match import make_queries, make_records, make_vocabulary
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+from prediction_validator import PredictionValidator
+imported = time.perf_counter()
+PredictionValidator(*sys.argv[1:4], use_index_cache=sys.argv[4] == "1")
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def time_startup(paths, use_cache, index_dir):
+    env = dict(os.environ, VALIDATOR_INDEX_DIR=index_dir)
+    out = subprocess.run([sys.executable, "-c", TIMER, *paths, "1" if use_cache else "0"],
+                         capture_output=True, text=True, env=env, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(out.stdout.strip().splitlines()[-1].split()[1])
+
+
+def check_parity(paths, queries):
+    from prediction_validator import PredictionValidator
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        built = PredictionValidator(*paths, use_index_cache=False)
+        loaded = PredictionValidator(*paths, use_index_cache=True)
+    assert loaded._pending_datasets, "expected the compiled index to be used"
+    problems = []
+    for name in ["symptom_disease_map", "disease_symptom_map", "symptom_pairs_map", "all_diseases"]:
+        if getattr(built, name) != getattr(loaded, name):
+            problems.append(name)
+    if {d: sorted(s) for d, s in built.disease_severity_map.items()} != \
+            {d: sorted(s) for d, s in loaded.disease_severity_map.items()}:
+        problems.append("disease_severity_map")
+    for symptoms, severity in queries:
+        predicted = random.Random(len(symptoms)).choice(sorted(built.all_diseases))
+        if built.validate_prediction(symptoms, "3 days", severity, predicted) != \
+                loaded.validate_prediction(symptoms, "3 days", severity, predicted):
+            problems.append(f"validate_prediction{tuple(symptoms)}")
+            break
+    with contextlib.redirect_stdout(io.StringIO()):
+        if loaded.training_data != built.training_data:
+            problems.append("training_data (lazy load)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    profiles = make_vocabulary(rng)
+    queries = make_queries(rng, profiles, args.queries)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            data_dir = os.path.join(workdir, str(size))
+            os.makedirs(data_dir)
+            paths = []
+            for name, count in [("train", size), ("val", size // 8), ("test", size // 8)]:
+                path = os.path.join(data_dir, f"medimate_{name}.jsonl")
+                write_jsonl(path, make_records(random.Random(f"{name}-{size}"), profiles, count))
+                paths.append(path)
+            index_dir = os.path.join(data_dir, "index")
+
+            rebuild = time_startup(paths, False, index_dir)
+            compile_ = time_startup(paths, True, index_dir)
+            warm = min(time_startup(paths, True, index_dir) for _ in range(3))
+
+            validator_index.VALIDATOR_INDEX_DIR = index_dir  # same index the subprocesses used
+            problems = check_parity(paths, queries)
+            rows.append((size, rebuild, compile_, warm, problems))
+
+    print(f"\n{'records':>9}{'rebuild ms':>12}{'compile ms':>12}{'mmap ms':>10}{'speedup':>9}  parity")
+    print("-" * 62)
+    for size, rebuild, compile_, warm, problems in rows:
+        parity = "ok" if not problems else "DIFF: " + ", ".join(problems)
+        print(f"{size:>9}{rebuild * 1000:>12.1f}{compile_ * 1000:>12.1f}{warm * 1000:>10.1f}{rebuild / warm:>8.0f}x  {parity}")
+    print("\nms = PredictionValidator(...) in a fresh process, excluding imports; records = training set size.")
+
+
+if __name__ == "__main__":
+    main()
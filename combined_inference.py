@@ -6,30 +6,161 @@ Combined inference pipeline:
  - apply simple rule-engine (emergency / doctor suggestion)
  - print friendly output
 
+analyze(texts) does all of it for a list of texts in batches and returns, per
+text, the NER spans, the prediction and the rule decision; pretty_print() and
+the demo below print its results.
+
+How much of the work the two models share is set with COMBINED_MODE:
+ - separate    each model tokenizes the text and runs its own encoder
+ - shared      (default) one tokenizer pass feeds both models, when their
+               tokenizers are the same (both Bio_ClinicalBERT); two encoders
+ - multihead   one encoder: the classifier's forward pass, with the NER model's
+               token head applied to its last hidden state. Only for a
+               shared-encoder checkpoint: every NER weight but the head must
+               equal the classifier's (checked tensor by tensor from the
+               safetensors files), so the outputs are those of the two models.
+               The NER encoder is never loaded (NER_INFERENCE_BACKEND does not
+               apply). Otherwise the shared mode is used
+
+Either model can run as the int8 variant written by quantize_models.py
+(NER_INFERENCE_BACKEND=int8, DISEASE_INFERENCE_BACKEND=int8); everything then
+runs on CPU. An int8 model that is missing or stale falls back to fp32.
+
+bench_combined_inference.py compares latency and memory of the three modes.
+
 Usage:
   python combined_inference.py
+  COMBINED_MODE=multihead python combined_inference.py
 """
 
-from transformers import AutoTokenizer, AutoModelForTokenClassification, AutoModelForSequenceClassification
+from transformers import AutoConfig, AutoTokenizer, AutoModelForTokenClassification, AutoModelForSequenceClassification
 import torch
 import torch.nn.functional as F
+import os
 import re
 
-NER_DIR = "medimate-ner-output"
-CLS_DIR = "medimate-disease-model"
-
-# Load models
+from model_runtime import load_int8_model
+from ner_decode import BIODecoder, offset_matrix, word_char_ranges, word_id_matrix
+from token_cache import CachedTokenizer
+
+NER_DIR = os.getenv("NER_MODEL_DIR", "medimate-ner-output")
+CLS_DIR = os.getenv("DISEASE_MODEL_DIR", "medimate-disease-model")
+NER_BACKEND = os.getenv("NER_INFERENCE_BACKEND", "pytorch").lower()
+CLS_BACKEND = os.getenv("DISEASE_INFERENCE_BACKEND", "pytorch").lower()
+COMBINED_MODE = os.getenv("COMBINED_MODE", "shared").lower()
+COMBINED_BATCH_SIZE = int(os.getenv("COMBINED_BATCH_SIZE", "16"))
+MAX_LENGTH = 256
+MODES = ("separate", "shared", "multihead")
+WHITESPACE = re.compile(r"\s+")
+
+if COMBINED_MODE not in MODES:
+    raise ValueError(f"Unknown COMBINED_MODE {COMBINED_MODE!r}, expected one of {MODES}")
+
+def load_model(model_dir, model_class, backend):
+    """(model, is_int8): the int8 variant if requested and published, else the fp32 model"""
+    if backend == "int8":
+        model = load_int8_model(model_dir, model_class)
+        if model is not None:
+            print(f"[COMBINED] Using int8 model from {model_dir}")
+            return model, True
+        print(f"[COMBINED] int8 model unavailable in {model_dir}, using fp32")
+    return model_class.from_pretrained(model_dir), False
+
+def same_tokenization(a, b):
+    """True if two fast tokenizers give the same ids for any text (vocab, normalizer, pre-tokenizer, special tokens)."""
+    if not (getattr(a, "is_fast", False) and getattr(b, "is_fast", False)):
+        return False
+    return a.backend_tokenizer.to_str() == b.backend_tokenizer.to_str() and list(a.model_input_names) == list(b.model_input_names)
+
+def shared_encoder_head(ner_dir, cls_dir, head_prefix="classifier."):
+    """
+    The NER model's token head as an nn.Linear if every other NER weight equals the
+    classifier's weight of the same name (a shared-encoder checkpoint), else None.
+    Compared tensor by tensor from the safetensors files; the NER encoder is never built.
+    """
+    from safetensors import safe_open
+
+    paths = [os.path.join(d, "model.safetensors") for d in (ner_dir, cls_dir)]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    with safe_open(paths[0], framework="pt") as ner_file, safe_open(paths[1], framework="pt") as cls_file:
+        cls_names = set(cls_file.keys())
+        head = {}
+        for name in ner_file.keys():
+            if name.startswith(head_prefix):
+                head[name[len(head_prefix):]] = ner_file.get_tensor(name)
+            elif name not in cls_names or not torch.equal(ner_file.get_tensor(name), cls_file.get_tensor(name)):
+                return None
+    if set(head) != {"weight", "bias"}:
+        return None
+    layer = torch.nn.Linear(head["weight"].shape[1], head["weight"].shape[0])
+    layer.load_state_dict(head)
+    return layer.eval()
+
+# Load tokenizers and models
 ner_tokenizer = AutoTokenizer.from_pretrained(NER_DIR, use_fast=True)
-ner_model = AutoModelForTokenClassification.from_pretrained(NER_DIR)
-ner_id2label = ner_model.config.id2label
-
 cls_tokenizer = AutoTokenizer.from_pretrained(CLS_DIR, use_fast=True)
-cls_model = AutoModelForSequenceClassification.from_pretrained(CLS_DIR)
+
+shared_tokens = COMBINED_MODE != "separate" and same_tokenization(ner_tokenizer, cls_tokenizer)
+if COMBINED_MODE != "separate" and not shared_tokens:
+    print(f"[COMBINED] {NER_DIR} and {CLS_DIR} tokenize differently, each model gets its own pass")
+
+ner_head = None
+if COMBINED_MODE == "multihead" and shared_tokens:
+    ner_head = shared_encoder_head(NER_DIR, CLS_DIR)
+    if ner_head is None:
+        print(f"[COMBINED] multihead needs {NER_DIR} to hold the classifier's encoder weights plus a token head "
+              f"(model.safetensors), using the shared mode")
+
+if ner_head is None:
+    ner_model, ner_int8 = load_model(NER_DIR, AutoModelForTokenClassification, NER_BACKEND)
+    ner_id2label = ner_model.config.id2label
+else:
+    # One encoder for both heads: only the NER head and label map are loaded
+    ner_model, ner_int8 = None, False
+    ner_id2label = AutoConfig.from_pretrained(NER_DIR).id2label
+
+cls_model, cls_int8 = load_model(CLS_DIR, AutoModelForSequenceClassification, CLS_BACKEND)
 cls_id2label = cls_model.config.id2label
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-ner_model.to(device)
+# Encodings (ids, word ids, offsets) of recently seen texts; one cache for both models when they
+# tokenize alike. Eager PyTorch gains nothing from length buckets, so batches pad to their longest text
+ner_encoder = CachedTokenizer(ner_tokenizer, "ner", max_length=MAX_LENGTH, buckets=())
+cls_encoder = ner_encoder if shared_tokens else CachedTokenizer(cls_tokenizer, "combined_classifier",
+                                                                 max_length=MAX_LENGTH, buckets=())
+
+# Dynamically quantized layers only run on CPU
+device = "cuda" if torch.cuda.is_available() and not (ner_int8 or cls_int8) else "cpu"
 cls_model.to(device)
+cls_model.eval()
+
+
+class MultiHeadModel(torch.nn.Module):
+    """The classifier's encoder with both heads: (token logits, sequence logits) from one forward pass."""
+
+    def __init__(self, cls_model, ner_head):
+        super().__init__()
+        self.cls_model = cls_model
+        self.ner_head = ner_head
+
+    def forward(self, **inputs):
+        out = self.cls_model(**inputs, output_hidden_states=True)
+        return self.ner_head(out.hidden_states[-1]), out.logits
+
+if ner_head is not None:
+    multihead = MultiHeadModel(cls_model, ner_head.to(device)).eval()
+    print(f"[COMBINED] multihead: {NER_DIR} shares the classifier's encoder, one forward pass for both heads")
+else:
+    multihead = None
+    ner_model.to(device)
+    ner_model.eval()
+
+
+def encode(encoder, texts):
+    """Encodings of texts, the batch's attention mask (CPU) and its padded model inputs on device."""
+    encodings = encoder.encode_batch(texts)
+    inputs = encoder.pad(encodings)
+    return encodings, inputs["attention_mask"], {k: v.to(device) for k, v in inputs.items()}
 
 def normalize_label_map(cfg_map):
     """Convert model.config.id2label to int->str dict safely"""
@@ -45,111 +176,58 @@ def normalize_label_map(cfg_map):
 
 ner_id2label = normalize_label_map(ner_id2label)
 cls_id2label = normalize_label_map(cls_id2label)
+ner_decoder = BIODecoder(ner_id2label)
 
 # NER extraction (works with fast tokenizer)
-def ner_extract(text, topk=None):
-    # Tokenize (fast tokenizer). Keep BatchEncoding so we can use .word_ids() and offsets,
-    # but remove offset_mapping before calling the model.
-    enc = ner_tokenizer(text, return_offsets_mapping=True, return_tensors="pt", truncation=True, max_length=256)
-
-    # Save offsets and word_ids for later (these are NOT passed to model)
-    offsets = enc["offset_mapping"][0].cpu().tolist() if "offset_mapping" in enc else None
-    # word_ids() works on BatchEncoding (fast tokenizer)
-    try:
-        word_ids = enc.word_ids(batch_index=0)
-    except Exception:
-        # fallback: build word_ids as None (shouldn't normally happen with fast tokenizer)
-        word_ids = None
-
-    # Prepare input dict for the model: only move tensor values to device and remove helper keys
-    model_inputs = {}
-    for k, v in enc.items():
-        if k == "offset_mapping":
-            continue
-        # some items might be lists/ints; only move tensors
-        if isinstance(v, torch.Tensor):
-            model_inputs[k] = v.to(device)
-        else:
-            # skip non-tensor helpers
-            continue
-
-    # Run model (no offset_mapping passed)
+def ner_logits(inputs):
+    """Token logits (batch, seq_len, num_labels) for padded inputs."""
     with torch.no_grad():
-        logits = ner_model(**model_inputs).logits[0]  # (seq_len, num_labels)
-        probs = F.softmax(logits, dim=-1)
-
-    preds = probs.argmax(-1).cpu().tolist()
-
-    # get tokens (string form) from the model_inputs input_ids (on CPU)
-    input_ids_cpu = model_inputs["input_ids"].cpu()[0].tolist()
-    tokens = ner_tokenizer.convert_ids_to_tokens(input_ids_cpu)
-
-    # Build spans by merging B-/I- tags using preds and word_ids
-    spans = []
-    cur = None  # [start_word_index, end_word_index, label_type, max_conf, token_indices]
-    for i, wid in enumerate(word_ids if word_ids else [None]*len(preds)):
-        if wid is None:
-            if cur:
-                spans.append(cur); cur = None
-            continue
-        label = ner_id2label.get(preds[i], "O")
-        conf = float(probs[i, preds[i]].cpu().item())
-        if label == "O":
-            if cur:
-                spans.append(cur); cur = None
-            continue
-        if "-" in label:
-            prefix, typ = label.split("-", 1)
-        else:
-            prefix, typ = "B", label
-        if prefix == "B" or cur is None or cur[2] != typ:
-            if cur:
-                spans.append(cur)
-            cur = [wid, wid, typ, conf, [i]]
-        else:
-            cur[1] = wid
-            cur[3] = max(cur[3], conf)
-            cur[4].append(i)
-    if cur:
-        spans.append(cur)
-
-    # group token indices by word id to extract original text spans using offsets
-    grouped = {}
-    for ti, wid in enumerate(word_ids if word_ids else []):
-        if wid is None:
-            continue
-        grouped.setdefault(wid, []).append(ti)
-
-    # reconstruct word_texts from offsets (use original text)
-    original = text
-    max_word = max([w for w in (word_ids or []) if w is not None], default=-1)
-    word_texts = []
-    for wid in range(max_word + 1):
-        if wid not in grouped:
-            word_texts.append("")
-            continue
-        idxs = grouped[wid]
-        if offsets and len(offsets) > 0:
-            s = offsets[idxs[0]][0]
-            e = offsets[idxs[-1]][1]
-            piece = original[s:e].strip()
-            if not piece:
-                piece = ner_tokenizer.convert_tokens_to_string([tokens[t] for t in idxs]).strip()
-        else:
-            piece = ner_tokenizer.convert_tokens_to_string([tokens[t] for t in idxs]).strip()
-        word_texts.append(piece)
+        if multihead is not None:
+            return multihead(**inputs)[0]
+        return ner_model(**inputs).logits
 
-    out = []
-    for s, e, typ, conf, token_idxs in spans:
-        s = max(0, s); e = min(e, len(word_texts) - 1)
-        ent_text = " ".join([w for w in word_texts[s:e+1] if w]).strip()
-        ent_text = re.sub(r"\s+", " ", ent_text)
-        out.append({"type": typ, "text": ent_text, "conf": round(conf, 3)})
-
-    out = sorted(out, key=lambda x: x["conf"], reverse=True)
-    if topk:
-        out = out[:topk]
-    return out
+def ner_extract(text, topk=None):
+    return ner_extract_batch([text], topk)[0]
+
+def ner_extract_batch(texts, topk=None, batch_size=COMBINED_BATCH_SIZE):
+    """Entities of each text, batch_size texts per forward pass."""
+    results = []
+    for i in range(0, len(texts), batch_size):
+        batch = list(texts[i:i + batch_size])
+        # Tokenize through the encoding cache (fast tokenizer): ids plus the word ids and
+        # character offsets used to map tags back to the text
+        encodings, mask, model_inputs = encode(ner_encoder, batch)
+        probs = F.softmax(ner_logits(model_inputs), dim=-1)  # (batch, seq_len, num_labels)
+        results.extend(decode_entities(batch, encodings, probs, mask, topk))
+    return results
+
+def decode_entities(texts, encodings, probs, attention_mask, topk=None):
+    """Entities per text from the tag probabilities of a padded batch (spans: ner_decode.py)."""
+    word_ids = word_id_matrix([e.word_ids for e in encodings], attention_mask)
+    all_spans = ner_decoder.decode(probs, word_ids)
+    starts, ends = word_char_ranges(word_ids, offset_matrix([e.offsets for e in encodings], attention_mask))
+    results = []
+    for row, (text, encoding, spans) in enumerate(zip(texts, encodings, all_spans)):
+        out = []
+        if spans:
+            row_starts, row_ends = starts[row].tolist(), ends[row].tolist()
+        for span in spans:
+            words = [word_text(text, encoding, w, row_starts[w], row_ends[w]) for w in range(span.start_word, span.end_word + 1)]
+            ent_text = WHITESPACE.sub(" ", " ".join(w for w in words if w).strip())
+            out.append({"type": span.type, "text": ent_text, "conf": round(span.conf, 3)})
+        out = sorted(out, key=lambda x: x["conf"], reverse=True)
+        results.append(out[:topk] if topk else out)
+    return results
+
+def word_text(text, encoding, wid, start, end):
+    """A word's text from its character range, or from its tokens when the offsets give nothing."""
+    if start < 0:
+        return ""
+    piece = text[start:end].strip()
+    if not piece:
+        tokens = ner_tokenizer.convert_ids_to_tokens([int(t) for t, w in zip(encoding.ids, encoding.word_ids) if w == wid])
+        piece = ner_tokenizer.convert_tokens_to_string(tokens).strip()
+    return piece
 
 COMMON_SYMPTOMS = ["fever","cough","chest pain","breathlessness","vomiting","diarrhea",
                    "headache","loss of smell","abdominal pain","nausea","rash","dizziness"]
@@ -165,12 +243,14 @@ def fallback_simple_symptoms(text):
 
 
 def classify_text(text, conf_threshold=0.20):
-    enc = cls_tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=256)
-    enc = {k: v.to(device) for k, v in enc.items()}
+    enc = {k: v.to(device) for k, v in cls_encoder([text]).items()}
     with torch.no_grad():
         logits = cls_model(**enc).logits
         probs = F.softmax(logits, dim=-1).cpu().numpy()[0]
+    return prediction_from_probs(probs, conf_threshold)
 
+def prediction_from_probs(probs, conf_threshold=0.20):
+    """Label and confidence of one text's class probabilities ("Uncertain" below conf_threshold)."""
     top_idx = int(probs.argmax())
     top_conf = float(probs[top_idx])
 
@@ -237,12 +317,37 @@ def rule_decision(ner_entities, predicted, full_text):
     return {"emergency": emergency, "doctor_recommend": doctor_needed, "reasons": reason}
 # ---------- end add ----------
 
+# Library API: NER spans, prediction and rule decision per text
+def analyze(texts, batch_size=COMBINED_BATCH_SIZE, conf_threshold=0.20):
+    """
+    [{"text", "entities", "prediction", "decision"}] for texts, batch_size texts per forward pass.
+    entities falls back to keyword matching when NER finds nothing, as pretty_print always did.
+    """
+    results = []
+    for i in range(0, len(texts), batch_size):
+        batch = list(texts[i:i + batch_size])
+        encodings, mask, inputs = encode(ner_encoder, batch)
+        with torch.no_grad():
+            if multihead is not None:
+                token_logits, seq_logits = multihead(**inputs)
+            else:
+                token_logits = ner_model(**inputs).logits
+                cls_inputs = inputs if cls_encoder is ner_encoder else encode(cls_encoder, batch)[2]
+                seq_logits = cls_model(**cls_inputs).logits
+        batch_entities = decode_entities(batch, encodings, F.softmax(token_logits, dim=-1), mask)
+        seq_probs = F.softmax(seq_logits, dim=-1).cpu().numpy()
+        for row, (text, entities) in enumerate(zip(batch, batch_entities)):
+            if not entities:
+                entities = fallback_simple_symptoms(text)
+            prediction = prediction_from_probs(seq_probs[row], conf_threshold)
+            results.append({"text": text, "entities": entities, "prediction": prediction,
+                            "decision": rule_decision(entities, prediction, text)})
+    return results
+
 # Pretty print helper
-def pretty_print(text):
-    print("\nINPUT:", text)
-    ner_out = ner_extract(text)
-    if not ner_out or len(ner_out) == 0:
-        ner_out = fallback_simple_symptoms(text)
+def print_analysis(result):
+    print("\nINPUT:", result["text"])
+    ner_out = result["entities"]
     if ner_out:
         print("NER:")
         for e in ner_out:
@@ -250,11 +355,11 @@ def pretty_print(text):
     else:
         print("NER: none")
 
-    cls_out = classify_text(text)
+    cls_out = result["prediction"]
     print("Disease prediction:")
     print(f" - {cls_out['label']} (conf={round(cls_out['confidence'],3)})")
 
-    decision = rule_decision(ner_out, cls_out, text)
+    decision = result["decision"]
     if decision["emergency"]:
         print("\n!! EMERGENCY FLAGGED !!")
     if decision["doctor_recommend"]:
@@ -262,6 +367,9 @@ def pretty_print(text):
     print("Reasons:", "; ".join(decision["reasons"]) if decision["reasons"] else "none")
     print("-" * 40)
 
+def pretty_print(text):
+    print_analysis(analyze([text])[0])
+
 if __name__ == "__main__":
     tests = [
         "Patient presents with persistent dry cough and mild fever for 2 days.",
@@ -269,5 +377,5 @@ if __name__ == "__main__":
         "Patient has vomiting and lower abdominal pain for 12 hours.",
         "I have fever, loss of smell and dry cough for 2 days."
     ]
-    for t in tests:
-        pretty_print(t)
+    for result in analyze(tests):
+        print_analysis(result)
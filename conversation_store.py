@@ -0,0 +1,303 @@
+# conversation_store.py - Bounded conversation state for the chat endpoints
+"""
+Per-user chat state (history, diagnosis, extracted file text, intake summary) for
+/chat_with_ai and /chat_with_ai_stream.
+
+The backend used to keep this in a module-level dict that grew without limit,
+never expired and was lost on restart. Two backends share one interface:
+
+ - MemoryConversationStore   in-process LRU with a TTL, a cap per conversation
+                             and a cap on the total (the default)
+ - SQLiteConversationStore   rows in the app database (user_model.ConversationState),
+                             so several uvicorn workers see the same conversations
+
+Both apply the same per-conversation cap: the oldest history turns are dropped
+first, then stored file text is truncated. Sizes are the conversation's
+serialized (JSON) size in bytes.
+
+    state = conversation_store.get(user_id)   # existing state or a fresh one
+    ... mutate state ...
+    conversation_store.save(user_id, state)
+    conversation_store.delete(user_id)
+
+Metrics (service_metrics): conversation_store.conversations and
+.resident_bytes gauges, the .conversation_bytes histogram (size of each saved
+conversation), and counters .evictions.ttl / .evictions.lru /
+.evictions.memory and .trimmed.
+
+Config (env):
+  CONVERSATION_STORE                memory | sqlite
+  CONVERSATION_TTL_SECONDS          idle time before a conversation expires
+  CONVERSATION_MAX_USERS            conversations kept in memory
+  CONVERSATION_MAX_BYTES_PER_USER   cap per conversation
+  CONVERSATION_MAX_TOTAL_BYTES      cap on all in-memory conversations
+"""
+
+import abc
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from intake_state import new_intake_state
+from service_metrics import metrics
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory").lower()
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", str(24 * 3600)))  # matches the token lifetime
+CONVERSATION_MAX_USERS = int(os.getenv("CONVERSATION_MAX_USERS", "10000"))
+CONVERSATION_MAX_BYTES_PER_USER = int(os.getenv("CONVERSATION_MAX_BYTES_PER_USER", str(1 << 20)))
+CONVERSATION_MAX_TOTAL_BYTES = int(os.getenv("CONVERSATION_MAX_TOTAL_BYTES", str(256 << 20)))
+
+# Size buckets for the conversation_bytes histogram
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20)
+
+FILE_CONTENT_TRUNCATED = "\n[... file content truncated ...]"
+
+
+def new_conversation() -> Dict:
+    return {
+        "history": [],
+        "diagnosis": None,
+        "file_content": None,  # Extracted file content, kept for follow-up questions
+        "intake": new_intake_state()  # Symptoms, duration, severity, ... so far (intake_state.py)
+    }
+
+
+def conversation_size(state: Dict) -> int:
+    """Serialized size of a conversation in bytes."""
+    return len(json.dumps(state, default=str).encode("utf-8"))
+
+
+def enforce_size_cap(state: Dict, max_bytes: int) -> int:
+    """
+    Shrink `state` in place to at most `max_bytes` and return its size.
+
+    Drops the oldest history turns (user + model message pairs) first, always
+    keeping the latest turn, then truncates the stored file content.
+    """
+    size = conversation_size(state)
+    if size <= max_bytes:
+        return size
+
+    history = state.get("history") or []
+    while size > max_bytes and len(history) > 2:
+        removed = conversation_size(history[:2])
+        del history[:2]
+        size -= removed + 2  # and the ", " separators
+    file_content = state.get("file_content")
+    if size > max_bytes and file_content:
+        keep = max(0, len(file_content.encode("utf-8")) - (size - max_bytes) - len(FILE_CONTENT_TRUNCATED) - 16)
+        state["file_content"] = file_content.encode("utf-8")[:keep].decode("utf-8", errors="ignore") + FILE_CONTENT_TRUNCATED
+    metrics.inc("conversation_store.trimmed")
+    return conversation_size(state)
+
+
+class ConversationStore(abc.ABC):
+    """Interface shared by the conversation backends."""
+
+    @abc.abstractmethod
+    def get(self, user_id: int) -> Dict:
+        """The user's conversation state, or a fresh one (not stored until save)."""
+
+    @abc.abstractmethod
+    def save(self, user_id: int, state: Dict):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> Dict:
+        ...
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process LRU of conversations with a TTL and byte caps."""
+
+    def __init__(self, max_users: int = CONVERSATION_MAX_USERS,
+                 max_total_bytes: int = CONVERSATION_MAX_TOTAL_BYTES,
+                 max_bytes_per_user: int = CONVERSATION_MAX_BYTES_PER_USER,
+                 ttl_seconds: float = CONVERSATION_TTL_SECONDS):
+        self.max_users = max_users
+        self.max_total_bytes = max_total_bytes
+        self.max_bytes_per_user = max_bytes_per_user
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, list]" = OrderedDict()  # user_id -> [state, size, last_used], LRU first
+        self._total_bytes = 0
+
+    def _evict(self, user_id: int, reason: str):
+        _, size, _ = self._entries.pop(user_id)
+        self._total_bytes -= size
+        metrics.inc(f"conversation_store.evictions.{reason}")
+
+    def _expire(self, now: float):
+        while self._entries:
+            user_id, (_, _, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.ttl_seconds:
+                break
+            self._evict(user_id, "ttl")
+
+    def _update_gauges(self):
+        metrics.set_gauge("conversation_store.conversations", len(self._entries))
+        metrics.set_gauge("conversation_store.resident_bytes", self._total_bytes)
+
+    def get(self, user_id: int) -> Dict:
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self._update_gauges()
+                return new_conversation()
+            entry[2] = time.time()
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def save(self, user_id: int, state: Dict):
+        size = enforce_size_cap(state, self.max_bytes_per_user)
+        metrics.observe("conversation_store.conversation_bytes", size, SIZE_BUCKETS)
+        with self._lock:
+            now = time.time()
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[user_id] = [state, size, now]
+            self._total_bytes += size
+
+            self._expire(now)
+            while len(self._entries) > self.max_users:
+                self._evict(next(iter(self._entries)), "lru")
+            while self._total_bytes > self.max_total_bytes and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)), "memory")
+            self._update_gauges()
+
+    def delete(self, user_id: int):
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+            self._update_gauges()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sizes = [entry[1] for entry in self._entries.values()]
+        return {
+            "backend": "memory",
+            "conversations": len(sizes),
+            "resident_bytes": sum(sizes),
+            "max_conversation_bytes": max(sizes) if sizes else 0,
+            "mean_conversation_bytes": (sum(sizes) / len(sizes)) if sizes else 0,
+            "limits": {
+                "max_users": self.max_users,
+                "max_total_bytes": self.max_total_bytes,
+                "max_bytes_per_user": self.max_bytes_per_user,
+                "ttl_seconds": self.ttl_seconds,
+            },
+            "evictions": {
+                reason: int(metrics.get_counter(f"conversation_store.evictions.{reason}"))
+                for reason in ("ttl", "lru", "memory")
+            },
+        }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversations as JSON rows in the app database, shared by every worker process."""
+
+    def __init__(self, session_factory=None, max_bytes_per_user: int = CONVERSATION_MAX_BYTES_PER_USER,
+                 ttl_seconds: float = CONVERSATION_TTL_SECONDS):
+        from user_model import ConversationState, SessionLocal
+        self.model = ConversationState
+        self.session_factory = session_factory or SessionLocal
+        self.max_bytes_per_user = max_bytes_per_user
+        self.ttl_seconds = ttl_seconds
+        self._table_ready = False
+        self._last_sweep = 0.0
+
+    def _session(self):
+        session = self.session_factory()
+        if not self._table_ready:
+            self.model.__table__.create(bind=session.get_bind(), checkfirst=True)
+            self._table_ready = True
+        return session
+
+    def _sweep(self, db, now: float):
+        """Delete expired rows, at most once a minute per process."""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        expired = db.query(self.model).filter(self.model.updated_at < now - self.ttl_seconds).delete()
+        db.commit()
+        if expired:
+            metrics.inc("conversation_store.evictions.ttl", expired)
+
+    def get(self, user_id: int) -> Dict:
+        now = time.time()
+        db = self._session()
+        try:
+            self._sweep(db, now)
+            row = db.get(self.model, user_id)
+            if row is None or now - row.updated_at >= self.ttl_seconds:
+                return new_conversation()
+            return json.loads(row.state)
+        finally:
+            db.close()
+
+    def save(self, user_id: int, state: Dict):
+        size = enforce_size_cap(state, self.max_bytes_per_user)
+        metrics.observe("conversation_store.conversation_bytes", size, SIZE_BUCKETS)
+        db = self._session()
+        try:
+            db.merge(self.model(user_id=user_id, state=json.dumps(state, default=str),
+                                size_bytes=size, updated_at=time.time()))
+            db.commit()
+        finally:
+            db.close()
+
+    def delete(self, user_id: int):
+        db = self._session()
+        try:
+            db.query(self.model).filter(self.model.user_id == user_id).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        from sqlalchemy import func
+        db = self._session()
+        try:
+            live = db.query(self.model).filter(self.model.updated_at >= time.time() - self.ttl_seconds)
+            count, total, largest = live.with_entities(
+                func.count(), func.coalesce(func.sum(self.model.size_bytes), 0),
+                func.coalesce(func.max(self.model.size_bytes), 0)).one()
+        finally:
+            db.close()
+        metrics.set_gauge("conversation_store.conversations", count)
+        metrics.set_gauge("conversation_store.resident_bytes", total)
+        return {
+            "backend": "sqlite",
+            "conversations": count,
+            "resident_bytes": total,
+            "max_conversation_bytes": largest,
+            "mean_conversation_bytes": (total / count) if count else 0,
+            "limits": {"max_bytes_per_user": self.max_bytes_per_user, "ttl_seconds": self.ttl_seconds},
+            "evictions": {"ttl": int(metrics.get_counter("conversation_store.evictions.ttl"))},
+        }
+
+
+def create_conversation_store(backend: str = CONVERSATION_STORE) -> ConversationStore:
+    if backend == "sqlite":
+        return SQLiteConversationStore()
+    if backend != "memory":
+        print(f"[WARNING] Unknown CONVERSATION_STORE '{backend}', using memory")
+    return MemoryConversationStore()
+
+
+# Process-wide store used by the chat endpoints
+conversation_store = create_conversation_store()
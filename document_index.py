@@ -0,0 +1,177 @@
+# document_index.py - BM25 retrieval over an uploaded document for follow-up questions
+"""
+conversation_state["file_content"] keeps the whole extracted document, and
+every follow-up question used to carry all of it into the LLM prompt.
+DocumentIndex cuts the document into chunks of RETRIEVAL_CHUNK_TOKENS
+(document_summarizer.chunk_text) and ranks them against the question with
+BM25, so a follow-up prompt carries only the RETRIEVAL_TOP_K best chunks, in
+document order.
+
+ - the index is built when the file is attached (backend_service
+   _prepare_chat_turn) and kept in a process-wide LRU keyed by the SHA-256 of
+   the text; the conversation state is unchanged (it stays small and
+   serializable), and a worker or restart that has not seen the document
+   rebuilds the index on first use (milliseconds for a few hundred chunks)
+ - terms are lower-cased words and numbers ("9.1", "x10"), minus a short list
+   of question words and stop words, so "what does my hemoglobin mean"
+   matches on "hemoglobin"
+ - a document no longer than RETRIEVAL_TOP_K chunks is sent whole, as before
+ - a question that matches no chunk gets the document's chunk summaries
+   (document_summarizer.document_context) instead of arbitrary chunks
+
+llm_process_conversation logs the estimated prompt tokens of each such
+follow-up with the whole document and with the retrieved chunks.
+
+Metrics (service_metrics):
+ - retrieval.queries                       counter
+ - retrieval.no_match                      counter, questions that matched no chunk
+ - retrieval.document_tokens / .context_tokens   histograms, estimated tokens per query
+ - retrieval.tokens_saved                  counter
+ - retrieval.indexes                       gauge, indexes kept
+
+Config (env):
+ - RETRIEVAL_CHUNK_TOKENS      tokens per chunk (default 256)
+ - RETRIEVAL_TOP_K             chunks per follow-up prompt (default 4)
+ - RETRIEVAL_MAX_INDEXES       indexes kept in memory (default 256)
+"""
+
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from document_summarizer import chunk_text, estimate_tokens
+from service_metrics import metrics
+
+# --- CONFIG ---
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "256"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MAX_INDEXES = int(os.getenv("RETRIEVAL_MAX_INDEXES", "256"))
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TERM = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in is it its
+me mean means my of on or our should so that the their them there these this to was we were what
+when where which who why will with would you your about tell explain please file report document
+""".split())
+# Histogram buckets for retrieval.*_tokens
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def terms(text: str) -> List[str]:
+    return [t for t in TERM.findall(text.lower()) if t not in STOP_WORDS]
+
+
+class DocumentIndex:
+    """BM25 over the chunks of one document."""
+
+    def __init__(self, text: str, chunk_tokens: int = RETRIEVAL_CHUNK_TOKENS):
+        self.chunks = chunk_text(text, chunk_tokens)
+        self.document_tokens = estimate_tokens(text)
+        counts = [Counter(terms(chunk)) for chunk in self.chunks]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+        self.norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean() if len(lengths) else 0, 1.0))
+        # term -> (chunk indexes, term frequencies)
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, chunk_counts in enumerate(counts):
+            for term, tf in chunk_counts.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        n = len(self.chunks)
+        self.postings = {term: (np.array(ids), np.array(tfs, dtype=np.float64),
+                                math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)))
+                         for term, (ids, tfs) in postings.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks))
+        for term in set(terms(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs, idf = posting
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + self.norms[ids])
+        return scores
+
+    def top_chunks(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[int]:
+        """Indexes of the k best-matching chunks (score > 0), in document order."""
+        scores = self.scores(query)
+        best = [i for i in np.argsort(-scores, kind="stable")[:k] if scores[i] > 0]
+        return sorted(int(i) for i in best)
+
+
+class DocumentIndexCache:
+    """LRU of DocumentIndex by the document's content hash, plus the follow-up context built from it."""
+
+    def __init__(self, top_k: int = RETRIEVAL_TOP_K, chunk_tokens: int = RETRIEVAL_CHUNK_TOKENS,
+                 max_indexes: int = RETRIEVAL_MAX_INDEXES):
+        self.top_k = top_k
+        self.chunk_tokens = chunk_tokens
+        self.max_indexes = max_indexes
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, DocumentIndex]" = OrderedDict()  # LRU first
+
+    def build(self, text: str) -> DocumentIndex:
+        """The index of text, built now unless it is already kept."""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = DocumentIndex(text, self.chunk_tokens)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            size = len(self._indexes)
+        metrics.set_gauge("retrieval.indexes", size)
+        return index
+
+    async def context_for(self, text: str, question: str, fallback=None) -> str:
+        """
+        The part of the document a follow-up prompt needs: the whole text when it is at most
+        top_k chunks, otherwise the top_k chunks for the question. When nothing matches,
+        await fallback(text) (e.g. the document's summaries), or the first top_k chunks without one.
+        """
+        index = self.build(text)
+        metrics.inc("retrieval.queries")
+        if len(index.chunks) <= self.top_k:
+            context = text
+        else:
+            best = index.top_chunks(question, self.top_k)
+            if best:
+                context = "\n...\n".join(index.chunks[i] for i in best)
+            else:
+                metrics.inc("retrieval.no_match")
+                context = await fallback(text) if fallback else "\n...\n".join(index.chunks[:self.top_k])
+        context_tokens = estimate_tokens(context)
+        metrics.observe("retrieval.document_tokens", index.document_tokens, TOKEN_BUCKETS)
+        metrics.observe("retrieval.context_tokens", context_tokens, TOKEN_BUCKETS)
+        metrics.inc("retrieval.tokens_saved", max(0, index.document_tokens - context_tokens))
+        return context
+
+    def stats(self) -> Dict:
+        with self._lock:
+            indexes = len(self._indexes)
+        return {
+            "indexes": indexes,
+            "top_k": self.top_k,
+            "chunk_tokens": self.chunk_tokens,
+            "queries": metrics.get_counter("retrieval.queries"),
+            "no_match": metrics.get_counter("retrieval.no_match"),
+            "tokens_saved": metrics.get_counter("retrieval.tokens_saved"),
+        }
+
+
+# Shared instance for the backend process
+document_index = DocumentIndexCache()
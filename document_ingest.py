@@ -0,0 +1,305 @@
+# document_ingest.py - Parallel, cached text extraction for uploaded PDF reports
+"""
+backend_service.extract_text_from_pdf used to parse the first five pages of
+every attached PDF one after the other with pdfplumber, in the request's
+worker thread, and did it again each time the same lab report was attached.
+DocumentIngestor splits that work up:
+
+ - pages are extracted in a process pool (pdfplumber is pure Python and holds
+   the GIL, so threads do not help), PDF_PAGES_PER_TASK pages per task; each
+   task opens the document once for its pages
+ - the text of every page is cached under (sha256 of the file, page number),
+   so a report attached again, or a longer budget over a known report, only
+   extracts the pages not seen before
+ - a budget: files over PDF_MAX_BYTES are not parsed, and only the first
+   PDF_MAX_PAGES pages are read (the text says how many were left out)
+ - extract_text() joins the pages in the format the chat prompt has always
+   used ("--- Page n ---" headers) and can hand each page's part of the text
+   to on_text as soon as that page is ready, so the summarizer can start on
+   page 1 while later pages are still being extracted
+   (document_summarizer.ChunkPrefetcher)
+
+A document is its bytes or the path of a file (an upload_store.py upload);
+with a path the pool processes open the file themselves and the bytes never
+cross a process boundary.
+
+The pool is started with the spawn method on first use: forking a backend
+process that holds model threads and an event loop is not safe.
+PDF_EXTRACT_PROCESSES=0 extracts in the calling thread (still cached).
+Calls block, so the backend runs them on service_executors.pdf_executor.
+
+Metrics (service_metrics):
+ - pdf.page_seconds              histogram, extraction time per page (in the worker)
+ - pdf.document_seconds          histogram, wall time per document (cache lookups included)
+ - pdf.page_cache.hits / misses  counters, per page
+ - pdf.page_cache.entries / bytes gauges
+ - pdf.pages_skipped             counter, pages past PDF_MAX_PAGES
+ - pdf.rejected                  counter, files over PDF_MAX_BYTES or that could not be opened
+
+Config (env):
+ - PDF_EXTRACT_PROCESSES         worker processes (default: cores, at most 4; 0 = in the calling thread)
+ - PDF_PAGES_PER_TASK            pages per pool task (default 2)
+ - PDF_MAX_PAGES                 pages read per document (default 5)
+ - PDF_MAX_BYTES                 largest file parsed (default 20 MB)
+ - PDF_PAGE_CACHE                1 / 0
+ - PDF_PAGE_CACHE_MAX_ENTRIES    cached pages (default 2048)
+ - PDF_PAGE_CACHE_MAX_BYTES      cached text bytes (default 32 MB)
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from service_metrics import metrics
+
+try:
+    import pdfplumber
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+# --- CONFIG ---
+PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "2"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "5"))
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+PDF_PAGE_CACHE = os.getenv("PDF_PAGE_CACHE", "1") == "1"
+PDF_PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PDF_PAGE_CACHE_MAX_ENTRIES", "2048"))
+PDF_PAGE_CACHE_MAX_BYTES = int(os.getenv("PDF_PAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Histogram buckets for pdf.page_seconds / pdf.document_seconds
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class PageText(NamedTuple):
+    number: int            # 1-based page number
+    text: str              # extracted text ("" when the page has none)
+    seconds: float         # extraction time (0 for a cached page)
+    cached: bool
+
+
+# A document: its bytes, or the path of a file holding them (an upload_store.py upload)
+Source = Union[bytes, str]
+
+
+class PDFError(ValueError):
+    """The file is over the byte budget or could not be opened as a PDF."""
+
+
+# ---- worker side (runs in the pool processes) ----
+
+def _pdf_file(source: Source):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def _extract_pages(source: Source, page_indexes: List[int]) -> List[Tuple[int, str, float]]:
+    """(index, text, seconds) for the given 0-based pages of one document."""
+    results = []
+    with pdfplumber.open(_pdf_file(source)) as pdf:
+        for index in page_indexes:
+            started = time.perf_counter()
+            text = pdf.pages[index].extract_text() or ""
+            results.append((index, text, time.perf_counter() - started))
+    return results
+
+
+def _page_count(source: Source) -> int:
+    with pdfplumber.open(_pdf_file(source)) as pdf:
+        return len(pdf.pages)
+
+
+# ---- caller side ----
+
+class DocumentIngestor:
+    """Page-parallel PDF text extraction with a per-page cache keyed on the file's content hash."""
+
+    def __init__(self, processes: int = PDF_EXTRACT_PROCESSES, pages_per_task: int = PDF_PAGES_PER_TASK,
+                 max_pages: int = PDF_MAX_PAGES, max_bytes: int = PDF_MAX_BYTES, cache: bool = PDF_PAGE_CACHE,
+                 cache_max_entries: int = PDF_PAGE_CACHE_MAX_ENTRIES, cache_max_bytes: int = PDF_PAGE_CACHE_MAX_BYTES):
+        self.processes = max(0, processes)
+        self.pages_per_task = max(1, pages_per_task)
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.cache_enabled = cache
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # (digest, page index) -> page text, (digest, None) -> page count; LRU first
+        self._cache: "OrderedDict[Tuple[str, Optional[int]], object]" = OrderedDict()
+        self._cache_bytes = 0
+
+    # ---- cache ----
+
+    def _cache_get(self, key):
+        if not self.cache_enabled:
+            return None
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        if not self.cache_enabled:
+            return
+        size = len(value.encode("utf-8")) if isinstance(value, str) else 0
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if isinstance(old, str):
+                self._cache_bytes -= len(old.encode("utf-8"))
+            self._cache[key] = value
+            self._cache_bytes += size
+            while self._cache and (len(self._cache) > self.cache_max_entries or self._cache_bytes > self.cache_max_bytes):
+                _, evicted = self._cache.popitem(last=False)
+                if isinstance(evicted, str):
+                    self._cache_bytes -= len(evicted.encode("utf-8"))
+            entries, total = len(self._cache), self._cache_bytes
+        metrics.set_gauge("pdf.page_cache.entries", entries)
+        metrics.set_gauge("pdf.page_cache.bytes", total)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+        metrics.set_gauge("pdf.page_cache.entries", 0)
+        metrics.set_gauge("pdf.page_cache.bytes", 0)
+
+    # ---- extraction ----
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes == 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _open(self, source: Source, digest: Optional[str] = None) -> Tuple[str, int]:
+        """(content hash, page count); raises PDFError when the file is over budget or unreadable."""
+        if not PDF_AVAILABLE:
+            raise PDFError("pdfplumber is not installed")
+        in_memory = isinstance(source, (bytes, bytearray))
+        size = len(source) if in_memory else os.path.getsize(source)
+        if size > self.max_bytes:
+            metrics.inc("pdf.rejected")
+            raise PDFError(f"file is {size / 1e6:.1f} MB, the limit is {self.max_bytes / 1e6:.1f} MB")
+        if digest is None:
+            if in_memory:
+                digest = hashlib.sha256(source).hexdigest()
+            else:
+                with open(source, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256").hexdigest()
+        count = self._cache_get((digest, None))
+        if count is None:
+            try:
+                count = _page_count(source)
+            except Exception as e:
+                metrics.inc("pdf.rejected")
+                raise PDFError(str(e)) from e
+            self._cache_put((digest, None), count)
+        return digest, count
+
+    def page_count(self, source: Source, digest: Optional[str] = None) -> int:
+        """Pages in the document (cached); raises PDFError when the file is over budget or unreadable."""
+        return self._open(source, digest)[1]
+
+    def _pages(self, source: Source, digest: str, count: int) -> Iterator[PageText]:
+        """Pages within the budget, in page order, each yielded as soon as it (and every page before it) is extracted."""
+        wanted = min(count, self.max_pages) if self.max_pages > 0 else count
+        if count > wanted:
+            metrics.inc("pdf.pages_skipped", count - wanted)
+
+        cached: Dict[int, str] = {}
+        for index in range(wanted):
+            text = self._cache_get((digest, index))
+            if text is not None:
+                cached[index] = text
+        missing = [i for i in range(wanted) if i not in cached]
+        metrics.inc("pdf.page_cache.hits", len(cached))
+        metrics.inc("pdf.page_cache.misses", len(missing))
+
+        # Tasks of consecutive missing pages, submitted at once; results are read back in page order
+        tasks = [missing[i:i + self.pages_per_task] for i in range(0, len(missing), self.pages_per_task)]
+        pool = self._get_pool() if len(tasks) > 1 else None
+        futures = [pool.submit(_extract_pages, source, task) for task in tasks] if pool else []
+        try:
+            done: Dict[int, Tuple[str, float]] = {}
+            next_task = 0
+            for index in range(wanted):
+                if index in cached:
+                    yield PageText(index + 1, cached[index], 0.0, True)
+                    continue
+                while index not in done:
+                    task = tasks[next_task]
+                    results = futures[next_task].result() if futures else _extract_pages(source, task)
+                    next_task += 1
+                    for page_index, text, seconds in results:
+                        metrics.observe("pdf.page_seconds", seconds, SECONDS_BUCKETS)
+                        self._cache_put((digest, page_index), text)
+                        done[page_index] = (text, seconds)
+                text, seconds = done.pop(index)
+                yield PageText(index + 1, text, seconds, False)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def extract_text(self, source: Source, digest: Optional[str] = None,
+                     on_text: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Text of the pages within the budget, each under a "--- Page n ---" header.
+        digest: the source's SHA-256 hex, when the caller already has it. on_text, if
+        given, is called with each page's part of the text (header included) as soon as
+        the page is extracted, in page order; the parts add up to the returned text up
+        to surrounding whitespace and the skipped-pages note.
+        """
+        started = time.perf_counter()
+        try:
+            digest, count = self._open(source, digest)
+            text = ""
+            for page in self._pages(source, digest, count):
+                part = ("\n" if text else "") + f"--- Page {page.number} ---\n" + page.text
+                text += part
+                if on_text is not None:
+                    on_text(part)
+            if self.max_pages > 0 and count > self.max_pages:
+                text += f"\n[Only the first {self.max_pages} of {count} pages were read]"
+            return text.strip() if text.strip() else "[PDF has no readable text]"
+        finally:
+            metrics.observe("pdf.document_seconds", time.perf_counter() - started, SECONDS_BUCKETS)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        hits = metrics.get_counter("pdf.page_cache.hits")
+        misses = metrics.get_counter("pdf.page_cache.misses")
+        with self._lock:
+            entries, total = len(self._cache), self._cache_bytes
+            started = self._pool is not None
+        return {
+            "available": PDF_AVAILABLE,
+            "processes": self.processes,
+            "pool_started": started,
+            "max_pages": self.max_pages,
+            "max_bytes": self.max_bytes,
+            "cache_entries": entries,
+            "cache_bytes": total,
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cache_hit_rate": hits / (hits + misses) if hits + misses else None,
+        }
+
+
+# Shared instance for the backend process
+document_ingestor = DocumentIngestor()
@@ -0,0 +1,355 @@
+# document_summarizer.py - Map-reduce summaries of long medical documents
+"""
+The file-summary branch of llm_process_conversation used to cut the extracted
+text at 10,000 characters and send it as one prompt: anything past the cut
+was silently ignored, and every follow-up question sent the whole document
+again. DocumentSummarizer instead:
+
+ - splits the text into chunks of at most SUMMARY_CHUNK_TOKENS (estimated at
+   CHARS_PER_TOKEN characters per token; no tokenizer of the provider's model
+   is available here), on line boundaries where possible
+ - map: summarizes the chunks concurrently, SUMMARY_CONCURRENCY calls in
+   flight at most across the process (so one long report cannot flood the
+   provider)
+ - reduce: answers the user's request from the partial summaries, in
+   document order; partials that do not fit one SUMMARY_CHUNK_TOKENS prompt
+   are summarized again in groups first (as many levels as needed)
+ - caches every chunk summary under the SHA-256 of (provider, map prompt,
+   chunk text): summarizing the same report again, or a follow-up question
+   that needs the document (document_context()), reuses them instead of
+   sending the document to the provider again
+
+A document that fits in one chunk is answered with a single call, as before.
+Past SUMMARY_MAX_CHUNKS chunks the rest of the document is left out and the
+answer says so. The final call gets on_token, so the answer streams; the map
+calls do not stream.
+
+The map step can start before the whole document is there: a ChunkPrefetcher
+(prefetcher()) is fed the text as it arrives and starts each chunk's summary
+as soon as the chunk is complete. summarize() then waits for those calls (a
+call in flight for a chunk is never made twice) instead of starting them.
+
+The provider call is passed in (a coroutine call_llm(system_prompt, prompt,
+on_token) -> text or None), so this module does not depend on the
+conversation code. A provider that cannot summarize passes no call:
+document_context() then returns the whole document, as before.
+
+Metrics (service_metrics):
+ - summarizer.chunks                   counter, chunks of summarized documents
+ - summarizer.cache.hits / misses      counters, per chunk
+ - summarizer.prefetched               counter, chunk summaries started before the text was complete
+ - summarizer.map_failures             counter, chunk calls that returned nothing
+ - summarizer.map_seconds              histogram, map phase per document (cache hits included)
+ - summarizer.reduce_levels            histogram, extra reduce rounds per document
+ - summarizer.cache.entries            gauge
+
+Config (env):
+ - SUMMARY_CHUNK_TOKENS        tokens per chunk / per reduce prompt (default 2000)
+ - SUMMARY_MAX_CHUNKS          chunks summarized per document (default 32)
+ - SUMMARY_CACHE_MAX_ENTRIES   cached chunk summaries (default 1024)
+ - SUMMARY_CONCURRENCY         provider calls in flight across all summaries (default 4)
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from service_metrics import metrics
+
+# --- CONFIG ---
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2000"))
+SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", "32"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+# Rough size of a token of English / clinical text for the providers' tokenizers
+CHARS_PER_TOKEN = 4
+
+MAP_SYSTEM_PROMPT = (
+    "You are a medical document summarizer. You are given one part of a longer medical "
+    "document. Summarize this part only: key findings, important numbers/measurements with "
+    "their units and reference ranges, diagnoses, medications, recommendations and next steps. "
+    "Keep every abnormal value. Do not add information that is not in the text."
+)
+REDUCE_GROUP_SYSTEM_PROMPT = (
+    "You are a medical document summarizer. You are given summaries of consecutive parts of a "
+    "medical document. Merge them into one summary that keeps every key finding, abnormal value, "
+    "diagnosis, medication and recommendation."
+)
+
+# await call_llm(system_prompt, prompt, on_token) -> response text, or None on failure
+LLMCall = Callable[[str, str, Optional[Callable[[str], None]]], Awaitable[Optional[str]]]
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class _ChunkPacker:
+    """
+    The chunking of chunk_text() for text that arrives in pieces: feed() returns the
+    chunks that the new text completes, finish() the last one. The chunks are the same
+    whether the text comes in one piece or many.
+    """
+
+    def __init__(self, max_tokens: int = SUMMARY_CHUNK_TOKENS):
+        self.limit = max(1, max_tokens) * CHARS_PER_TOKEN
+        self._tail = ""  # last line seen; the next piece of text may continue it
+        self._current: List[str] = []
+        self._size = 0
+
+    def _pack(self, lines: List[str]) -> List[str]:
+        chunks: List[str] = []
+        for line in lines:
+            pieces = []
+            while len(line) > self.limit:
+                cut = line.rfind(" ", 0, self.limit)
+                cut = cut + 1 if cut > 0 else self.limit
+                pieces.append(line[:cut])
+                line = line[cut:]
+            pieces.append(line)
+            for piece in pieces:
+                if self._current and self._size + len(piece) > self.limit:
+                    chunks.append("".join(self._current))
+                    self._current, self._size = [], 0
+                self._current.append(piece)
+                self._size += len(piece)
+        return [c for c in (c.strip() for c in chunks) if c]
+
+    def feed(self, text: str) -> List[str]:
+        lines = (self._tail + text).splitlines(keepends=True)
+        self._tail = lines.pop() if lines else ""
+        return self._pack(lines)
+
+    def finish(self) -> List[str]:
+        chunks = self._pack([self._tail] if self._tail else [])
+        self._tail = ""
+        last = "".join(self._current).strip()
+        self._current, self._size = [], 0
+        return chunks + [last] if last else chunks
+
+
+def chunk_text(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+    """
+    Consecutive pieces of text of at most max_tokens (estimated) each, split between
+    lines; a line longer than that is split at the last space that fits.
+    """
+    packer = _ChunkPacker(max_tokens)
+    return packer.feed(text) + packer.finish()
+
+
+class ChunkPrefetcher:
+    """
+    Starts the map summaries of a document while its text is still arriving (e.g. PDF
+    pages as they are extracted). feed() takes the text in order; a chunk is started
+    as soon as the text after it shows where it ends, so it is the chunk chunk_text()
+    cuts from the whole document, and summarize() / document_context() find its summary
+    in flight or cached. Use on the event loop the summary will run on.
+    """
+
+    def __init__(self, summarizer: "DocumentSummarizer", call_llm: LLMCall, provider: str):
+        self._summarizer = summarizer
+        self._call_llm = call_llm
+        self._provider = provider
+        self._packer = _ChunkPacker(summarizer.chunk_tokens)
+        self.started = 0
+
+    def feed(self, text: str):
+        for chunk in self._packer.feed(text):
+            if self.started >= self._summarizer.max_chunks:
+                return
+            self._summarizer._start(self._call_llm, self._provider, MAP_SYSTEM_PROMPT, chunk)
+            self.started += 1
+            metrics.inc("summarizer.prefetched")
+
+
+class DocumentSummarizer:
+    """Chunked, cached map-reduce summaries through a provider call (see call_llm above)."""
+
+    def __init__(self, chunk_tokens: int = SUMMARY_CHUNK_TOKENS, max_chunks: int = SUMMARY_MAX_CHUNKS,
+                 cache_max_entries: int = SUMMARY_CACHE_MAX_ENTRIES, concurrency: int = SUMMARY_CONCURRENCY):
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max_chunks
+        self.cache_max_entries = cache_max_entries
+        self.concurrency = max(1, concurrency)
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()  # LRU first
+        self._calls: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self._in_flight: Dict[str, asyncio.Task] = {}  # summary calls by cache key
+
+    # ---- cache ----
+
+    def _key(self, provider: str, system_prompt: str, text: str) -> str:
+        return hashlib.sha256("\x00".join((provider, system_prompt, text)).encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._cache.get(key)
+            if summary is not None:
+                self._cache.move_to_end(key)
+        return summary
+
+    def _cache_put(self, key: str, summary: str):
+        with self._lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+            size = len(self._cache)
+        metrics.set_gauge("summarizer.cache.entries", size)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        metrics.set_gauge("summarizer.cache.entries", 0)
+
+    # ---- map ----
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Bound to the event loop that created it, like the provider client's pool
+        loop = asyncio.get_running_loop()
+        if self._calls is None or self._loop is not loop:
+            self._calls = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+            self._in_flight = {}
+        return self._calls
+
+    async def _summarize_one(self, call_llm: LLMCall, key: str, system_prompt: str, text: str) -> Optional[str]:
+        try:
+            async with self._slots():
+                summary = await call_llm(system_prompt, text, None)
+        except Exception as e:
+            print(f"[SUMMARIZER] Summary call failed: {e}")
+            summary = None
+        summary = summary.strip() if summary and summary.strip() else None
+        if summary is None:
+            metrics.inc("summarizer.map_failures")
+        else:
+            self._cache_put(key, summary)
+        return summary
+
+    def _start(self, call_llm: LLMCall, provider: str, system_prompt: str, text: str) -> asyncio.Task:
+        """The summary call for text: the one already in flight, or a new one."""
+        self._slots()
+        key = self._key(provider, system_prompt, text)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._summarize_one(call_llm, key, system_prompt, text))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    def prefetcher(self, call_llm: LLMCall, provider: str) -> ChunkPrefetcher:
+        """A ChunkPrefetcher for a document whose text is still arriving."""
+        return ChunkPrefetcher(self, call_llm, provider)
+
+    async def _summarize_all(self, call_llm: LLMCall, provider: str, system_prompt: str,
+                             texts: Sequence[str]) -> List[Optional[str]]:
+        """Summary of each text (None where the call failed), cached ones first, the rest concurrently."""
+        keys = [self._key(provider, system_prompt, text) for text in texts]
+        summaries = [self._cache_get(key) for key in keys]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        metrics.inc("summarizer.cache.hits", len(texts) - len(missing))
+        metrics.inc("summarizer.cache.misses", len(missing))
+        # Shielded: a call another request also waits for is not cancelled with this one
+        results = await asyncio.gather(*(asyncio.shield(self._start(call_llm, provider, system_prompt, texts[i]))
+                                         for i in missing))
+        for i, summary in zip(missing, results):
+            summaries[i] = summary
+        return summaries
+
+    async def chunk_summaries(self, call_llm: LLMCall, provider: str, text: str) -> List[Optional[str]]:
+        """Summary of each chunk of text (None for a failed one), up to max_chunks chunks."""
+        chunks = chunk_text(text, self.chunk_tokens)[:self.max_chunks]
+        metrics.inc("summarizer.chunks", len(chunks))
+        with metrics.timer("summarizer.map_seconds"):
+            return await self._summarize_all(call_llm, provider, MAP_SYSTEM_PROMPT, chunks)
+
+    # ---- reduce ----
+
+    async def _fit(self, call_llm: LLMCall, provider: str, partials: List[str]) -> List[str]:
+        """Partials, merged group by group until they fit one prompt together."""
+        levels = 0
+        while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > self.chunk_tokens:
+            groups, current = [], []
+            for partial in partials:
+                if current and estimate_tokens("\n\n".join(current + [partial])) > self.chunk_tokens:
+                    groups.append(current)
+                    current = []
+                current.append(partial)
+            groups.append(current)
+            if len(groups) == len(partials):
+                break  # every partial is a group of its own; merging would not shrink anything
+            merged = await self._summarize_all(call_llm, provider, REDUCE_GROUP_SYSTEM_PROMPT,
+                                               ["\n\n".join(group) for group in groups])
+            partials = [m if m is not None else "\n\n".join(g) for m, g in zip(merged, groups)]
+            levels += 1
+        metrics.observe("summarizer.reduce_levels", levels, (0, 1, 2, 3, 5))
+        return partials
+
+    async def summarize(self, call_llm: LLMCall, provider: str, text: str, user_request: str, system_prompt: str,
+                        on_token: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        Answer user_request about the document text with system_prompt: one call when it
+        fits a chunk, otherwise map-reduce. None when the provider gave nothing back.
+        """
+        chunks = chunk_text(text, self.chunk_tokens)
+        if len(chunks) <= 1:
+            return await call_llm(system_prompt, f"User request: {user_request}\n\n{text}", on_token)
+
+        started = time.perf_counter()
+        summaries = await self.chunk_summaries(call_llm, provider, text)
+        partials = [f"Part {i + 1}:\n{s}" for i, s in enumerate(summaries) if s is not None]
+        if not partials:
+            return None
+        notes = []
+        failed = sum(s is None for s in summaries)
+        if failed:
+            notes.append(f"{failed} of the {len(summaries)} parts could not be summarized.")
+        if len(chunks) > self.max_chunks:
+            notes.append(f"Only the first {self.max_chunks} of {len(chunks)} parts of the document were read.")
+        partials = await self._fit(call_llm, provider, partials)
+        print(f"[SUMMARIZER] {len(chunks)} chunks -> {len(partials)} partial summaries in "
+              f"{time.perf_counter() - started:.2f}s")
+
+        prompt = (f"User request: {user_request}\n\n"
+                  f"The document was too long to read at once; below are summaries of its parts, in order.\n"
+                  + ("Note: " + " ".join(notes) + "\n" if notes else "")
+                  + "\n\n" + "\n\n".join(partials))
+        return await call_llm(system_prompt, prompt, on_token)
+
+    async def document_context(self, call_llm: Optional[LLMCall], provider: str, text: str) -> str:
+        """
+        The document for a follow-up prompt: the text itself when it fits one chunk or there
+        is no provider to summarize with (call_llm None), otherwise its chunk summaries (from
+        the cache after the first summary).
+        """
+        if call_llm is None or estimate_tokens(text) <= self.chunk_tokens:
+            return text
+        summaries = await self.chunk_summaries(call_llm, provider, text)
+        parts = [f"Part {i + 1} (summary):\n{s}" for i, s in enumerate(summaries) if s is not None]
+        return "\n\n".join(parts) if parts else text[:self.chunk_tokens * CHARS_PER_TOKEN]
+
+    def stats(self) -> dict:
+        hits = metrics.get_counter("summarizer.cache.hits")
+        misses = metrics.get_counter("summarizer.cache.misses")
+        with self._lock:
+            entries = len(self._cache)
+        return {
+            "chunk_tokens": self.chunk_tokens,
+            "max_chunks": self.max_chunks,
+            "cache_entries": entries,
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cache_hit_rate": hits / (hits + misses) if hits + misses else None,
+            "map_failures": metrics.get_counter("summarizer.map_failures"),
+        }
+
+
+# Shared instance (chunk summaries are shared by all conversations in the process)
+document_summarizer = DocumentSummarizer()
@@ -0,0 +1,110 @@
+# export_disease_model.py
+"""
+Export the trained disease classifier for the CPU inference backends.
+
+Writes model.torchscript.pt and/or model.onnx into the model directory, next
+to the PyTorch weights and label_classes.npy, then runs each artifact through
+the backend that will serve it (model_runtime.py) and compares its logits with
+the PyTorch model's on a fixed set of clinical sentences, batched several ways
+so padding is covered. The result goes into the artifact's .json sidecar; the
+serving code refuses an artifact whose check failed or whose source weights
+have changed since. Exits with status 1 if any check fails.
+
+train_disease_classifier.py calls export() after training. Select the backend
+at serving time with DISEASE_INFERENCE_BACKEND=onnx (or torchscript).
+
+Usage:
+  python export_disease_model.py
+  python export_disease_model.py --model-dir medimate-disease-model --formats onnx --texts-file medimate_option1_val_1000.jsonl
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Sequence
+
+from model_registry import BASE_MODEL, MAX_LENGTH, MODEL_DIR
+from model_runtime import (
+    ONNX_OPSET, ONNXRUNTIME_AVAILABLE, PARITY_TEXTS, PARITY_TOLERANCE, OnnxRunner, TorchRunner, TorchScriptRunner,
+    artifact_path, check_parity, export_onnx, export_torchscript, weights_fingerprint, write_sidecar,
+)
+
+FORMATS = ("torchscript", "onnx")
+
+
+def export(model_dir: str = MODEL_DIR, formats: Sequence[str] = FORMATS, tokenizer=None, model=None,
+           base_model: str = BASE_MODEL, extra_texts: Sequence[str] = (), tolerance: float = PARITY_TOLERANCE) -> Dict:
+    """
+    Export model (loaded from model_dir if not given) in each format and check it.
+    Returns {format: parity result}; formats that could not be exported are left out.
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    if tokenizer is None:
+        tokenizer = AutoTokenizer.from_pretrained(base_model)
+    if model is None:
+        model = AutoModelForSequenceClassification.from_pretrained(model_dir, local_files_only=True)
+    model = model.cpu().eval()
+    reference = TorchRunner(model, "cpu")
+    weights = weights_fingerprint(model_dir)
+    texts = list(PARITY_TEXTS) + list(extra_texts)
+
+    results = {}
+    for fmt in formats:
+        if fmt == "onnx" and not ONNXRUNTIME_AVAILABLE:
+            print("[EXPORT] Skipping onnx: onnxruntime is not installed (pip install onnxruntime onnx)")
+            continue
+        path = artifact_path(model_dir, fmt)
+        start = time.perf_counter()
+        if fmt == "onnx":
+            input_names = export_onnx(model, tokenizer, path, MAX_LENGTH)
+            candidate = OnnxRunner(path)
+        else:
+            input_names = export_torchscript(model, tokenizer, path, MAX_LENGTH)
+            candidate = TorchScriptRunner(path, "cpu", input_names)
+        parity = check_parity(reference, candidate, tokenizer, texts, max_length=MAX_LENGTH, tolerance=tolerance)
+        write_sidecar(path, {
+            "format": fmt,
+            "weights": weights,
+            "input_names": input_names,
+            "max_length": MAX_LENGTH,
+            "onnx_opset": ONNX_OPSET if fmt == "onnx" else None,
+            "parity": parity,
+        })
+        status = "PASSED" if parity["passed"] else "FAILED"
+        print(f"[EXPORT] {path} in {time.perf_counter() - start:.1f}s - parity {status}: "
+              f"max |logit diff| {parity['max_abs_diff']:.2e} (tolerance {tolerance:g}), "
+              f"argmax agreement {parity['argmax_agreement']:.1%} over {parity['texts']} texts")
+        results[fmt] = parity
+    return results
+
+
+def load_texts(path: str, limit: int):
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and len(texts) < limit:
+                texts.append(json.loads(line).get("text", ""))
+    return [t for t in texts if t]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--base-model", default=BASE_MODEL, help="tokenizer to export with (the one the backend serves)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--texts-file", help="JSONL with a \"text\" field, added to the parity check")
+    parser.add_argument("--max-texts", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=PARITY_TOLERANCE)
+    args = parser.parse_args()
+
+    extra = load_texts(args.texts_file, args.max_texts) if args.texts_file else []
+    results = export(args.model_dir, args.formats, base_model=args.base_model, extra_texts=extra,
+                     tolerance=args.tolerance)
+    if not results or not all(parity["passed"] for parity in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# hard_rules.py - Declarative hard rules for ML predictions
+"""
+The "impossible diagnosis" rules of validate_and_correct_prediction
+(appendicitis without abdominal pain, dengue without severe body aches, the
+meningitis emergency pattern, ...) as data. They live in hard_rules.json and
+are compiled once into predicates over a symptom bitmask:
+
+ - every symptom term and fragment the rules mention gets one bit
+ - a case's symptoms are turned into one mask (each distinct symptom string is
+   looked up once and memoized), so "has any of these symptoms" is a single AND
+ - rules are indexed by the predicted disease they apply to, and the first rule
+   whose condition holds decides the outcome
+
+Rule file format:
+
+    {
+      "symptom_sets": {"fever": ["fever", "high fever"], ...},   referenced as "@fever"
+      "rules": [{
+        "name": "viral_fever_requires_fever",
+        "diseases": ["viral fever"],         predicted disease, case-insensitive; omit for every disease
+        "when": {"no_symptom": "@fever"},   condition, see below; {} always holds
+        "disease": "Allergic Rhinitis",       value, see below; default: the predicted disease
+        "severity": "{predicted_severity}",   value; this is the default
+        "corrected": true,                    was_corrected of the result; this is the default
+        "log": "...", "reason": "..."         templates
+      }, ...]
+    }
+
+Conditions (all keys of one object must hold):
+    any_symptom / no_symptom     some / no symptom is one of these terms (whole symptom, case-insensitive)
+    first_symptom                the first symptom is one of these terms
+    symptom_contains             some symptom contains one of these fragments
+    min_symptoms / max_symptoms  number of symptoms listed
+    severity / predicted_severity    user-stated / predicted severity is one of these (case-insensitive)
+    duration_contains            duration text contains one of these fragments
+    all / any / not              combinations of conditions
+
+Values are a template string, {"validator_suggestion": default} (the validator
+report's suggested_disease), or a list of {"when": condition, "value": value}
+tried in order. Templates can use {predicted_disease}, {predicted_severity},
+{symptoms}, {user_severity}, {duration} and, in log and reason, the result's
+{disease} and {severity}.
+
+replay_hard_rules.py evaluates a rule file over a JSONL file of cases.
+
+Config (env):
+ - HARD_RULES_PATH   rule file (default: hard_rules.json next to this module)
+"""
+
+import json
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+# --- CONFIG ---
+HARD_RULES_PATH = os.getenv("HARD_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hard_rules.json"))
+
+MAX_CACHED_SYMPTOMS = 50000  # distinct symptom strings whose masks are memoized
+
+SYMPTOM_CONDITIONS = ("any_symptom", "no_symptom", "first_symptom")
+
+
+class HardRuleDecision(NamedTuple):
+    rule: str
+    disease: str
+    severity: str
+    was_corrected: bool
+    reason: str
+    log: str
+
+
+class _Case:
+    """One prediction reduced to what the compiled conditions look at."""
+
+    __slots__ = ("mask", "first_mask", "count", "severity", "predicted_severity", "duration", "report", "fields")
+
+    def __init__(self, mask, first_mask, count, severity, predicted_severity, duration, report, fields):
+        self.mask = mask
+        self.first_mask = first_mask
+        self.count = count
+        self.severity = severity
+        self.predicted_severity = predicted_severity
+        self.duration = duration
+        self.report = report
+        self.fields = fields
+
+
+class _Rule(NamedTuple):
+    name: str
+    condition: Callable
+    disease: Callable
+    severity: Callable
+    corrected: bool
+    log: str
+    reason: str
+
+
+class HardRulesEngine:
+    """Rules from a hard_rules.json spec, compiled to bitmask predicates."""
+
+    def __init__(self, spec: Dict):
+        self._sets = {name: [term.lower() for term in terms] for name, terms in spec.get("symptom_sets", {}).items()}
+        self._exact_bits: Dict[str, int] = {}  # whole symptom -> bit
+        self._fragment_bits: Dict[str, int] = {}  # substring -> bit
+        self._symptom_masks: Dict[str, int] = {}
+        # What the rules look at beyond the symptom set (prediction_cache.py keys on these)
+        self.first_symptom_terms = set()
+        self.duration_fragments = set()
+
+        rules = []  # (compiled rule, lower-cased diseases it applies to; empty for every disease)
+        for raw in spec.get("rules", []):
+            rules.append((self._compile_rule(raw), frozenset(d.lower() for d in raw.get("diseases", []))))
+        self.rule_names = [rule.name for rule, _ in rules]
+        # Predicted disease -> rules that apply to it, in file order
+        self._global_rules = tuple(rule for rule, diseases in rules if not diseases)
+        self._rules_by_disease = {
+            disease: tuple(rule for rule, diseases in rules if not diseases or disease in diseases)
+            for disease in set().union(*(diseases for _, diseases in rules))
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "HardRulesEngine":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    # ---- compilation ----
+
+    def _terms(self, value, rule_name: str) -> List[str]:
+        if isinstance(value, str):
+            if not value.startswith("@") or value[1:] not in self._sets:
+                raise ValueError(f"Hard rule '{rule_name}': unknown symptom set {value!r}")
+            return self._sets[value[1:]]
+        return [term.lower() for term in value]
+
+    def _bits(self, terms: Sequence[str], table: Dict[str, int]) -> int:
+        mask = 0
+        for term in terms:
+            if term not in table:
+                table[term] = 1 << (len(self._exact_bits) + len(self._fragment_bits))
+            mask |= table[term]
+        return mask
+
+    def _compile_condition(self, condition: Dict, rule_name: str) -> Callable:
+        checks = []
+        for key, value in condition.items():
+            if key in SYMPTOM_CONDITIONS:
+                terms = self._terms(value, rule_name)
+                bits = self._bits(terms, self._exact_bits)
+                if key == "first_symptom":
+                    self.first_symptom_terms.update(terms)
+                if key == "any_symptom":
+                    checks.append(lambda case, bits=bits: case.mask & bits != 0)
+                elif key == "no_symptom":
+                    checks.append(lambda case, bits=bits: case.mask & bits == 0)
+                else:
+                    checks.append(lambda case, bits=bits: case.first_mask & bits != 0)
+            elif key == "symptom_contains":
+                bits = self._bits(self._terms(value, rule_name), self._fragment_bits)
+                checks.append(lambda case, bits=bits: case.mask & bits != 0)
+            elif key == "min_symptoms":
+                checks.append(lambda case, n=int(value): case.count >= n)
+            elif key == "max_symptoms":
+                checks.append(lambda case, n=int(value): case.count <= n)
+            elif key in ("severity", "predicted_severity"):
+                allowed = frozenset(v.lower() for v in value)
+                checks.append(lambda case, attr=key, allowed=allowed: getattr(case, attr) in allowed)
+            elif key == "duration_contains":
+                fragments = tuple(v.lower() for v in value)
+                self.duration_fragments.update(fragments)
+                checks.append(lambda case, fragments=fragments: any(f in case.duration for f in fragments))
+            elif key in ("all", "any"):
+                parts = [self._compile_condition(part, rule_name) for part in value]
+                combine = all if key == "all" else any
+                checks.append(lambda case, parts=parts, combine=combine: combine(part(case) for part in parts))
+            elif key == "not":
+                inner = self._compile_condition(value, rule_name)
+                checks.append(lambda case, inner=inner: not inner(case))
+            else:
+                raise ValueError(f"Hard rule '{rule_name}': unknown condition {key!r}")
+        if not checks:
+            return lambda case: True
+        if len(checks) == 1:
+            return checks[0]
+        return lambda case: all(check(case) for check in checks)
+
+    def _compile_value(self, value, rule_name: str) -> Callable:
+        if isinstance(value, str):
+            return lambda case: value.format(**case.fields)
+        if isinstance(value, dict) and "validator_suggestion" in value:
+            default = value["validator_suggestion"]
+            return lambda case: case.report.get("suggested_disease", default)
+        if isinstance(value, list):
+            choices = [(self._compile_condition(choice.get("when", {}), rule_name),
+                        self._compile_value(choice["value"], rule_name)) for choice in value]
+
+            def choose(case):
+                for condition, result in choices:
+                    if condition(case):
+                        return result(case)
+                return None
+            return choose
+        raise ValueError(f"Hard rule '{rule_name}': unsupported value {value!r}")
+
+    def _compile_rule(self, rule: Dict) -> _Rule:
+        name = rule["name"]
+        return _Rule(
+            name=name,
+            condition=self._compile_condition(rule.get("when", {}), name),
+            disease=self._compile_value(rule.get("disease", "{predicted_disease}"), name),
+            severity=self._compile_value(rule.get("severity", "{predicted_severity}"), name),
+            corrected=bool(rule.get("corrected", True)),
+            log=rule.get("log", ""),
+            reason=rule.get("reason", ""),
+        )
+
+    # ---- evaluation ----
+
+    def _symptom_mask(self, symptom: str) -> int:
+        mask = self._symptom_masks.get(symptom)
+        if mask is None:
+            lowered = symptom.lower()
+            mask = self._exact_bits.get(lowered, 0)
+            for fragment, bit in self._fragment_bits.items():
+                if fragment in lowered:
+                    mask |= bit
+            if len(self._symptom_masks) >= MAX_CACHED_SYMPTOMS:
+                self._symptom_masks.clear()
+            self._symptom_masks[symptom] = mask
+        return mask
+
+    def _case(self, predicted_disease, predicted_severity, symptoms, duration, severity, validation_report) -> _Case:
+        masks = [self._symptom_mask(s) for s in symptoms]
+        mask = 0
+        for m in masks:
+            mask |= m
+        fields = {
+            "predicted_disease": predicted_disease,
+            "predicted_severity": predicted_severity,
+            "symptoms": symptoms,
+            "user_severity": severity,
+            "duration": duration,
+        }
+        return _Case(mask, masks[0] if masks else 0, len(symptoms), str(severity).lower(),
+                     str(predicted_severity).lower(), str(duration).lower(), validation_report or {}, fields)
+
+    def evaluate(self, predicted_disease: str, predicted_severity: str, symptoms: Sequence[str], duration: str,
+                 severity: str, validation_report: Optional[Dict] = None) -> Optional[HardRuleDecision]:
+        """The decision of the first rule that applies to this prediction, or None if no rule fires."""
+        rules = self._rules_by_disease.get(str(predicted_disease).lower(), self._global_rules)
+        if not rules:
+            return None
+        case = self._case(predicted_disease, predicted_severity, symptoms, duration, severity, validation_report)
+        for rule in rules:
+            if rule.condition(case):
+                disease = rule.disease(case)
+                result_severity = rule.severity(case)
+                fields = dict(case.fields, disease=disease, severity=result_severity)
+                return HardRuleDecision(rule.name, disease, result_severity, rule.corrected,
+                                        rule.reason.format(**fields), rule.log.format(**fields))
+        return None
+
+    def evaluate_batch(self, cases: Iterable[Dict]) -> List[Optional[HardRuleDecision]]:
+        """
+        evaluate() over dicts with predicted_disease, predicted_severity, symptoms,
+        duration, severity and optionally validation_report.
+        """
+        return [
+            self.evaluate(case["predicted_disease"], case.get("predicted_severity", "mild"), case.get("symptoms", []),
+                          case.get("duration", "unknown"), case.get("severity", "mild"), case.get("validation_report"))
+            for case in cases
+        ]
+
+
+# Rules used by validate_and_correct_prediction in this process
+hard_rules = HardRulesEngine.from_file(HARD_RULES_PATH)
@@ -0,0 +1,178 @@
+# inference_batcher.py - Dynamic micro-batching for the disease classifier
+"""
+Coalesces concurrent single-text predictions into one padded forward pass.
+
+Each caller submits one text and blocks (or awaits) on a future. A worker thread
+collects pending texts until either BATCH_MAX_SIZE texts are queued or
+BATCH_WINDOW_MS milliseconds have passed since the first one arrived, runs a
+single forward pass (the tokenizer pads to the longest text in the batch) and
+fans the per-text results back out to the callers.
+
+Metrics (service_metrics):
+ - batcher.<name>.batch_size             histogram of texts per forward pass
+ - batcher.<name>.batch_latency_seconds  histogram of forward pass time
+ - batcher.<name>.queue_wait_seconds     histogram of time a text waited for its batch
+ - batcher.<name>.requests / batches / errors  counters
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from service_executors import inference_executor
+from service_metrics import metrics
+
+# --- CONFIG ---
+BATCHING_ENABLED = os.getenv("DISEASE_BATCHING", "1") == "1"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class MicroBatcher:
+    """
+    Request-coalescing queue in front of a batch predict function.
+
+    predict_fn receives a list of texts and must return one result per text,
+    in the same order.
+    """
+
+    def __init__(self, predict_fn: Callable[[List[str]], List[Dict]], max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_WINDOW_MS, name: str = "disease"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    # --- public API ---
+    def submit(self, text: str) -> Future:
+        """Queue one text and return a future that resolves to its prediction."""
+        future: Future = Future()
+        # Under the start lock, so a text is never queued behind a worker that has already drained
+        with self._start_lock:
+            self._ensure_started()
+            self._queue.put((text, future, time.perf_counter()))
+        metrics.inc(f"batcher.{self.name}.requests")
+        return future
+
+    def predict(self, text: str, timeout: float = None) -> Dict:
+        """Blocking helper for sync callers (FastAPI threadpool endpoints, CLI)."""
+        return self.submit(text).result(timeout=timeout)
+
+    async def predict_async(self, text: str) -> Dict:
+        """Awaitable helper for async callers."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stop(self):
+        """Stop the worker thread after the queued texts have been served."""
+        with self._start_lock:
+            worker = self._worker
+            if worker is None:
+                return
+            self._queue.put(None)
+        worker.join(timeout=5)
+
+    # --- worker ---
+    def _ensure_started(self):
+        """Start the worker if there is none (caller holds _start_lock)."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+            self._worker.start()
+
+    def _collect_batch(self) -> Tuple[List, bool]:
+        """(batch, stop marker seen)"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stop = self._collect_batch()
+            if batch:
+                self._serve(batch)
+            if stop:
+                break
+        # Texts queued behind the stop marker are served too; once the worker is unset, new
+        # submits start a fresh one, so nothing can be left in the queue unserved
+        while True:
+            with self._start_lock:
+                leftover = []
+                while len(leftover) < self.max_batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        leftover.append(item)
+                if not leftover:
+                    self._worker = None
+                    return
+            self._serve(leftover)
+
+    def _serve(self, batch: List):
+        texts = [text for text, _, _ in batch]
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            metrics.observe(f"batcher.{self.name}.queue_wait_seconds", started - enqueued)
+        try:
+            results = self.predict_fn(texts)
+            if len(results) != len(texts):
+                raise RuntimeError(f"predict_fn returned {len(results)} results for {len(texts)} texts")
+        except Exception as e:
+            metrics.inc(f"batcher.{self.name}.errors")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.inc(f"batcher.{self.name}.batches")
+        metrics.observe(f"batcher.{self.name}.batch_size", len(texts), BATCH_SIZE_BUCKETS)
+        metrics.observe(f"batcher.{self.name}.batch_latency_seconds", time.perf_counter() - started)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def _predict_with_registry(texts: List[str]) -> List[Dict]:
+    from model_registry import disease_model_registry
+    model = disease_model_registry.get()
+    if model is None:
+        raise RuntimeError(f"ML Model not loaded: {disease_model_registry.last_error}")
+    return model.predict(texts, batch_size=len(texts))
+
+
+# Shared batcher for the disease classifier in this process
+disease_batcher = MicroBatcher(_predict_with_registry)
+
+
+def predict_disease_text(text: str) -> Dict:
+    """Predict one text through the shared batcher (or directly when batching is disabled)."""
+    if BATCHING_ENABLED:
+        return disease_batcher.predict(text)
+    return _predict_with_registry([text])[0]
+
+
+async def predict_disease_text_async(text: str) -> Dict:
+    """Async variant for the FastAPI endpoints; never blocks the event loop."""
+    if BATCHING_ENABLED:
+        return await disease_batcher.predict_async(text)
+    return (await inference_executor.run(_predict_with_registry, [text]))[0]
@@ -4,12 +4,15 @@ import torch
 import torch.nn.functional as F
 import re
 
+from ner_decode import BIODecoder, word_char_ranges, word_id_matrix
+
 MODEL_DIR = "medimate-ner-output"
 
 # Load tokenizer + model
 tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=True)
 model = AutoModelForTokenClassification.from_pretrained(MODEL_DIR)
 id2label = model.config.id2label
+decoder = BIODecoder(id2label)
 
 
 # -----------------------------
@@ -54,90 +57,53 @@ def rule_based_extraction(text):
 # TOKEN CLASSIFIER MODEL NER
 # -----------------------------
 def model_entities(text, max_length=256):
-    encoding = tokenizer(
-        text,
-        return_tensors="pt",
-        truncation=True,
-        max_length=max_length,
-        return_offsets_mapping=True,
-    )
-
-    offsets = encoding["offset_mapping"][0].tolist()
-    word_ids = encoding.word_ids(batch_index=0)
-
-    model_inputs = {}
-    for k, v in encoding.items():
-        if k in ("input_ids", "attention_mask", "token_type_ids"):
-            model_inputs[k] = v
-
-    with torch.no_grad():
-        logits = model(**model_inputs).logits[0]
-        probs = F.softmax(logits, dim=-1)
-        preds = probs.argmax(-1).tolist()
-
-    tokens = tokenizer.convert_ids_to_tokens(model_inputs["input_ids"][0])
-
-    # Merge subword tokens to whole words
-    entities = []
-    cur = None
-
-    for i, wid in enumerate(word_ids):
-        if wid is None:
-            if cur:
-                entities.append(cur); cur = None
-            continue
-
-        label = id2label[preds[i]]
-        conf = float(probs[i, preds[i]])
-
-        if label == "O":
-            if cur:
-                entities.append(cur); cur = None
-            continue
-
-        prefix, etype = label.split("-", 1)
-
-        if prefix == "B" or cur is None or cur[2] != etype:
-            if cur:
-                entities.append(cur)
-            cur = [wid, wid, etype, conf]
-        else:
-            cur[1] = wid
-            if conf > cur[3]:
-                cur[3] = conf
-
-    if cur:
-        entities.append(cur)
-
-    # WORD RECONSTRUCTION
-    input_text = text
-    grouped = {}
-    for token_idx, wid in enumerate(word_ids):
-        if wid is None: continue
-        grouped.setdefault(wid, []).append(token_idx)
-
-    max_word = max([w for w in word_ids if w is not None])
-    word_texts = []
-    for wid in range(max_word + 1):
-        if wid not in grouped:
-            word_texts.append("")
-            continue
-        idxs = grouped[wid]
-        s = offsets[idxs[0]][0]
-        e = offsets[idxs[-1]][1]
-        word_texts.append(input_text[s:e])
-
-    # Final structured entities
-    final = []
-    for start, end, typ, conf in entities:
-        ent_text = " ".join(word_texts[start:end+1]).strip()
-        final.append({
-            "entity": typ,
-            "text": ent_text,
-            "confidence": round(conf, 3)
-        })
-
-    return final
+    return model_entities_batch([text], max_length)[0]
+
+
+def model_entities_batch(texts, max_length=256, batch_size=16):
+    """Entities of each text, batch_size texts per padded forward pass (spans: ner_decode.py)."""
+    results = []
+    for i in range(0, len(texts), batch_size):
+        batch = list(texts[i:i + batch_size])
+        encoding = tokenizer(
+            batch,
+            return_tensors="pt",
+            truncation=True,
+            max_length=max_length,
+            padding=True,
+            return_offsets_mapping=True,
+        )
+
+        offsets = encoding["offset_mapping"].numpy()
+        word_ids = [encoding.word_ids(batch_index=b) for b in range(len(batch))]
+
+        model_inputs = {}
+        for k, v in encoding.items():
+            if k in ("input_ids", "attention_mask", "token_type_ids"):
+                model_inputs[k] = v
+
+        with torch.no_grad():
+            logits = model(**model_inputs).logits
+            probs = F.softmax(logits, dim=-1)
+
+        # Merge subword tokens to whole words
+        word_id_rows = word_id_matrix(word_ids)
+        spans = decoder.decode(probs, word_id_rows)
+
+        # WORD RECONSTRUCTION + final structured entities
+        starts, ends = word_char_ranges(word_id_rows, offsets)
+        for row, (input_text, entities) in enumerate(zip(batch, spans)):
+            final = []
+            for start, end, typ, conf in entities:
+                words = [input_text[s:e] if s >= 0 else "" for s, e in zip(starts[row, start:end + 1].tolist(), ends[row, start:end + 1].tolist())]
+                final.append({
+                    "entity": typ,
+                    "text": " ".join(words).strip(),
+                    "confidence": round(conf, 3)
+                })
+            results.append(final)
+
+    return results
 
 
 # -----------------------------
@@ -0,0 +1,106 @@
+# intake_state.py - Incremental intake summary kept with each conversation
+"""
+What the intake branch of llm_process_conversation needs to know about a
+conversation, updated one message at a time.
+
+llm_process_conversation used to re-join the whole history into one string and
+re-extract symptoms, duration and severity from every user message on every
+turn, so a chat of n turns cost O(n^2) in total. The intake state is a small
+JSON-serializable dict stored with the conversation (conversation_state["intake"])
+and advanced with each new message, so a turn costs O(new message):
+
+    {
+        "symptoms":    ["fever", "cough"],   # de-duplicated, first-mentioned order
+        "denials":     ["no rash"],          # denial phrases the user has used
+        "duration":    "3 days",             # latest "<n> <unit>" stated, or "unknown"
+        "severity":    "moderate",           # latest severity stated, default "mild"
+        "red_flags":   ["chest pain"],       # emergency keywords the user has mentioned
+        "flags":       {...},                # CONVERSATION_FLAGS over the joined conversation text
+        "ai_messages": 2, "user_messages": 3,
+        "tail":        "..."                 # end of the joined text, see below
+    }
+
+Results are the same as re-scanning the history with symptom_extractor:
+symptoms, duration and severity from user messages only, and the conversation
+flags from every message joined by spaces. A flag term can straddle two
+messages in the joined text, so each new message is checked together with the
+last few characters of the text before it ("tail", one character shorter than
+the longest flag term).
+
+Unlike a re-scan, the state still covers turns that the conversation store has
+trimmed from a long history.
+"""
+
+from typing import Dict, Optional, Sequence
+
+from symptom_extractor import CONVERSATION_FLAGS, RED_FLAG_TERMS, symptom_extractor
+
+# Characters of earlier text that a flag term can reach back into
+FLAG_TAIL_CHARS = max(len(term) for terms in CONVERSATION_FLAGS.values() for term in terms) - 1
+
+
+def new_intake_state() -> Dict:
+    return {
+        "symptoms": [],
+        "denials": [],
+        "duration": "unknown",
+        "severity": "mild",
+        "red_flags": [],
+        "flags": {flag: False for flag in CONVERSATION_FLAGS},
+        "ai_messages": 0,
+        "user_messages": 0,
+        "tail": "",
+    }
+
+
+def _message_text(msg: Dict) -> str:
+    return msg.get("parts", [{}])[0].get("text", "")
+
+
+def observe_message(state: Dict, role: str, text: str) -> Dict:
+    """
+    The intake state after one more message. `state` is not modified, so a turn
+    that fails part-way leaves the stored conversation untouched.
+    """
+    state = dict(state, flags=dict(state["flags"]))
+    lowered = text.lower()
+
+    # Conversation-level flags see every message, joined by spaces
+    started = state["ai_messages"] + state["user_messages"] > 0
+    window = state["tail"] + " " + lowered if started else lowered
+    flags = state["flags"]
+    for flag, terms in CONVERSATION_FLAGS.items():
+        if not flags.get(flag):
+            flags[flag] = any(term in window for term in terms)
+    state["tail"] = window[-FLAG_TAIL_CHARS:]
+
+    if role == "model":
+        state["ai_messages"] += 1
+        return state
+    if role != "user":
+        return state
+
+    state["user_messages"] += 1
+    findings = symptom_extractor.analyze_message(lowered)
+    if findings.severity:
+        state["severity"] = findings.severity
+    if findings.duration:
+        state["duration"] = findings.duration
+    state["symptoms"] = _merge(state["symptoms"], findings.symptoms)
+    state["denials"] = _merge(state["denials"], findings.denials)
+    state["red_flags"] = _merge(state["red_flags"], [term for term in RED_FLAG_TERMS if term in lowered])
+    return state
+
+
+def _merge(existing: list, new: Sequence[str]) -> list:
+    """`existing` plus the items of `new` it does not have yet, in order."""
+    added = [item for item in dict.fromkeys(new) if item not in existing]
+    return existing + added if added else existing
+
+
+def intake_state_from_history(history: Sequence[Dict], state: Optional[Dict] = None) -> Dict:
+    """Intake state for a whole history in Gemini message format (for conversations stored without one)."""
+    state = state or new_intake_state()
+    for msg in history:
+        state = observe_message(state, msg.get("role", ""), _message_text(msg))
+    return state
@@ -0,0 +1,369 @@
+# llm_cache.py - Response cache in front of the LLM provider calls
+"""
+Cached LLM responses, keyed by provider, model, normalized system prompt,
+normalized messages and the diagnosis the call is about.
+
+The same follow-up questions ("is it contagious", "what can I eat") keep coming
+for the same diagnosis, and each one was a provider round trip of several
+seconds. Three tiers, checked in order:
+
+ - memory    LRU of recent responses (LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES)
+ - disk      SQLite file shared by worker processes and restarts, entries expire
+             after LLM_CACHE_TTL_SECONDS
+ - similar   optional (LLM_CACHE_SIMILARITY > 0): a response cached for a
+             near-duplicate question with the same context (everything but the
+             last message: provider, model, system prompt, earlier messages,
+             diagnosis), by cosine similarity of question embeddings
+
+Normalization is Unicode NFKC, case folding and collapsed whitespace, so
+"Is it contagious?" and "is it  contagious?" share an entry. Only non-empty,
+complete responses are cached: a provider call returns a PartialResponse for
+an answer that was cut short (e.g. a stream that timed out mid-answer), which
+the caller gets but the cache does not keep.
+
+Provider coroutines are wrapped with llm_cache.cached(provider, model). The
+wrapper takes two extra keyword arguments:
+  diagnosis        diagnosis dict the answer depends on (disease and severity are keyed)
+  cache_messages   messages to key on instead of the ones sent, e.g. the
+                   follow-up system prompt and the question without the chat
+                   history before them
+With on_token (streaming), a cached response is passed to on_token in one piece.
+
+Embeddings: sentence-transformers when installed and LLM_CACHE_EMBEDDING_MODEL
+is set, otherwise hashed character trigrams and words (NumPy), which is enough
+for rewordings and typos, not for synonyms.
+
+Metrics (service_metrics): llm_cache.hits.memory / .hits.disk / .hits.similar
+and llm_cache.misses counters, llm_cache.saved_seconds (provider latency of the
+original call, summed over hits), llm_cache.memory_entries / .memory_bytes
+gauges. stats() adds the hit rate and the disk tier's size.
+
+Config (env):
+  LLM_CACHE                      1 / 0
+  LLM_CACHE_MAX_ENTRIES          memory tier entries
+  LLM_CACHE_MAX_BYTES            memory tier response bytes
+  LLM_CACHE_DB                   SQLite file of the disk tier ("" = no disk tier)
+  LLM_CACHE_TTL_SECONDS          disk tier lifetime
+  LLM_CACHE_DISK_MAX_ENTRIES     disk tier entries (oldest pruned)
+  LLM_CACHE_SIMILARITY           cosine threshold of the similar tier (0 = off)
+  LLM_CACHE_EMBEDDING_MODEL      sentence-transformers model for the similar tier
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from service_metrics import metrics
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 << 20)))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "./llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "100000"))
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0"))
+LLM_CACHE_EMBEDDING_MODEL = os.getenv("LLM_CACHE_EMBEDDING_MODEL", "")
+
+HASHED_EMBEDDING_DIM = 1024
+SIMILAR_MAX_ENTRIES = 20000  # question vectors kept for the similar tier
+SWEEP_INTERVAL_SECONDS = 600
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def _message_text(msg: Dict) -> str:
+    parts = msg.get("parts")
+    if isinstance(parts, list) and parts:
+        return parts[0].get("text", "") if isinstance(parts[0], dict) else str(parts[0])
+    if isinstance(parts, str):
+        return parts
+    return msg.get("content", "") or ""
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def hashed_embedding(text: str, dim: int = HASHED_EMBEDDING_DIM) -> np.ndarray:
+    """L2-normalized counts of hashed character trigrams and words."""
+    vector = np.zeros(dim, dtype=np.float32)
+    padded = f"  {text}  "
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % dim] += 1.0
+    for word in text.split():
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 2.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class PartialResponse(str):
+    """Response text that was cut short; returned to the caller as is, never cached."""
+
+
+class CacheKey:
+    """Exact key, similarity scope (everything but the last message) and the normalized question."""
+
+    __slots__ = ("key", "scope", "question")
+
+    def __init__(self, provider: str, model: str, messages: Sequence[Dict], system_prompt: Optional[str] = None,
+                 diagnosis: Optional[Dict] = None):
+        turns = [[msg.get("role", "user"), normalize_text(_message_text(msg))] for msg in messages]
+        context = [provider, model, normalize_text(system_prompt or "")]
+        if diagnosis:
+            context.append([diagnosis.get("disease"), diagnosis.get("severity")])
+        self.key = _digest(context + [turns])
+        self.scope = _digest(context + [turns[:-1]])
+        self.question = turns[-1][1] if turns else ""
+
+
+class LLMResponseCache:
+    def __init__(self, enabled: bool = LLM_CACHE, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, db_path: Optional[str] = LLM_CACHE_DB,
+                 ttl_seconds: float = LLM_CACHE_TTL_SECONDS, disk_max_entries: int = LLM_CACHE_DISK_MAX_ENTRIES,
+                 similarity: float = LLM_CACHE_SIMILARITY, embedding_model: str = LLM_CACHE_EMBEDDING_MODEL):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path or None
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self.similarity = similarity
+        self.embedding_model = embedding_model
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (response, latency), LRU first
+        self._memory_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_sweep = 0.0
+        # Similar tier: key -> (scope, question vector), oldest first; scopes already loaded from disk
+        self._vectors: "OrderedDict[str, Tuple[str, np.ndarray]]" = OrderedDict()
+        self._loaded_scopes = set()
+        self._encoder = None
+
+    # ------------------------------------------------------------------ tiers
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            try:
+                db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, scope TEXT, question TEXT, "
+                           "response TEXT, latency REAL, created_at REAL)")
+                db.execute("CREATE INDEX IF NOT EXISTS llm_cache_scope ON llm_cache (scope)")
+                db.execute("CREATE INDEX IF NOT EXISTS llm_cache_created ON llm_cache (created_at)")
+                db.commit()
+                self._db = db
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Disk tier disabled, cannot open {self.db_path}: {e}")
+                self.db_path = None
+        return self._db
+
+    def _remember(self, key: str, response: str, latency: float):
+        """Put an entry in the memory tier (caller holds the lock)."""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._memory[key] = (response, latency)
+        self._memory_bytes += len(response)
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+        metrics.set_gauge("llm_cache.memory_entries", len(self._memory))
+        metrics.set_gauge("llm_cache.memory_bytes", self._memory_bytes)
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, float, str]]:
+        """(response, latency, tier) from memory or disk (caller holds the lock)."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry[0], entry[1], "memory"
+        db = self._connection()
+        if db is None:
+            return None
+        row = db.execute("SELECT response, latency FROM llm_cache WHERE key = ? AND created_at >= ?",
+                         (key, time.time() - self.ttl_seconds)).fetchone()
+        if row is None:
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0], row[1], "disk"
+
+    def _sweep(self, db: sqlite3.Connection, now: float):
+        """Drop expired and excess disk entries, at most every SWEEP_INTERVAL_SECONDS."""
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        db.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY created_at DESC "
+                   "LIMIT -1 OFFSET ?)", (self.disk_max_entries,))
+
+    # ------------------------------------------------------------ similar tier
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if self.embedding_model and SENTENCE_TRANSFORMERS_AVAILABLE:
+            if self._encoder is None:
+                self._encoder = SentenceTransformer(self.embedding_model)
+            return np.asarray(self._encoder.encode(texts, normalize_embeddings=True), dtype=np.float32)
+        return np.stack([hashed_embedding(text) for text in texts]) if texts else np.zeros((0, HASHED_EMBEDDING_DIM))
+
+    def _add_vectors(self, keys: List[str], scope: str, questions: List[str]):
+        for key, vector in zip(keys, self._embed(questions)):
+            self._vectors.pop(key, None)
+            self._vectors[key] = (scope, vector)
+        while len(self._vectors) > SIMILAR_MAX_ENTRIES:
+            self._vectors.popitem(last=False)
+
+    def _find_similar(self, cache_key: CacheKey) -> Optional[str]:
+        """Key of the most similar cached question in the same scope, if above the threshold."""
+        if cache_key.scope not in self._loaded_scopes:
+            self._loaded_scopes.add(cache_key.scope)
+            db = self._connection()
+            if db is not None:
+                rows = db.execute("SELECT key, question FROM llm_cache WHERE scope = ? AND created_at >= ? "
+                                  "ORDER BY created_at DESC LIMIT 1000",
+                                  (cache_key.scope, time.time() - self.ttl_seconds)).fetchall()
+                fresh = [(key, question) for key, question in rows if key not in self._vectors]
+                if fresh:
+                    self._add_vectors([k for k, _ in fresh], cache_key.scope, [q for _, q in fresh])
+        candidates = [(key, vector) for key, (scope, vector) in self._vectors.items() if scope == cache_key.scope]
+        if not candidates:
+            return None
+        scores = np.stack([vector for _, vector in candidates]) @ self._embed([cache_key.question])[0]
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity else None
+
+    # ----------------------------------------------------------------- public
+
+    def get(self, cache_key: CacheKey) -> Optional[str]:
+        with self._lock:
+            found = self._lookup(cache_key.key)
+            if found is None and self.similarity > 0:
+                similar = self._find_similar(cache_key)
+                if similar is not None:
+                    found = self._lookup(similar)
+                    if found is not None:
+                        found = (found[0], found[1], "similar")
+                        self._remember(cache_key.key, found[0], found[1])  # this wording is an exact hit next time
+        if found is None:
+            metrics.inc("llm_cache.misses")
+            return None
+        response, latency, tier = found
+        metrics.inc(f"llm_cache.hits.{tier}")
+        metrics.inc("llm_cache.saved_seconds", latency)
+        return response
+
+    def put(self, cache_key: CacheKey, response: str, latency: float):
+        now = time.time()
+        with self._lock:
+            self._remember(cache_key.key, response, latency)
+            if self.similarity > 0:
+                self._add_vectors([cache_key.key], cache_key.scope, [cache_key.question])
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                           (cache_key.key, cache_key.scope, cache_key.question, response, latency, now))
+                self._sweep(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[LLM CACHE] Disk write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._vectors.clear()
+            self._loaded_scopes.clear()
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM llm_cache")
+                db.commit()
+
+    def cached(self, provider: str, model: str) -> Callable:
+        """
+        Decorator for a provider coroutine `fn(messages, ..., system_prompt=None, on_token=None)`
+        returning the response text (or None/"" on failure, or a PartialResponse, which are not cached).
+        Lookups and stores run in a worker thread (SQLite, and the embedding model of the similar
+        tier), off the event loop.
+        """
+        def decorate(fn):
+            signature = inspect.signature(fn)
+
+            @functools.wraps(fn)
+            async def wrapper(*args, diagnosis: Optional[Dict] = None, cache_messages: Optional[List[Dict]] = None,
+                              **kwargs):
+                if not self.enabled:
+                    return await fn(*args, **kwargs)
+                arguments = signature.bind(*args, **kwargs).arguments
+                cache_key = CacheKey(provider, model, cache_messages or arguments["messages"],
+                                     arguments.get("system_prompt"), diagnosis)
+                response = await asyncio.to_thread(self.get, cache_key)
+                if response is not None:
+                    print(f"[LLM CACHE] Hit for {provider} ({len(response)} chars)")
+                    on_token = arguments.get("on_token")
+                    if on_token:
+                        on_token(response)
+                    return response
+                start = time.perf_counter()
+                response = await fn(*args, **kwargs)
+                if isinstance(response, PartialResponse):
+                    print(f"[LLM CACHE] Not caching partial {provider} response ({len(response)} chars)")
+                elif response and response.strip():
+                    await asyncio.to_thread(self.put, cache_key, response, time.perf_counter() - start)
+                return response
+            return wrapper
+        return decorate
+
+    def stats(self) -> Dict:
+        hits = {tier: int(metrics.get_counter(f"llm_cache.hits.{tier}")) for tier in ("memory", "disk", "similar")}
+        misses = int(metrics.get_counter("llm_cache.misses"))
+        lookups = sum(hits.values()) + misses
+        with self._lock:
+            memory_entries, memory_bytes = len(self._memory), self._memory_bytes
+            disk_entries = disk_bytes = 0
+            db = self._connection()
+            if db is not None:
+                disk_entries, disk_bytes = db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM llm_cache").fetchone()
+        return {
+            "enabled": self.enabled,
+            "hit_rate": (sum(hits.values()) / lookups) if lookups else 0.0,
+            "hits": hits,
+            "misses": misses,
+            "saved_seconds": metrics.get_counter("llm_cache.saved_seconds"),
+            "memory": {"entries": memory_entries, "bytes": memory_bytes,
+                       "max_entries": self.max_entries, "max_bytes": self.max_bytes},
+            "disk": {"path": self.db_path, "entries": disk_entries, "bytes": disk_bytes,
+                     "ttl_seconds": self.ttl_seconds},
+            "similarity": self.similarity,
+        }
+
+
+# Process-wide cache used by the provider calls in ai_doctor_llm_final_integrated.py
+llm_cache = LLMResponseCache()
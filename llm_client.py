@@ -0,0 +1,185 @@
+# llm_client.py - Shared, pooled HTTP client for the LLM providers
+"""
+One connection pool per process for OpenRouter, HuggingFace and the local
+(Ollama / llamafile) model, instead of a fresh requests.post per call.
+
+A chat turn can make several provider calls (conversation, AI validation,
+follow-up, file summary). With bare requests.post each of them paid a new TCP
+and TLS handshake. Here connections are kept alive and reused across calls.
+HTTP/2 is used when the optional `h2` package is installed (pip install h2),
+so concurrent calls to one host share a single connection.
+
+The client is an httpx.AsyncClient: the provider calls are coroutines awaited
+on the backend's event loop, so a slow provider holds a socket, not a thread.
+The AsyncClient and the per-host semaphores belong to the event loop that
+first used them; a call from another loop (a script calling asyncio.run
+twice) gets a fresh set.
+
+Per-host concurrency is capped by LLM_MAX_CONNECTIONS_PER_HOST. A call that
+finds its host at the cap waits up to LLM_POOL_TIMEOUT seconds for a slot.
+
+Metrics (service_metrics):
+ - llm_http.requests / errors                 counters
+ - llm_http.tcp_connects / tls_handshakes     counters (new connections; requests - tcp_connects = reused)
+ - llm_http.pool_saturated                    counter, calls that found their host at the cap
+ - llm_http.pool_wait_seconds                 histogram, time waiting for a per-host slot
+ - llm_http.request_seconds                   histogram
+ - llm_http.<host>.in_flight                  gauge
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from service_metrics import metrics
+
+try:
+    import h2  # noqa: F401  (only needed for http2=True)
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+# --- CONFIG ---
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))  # seconds an idle connection is kept
+LLM_MAX_CONNECTIONS_PER_HOST = int(os.getenv("LLM_MAX_CONNECTIONS_PER_HOST", "16"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "30"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1" and H2_AVAILABLE
+
+
+class PoolSaturated(httpx.PoolTimeout):
+    """No per-host slot became free within LLM_POOL_TIMEOUT."""
+
+
+async def _trace(event_name: str, info: Dict):
+    # httpcore trace hook; fires once per new connection, not for reused ones
+    if event_name == "connection.connect_tcp.complete":
+        metrics.inc("llm_http.tcp_connects")
+    elif event_name == "connection.start_tls.complete":
+        metrics.inc("llm_http.tls_handshakes")
+
+
+class ProviderClient:
+    """
+    Keep-alive connection pool shared by every provider call in this process.
+
+    post() and stream() are coroutines / async context managers that work with
+    httpx.Response and raise httpx exceptions (httpx.TimeoutException,
+    httpx.ConnectError, httpx.HTTPError).
+    """
+
+    def __init__(self, max_connections: int = LLM_MAX_CONNECTIONS, max_keepalive: int = LLM_MAX_KEEPALIVE,
+                 keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY, max_per_host: int = LLM_MAX_CONNECTIONS_PER_HOST,
+                 pool_timeout: float = LLM_POOL_TIMEOUT, http2: bool = LLM_HTTP2):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.max_per_host = max(1, max_per_host)
+        self.pool_timeout = pool_timeout
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # AsyncClient and asyncio semaphores are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(limits=self.limits, http2=self.http2)
+            self._loop = loop
+            self._host_slots = {}
+        return self._client
+
+    # --- per-host accounting ---
+    def _track(self, host: str, delta: int):
+        with self._lock:
+            self._in_flight[host] = self._in_flight.get(host, 0) + delta
+            in_flight = self._in_flight[host]
+        metrics.set_gauge(f"llm_http.{host}.in_flight", in_flight)
+
+    async def _acquire_slot(self, host: str) -> asyncio.Semaphore:
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        if slot.locked():
+            metrics.inc("llm_http.pool_saturated")
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(slot.acquire(), timeout=self.pool_timeout)
+            except asyncio.TimeoutError:
+                raise PoolSaturated(f"No connection slot for {host} within {self.pool_timeout}s")
+            finally:
+                metrics.observe("llm_http.pool_wait_seconds", time.perf_counter() - start)
+        else:
+            await slot.acquire()
+        return slot
+
+    # --- requests ---
+    async def post(self, url: str, json=None, headers: Dict = None, timeout: float = 60) -> httpx.Response:
+        host = urlsplit(url).netloc
+        client = self._get_client()
+        slot = await self._acquire_slot(host)
+        self._track(host, 1)
+        metrics.inc("llm_http.requests")
+        start = time.perf_counter()
+        try:
+            return await client.post(url, json=json, headers=headers, timeout=timeout,
+                                     extensions={"trace": _trace})
+        except httpx.HTTPError:
+            metrics.inc("llm_http.errors")
+            raise
+        finally:
+            metrics.observe("llm_http.request_seconds", time.perf_counter() - start)
+            self._track(host, -1)
+            slot.release()
+
+    @asynccontextmanager
+    async def stream(self, url: str, json=None, headers: Dict = None,
+                     timeout: float = 60) -> AsyncIterator[httpx.Response]:
+        """POST and yield the response before its body is read (for token streaming)."""
+        host = urlsplit(url).netloc
+        client = self._get_client()
+        slot = await self._acquire_slot(host)
+        self._track(host, 1)
+        metrics.inc("llm_http.requests")
+        start = time.perf_counter()
+        try:
+            async with client.stream("POST", url, json=json, headers=headers, timeout=timeout,
+                                     extensions={"trace": _trace}) as response:
+                yield response
+        except httpx.HTTPError:
+            metrics.inc("llm_http.errors")
+            raise
+        finally:
+            metrics.observe("llm_http.request_seconds", time.perf_counter() - start)
+            self._track(host, -1)
+            slot.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = dict(self._in_flight)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "max_per_host": self.max_per_host,
+            "in_flight": in_flight,
+        }
+
+    async def aclose(self):
+        """Close the pooled connections (call on the loop that used them, e.g. at shutdown)."""
+        client, self._client, self._loop = self._client, None, None
+        if client is not None:
+            await client.aclose()
+
+
+# Shared client used by every provider call in this process
+provider_client = ProviderClient()
@@ -0,0 +1,125 @@
+# llm_stub_server.py
+"""
+Local stand-in for the LLM providers, for tests and benchmarks without API keys.
+
+Serves:
+ - POST /v1/chat/completions   OpenAI format (OpenRouter and the local Ollama/llamafile provider)
+ - POST /models/{model}        HuggingFace Inference API format
+ - GET  /stats                 requests served and distinct client connections seen
+
+Replies echo the last user message after an optional artificial delay.
+Each word of the reply costs --token-delay seconds of "generation"; requests
+with "stream": true receive the words as SSE deltas as they are produced. /stats
+shows how many TCP connections the clients opened, so keep-alive reuse can be
+checked from the server side as well.
+
+Usage:
+  python llm_stub_server.py --port 8100 --delay 0.2 --token-delay 0.02
+
+Then point Medimate at it, e.g.:
+  LLM_PROVIDER=local LOCAL_MODEL_URL=http://127.0.0.1:8100/v1
+  LLM_PROVIDER=openrouter OPENROUTER_API_KEY=stub OPENROUTER_API_URL=http://127.0.0.1:8100/v1/chat/completions
+  LLM_PROVIDER=huggingface HF_API_KEY=stub HF_API_URL=http://127.0.0.1:8100/models/{model}
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+STUB_DELAY_SECONDS = 0.0
+STUB_TOKEN_DELAY_SECONDS = 0.02
+
+app = FastAPI(title="Medimate LLM stub")
+stats = {"requests": 0, "connections": set()}
+
+
+def _last_user_text(messages) -> str:
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            return str(message.get("content", ""))
+    return ""
+
+
+def _track(request: Request):
+    stats["requests"] += 1
+    if request.client:
+        stats["connections"].add((request.client.host, request.client.port))
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    _track(request)
+    body = await request.json()
+    if STUB_DELAY_SECONDS:
+        await asyncio.sleep(STUB_DELAY_SECONDS)
+    text = _last_user_text(body.get("messages"))
+    reply = f"Stub reply to: {text[:200]}"
+    if body.get("stream"):
+        return StreamingResponse(_stream_reply(reply, body.get("model", "stub")), media_type="text/event-stream")
+    if STUB_TOKEN_DELAY_SECONDS:
+        # Same generation time as the streamed reply, delivered all at once
+        await asyncio.sleep(STUB_TOKEN_DELAY_SECONDS * len(reply.split(" ")))
+    return {
+        "id": f"stub-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": reply},
+            "finish_reason": "stop"
+        }]
+    }
+
+
+async def _stream_reply(reply: str, model: str):
+    words = reply.split(" ")
+    for i, word in enumerate(words):
+        chunk = {
+            "id": f"stub-{stats['requests']}",
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        if STUB_TOKEN_DELAY_SECONDS:
+            await asyncio.sleep(STUB_TOKEN_DELAY_SECONDS)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/models/{model:path}")
+async def huggingface_generate(model: str, request: Request):
+    _track(request)
+    body = await request.json()
+    if STUB_DELAY_SECONDS:
+        await asyncio.sleep(STUB_DELAY_SECONDS)
+    prompt = body.get("inputs", "")
+    return [{"generated_text": f"{prompt}Stub reply from {model}"}]
+
+
+@app.get("/stats")
+def get_stats():
+    return {"requests": stats["requests"], "connections": len(stats["connections"])}
+
+
+def main():
+    global STUB_DELAY_SECONDS, STUB_TOKEN_DELAY_SECONDS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each reply")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="simulated generation time per word")
+    args = parser.parse_args()
+    STUB_DELAY_SECONDS = args.delay
+    STUB_TOKEN_DELAY_SECONDS = args.token_delay
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
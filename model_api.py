@@ -1,16 +1,12 @@
 # model_api.py
-import os
 import json
-import numpy as np
 from fastapi import FastAPI
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
 
-# --- CONFIG ---
-# Directory where your trained model and labels were saved
-MODEL_DIR = "medimate-disease-model"
-BASE_MODEL = "emilyalsentzer/Bio_ClinicalBERT"
+# Classifier, tokenizer and label map are shared through the process-wide registry
+from model_registry import disease_model_registry, split_combined_label
+from inference_batcher import predict_disease_text
+from service_metrics import metrics
 
 # --- FASTAPI SETUP ---
 app = FastAPI(
@@ -19,11 +15,6 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# --- GLOBAL MODEL OBJECTS ---
-tokenizer = None
-model = None
-id2label_map = None
-
 # Define the expected input structure for the API call
 class PredictRequest(BaseModel):
     """Input structure for the prediction endpoint."""
@@ -32,35 +23,10 @@ class PredictRequest(BaseModel):
 # --- MODEL LOADING (Runs ONCE when API starts) ---
 @app.on_event("startup")
 def load_model():
-    """Load the fine-tuned model and required assets."""
-    global tokenizer, model, id2label_map
-    print(f"Loading tokenizer and model from: {MODEL_DIR}...")
-    
-    # 1. Load Labels
-    label_path = os.path.join(MODEL_DIR, "label_classes.npy")
-    if not os.path.exists(label_path):
-        print(f"Error: Label file not found at {label_path}")
-        return
-        
-    # Load the 72 combined labels
-    labels = np.load(label_path, allow_pickle=True).tolist()
-    id2label_map = {i: label for i, label in enumerate(labels)}
-
-    # 2. Load Tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-    
-    # 3. Load Model weights
-    # Using 'local_files_only=True' to ensure it loads from the saved path
-    model = AutoModelForSequenceClassification.from_pretrained(
-        MODEL_DIR, 
-        local_files_only=True,
-        num_labels=len(labels),
-        # ADD THIS LINE TO IGNORE THE CLASSIFIER HEAD SIZE MISMATCH
-        ignore_mismatched_sizes=True 
-    ).to("cuda" if torch.cuda.is_available() else "cpu")
-    
-    model.eval()
-    print("Model loaded successfully. Ready for inference!")
+    """Warm the shared model registry so the first request doesn't pay the load cost."""
+    print(f"Loading tokenizer and model from: {disease_model_registry.model_dir}...")
+    if disease_model_registry.warm():
+        print("Model loaded successfully. Ready for inference!")
 
 # --- PREDICTION ENDPOINT ---
 @app.post("/predict_disease")
@@ -68,43 +34,26 @@ def predict_disease(request: PredictRequest):
     """
     Predicts the combined Disease and Severity from the input text.
     """
+    model = disease_model_registry.get()
     if model is None:
         return {"error": "Model not loaded. Check startup logs."}
 
-    # Tokenize input text
-    inputs = tokenizer(
-        request.text, 
-        return_tensors="pt", 
-        truncation=True, 
-        padding=True, 
-        max_length=128
-    )
-
-    # Move tensors to the same device as the model (GPU if available)
-    device = next(model.parameters()).device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-
-    # Run inference
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-
-    # Get the predicted label index
-    predicted_id = torch.argmax(logits, dim=1).item()
-    
-    # Map the ID back to the combined label
-    combined_label = id2label_map.get(predicted_id, "Unknown_mild")
+    # Tokenize, run inference (micro-batched with concurrent requests) and map the ID back to the combined label
+    prediction = predict_disease_text(request.text)
+    combined_label = prediction["label"] or "Unknown_mild"
     
     # Split the combined label into disease and severity
-    try:
-        disease, severity = combined_label.rsplit('_', 1)
-    except ValueError:
-        disease = combined_label
-        severity = "Unknown"
+    disease, severity = split_combined_label(combined_label, unknown_severity="Unknown")
 
     return {
         "input_text": request.text,
         "predicted_combined_label": combined_label,
         "disease": disease,
         "severity": severity
-    }
\ No newline at end of file
+    }
+
+# --- METRICS ENDPOINT ---
+@app.get("/metrics")
+def get_metrics():
+    """JSON snapshot of model load time, memory footprint and other counters."""
+    return {"models": {"disease": disease_model_registry.stats()}, **metrics.snapshot()}
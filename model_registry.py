@@ -0,0 +1,238 @@
+# model_registry.py - Process-wide registry for the Medimate disease classifier
+"""
+Loads the Bio_ClinicalBERT disease classifier, its tokenizer and the label map
+ONCE per process and hands the same objects to every caller.
+
+Used by:
+ - backend_service.py  (/predict_disease, /predict_disease_with_gemini, warmed in lifespan)
+ - model_api.py        (/predict_disease, warmed on startup)
+ - ai_doctor_llm_final_integrated.get_diagnosis_from_ml_model (LLM orchestrator)
+
+The forward pass runs on the backend chosen with DISEASE_INFERENCE_BACKEND
+(model_runtime.py): eager PyTorch by default, a TorchScript / ONNX Runtime
+artifact written by export_disease_model.py, or the int8 model written by
+quantize_models.py. If the artifact is missing, stale or failed its check, the
+registry loads the PyTorch model instead.
+
+Load time and memory footprint are published through service_metrics:
+ - model.disease.load_seconds        (gauge)
+ - model.disease.param_bytes         (gauge, parameters + buffers, or the ONNX / int8 file size)
+ - model.disease.rss_delta_bytes     (gauge, process RSS growth during load)
+ - model.disease.loads / load_failures (counters)
+ - model.disease.backend_fallbacks   (counter, requested backend unusable, PyTorch used)
+
+Config (env):
+ - DISEASE_MODEL_DIR, DISEASE_BASE_MODEL
+ - DISEASE_INFERENCE_BACKEND   pytorch | torchscript | onnx | int8 (default pytorch)
+ - DISEASE_INFERENCE_THREADS   intra-op threads for the forward pass (0 = library default)
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_runtime import BACKENDS, TorchRunner, load_runner
+from service_metrics import metrics, process_rss_bytes
+from token_cache import TOKEN_PAD_BUCKETS, CachedTokenizer
+
+# --- CONFIG ---
+MODEL_DIR = os.getenv("DISEASE_MODEL_DIR", "medimate-disease-model")
+BASE_MODEL = os.getenv("DISEASE_BASE_MODEL", "emilyalsentzer/Bio_ClinicalBERT")
+MAX_LENGTH = 128
+INFERENCE_BACKEND = os.getenv("DISEASE_INFERENCE_BACKEND", "pytorch").lower()
+INFERENCE_THREADS = int(os.getenv("DISEASE_INFERENCE_THREADS", "0"))
+
+
+def split_combined_label(combined_label: str, unknown_severity: str = "unknown") -> Tuple[str, str]:
+    """Split a combined 'Disease_severity' label into (disease, severity)."""
+    try:
+        disease, severity = combined_label.rsplit('_', 1)
+    except ValueError:
+        disease = combined_label
+        severity = unknown_severity
+    return disease, severity
+
+
+class DiseaseModel:
+    """Tokenizer, classifier and label map that were loaded together."""
+
+    def __init__(self, tokenizer, model, id2label_map: Dict[int, str], device: str, runner=None):
+        self.tokenizer = tokenizer
+        self.model = model  # the PyTorch model, None when an exported backend runs without it
+        self.id2label_map = id2label_map
+        self.device = device
+        self.runner = runner or TorchRunner(model, device)
+        # Length buckets only where the backend reuses work per input shape (token_cache.py)
+        self.encoder = CachedTokenizer(tokenizer, "disease", MAX_LENGTH,
+                                       buckets=TOKEN_PAD_BUCKETS if self.runner.bucketed_padding else ())
+
+    @property
+    def backend(self) -> str:
+        return self.runner.backend
+
+    def predict(self, texts: List[str], max_length: int = MAX_LENGTH, batch_size: int = 16) -> List[Dict]:
+        """
+        Classify texts in batches (same pattern as eval_disease.batch_predict), tokenized
+        through the encoding cache with length-bucketed padding (token_cache.py).
+
+        Returns one dict per text: {"label_id", "label", "confidence"}.
+        """
+        results = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            inputs = self.encoder(batch, self.runner.tensor_type, max_length)
+            logits = self.runner(inputs)
+            # Softmax over the (batch, num_labels) logits; numpy so the ONNX backend needs no torch
+            logits = logits.astype(np.float64)
+            shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs = shifted / shifted.sum(axis=-1, keepdims=True)
+            for predicted_id, confidence in zip(probs.argmax(axis=-1).tolist(), probs.max(axis=-1).tolist()):
+                results.append({
+                    "label_id": predicted_id,
+                    "label": self.id2label_map.get(predicted_id),
+                    "confidence": float(confidence),
+                })
+        return results
+
+
+class ModelRegistry:
+    """
+    Thread-safe, load-once holder for the disease classifier.
+
+    The first caller of get() (or warm()) pays the load cost; concurrent callers
+    wait on the same lock instead of loading their own copy. A failed load is
+    remembered so the hot path does not retry a multi-second load on every request;
+    call warm(force=True) to retry.
+    """
+
+    def __init__(self, model_dir: str = MODEL_DIR, base_model: str = BASE_MODEL, backend: str = INFERENCE_BACKEND,
+                 threads: int = INFERENCE_THREADS):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+        self.model_dir = model_dir
+        self.base_model = base_model
+        self.backend = backend
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._model: Optional[DiseaseModel] = None
+        self._attempted = False
+        self.last_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.param_bytes: Optional[int] = None
+        self.rss_delta_bytes: Optional[int] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def get(self) -> Optional[DiseaseModel]:
+        """Return the loaded model, loading it on first use. Returns None if unavailable."""
+        if self._model is not None or self._attempted:
+            return self._model
+        return self.warm()
+
+    def warm(self, force: bool = False) -> Optional[DiseaseModel]:
+        """Load the model now (e.g. from a FastAPI lifespan hook)."""
+        with self._lock:
+            if self._model is not None and not force:
+                return self._model
+            if self._attempted and not force:
+                return self._model
+            self._attempted = True
+            try:
+                self._model = self._load()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                metrics.inc("model.disease.load_failures")
+                print(f"[MODEL REGISTRY] WARNING: Model load failed. Did you run training? Error: {e}")
+            return self._model
+
+    def _torch_device(self) -> str:
+        import torch
+
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    def _load(self) -> DiseaseModel:
+        label_file = os.path.join(self.model_dir, "label_classes.npy")
+        if not os.path.exists(self.model_dir):
+            raise FileNotFoundError(f"Model directory not found: {self.model_dir}")
+        if not os.path.exists(label_file):
+            raise FileNotFoundError(f"Label file not found: {label_file}")
+
+        # Import here so modules that only need the fallback path don't pay for torch
+        from transformers import AutoTokenizer
+
+        rss_before = process_rss_bytes()
+        start = time.perf_counter()
+
+        labels = np.load(label_file, allow_pickle=True).tolist()
+        id2label_map = {i: label for i, label in enumerate(labels)}
+
+        print(f"[MODEL REGISTRY] Loading tokenizer from {self.base_model}...")
+        tokenizer = AutoTokenizer.from_pretrained(self.base_model)
+
+        model = runner = None
+        device = "cpu" if self.backend == "onnx" else self._torch_device()
+        if self.backend == "int8":
+            device = "cpu"  # dynamically quantized kernels only exist for CPU
+        if self.backend != "pytorch":
+            print(f"[MODEL REGISTRY] Loading {self.backend} artifact from {self.model_dir}...")
+            runner = load_runner(self.backend, self.model_dir, device, self.threads)
+            if runner is None:
+                metrics.inc("model.disease.backend_fallbacks")
+                print(f"[MODEL REGISTRY] WARNING: {self.backend} backend unavailable, falling back to pytorch")
+        if runner is None:
+            from transformers import AutoModelForSequenceClassification
+
+            device = self._torch_device()
+            print(f"[MODEL REGISTRY] Loading model from {self.model_dir}...")
+            model = AutoModelForSequenceClassification.from_pretrained(
+                self.model_dir,
+                local_files_only=True,
+                num_labels=len(labels),
+                ignore_mismatched_sizes=True
+            ).to(device)
+            model.eval()
+            runner = TorchRunner(model, device)
+
+        self.load_seconds = time.perf_counter() - start
+        self.param_bytes = runner.weight_bytes()
+        rss_after = process_rss_bytes()
+        self.rss_delta_bytes = (rss_after - rss_before) if rss_before is not None and rss_after is not None else None
+
+        metrics.inc("model.disease.loads")
+        metrics.set_gauge("model.disease.load_seconds", self.load_seconds)
+        metrics.set_gauge("model.disease.param_bytes", self.param_bytes)
+        if self.rss_delta_bytes is not None:
+            metrics.set_gauge("model.disease.rss_delta_bytes", self.rss_delta_bytes)
+
+        print(f"[MODEL REGISTRY] Model loaded in {self.load_seconds:.2f}s "
+              f"({self.param_bytes / 1e6:.1f} MB weights, backend={runner.backend}, device={device})")
+        return DiseaseModel(tokenizer, model, id2label_map, device, runner)
+
+    def stats(self) -> Dict:
+        return {
+            "model_dir": self.model_dir,
+            "backend": self._model.backend if self._model is not None else self.backend,
+            "loaded": self.is_loaded,
+            "load_seconds": self.load_seconds,
+            "param_bytes": self.param_bytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "last_error": self.last_error,
+            "tokenizer": self._model.encoder.stats() if self._model is not None else None,
+        }
+
+
+# Shared instance used by every service in this process
+disease_model_registry = ModelRegistry()
+
+
+def get_disease_model() -> Optional[DiseaseModel]:
+    """Shortcut for disease_model_registry.get()."""
+    return disease_model_registry.get()
@@ -0,0 +1,390 @@
+# model_runtime.py - Inference backends for the disease classifier
+"""
+What actually runs the disease classifier's forward pass. ModelRegistry picks
+one of these with DISEASE_INFERENCE_BACKEND; DiseaseModel.predict only sees a
+runner that turns tokenized inputs into a numpy array of logits:
+
+ - pytorch       the transformers model in eager mode (default)
+ - torchscript   a traced graph, frozen and optimized for inference on load
+ - onnx          ONNX Runtime on CPU with all graph optimizations (fused
+                 attention / GELU / LayerNorm); needs `pip install onnxruntime`
+                 and does not load PyTorch weights at all
+ - int8          the eager model with its nn.Linear layers dynamically
+                 quantized to int8 (CPU only)
+
+export_disease_model.py and quantize_models.py write the artifacts next to the
+PyTorch weights:
+
+    <model_dir>/model.torchscript.pt   + model.torchscript.pt.json
+    <model_dir>/model.onnx             + model.onnx.json
+    <model_dir>/model.int8.safetensors + model.int8.safetensors.json
+
+The .json sidecar records the SHA-256 of the weights file the artifact was
+built from and the result of its check: logit parity with the PyTorch model
+for the exports, the weighted-F1 accuracy gate for int8. An artifact is only
+used if that check passed and the weights have not changed since (i.e. the
+model was not retrained without re-exporting); otherwise load_runner returns
+None and the registry stays on PyTorch.
+
+The int8 artifact works for the NER model too (load_int8_model with a token
+classification class); combined_inference.py uses it that way.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ort = None
+    ONNXRUNTIME_AVAILABLE = False
+
+BACKENDS = ("pytorch", "torchscript", "onnx", "int8")
+ARTIFACT_FILES = {"torchscript": "model.torchscript.pt", "onnx": "model.onnx", "int8": "model.int8.safetensors"}
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+ONNX_OPSET = 17
+PARITY_TOLERANCE = 1e-3  # max |logit difference| an exported artifact may have
+
+# Sentences the parity check runs through both models (plus any caller-supplied texts)
+PARITY_TEXTS = [
+    "Patient presents with fever and cough for 3 days. Symptoms are moderate in severity.",
+    "Patient presents with headache, nausea and sensitivity to light for 1 day. Symptoms are severe in severity.",
+    "Patient presents with runny nose and sneezing for 2 days. Symptoms are mild in severity.",
+    "Patient presents with abdominal pain, vomiting and fever for 12 hours. Symptoms are severe in severity.",
+    "Patient presents with joint pain, high fever, rash and body ache for 5 days. Symptoms are severe in severity.",
+    "Patient presents with fatigue for 2 weeks.",
+    "cough",
+    "Patient presents with chest pain, shortness of breath, sweating, dizziness and palpitations that started "
+    "suddenly this morning after climbing stairs, with pain spreading to the left arm. Symptoms are severe in severity.",
+]
+
+
+def artifact_path(model_dir: str, backend: str) -> str:
+    return os.path.join(model_dir, ARTIFACT_FILES[backend])
+
+
+def weights_fingerprint(model_dir: str) -> Optional[str]:
+    """SHA-256 of the PyTorch weights file in model_dir (None if there is none)."""
+    for name in WEIGHT_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            return f"{name}:{digest.hexdigest()}"
+    return None
+
+
+def read_sidecar(path: str) -> Optional[Dict]:
+    try:
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_sidecar(path: str, info: Dict):
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+
+# ---- runners: tokenizer output (dict of tensors / arrays) -> logits as np.ndarray ----
+
+class TorchRunner:
+    """The transformers model in eager mode."""
+
+    backend = "pytorch"
+    tensor_type = "pt"
+    bucketed_padding = False  # eager kernels gain nothing from repeated shapes, padding only adds work
+
+    def __init__(self, model, device: str):
+        self.model = model
+        self.device = device
+
+    def __call__(self, inputs) -> np.ndarray:
+        import torch
+
+        with torch.no_grad():
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            return self.model(**inputs).logits.float().cpu().numpy()
+
+    def weight_bytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in list(self.model.parameters()) + list(self.model.buffers()))
+
+
+class Int8Runner(TorchRunner):
+    """A dynamically quantized model from quantize_models.py (CPU only)."""
+
+    backend = "int8"
+
+    def __init__(self, model, path: str):
+        super().__init__(model, "cpu")
+        self.path = path
+
+    def weight_bytes(self) -> int:
+        # Packed int8 weights are not parameters; the saved file is the closest measure
+        return os.path.getsize(self.path)
+
+
+class TorchScriptRunner:
+    """A traced model from export_disease_model.py, frozen on load."""
+
+    backend = "torchscript"
+    tensor_type = "pt"
+    bucketed_padding = True  # the profiling executor specialises the graph per input shape
+
+    def __init__(self, path: str, device: str, input_names: Sequence[str] = INPUT_NAMES):
+        import torch
+
+        self.device = device
+        self.input_names = list(input_names)
+        module = torch.jit.load(path, map_location=device).eval()
+        self._weight_bytes = sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+        module = torch.jit.freeze(module)
+        if device == "cpu":
+            module = torch.jit.optimize_for_inference(module)
+        self.module = module
+
+    def __call__(self, inputs) -> np.ndarray:
+        import torch
+
+        with torch.no_grad():
+            return self.module(*(inputs[name].to(self.device) for name in self.input_names)).float().cpu().numpy()
+
+    def weight_bytes(self) -> int:
+        # Counted before freezing, which turns the weights into graph constants
+        return self._weight_bytes
+
+
+class OnnxRunner:
+    """An ONNX export run by ONNX Runtime on CPU."""
+
+    backend = "onnx"
+    tensor_type = "np"
+    bucketed_padding = True
+
+    def __init__(self, path: str, threads: int = 0):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, inputs) -> np.ndarray:
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0]
+
+    def weight_bytes(self) -> int:
+        return os.path.getsize(self.path)
+
+
+def _checked_artifact(backend: str, model_dir: str) -> Optional[Dict]:
+    """Sidecar of the backend's artifact in model_dir, or None (with the reason printed) if it must not be used."""
+    path = artifact_path(model_dir, backend)
+    tool, check = ("quantize_models.py", "accuracy_gate") if backend == "int8" else ("export_disease_model.py", "parity")
+    if not os.path.exists(path):
+        print(f"[MODEL RUNTIME] No {backend} artifact at {path}; run {tool}")
+        return None
+    info = read_sidecar(path) or {}
+    if not info.get(check, {}).get("passed"):
+        print(f"[MODEL RUNTIME] {path} has no passing {check.replace('_', ' ')}; re-run {tool}")
+        return None
+    if info.get("weights") != weights_fingerprint(model_dir):
+        print(f"[MODEL RUNTIME] {path} was built from different weights; re-run {tool}")
+        return None
+    return info
+
+
+def load_runner(backend: str, model_dir: str, device: str = "cpu", threads: int = 0):
+    """
+    Runner for an exported artifact in model_dir, or None (with the reason printed)
+    if it is missing, failed its check or is stale.
+    """
+    if backend == "int8":
+        from transformers import AutoModelForSequenceClassification
+
+        model = load_int8_model(model_dir, AutoModelForSequenceClassification)
+        return Int8Runner(model, artifact_path(model_dir, backend)) if model is not None else None
+    info = _checked_artifact(backend, model_dir)
+    if info is None:
+        return None
+    path = artifact_path(model_dir, backend)
+    if backend == "onnx":
+        if not ONNXRUNTIME_AVAILABLE:
+            print("[MODEL RUNTIME] onnxruntime is not installed (pip install onnxruntime)")
+            return None
+        return OnnxRunner(path, threads)
+    return TorchScriptRunner(path, device, info.get("input_names", INPUT_NAMES))
+
+
+# ---- int8 ----
+
+def quantize_int8(model):
+    """A copy of model (fp32, moved to CPU) with every nn.Linear dynamically quantized to int8."""
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def save_int8(model, path: str):
+    """
+    Save a quantize_int8() model as plain tensors in a safetensors file: per quantized
+    layer "<name>.weight" (int8 values), "<name>.weight_scale", "<name>.weight_zero_point"
+    and "<name>.bias", plus every remaining parameter and buffer (including the
+    non-persistent position ids, which a state dict leaves out).
+    """
+    import torch
+    from safetensors.torch import save_file
+
+    tensors = {}
+    for name, module in model.named_modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._weight_bias()
+            if weight.qscheme() != torch.per_tensor_affine:
+                raise ValueError(f"{name}: only per-tensor quantized weights are supported, got {weight.qscheme()}")
+            tensors[f"{name}.weight"] = weight.int_repr()
+            tensors[f"{name}.weight_scale"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+            tensors[f"{name}.weight_zero_point"] = torch.tensor(weight.q_zero_point(), dtype=torch.int64)
+            if bias is not None:
+                tensors[f"{name}.bias"] = bias
+    for name, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+        tensors[name] = tensor.detach().contiguous()
+    save_file(tensors, path, metadata={"format": "pt", "quantization": "dynamic qint8 (torch.nn.Linear)"})
+
+
+def build_int8_model(model_dir: str, model_class, path: str):
+    """
+    Rebuild a model saved with save_int8. No checks, see load_int8_model.
+
+    The architecture comes from model_dir's config, instantiated on the meta device
+    with quantized layers in place of nn.Linear, so no fp32 weights are ever
+    allocated (quantizing a randomly initialised fp32 copy instead costs its full
+    size again in heap fragmentation).
+    """
+    import torch
+    from safetensors.torch import load_file
+    from transformers import AutoConfig
+
+    tensors = load_file(path)
+    with torch.device("meta"):
+        model = model_class.from_config(AutoConfig.from_pretrained(model_dir))
+    for name, module in list(model.named_modules()):
+        if type(module) is torch.nn.Linear:  # what quantize_dynamic replaces
+            quantized = torch.ao.nn.quantized.dynamic.Linear(module.in_features, module.out_features,
+                                                             bias_=module.bias is not None, dtype=torch.qint8)
+            weight = torch._make_per_tensor_quantized_tensor(tensors.pop(f"{name}.weight"),
+                                                             tensors.pop(f"{name}.weight_scale").item(),
+                                                             tensors.pop(f"{name}.weight_zero_point").item())
+            quantized.set_weight_bias(weight, tensors.pop(f"{name}.bias", None))
+            parent, _, child = name.rpartition(".")
+            setattr(model.get_submodule(parent), child, quantized)
+    # Everything else is still on the meta device; take the saved tensors as they are
+    expected = {name for name, _ in list(model.named_parameters()) + list(model.named_buffers())}
+    if expected != set(tensors):
+        raise ValueError(f"{path} does not match the model in {model_dir}: "
+                         f"missing {sorted(expected - set(tensors))[:5]}, unexpected {sorted(set(tensors) - expected)[:5]}")
+    for name, tensor in tensors.items():
+        parent, _, child = name.rpartition(".")
+        module = model.get_submodule(parent)
+        if child in module._parameters:
+            module._parameters[child] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[child] = tensor
+    return model.eval()
+
+
+def load_int8_model(model_dir: str, model_class):
+    """
+    The int8 model in model_dir (model_class is e.g. AutoModelForTokenClassification),
+    or None if there is no published artifact or it is stale.
+    """
+    if _checked_artifact("int8", model_dir) is None:
+        return None
+    return build_int8_model(model_dir, model_class, artifact_path(model_dir, "int8"))
+
+
+# ---- export ----
+
+def _example_inputs(tokenizer, max_length: int):
+    # Two texts of different lengths, so padding and the attention mask are part of the trace
+    encoded = tokenizer(PARITY_TEXTS[:2], return_tensors="pt", truncation=True, padding=True, max_length=max_length)
+    input_names = [name for name in INPUT_NAMES if name in encoded]
+    return input_names, tuple(encoded[name] for name in input_names)
+
+
+def _logits_module(model, input_names: Sequence[str]):
+    """model wrapped to take positional inputs and return only the logits tensor."""
+    import torch
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+
+    return LogitsOnly().eval()
+
+
+def export_torchscript(model, tokenizer, path: str, max_length: int = 128) -> List[str]:
+    import torch
+
+    input_names, example = _example_inputs(tokenizer, max_length)
+    with torch.no_grad():
+        traced = torch.jit.trace(_logits_module(model, input_names), example)
+    traced.save(path)
+    return input_names
+
+
+def export_onnx(model, tokenizer, path: str, max_length: int = 128) -> List[str]:
+    import torch
+
+    input_names, example = _example_inputs(tokenizer, max_length)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        options["dynamo"] = False  # torch >= 2.5; the TorchScript exporter is what takes dynamic_axes
+    with torch.no_grad():
+        torch.onnx.export(_logits_module(model, input_names), example, path, input_names=input_names,
+                          output_names=["logits"], dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, **options)
+    return input_names
+
+
+def check_parity(reference, candidate, tokenizer, texts: Sequence[str] = PARITY_TEXTS, batch_sizes=(1, 8),
+                 max_length: int = 128, tolerance: float = PARITY_TOLERANCE) -> Dict:
+    """Compare candidate's logits with reference's on texts, batched (and so padded) several ways."""
+    max_diff = 0.0
+    compared = agree = 0
+    for batch_size in batch_sizes:
+        for i in range(0, len(texts), batch_size):
+            batch = list(texts[i:i + batch_size])
+            expected = reference(tokenizer(batch, return_tensors=reference.tensor_type, truncation=True,
+                                           padding=True, max_length=max_length))
+            actual = candidate(tokenizer(batch, return_tensors=candidate.tensor_type, truncation=True,
+                                         padding=True, max_length=max_length))
+            max_diff = max(max_diff, float(np.abs(expected - actual).max()))
+            agree += int((expected.argmax(-1) == actual.argmax(-1)).sum())
+            compared += len(batch)
+    return {
+        "max_abs_diff": max_diff,
+        "argmax_agreement": agree / compared if compared else 1.0,
+        "texts": compared,
+        "tolerance": tolerance,
+        "passed": max_diff <= tolerance and agree == compared,
+    }
@@ -0,0 +1,200 @@
+# prediction_cache.py - Cache of validated ML diagnoses keyed on the canonical intake
+"""
+Many patients end the intake with the same findings: the same symptoms, a
+duration of "2 days" or "3 days", the same severity. Each of them paid for a
+classifier forward pass (get_diagnosis_from_ml_model) and, when the hard rules
+and the training-data validator left the outcome open, an LLM round trip
+(validate_and_correct_prediction). This cache keeps the prediction and the
+validated result of such a case and hands them to the next patient with the
+same canonical intake.
+
+The key is
+ - the symptoms, lower-cased, de-duplicated and sorted
+ - the first symptom, but only if a hard rule looks at it (first_symptom)
+ - the duration bucket ("2-3 days", "1-2 weeks", ...; text that is not
+   "<n> <unit>" is its own bucket) plus which of the hard rules'
+   duration_contains fragments the text has, so "6 hours" and "6 hrs" never
+   share an entry when a rule matches "hour"
+ - the stated severity
+ - the model version: a hash of the names, sizes and modification times of
+   the files in the model directory (weights, labels, exported artifacts)
+
+Entries are evicted least recently used past PREDICTION_CACHE_MAX_ENTRIES and
+expire PREDICTION_CACHE_TTL_SECONDS after they were stored. The model version
+is re-read on every lookup (a directory listing, no hashing of the weights);
+when it changes, e.g. after train_disease_classifier.py or quantize_models.py
+wrote into the model directory, every entry is dropped.
+
+Only complete outcomes are stored: a real classifier prediction (not the
+fallback diagnosis) whose check was decided by the rules or answered by the
+AI. A check that ran out of budget or could not reach a provider is computed
+again next time. The texts in a hit (the correction reason, the validation
+report) are those of the case that filled the entry: same symptoms, possibly
+listed in another order or with another duration from the same bucket.
+
+Used by ai_doctor_llm_final_integrated.llm_process_conversation for the
+intake diagnosis.
+
+Metrics (service_metrics):
+ - prediction_cache.hits / misses   counters, per lookup (an expired entry is a miss)
+ - prediction_cache.expired         counter, entries dropped by the TTL on lookup
+ - prediction_cache.invalidations   counter, model directory changes that emptied the cache
+ - prediction_cache.entries         gauge
+
+Config (env):
+ - PREDICTION_CACHE                1 / 0
+ - PREDICTION_CACHE_MAX_ENTRIES    entries kept (default 4096)
+ - PREDICTION_CACHE_TTL_SECONDS    entry lifetime (default 86400, 0 = no expiry)
+"""
+
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from hard_rules import hard_rules
+from model_registry import disease_model_registry
+from service_metrics import metrics
+
+# --- CONFIG ---
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE", "1") == "1"
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "4096"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "86400"))
+
+DURATION_VALUE = re.compile(r"^(\d+(?:\.\d+)?)\s*([a-z]+)$")
+# Unit -> days; sub-day units keep their own bucket
+UNIT_DAYS = {
+    "min": None, "mins": None, "minute": None, "minutes": None,
+    "hr": None, "hrs": None, "hour": None, "hours": None,
+    "day": 1, "days": 1, "week": 7, "weeks": 7, "month": 30, "months": 30,
+}
+# (upper bound in days, bucket), first match wins
+DAY_BUCKETS = ((1, "1 day"), (3, "2-3 days"), (6, "4-6 days"), (13, "1-2 weeks"), (29, "2-4 weeks"))
+
+
+def duration_bucket(duration: str) -> str:
+    """Coarse bucket of an intake duration ("3 days" -> "2-3 days"); other text is its own bucket."""
+    text = " ".join(str(duration or "unknown").lower().split())
+    match = DURATION_VALUE.match(text)
+    if not match or match.group(2) not in UNIT_DAYS:
+        return text
+    if UNIT_DAYS[match.group(2)] is None:
+        return "under 1 day"
+    days = float(match.group(1)) * UNIT_DAYS[match.group(2)]
+    for limit, bucket in DAY_BUCKETS:
+        if days <= limit:
+            return bucket
+    return "1 month or more"
+
+
+def model_version(model_dir: str) -> Optional[str]:
+    """Hash of the names, sizes and mtimes of the files in model_dir (None if it does not exist)."""
+    try:
+        entries = sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns)
+                         for e in os.scandir(model_dir) if e.is_file())
+    except OSError:
+        return None
+    return hashlib.sha256(repr(entries).encode("utf-8")).hexdigest()[:16]
+
+
+class PredictionCache:
+    """LRU + TTL cache of (prediction, validated result) per canonical intake and model version."""
+
+    def __init__(self, model_dir: str, max_entries: int = PREDICTION_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = PREDICTION_CACHE_TTL_SECONDS, enabled: bool = PREDICTION_CACHE,
+                 first_symptom_terms: Iterable[str] = (), duration_fragments: Iterable[str] = ()):
+        self.model_dir = model_dir
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.first_symptom_terms = frozenset(t.lower() for t in first_symptom_terms)
+        self.duration_fragments = tuple(sorted(f.lower() for f in duration_fragments))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict, Dict]]" = OrderedDict()  # LRU first
+        self._version: Optional[str] = None
+
+    def key(self, symptoms: Sequence[str], duration: str, severity: str) -> Tuple:
+        """Canonical intake: (symptoms, rule-relevant first symptom, duration bucket, duration fragments, severity)."""
+        normalized = [" ".join(str(s).lower().split()) for s in symptoms]
+        first = normalized[0] if normalized and normalized[0] in self.first_symptom_terms else None
+        duration_text = str(duration or "unknown").lower()
+        fragments = tuple(f for f in self.duration_fragments if f in duration_text)
+        return (tuple(sorted(set(normalized))), first, duration_bucket(duration), fragments,
+                str(severity or "mild").strip().lower())
+
+    def _current_version(self) -> Optional[str]:
+        """Model version now; empties the cache when it differs from the one the entries were made with."""
+        version = model_version(self.model_dir)
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    metrics.inc("prediction_cache.invalidations")
+                    print(f"[PREDICTION CACHE] {self.model_dir} changed, dropping {len(self._entries)} entries")
+                    self._entries.clear()
+                    metrics.set_gauge("prediction_cache.entries", 0)
+                self._version = version
+        return version
+
+    def get(self, symptoms: Sequence[str], duration: str, severity: str) -> Optional[Tuple[Dict, Dict]]:
+        """(prediction, validated result) cached for this intake, or None."""
+        if not self.enabled:
+            return None
+        key = self.key(symptoms, duration, severity) + (self._current_version(),)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds > 0 and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                metrics.inc("prediction_cache.expired")
+                metrics.set_gauge("prediction_cache.entries", len(self._entries))
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            metrics.inc("prediction_cache.misses")
+            return None
+        metrics.inc("prediction_cache.hits")
+        # Callers add to these dicts; hand out copies so the cached ones stay as stored
+        return copy.deepcopy(entry[1]), copy.deepcopy(entry[2])
+
+    def put(self, symptoms: Sequence[str], duration: str, severity: str, prediction: Dict, validated: Dict):
+        if not self.enabled:
+            return
+        key = self.key(symptoms, duration, severity) + (self._current_version(),)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(prediction), copy.deepcopy(validated))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            size = len(self._entries)
+        metrics.set_gauge("prediction_cache.entries", size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        metrics.set_gauge("prediction_cache.entries", 0)
+
+    def stats(self) -> Dict:
+        hits = metrics.get_counter("prediction_cache.hits")
+        misses = metrics.get_counter("prediction_cache.misses")
+        with self._lock:
+            entries = len(self._entries)
+            version = self._version
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "expired": metrics.get_counter("prediction_cache.expired"),
+            "invalidations": metrics.get_counter("prediction_cache.invalidations"),
+            "model_version": version,
+        }
+
+
+# Shared instance for the disease classifier served by model_registry
+prediction_cache = PredictionCache(disease_model_registry.model_dir, first_symptom_terms=hard_rules.first_symptom_terms,
+                                   duration_fragments=hard_rules.duration_fragments)
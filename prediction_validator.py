@@ -2,9 +2,13 @@
 import json
 import os
 from typing import Dict, List, Tuple, Optional
-from collections import defaultdict, Counter
+from collections import defaultdict
 import numpy as np
 
+from severity_table import SeverityCountTable
+from symptom_match_index import SymptomMatchIndex
+from validator_index import VALIDATOR_INDEX_CACHE, CompiledValidatorIndex, load_or_compile
+
 class PredictionValidator:
     """
     Validates ML model predictions against training data patterns.
@@ -12,16 +16,25 @@ class PredictionValidator:
     Generates comprehensive analysis reports.
     """
     
-    def __init__(self, training_data_path: str = None, validation_data_path: str = None, test_data_path: str = None):
-        """Initialize validator with training, validation, and test datasets."""
-        self.training_data = []
-        self.validation_data = []
-        self.test_data = []
+    def __init__(self, training_data_path: str = None, validation_data_path: str = None, test_data_path: str = None,
+                 use_index_cache: bool = VALIDATOR_INDEX_CACHE):
+        """
+        Initialize validator with training, validation, and test datasets.
+
+        With use_index_cache, the lookup indices come from a compiled index
+        (validator_index.py) keyed on the dataset files' contents; the JSONL
+        records themselves are then only parsed if training_data /
+        validation_data / test_data are read.
+        """
+        self._datasets = {"training": [], "validation": [], "test": []}
+        self._pending_datasets = {}  # dataset type -> (path, size) not parsed yet (compiled index in use)
         self.symptom_disease_map = defaultdict(set)  # symptom -> set of diseases
         self.disease_symptom_map = defaultdict(set)  # disease -> set of symptoms
         self.disease_severity_map = defaultdict(list)  # disease -> list of severities
+        self.severity_table = SeverityCountTable()  # disease x severity counts (_check_severity_consistency)
         self.symptom_pairs_map = defaultdict(set)  # (symptom1, symptom2) -> set of diseases
         self.all_diseases = set()
+        self.match_index = None  # SymptomMatchIndex over training_data (built with the other indices)
         self.validation_results = {
             "total_predictions": 0,
             "correct_predictions": 0,
@@ -30,63 +43,154 @@ class PredictionValidator:
             "confidence_scores": []
         }
         
-        # Load datasets
-        if training_data_path and os.path.exists(training_data_path):
-            self._load_dataset(training_data_path, "training")
-            
-        if validation_data_path and os.path.exists(validation_data_path):
-            self._load_dataset(validation_data_path, "validation")
-            
-        if test_data_path and os.path.exists(test_data_path):
-            self._load_dataset(test_data_path, "test")
+        paths = {
+            dataset_type: path
+            for dataset_type, path in (("training", training_data_path),
+                                       ("validation", validation_data_path),
+                                       ("test", test_data_path))
+            if path and os.path.exists(path)
+        }
         
-        # Build indices for fast lookup
-        self._build_symptom_indices()
+        compiled = None
+        if use_index_cache and paths:
+            try:
+                compiled = load_or_compile(paths, lambda: self._load_and_build(paths))
+            except OSError as e:
+                print(f"[WARNING] Validator index cache unavailable: {e}")
+                if self.match_index is None:
+                    self._load_and_build(paths)
+        else:
+            self._load_and_build(paths)
         
-        print(f"[OK] Validator initialized with {len(self.training_data)} training examples")
+        if compiled is not None:
+            self._restore_compiled_index(compiled, paths)
+        
+        print(f"[OK] Validator initialized with {self._dataset_size('training')} training examples")
         print(f"[OK] Found {len(self.all_diseases)} unique diseases")
+    
+    def _load_and_build(self, paths: Dict[str, str]):
+        """Parse the JSONL datasets and build the indices from them (no compiled index)."""
+        for dataset_type, path in paths.items():
+            self._load_dataset(path, dataset_type)
+        
+        # Build indices for fast lookup
+        self._build_symptom_indices()
+        return self, {dataset_type: len(records) for dataset_type, records in self._datasets.items()}
+    
+    def _restore_compiled_index(self, compiled: CompiledValidatorIndex, paths: Dict[str, str]):
+        """Take the indices from a compiled index; datasets are parsed lazily on first access."""
+        self.symptom_disease_map = compiled.symptom_disease_map()
+        self.disease_symptom_map = compiled.disease_symptom_map()
+        self.disease_severity_map = compiled.disease_severity_map()
+        self.severity_table = compiled.severity_table()
+        self.symptom_pairs_map = compiled.symptom_pairs_map()
+        self.all_diseases = set(compiled.diseases)
+        self.match_index = compiled.match_index()
+        self._pending_datasets = {
+            dataset_type: (path, compiled.dataset_sizes.get(dataset_type, 0))
+            for dataset_type, path in paths.items()
+        }
+    
+    def _dataset(self, dataset_type: str) -> List[Dict]:
+        pending = self._pending_datasets.pop(dataset_type, None)
+        if pending is not None:
+            self._load_dataset(pending[0], dataset_type)
+        return self._datasets[dataset_type]
+    
+    def _set_dataset(self, dataset_type: str, records: List[Dict]):
+        self._pending_datasets.pop(dataset_type, None)
+        self._datasets[dataset_type] = records
+    
+    def _dataset_size(self, dataset_type: str) -> int:
+        """Record count, without parsing a dataset that is still pending."""
+        if dataset_type in self._pending_datasets:
+            return self._pending_datasets[dataset_type][1]
+        return len(self._datasets[dataset_type])
+    
+    @property
+    def training_data(self) -> List[Dict]:
+        return self._dataset("training")
+    
+    @training_data.setter
+    def training_data(self, records: List[Dict]):
+        self._set_dataset("training", records)
+    
+    @property
+    def validation_data(self) -> List[Dict]:
+        return self._dataset("validation")
+    
+    @validation_data.setter
+    def validation_data(self, records: List[Dict]):
+        self._set_dataset("validation", records)
+    
+    @property
+    def test_data(self) -> List[Dict]:
+        return self._dataset("test")
+    
+    @test_data.setter
+    def test_data(self, records: List[Dict]):
+        self._set_dataset("test", records)
         
     def _load_dataset(self, path: str, dataset_type: str):
         """Load JSONL dataset file."""
+        records = self._datasets[dataset_type]
         try:
             with open(path, 'r', encoding='utf-8') as f:
                 for line in f:
                     try:
-                        record = json.loads(line.strip())
-                        if dataset_type == "training":
-                            self.training_data.append(record)
-                        elif dataset_type == "validation":
-                            self.validation_data.append(record)
-                        elif dataset_type == "test":
-                            self.test_data.append(record)
+                        records.append(json.loads(line.strip()))
                     except json.JSONDecodeError:
                         continue
-            count = len(self.training_data) if dataset_type == 'training' else len(self.validation_data) if dataset_type == 'validation' else len(self.test_data)
-            print(f"[OK] Loaded {count} {dataset_type} examples")
+            print(f"[OK] Loaded {len(records)} {dataset_type} examples")
         except Exception as e:
             print(f"[ERROR] Error loading {dataset_type} dataset: {e}")
     
     def _build_symptom_indices(self):
         """Build indices for fast symptom-to-disease and disease-to-symptom lookups."""
         for record in self.training_data:
-            disease = record.get("label", "").strip()
-            symptoms = record.get("symptoms", [])
-            severity = record.get("severity", "").strip()
-            
-            self.all_diseases.add(disease)
-            self.disease_severity_map[disease].append(severity)
-            
-            for symptom in symptoms:
-                symptom_clean = symptom.strip().lower()
-                self.symptom_disease_map[symptom_clean].add(disease)
-                self.disease_symptom_map[disease].add(symptom_clean)
-            
-            # Build symptom pairs
-            if len(symptoms) >= 2:
-                for i in range(len(symptoms)):
-                    for j in range(i+1, len(symptoms)):
-                        pair = tuple(sorted([symptoms[i].lower().strip(), symptoms[j].lower().strip()]))
-                        self.symptom_pairs_map[pair].add(disease)
+            self._index_record(record)
+        
+        # Inverted record index for the Jaccard matcher in _find_exact_matches
+        self.match_index = SymptomMatchIndex(self.training_data)
+    
+    def _index_record(self, record: Dict):
+        """Add one training record to the lookup maps and the severity table."""
+        disease = record.get("label", "").strip()
+        symptoms = record.get("symptoms", [])
+        severity = record.get("severity", "").strip()
+        
+        self.all_diseases.add(disease)
+        self.disease_severity_map[disease].append(severity)
+        self.severity_table.add(disease, severity)
+        
+        for symptom in symptoms:
+            symptom_clean = symptom.strip().lower()
+            self.symptom_disease_map[symptom_clean].add(disease)
+            self.disease_symptom_map[disease].add(symptom_clean)
+        
+        # Build symptom pairs
+        if len(symptoms) >= 2:
+            for i in range(len(symptoms)):
+                for j in range(i+1, len(symptoms)):
+                    pair = tuple(sorted([symptoms[i].lower().strip(), symptoms[j].lower().strip()]))
+                    self.symptom_pairs_map[pair].add(disease)
+    
+    def add_training_records(self, records: List[Dict]):
+        """
+        Add records to the training data and update the indices in place.
+        
+        The maps and the severity table are updated incrementally; the Jaccard
+        match index is rebuilt on the next validation that needs it.
+        """
+        training_data = self.training_data
+        for record in records:
+            training_data.append(record)
+            self._index_record(record)
+        self.match_index = None
+    
+    def add_training_record(self, record: Dict):
+        """Add a single record (see add_training_records)."""
+        self.add_training_records([record])
     
     def validate_prediction(self, 
                            symptoms: List[str], 
@@ -107,10 +211,37 @@ class PredictionValidator:
                 "reasoning": str
             }
         """
+        severity_clean = severity.strip().lower()
+        
+        # Check 4: Severity consistency
+        severity_match = self._check_severity_consistency(predicted_disease, severity_clean)
+        
+        return self._validate(symptoms, severity_clean, predicted_disease, severity_match)
+    
+    def validate_predictions(self, predictions: List[Dict]) -> List[Dict]:
+        """
+        Validate many predictions at once.
+        
+        Each item has the validate_prediction() arguments as keys (symptoms,
+        duration, severity, predicted_disease). Severity consistency for the
+        whole batch is one vectorized lookup in the severity table; results
+        are the same as calling validate_prediction() on each item in order.
+        """
+        severities_clean = [p["severity"].strip().lower() for p in predictions]
+        severity_matches = self.severity_table.consistency_batch(
+            [p["predicted_disease"] for p in predictions], severities_clean).tolist()
+        
+        return [
+            self._validate(p["symptoms"], severity_clean, p["predicted_disease"], severity_match)
+            for p, severity_clean, severity_match in zip(predictions, severities_clean, severity_matches)
+        ]
+    
+    def _validate(self, symptoms: List[str], severity_clean: str, predicted_disease: str,
+                  severity_match: float) -> Dict:
+        """Checks 1-3, evaluation and bookkeeping for one prediction (severity consistency precomputed)."""
         self.validation_results["total_predictions"] += 1
         
         symptoms_clean = [s.strip().lower() for s in symptoms]
-        severity_clean = severity.strip().lower()
         
         # Check 1: Exact symptom-disease match from training data
         exact_matches = self._find_exact_matches(symptoms_clean, severity_clean)
@@ -121,9 +252,6 @@ class PredictionValidator:
         # Check 3: Individual symptom matches
         symptom_matches = self._find_symptom_matches(symptoms_clean)
         
-        # Check 4: Severity consistency
-        severity_match = self._check_severity_consistency(predicted_disease, severity_clean)
-        
         # Determine validation result
         result = self._evaluate_prediction(
             predicted_disease, 
@@ -152,7 +280,13 @@ class PredictionValidator:
         return result
     
     def _find_exact_matches(self, symptoms: List[str], severity: str) -> List[Tuple[str, float]]:
-        """Find exact or near-exact matches in training data."""
+        """Find exact or near-exact matches in training data (top 3 by weighted Jaccard overlap)."""
+        if self.match_index is None:  # records were added since the last build
+            self.match_index = SymptomMatchIndex(self.training_data)
+        return self.match_index.top_matches(symptoms, severity)
+    
+    def _find_exact_matches_scan(self, symptoms: List[str], severity: str) -> List[Tuple[str, float]]:
+        """Reference full scan over training_data; same results as _find_exact_matches, kept for parity checks."""
         matches = []
         
         for record in self.training_data:
@@ -213,17 +347,9 @@ class PredictionValidator:
     
     def _check_severity_consistency(self, disease: str, severity: str) -> float:
         """Check if the severity is consistent with the disease in training data."""
-        if disease not in self.disease_severity_map:
-            return 0.5  # Unknown disease, neutral score
-        
-        severities = self.disease_severity_map[disease]
-        severity_counts = Counter(severities)
-        
-        if severity in severity_counts:
-            # Calculate proportion
-            return severity_counts[severity] / len(severities)
-        else:
-            return 0.3  # Severity not seen in training for this disease
+        # Share of the disease's training records with this severity; 0.5 for an
+        # unknown disease, 0.3 for a severity never seen with it
+        return self.severity_table.consistency(disease, severity)
     
     def _evaluate_prediction(self, 
                             predicted_disease: str,
@@ -348,9 +474,9 @@ class PredictionValidator:
             },
             "corrections": self.validation_results["corrections_made"],
             "datasets_info": {
-                "training_examples": len(self.training_data),
-                "validation_examples": len(self.validation_data),
-                "test_examples": len(self.test_data),
+                "training_examples": self._dataset_size("training"),
+                "validation_examples": self._dataset_size("validation"),
+                "test_examples": self._dataset_size("test"),
                 "total_unique_diseases": len(self.all_diseases),
                 "diseases": sorted(list(self.all_diseases))
             },
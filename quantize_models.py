@@ -0,0 +1,286 @@
+# quantize_models.py
+"""
+Dynamic int8 quantization of the disease classifier and the NER model, behind
+an accuracy gate.
+
+For each model the nn.Linear weights are quantized to int8 (activations are
+quantized on the fly, per batch), saved to a staging file, reloaded the way
+the services load it (model_runtime.build_int8_model) and evaluated next to
+the fp32 model:
+
+ - disease  weighted F1 on the held-out 10% of the dataset, split like
+            eval_disease.py (stratified, random_state=42), with the labels of
+            label_classes.npy as served
+ - ner      token-level weighted F1 over the entity tags (O excluded) against
+            the gold BIO tags of a train_medimate_ner.py dataset (--ner-data,
+            same 10% split); without one, against the fp32 model's own tags
+            on the disease texts
+
+The artifact is published (<model_dir>/model.int8.safetensors and its sidecar,
+see model_runtime.py) only if weighted F1 dropped by no more than the allowed
+amount; otherwise the staging file and any int8 artifact published earlier
+are deleted and the script exits with status 1. Either way it reports,
+fp32 -> int8: weights file size, RSS growth of a fresh process loading the
+model and running one text, and median single-text latency.
+
+Serve the published models with DISEASE_INFERENCE_BACKEND=int8
+(backend_service.py, model_api.py, combined_inference.py) and
+NER_INFERENCE_BACKEND=int8 (combined_inference.py).
+
+Config (env):
+ - QUANTIZE_MAX_F1_DROP   largest allowed weighted-F1 drop, absolute (default 0.01)
+ - DISEASE_MODEL_DIR, NER_MODEL_DIR
+
+Usage:
+  python quantize_models.py
+  python quantize_models.py --models disease --dataset medimate_dataset_top100.jsonl --max-f1-drop 0.005
+  python quantize_models.py --models ner --ner-data medimate_bio.jsonl
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+from transformers import AutoModelForSequenceClassification, AutoModelForTokenClassification, AutoTokenizer
+
+from eval_disease import DATASET_PATH, batch_predict, load_jsonl
+from model_registry import MAX_LENGTH, MODEL_DIR
+from model_runtime import (
+    WEIGHT_FILES, artifact_path, build_int8_model, quantize_int8, save_int8, weights_fingerprint, write_sidecar,
+)
+
+# --- CONFIG ---
+MAX_F1_DROP = float(os.getenv("QUANTIZE_MAX_F1_DROP", "0.01"))
+NER_MODEL_DIR = os.getenv("NER_MODEL_DIR", "medimate-ner-output")
+NER_MAX_LENGTH = 256  # as in train_medimate_ner.py
+
+MODEL_CLASSES = {"disease": AutoModelForSequenceClassification, "ner": AutoModelForTokenClassification}
+
+# Loads one model in a fresh interpreter, runs one forward pass (so memory-mapped weights are
+# actually resident) and prints the RSS growth, imports excluded
+RSS_PROBE = """
+import sys
+import torch, transformers
+from model_runtime import build_int8_model
+from service_metrics import process_rss_bytes
+model_class = getattr(transformers, sys.argv[1])
+before = process_rss_bytes()
+model = build_int8_model(sys.argv[2], model_class, sys.argv[3]) if len(sys.argv) > 3 else model_class.from_pretrained(sys.argv[2])
+with torch.no_grad():
+    model.eval()(input_ids=torch.ones(1, 16, dtype=torch.long))
+print(process_rss_bytes() - before)
+"""
+
+
+def held_out(items, labels=None):
+    """The 10% test split of eval_disease.py (stratified when labels are given and allow it)."""
+    try:
+        return train_test_split(items, test_size=0.1, random_state=42, stratify=labels)[1]
+    except ValueError:  # a class with a single example cannot be stratified
+        return train_test_split(items, test_size=0.1, random_state=42)[1]
+
+
+# ---- evaluation ----
+
+def disease_f1(model, tokenizer, texts, labels, id2label):
+    predicted = [str(id2label.get(p)) for p in batch_predict(texts, tokenizer, model, device="cpu")]
+    return f1_score(labels, predicted, average="weighted", zero_division=0)
+
+
+def ner_tags(model, tokenizer, texts, batch_size=16):
+    """Predicted tag ids per text, for its non-special tokens."""
+    tags = []
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            enc = tokenizer(texts[i:i + batch_size], truncation=True, padding=True, max_length=NER_MAX_LENGTH,
+                            return_tensors="pt", return_special_tokens_mask=True)
+            keep = (enc.pop("attention_mask") == 1) & (enc.pop("special_tokens_mask") == 0)
+            predicted = model(**enc).logits.argmax(-1)
+            tags.extend(row[mask].tolist() for row, mask in zip(predicted, keep))
+    return tags
+
+
+def gold_ner_tags(tokenizer, records, label2id):
+    """Gold tag ids per record, aligned like train_medimate_ner.py (padded with O), non-special tokens only."""
+    tags = []
+    for record in records:
+        enc = tokenizer(record["text"], truncation=True, max_length=NER_MAX_LENGTH, return_special_tokens_mask=True)
+        labels = list(record["labels"])[:len(enc["input_ids"])]
+        labels += ["O"] * (len(enc["input_ids"]) - len(labels))
+        tags.append([label2id.get(label, label2id["O"])
+                     for label, special in zip(labels, enc["special_tokens_mask"]) if not special])
+    return tags
+
+
+def ner_f1(gold, predicted, outside_id):
+    gold = [t for seq in gold for t in seq]
+    predicted = [t for seq in predicted for t in seq]
+    entity_ids = sorted(set(gold) - {outside_id})
+    if not entity_ids:
+        return 1.0 if gold == predicted else 0.0
+    return f1_score(gold, predicted, labels=entity_ids, average="weighted", zero_division=0)
+
+
+class Evaluation:
+    """What a model is scored on: f1(model) and single-text latency on the same texts."""
+
+    def __init__(self, kind, model_dir, tokenizer, fp32_model, dataset_path, ner_data_path):
+        self.tokenizer = tokenizer
+        self.max_length = MAX_LENGTH if kind == "disease" else NER_MAX_LENGTH
+        if kind == "disease":
+            records = load_jsonl(dataset_path)
+            test = held_out(records, [r["label"] for r in records])
+            self.texts = [r["text"] for r in test]
+            labels = [r["label"] for r in test]
+            id2label = dict(enumerate(np.load(os.path.join(model_dir, "label_classes.npy"), allow_pickle=True).tolist()))
+            self.description = f"{dataset_path} held-out 10% ({len(test)} texts)"
+            self.f1 = lambda model: disease_f1(model, tokenizer, self.texts, labels, id2label)
+            return
+
+        outside_id = fp32_model.config.label2id.get("O", 0)
+        if ner_data_path:
+            test = held_out(load_jsonl(ner_data_path))
+            self.texts = [r["text"] for r in test]
+            gold = gold_ner_tags(tokenizer, test, fp32_model.config.label2id)
+            self.description = f"{ner_data_path} held-out 10% ({len(test)} texts, gold tags)"
+        else:
+            self.texts = [r["text"] for r in held_out(load_jsonl(dataset_path))]
+            gold = ner_tags(fp32_model, tokenizer, self.texts)
+            self.description = f"{dataset_path} held-out 10% ({len(self.texts)} texts, fp32 tags as reference)"
+        self.f1 = lambda model: ner_f1(gold, ner_tags(model, tokenizer, self.texts), outside_id)
+
+    def latency(self, model, rounds):
+        model.eval()
+        timings = []
+        with torch.no_grad():
+            for text in self.texts[:rounds]:
+                enc = self.tokenizer([text], truncation=True, padding=True, max_length=self.max_length, return_tensors="pt")
+                start = time.perf_counter()
+                model(**enc)
+                timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2] if timings else float("nan")
+
+
+def rss_growth(model_class, model_dir, int8_path=None):
+    args = [sys.executable, "-c", RSS_PROBE, model_class.__name__, os.path.abspath(model_dir)]
+    if int8_path:
+        args.append(os.path.abspath(int8_path))
+    out = subprocess.run(args, capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(out.stdout.strip().splitlines()[-1])
+
+
+def fp32_weights_bytes(model_dir):
+    return next(os.path.getsize(os.path.join(model_dir, name)) for name in WEIGHT_FILES
+                if os.path.exists(os.path.join(model_dir, name)))
+
+
+# ---- pipeline ----
+
+def quantize(kind, model_dir, dataset_path=DATASET_PATH, ner_data_path=None, max_f1_drop=MAX_F1_DROP, rounds=30):
+    """Quantize one model, gate it on weighted F1 and publish it if it passes. Returns the report."""
+    model_class = MODEL_CLASSES[kind]
+    path = artifact_path(model_dir, "int8")
+    staging = path + ".staging"
+    print(f"[QUANTIZE] {kind}: loading {model_dir}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+    fp32 = model_class.from_pretrained(model_dir, local_files_only=True).eval()
+    weights = weights_fingerprint(model_dir)
+
+    start = time.perf_counter()
+    save_int8(quantize_int8(fp32), staging)
+    int8 = build_int8_model(model_dir, model_class, staging)
+    quantize_seconds = time.perf_counter() - start
+
+    try:
+        evaluation = Evaluation(kind, model_dir, tokenizer, fp32, dataset_path, ner_data_path)
+        print(f"[QUANTIZE] {kind}: evaluating on {evaluation.description}...")
+        fp32_f1, int8_f1 = evaluation.f1(fp32), evaluation.f1(int8)
+        report = {
+            "model": kind,
+            "model_dir": model_dir,
+            "quantize_seconds": quantize_seconds,
+            "size_bytes": (fp32_weights_bytes(model_dir), os.path.getsize(staging)),
+            "rss_bytes": (rss_growth(model_class, model_dir), rss_growth(model_class, model_dir, staging)),
+            "latency_seconds": (evaluation.latency(fp32, rounds), evaluation.latency(int8, rounds)),
+        }
+        gate = {
+            "metric": "weighted_f1",
+            "evaluated_on": evaluation.description,
+            "fp32_f1": fp32_f1,
+            "int8_f1": int8_f1,
+            "drop": fp32_f1 - int8_f1,
+            "max_drop": max_f1_drop,
+            "passed": fp32_f1 - int8_f1 <= max_f1_drop,
+        }
+        report["accuracy_gate"] = gate
+        if gate["passed"]:
+            os.replace(staging, path)
+            write_sidecar(path, {
+                "format": "int8",
+                "weights": weights,
+                "quantization": "dynamic qint8 (torch.nn.Linear)",
+                "accuracy_gate": gate,
+                "report": {k: report[k] for k in ("size_bytes", "rss_bytes", "latency_seconds")},
+            })
+            print(f"[QUANTIZE] {kind}: published {path}")
+        else:
+            print(f"[QUANTIZE] {kind}: NOT published - weighted F1 dropped by {gate['drop']:.4f} "
+                  f"(allowed {max_f1_drop:g})")
+            # An artifact published earlier (e.g. under a looser threshold) must not keep serving
+            for stale in (path, path + ".json"):
+                if os.path.exists(stale):
+                    os.remove(stale)
+                    print(f"[QUANTIZE] {kind}: removed previously published {stale}")
+        return report
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+
+
+def print_report(report):
+    gate = report["accuracy_gate"]
+    print(f"\n{report['model']} ({report['model_dir']}), quantized in {report['quantize_seconds']:.1f}s")
+    print(f"  {'':<22}{'fp32':>12}{'int8':>12}{'delta':>12}")
+    rows = [
+        ("weights file MB", *(b / 1e6 for b in report["size_bytes"])),
+        ("load RSS growth MB", *(b / 1e6 for b in report["rss_bytes"])),
+        ("p50 latency ms", *(s * 1000 for s in report["latency_seconds"])),
+        ("weighted F1", gate["fp32_f1"], gate["int8_f1"]),
+    ]
+    for name, fp32, int8 in rows:
+        change = f"{(int8 - fp32) / fp32:+.1%}" if name != "weighted F1" and fp32 else f"{int8 - fp32:+.4f}"
+        print(f"  {name:<22}{fp32:>12.4g}{int8:>12.4g}{change:>12}")
+    print(f"  accuracy gate (max drop {gate['max_drop']:g}): {'PASSED' if gate['passed'] else 'FAILED'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=list(MODEL_CLASSES), default=list(MODEL_CLASSES))
+    parser.add_argument("--disease-dir", default=MODEL_DIR)
+    parser.add_argument("--ner-dir", default=NER_MODEL_DIR)
+    parser.add_argument("--dataset", default=DATASET_PATH, help="JSONL with \"text\" and \"label\" (eval_disease.py)")
+    parser.add_argument("--ner-data", help="JSONL with \"text\" and tokenizer-aligned \"labels\" (train_medimate_ner.py)")
+    parser.add_argument("--max-f1-drop", type=float, default=MAX_F1_DROP)
+    parser.add_argument("--rounds", type=int, default=30, help="single-text forward passes timed per model")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = library default)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    dirs = {"disease": args.disease_dir, "ner": args.ner_dir}
+    reports = [quantize(kind, dirs[kind], args.dataset, args.ner_data, args.max_f1_drop, args.rounds)
+               for kind in args.models]
+    for report in reports:
+        print_report(report)
+    if not all(report["accuracy_gate"]["passed"] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
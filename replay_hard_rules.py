@@ -0,0 +1,95 @@
+# replay_hard_rules.py
+"""
+Replay hard rules (hard_rules.py) over historical cases.
+
+Reads a JSONL file of cases and evaluates a rule file over all of them in one
+batch. Each line needs "symptoms" and a predicted disease ("predicted_disease",
+or "label" for the training datasets). "predicted_severity" (or "severity"),
+"severity", "duration" and "validation_report" are optional. It prints how often
+each rule fired and the time taken.
+
+With --baseline it evaluates a second rule file too (for example the committed
+one, from `git show HEAD:hard_rules.json`) and lists the cases whose outcome
+changed, so a rule edit can be checked before it ships.
+
+Usage:
+  python replay_hard_rules.py medimate_option1_train_8000.jsonl
+  python replay_hard_rules.py cases.jsonl --rules hard_rules.json --baseline old_rules.json --show 20
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+
+from hard_rules import HARD_RULES_PATH, HardRulesEngine
+
+
+def load_cases(path):
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            severity = record.get("severity", "mild")
+            cases.append({
+                "predicted_disease": record.get("predicted_disease", record.get("label", "")).strip(),
+                "predicted_severity": record.get("predicted_severity", severity),
+                "symptoms": record.get("symptoms", []),
+                "duration": record.get("duration", "unknown"),
+                "severity": severity,
+                "validation_report": record.get("validation_report"),
+            })
+    return cases
+
+
+def replay(engine, cases):
+    start = time.perf_counter()
+    decisions = engine.evaluate_batch(cases)
+    return decisions, time.perf_counter() - start
+
+
+def outcome(decision):
+    if decision is None:
+        return None
+    return decision.rule, decision.disease, decision.severity, decision.was_corrected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", help="JSONL file of cases")
+    parser.add_argument("--rules", default=HARD_RULES_PATH, help="rule file to evaluate")
+    parser.add_argument("--baseline", help="rule file to compare against")
+    parser.add_argument("--show", type=int, default=10, help="changed cases to print")
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    engine = HardRulesEngine.from_file(args.rules)
+    decisions, elapsed = replay(engine, cases)
+
+    fired = Counter(d.rule for d in decisions if d is not None)
+    print(f"\n{len(cases)} cases, {args.rules}: {elapsed * 1000:.1f} ms ({elapsed / max(len(cases), 1) * 1e6:.1f} us/case)")
+    print(f"{'rule':<42}{'fired':>8}")
+    print("-" * 50)
+    for name in engine.rule_names:
+        print(f"{name:<42}{fired[name]:>8}")
+    print(f"{'(no rule)':<42}{sum(d is None for d in decisions):>8}")
+
+    if args.baseline:
+        baseline_decisions, baseline_elapsed = replay(HardRulesEngine.from_file(args.baseline), cases)
+        changed = [(case, old, new) for case, old, new in zip(cases, baseline_decisions, decisions)
+                   if outcome(old) != outcome(new)]
+        transitions = Counter((old.rule if old else "(no rule)", new.rule if new else "(no rule)")
+                              for _, old, new in changed)
+        print(f"\nAgainst {args.baseline} ({baseline_elapsed * 1000:.1f} ms): {len(changed)} outcomes changed")
+        for (old_rule, new_rule), count in transitions.most_common():
+            print(f"  {old_rule} -> {new_rule}: {count}")
+        for case, old, new in changed[:args.show]:
+            print(f"\n  {case['predicted_disease']} {case['symptoms']} ({case['severity']}, {case['duration']})")
+            print(f"    before: {outcome(old)}")
+            print(f"    after:  {outcome(new)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# service_executors.py - Bounded thread pools for blocking work in the async backend
+"""
+The FastAPI endpoints in backend_service.py are async. Anything that blocks
+the CPU or the thread (torch forward passes and the prediction checks of a
+diagnosis turn, bcrypt, PDF parsing) is pushed onto one of these pools instead
+of Starlette's shared default threadpool, so a burst of slow work of one kind
+never delays a login or a prediction. LLM provider calls are not here: they
+are coroutines on the event loop (llm_client.py) and hold no thread while the
+provider is thinking.
+
+Each pool has its own size and a bound on how much work may be queued behind
+it. When that bound is hit, run() raises ExecutorSaturated and the endpoint
+answers 503 instead of letting the queue (and latency) grow without limit.
+submit() is the same for synchronous callers and returns a Future.
+
+Metrics (service_metrics):
+ - executor.<name>.in_flight             gauge, submitted and not yet finished
+ - executor.<name>.queue_wait_seconds    histogram, time spent waiting for a worker
+ - executor.<name>.run_seconds           histogram, time spent running
+ - executor.<name>.rejected              counter
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+from service_metrics import metrics
+
+# --- CONFIG ---
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))  # torch forward passes, prediction checks
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "4"))  # bcrypt hash / verify
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))  # pdfplumber text extraction
+EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "256"))  # queued jobs per pool before 503
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when a pool already has max_workers + max_queue jobs in flight."""
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor with a cap on queued work and per-pool metrics."""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int = EXECUTOR_MAX_QUEUE):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers + max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.inc(f"executor.{self.name}.rejected")
+                raise ExecutorSaturated(f"{self.name} executor is saturated ({self._pending} jobs in flight)")
+            self._pending += 1
+            pending = self._pending
+        metrics.set_gauge(f"executor.{self.name}.in_flight", pending)
+
+    def _release(self, *_):
+        with self._lock:
+            self._pending -= 1
+            pending = self._pending
+        metrics.set_gauge(f"executor.{self.name}.in_flight", pending)
+
+    def _timed(self, fn: Callable, args, kwargs) -> Callable:
+        submitted = time.perf_counter()
+
+        def timed_call():
+            started = time.perf_counter()
+            metrics.observe(f"executor.{self.name}.queue_wait_seconds", started - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe(f"executor.{self.name}.run_seconds", time.perf_counter() - started)
+
+        return timed_call
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) on this pool and await its result."""
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, self._timed(fn, args, kwargs))
+        finally:
+            self._release()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Start fn(*args, **kwargs) on this pool from synchronous code and return its
+        Future. Raises ExecutorSaturated like run().
+        """
+        self._acquire()
+        try:
+            future = self._pool.submit(self._timed(fn, args, kwargs))
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def stats(self) -> Dict:
+        return {"max_workers": self.max_workers, "max_pending": self.max_pending, "in_flight": self._pending}
+
+
+# Shared pools used by the backend in this process
+inference_executor = BoundedExecutor("inference", INFERENCE_WORKERS)
+auth_executor = BoundedExecutor("auth", AUTH_WORKERS)
+pdf_executor = BoundedExecutor("pdf", PDF_WORKERS)
+
+EXECUTORS = {
+    "inference": inference_executor,
+    "auth": auth_executor,
+    "pdf": pdf_executor,
+}
+
+
+def executor_stats() -> Dict:
+    return {name: executor.stats() for name, executor in EXECUTORS.items()}
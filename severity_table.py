@@ -0,0 +1,93 @@
+# severity_table.py - Disease x severity count table for PredictionValidator
+"""
+Dense record counts per (disease, severity), behind
+PredictionValidator._check_severity_consistency.
+
+The validator used to build a Counter over disease_severity_map[disease] (one
+entry per training record) on every call. This table keeps the counts and the
+per-disease totals in NumPy arrays, so a lookup is two dict gets and one
+division, and a whole batch is a single fancy-indexing pass. Adding records
+updates the counts in place; the arrays grow by doubling when a new disease or
+severity shows up.
+
+Scores are identical to the Counter version, including its quirk that stored
+severities are only stripped (not lower-cased) while queries are lower-cased.
+"""
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+UNKNOWN_DISEASE_SCORE = 0.5  # disease never seen in training: neutral
+UNSEEN_SEVERITY_SCORE = 0.3  # disease known, severity never seen with it
+
+
+class SeverityCountTable:
+    """Disease x severity record counts with O(1) consistency lookups."""
+
+    def __init__(self, diseases: Sequence[str] = (), severities: Sequence[str] = (),
+                 counts: Optional[np.ndarray] = None):
+        self.disease_ids: Dict[str, int] = {disease: i for i, disease in enumerate(diseases)}
+        self.severity_ids: Dict[str, int] = {severity: i for i, severity in enumerate(severities)}
+        shape = (max(len(self.disease_ids), 8), max(len(self.severity_ids), 4))
+        self._counts = np.zeros(shape, dtype=np.int64)
+        if counts is not None:
+            self._counts[:counts.shape[0], :counts.shape[1]] = counts
+        self._totals = self._counts.sum(axis=1)
+
+    @property
+    def counts(self) -> np.ndarray:
+        """The (diseases x severities) count matrix, as a view."""
+        return self._counts[:len(self.disease_ids), :len(self.severity_ids)]
+
+    def __contains__(self, disease: str) -> bool:
+        return disease in self.disease_ids
+
+    def _grow(self, rows: int, cols: int):
+        """Make room for `rows` diseases and `cols` severities (capacity doubles)."""
+        new_rows, new_cols = self._counts.shape
+        while new_rows < rows:
+            new_rows *= 2
+        while new_cols < cols:
+            new_cols *= 2
+        if (new_rows, new_cols) == self._counts.shape:
+            return
+        grown = np.zeros((new_rows, new_cols), dtype=np.int64)
+        grown[:self._counts.shape[0], :self._counts.shape[1]] = self._counts
+        totals = np.zeros(new_rows, dtype=np.int64)
+        totals[:len(self._totals)] = self._totals
+        self._counts, self._totals = grown, totals
+
+    def add(self, disease: str, severity: str, count: int = 1):
+        """Count `count` more records of `disease` with `severity`."""
+        disease_id = self.disease_ids.setdefault(disease, len(self.disease_ids))
+        severity_id = self.severity_ids.setdefault(severity, len(self.severity_ids))
+        self._grow(len(self.disease_ids), len(self.severity_ids))
+        self._counts[disease_id, severity_id] += count
+        self._totals[disease_id] += count
+
+    def consistency(self, disease: str, severity: str) -> float:
+        """Share of `disease`'s training records with `severity`."""
+        disease_id = self.disease_ids.get(disease)
+        if disease_id is None:
+            return UNKNOWN_DISEASE_SCORE
+        severity_id = self.severity_ids.get(severity)
+        count = int(self._counts[disease_id, severity_id]) if severity_id is not None else 0
+        if count == 0:
+            return UNSEEN_SEVERITY_SCORE
+        return count / int(self._totals[disease_id])
+
+    def consistency_batch(self, diseases: Sequence[str], severities: Sequence[str]) -> np.ndarray:
+        """consistency() for many (disease, severity) pairs in one vectorized lookup."""
+        disease_ids = np.array([self.disease_ids.get(d, -1) for d in diseases], dtype=np.int64)
+        severity_ids = np.array([self.severity_ids.get(s, -1) for s in severities], dtype=np.int64)
+        known = (disease_ids >= 0) & (severity_ids >= 0)
+        counts = np.zeros(len(disease_ids), dtype=np.int64)
+        counts[known] = self._counts[disease_ids[known], severity_ids[known]]
+        totals = self._totals[np.maximum(disease_ids, 0)]
+
+        scores = np.full(len(disease_ids), UNSEEN_SEVERITY_SCORE)
+        seen = counts > 0
+        scores[seen] = counts[seen] / totals[seen]
+        scores[disease_ids < 0] = UNKNOWN_DISEASE_SCORE
+        return scores
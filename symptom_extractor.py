@@ -0,0 +1,314 @@
+# symptom_extractor.py - Compiled keyword tables for the intake branch of llm_process_conversation
+"""
+Single-pass symptom / severity / duration extraction for the medical intake.
+
+llm_process_conversation used to run a cascade of `'x' in text` and
+`any(deny in text for deny in [...])` checks for every user message in the
+history on every turn, plus several more scans of the joined conversation text.
+The keywords now live in the declarative tables below, compiled once into a
+KeywordMatcher.
+
+KeywordMatcher finds every table term that occurs anywhere in a message (the
+same substring semantics as `term in text`) in one pass over its distinct
+space-separated tokens; what each token contains is memoized, so the cost
+depends on the message, not on the number of keywords. Severity, denials and
+symptom rules are then evaluated against that set of terms, memoized per set.
+The conversation-level flags only need one boolean each and keep their
+short-circuiting substring checks.
+
+Behaviour is identical to the original cascade, quirks included:
+ - negation is message-scoped: a denial anywhere in a message suppresses the
+   symptom for that whole message, and a message containing only denials is
+   skipped (after its severity has been read)
+ - 'itching' counts even when denied; only 'itchy' honours the denials
+ - severity keywords include bare digits, so "3 days" reads as mild
+bench_symptom_extractor.py checks this against a copy of the cascade.
+"""
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+# ============================================================================
+# TABLES
+# ============================================================================
+
+# Latest user message that states a severity wins; first matching level per message
+SEVERITY_LEVELS = (
+    ("severe", ("very bad", "extremely", "really bad", "terrible", "severe")),
+    ("moderate", ("moderate", "5", "6", "7", "somewhat bad", "pretty bad")),
+    ("mild", ("mild", "1", "2", "3", "little", "slight", "bit")),
+)
+
+# A message with any of these and none of SYMPTOM_MENTION_TERMS only denies symptoms
+DENIAL_ONLY_TERMS = (
+    "no cough", "no sore throat", "no fatigue", "no nausea", "no body ache",
+    "no body aches", "no aches", "no pain", "no rash", "no cold", "no runny nose", "no cold symptoms",
+    "don't have cough", "don't have sore throat", "don't have fatigue", "don't have body aches",
+    "don't have aches", "don't have pain", "i do not have", "no tired", "no chills",
+)
+SYMPTOM_MENTION_TERMS = (
+    "cough", "sore", "fever", "pain", "ache", "rash", "nausea", "vomit", "cold", "runny", "sneeze",
+    "breathless", "wheez", "chest", "phlegm", "nosebleed", "diarrhea", "loose", "motion", "stool",
+    "stomach", "abdominal", "constipation", "bowel",
+)
+
+# (symptom, triggers, denials): the symptom is reported when every term of any
+# one trigger is present and no denial is. Order is the order symptoms are reported.
+SYMPTOM_RULES = (
+    ("cough", [("cough",)], ("no cough", "don't have cough")),
+    ("productive cough", [("productive cough",), ("cough", "phlegm")], ("no cough", "don't have cough")),
+    ("phlegm", [("phlegm",), ("sputum",)], ("no phlegm", "no sputum")),
+    ("yellow phlegm", [("yellow", "phlegm"), ("yellow", "sputum")], ("no phlegm", "no sputum")),
+    ("nosebleed", [("nosebleed",), ("nose bleed",), ("bleeding in nose",), ("bleeding nose",),
+                   ("blood from nose",), ("epistaxis",)], ("no nosebleed", "no bleeding", "no blood")),
+    ("sneezing", [("sneeze",), ("sneezing",)], ("no sneeze", "no sneezing")),
+    ("runny nose", [("runny nose",), ("runny",)], ("no runny nose", "don't have runny nose")),
+    ("sore throat", [("sore throat",), ("sore", "throat")], ("no sore throat", "don't have sore throat")),
+    ("fever", [("fever",)], ("no fever", "don't have fever")),
+    ("pain", [("pain",), ("ache",), ("hurt",), ("body ache",)],
+     ("no pain", "no ache", "no body ache", "no body aches", "don't have pain", "don't have aches")),
+    ("rash", [("rash",)], ("no rash", "don't have rash")),
+    ("nausea", [("nausea",), ("vomit",)], ("no nausea", "don't have nausea")),
+    ("chills", [("chills",)], ("no chills", "don't have chills")),
+    ("body aches", [("body ache",), ("body aches",)],
+     ("no body ache", "no body aches", "no aches", "don't have body aches")),
+    ("cold", [("cold",)], ("no cold", "don't have cold")),
+    ("fatigue", [("fatigue",), ("tired",), ("tiredness",)], ("no fatigue", "no tired", "don't have fatigue")),
+    ("shortness of breath", [("shortness of breath",), ("breathless",), ("difficulty breathing",),
+                             ("cant breathe",), ("can't breathe",), ("hard to breathe",)],
+     ("no breathlessness", "no shortness of breath")),
+    ("wheezing", [("wheez",)], ("no wheeze", "no wheezing")),
+    ("chest pain", [("chest pain",)], ("no chest pain",)),
+    ("congestion", [("congestion",)], ("no congestion",)),
+    ("diarrhea", [("diarrhea",), ("loose motion",), ("loose stool",), ("loose motions",)],
+     ("no diarrhea", "no loose motion")),
+    ("abdominal pain", [("abdominal pain",), ("stomach pain",), ("belly pain",), ("stomach ache",)],
+     ("no stomach pain", "no abdominal pain")),
+    ("constipation", [("constipation",)], ("no constipation",)),
+    ("vomiting", [("vomiting",), ("vomit",)], ("no vomiting", "no vomit")),
+    ("dizziness", [("dizziness",), ("dizzy",), ("vertigo",)], ("no dizziness", "no dizzy")),
+    ("itching", [("itchy",)], ("no itching", "no itchy")),
+)
+
+# Triggers that report their symptom even when it is denied (operator precedence in the
+# original check: `'itching' in text or 'itchy' in text and not <denied>`)
+UNNEGATED_TRIGGERS = {"itching": [("itching",)]}
+
+# Duration: a message mentioning one of these is searched for "<n> <unit>"
+DURATION_TERMS = ("day", "week", "month", "hour")
+DURATION_UNITS = ("days", "day", "weeks", "week", "months", "month", "hours", "hour")
+# First whitespace-separated word that is a unit, with the word before it
+DURATION_PATTERN = re.compile(r"(?<!\S)(\S+)\s+(%s)(?!\S)" % "|".join(DURATION_UNITS))
+
+# Checks on the whole (lower-cased, space-joined) conversation text
+CONVERSATION_FLAGS = {
+    "symptom_patterns": (
+        "day", "week", "month", "hours", "fever", "cough", "pain", "ache",
+        "terrible", "mild", "moderate", "severe", "bad", "hurts",
+        "sick", "vomit", "nausea", "diarrhea", "rash", "itchy", "swollen",
+        "difficulty", "trouble breathing", "weak", "tired", "fatigue",
+    ),
+    "symptoms": (
+        "fever", "cough", "pain", "ache", "rash", "nausea", "vomit", "cold", "flu", "sore", "throat",
+        "nosebleed", "bleeding", "headache", "diarrhea", "vomiting",
+    ),
+    "duration": (
+        "day", "days", "week", "weeks", "hour", "hours", "minute", "minutes", "month", "months",
+        "min", "mins", "hr", "hrs",
+    ),
+    "severity": ("mild", "moderate", "severe", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"),
+    "bleeding": (
+        "nosebleed", "nose bleed", "bleeding nose", "blood from nose", "bleeding in nose", "epistaxis",
+        "bleeding", "bleed",
+    ),
+    "prolonged_bleeding": (
+        "10 min", "10min", "15 min", "20 min", "30 min", "hour", "hours", "more than 5", ">5", "5+",
+        "won't stop", "won't stop bleeding", "continuous",
+    ),
+}
+
+
+# Emergency keywords in the current user message (intake red-flag check)
+RED_FLAG_TERMS = (
+    "severe chest pain", "chest pain", "difficulty breathing", "can't breathe",
+    "vomiting blood", "blood in vomit", "blood in stool", "fainting", "fainted",
+    "confused", "confusion", "severe abdominal pain", "severe pain",
+    "high fever", "103", "104", "105", "106",
+)
+
+
+# ============================================================================
+# MATCHER
+# ============================================================================
+
+class KeywordMatcher:
+    """
+    Finds which of a fixed set of terms occur in a text, with `term in text`
+    semantics, from one pass over the text's distinct space-separated tokens.
+
+    A term without spaces can only occur inside a single token, so what each
+    distinct token contains is computed once and memoized. A term with spaces
+    ("no cough", "more than 5") can only occur if some token ends with its
+    first word and every other word is inside some token; only those
+    candidates are confirmed with a substring check.
+    """
+
+    def __init__(self, terms: Iterable[str], max_cached_tokens: int = 50000):
+        self.terms = sorted(set(terms))
+        self._single = frozenset(term for term in self.terms if " " not in term)
+        self._multi = {term: term.split(" ") for term in self.terms if " " in term}
+        self._multi_rest = {term: frozenset(words[1:]) for term, words in self._multi.items()}
+        # Everything a token is checked for: single-word terms and the words of multi-word terms
+        self._pieces = sorted(self._single.union(*self._multi.values()))
+        self._max_cached_tokens = max_cached_tokens
+        self._tokens: Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]] = {}
+
+    def _token_info(self, token: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        """(pieces inside `token`, multi-word terms whose first word ends `token`), memoized."""
+        pieces = frozenset(piece for piece in self._pieces if piece in token)
+        candidates = frozenset(term for term, words in self._multi.items() if token.endswith(words[0]))
+        if len(self._tokens) >= self._max_cached_tokens:
+            self._tokens.clear()
+        info = self._tokens[token] = (pieces, candidates)
+        return info
+
+    def find(self, text: str) -> FrozenSet[str]:
+        pieces = set()
+        candidates = set()
+        cache = self._tokens
+        for token in set(text.split(" ")):
+            info = cache.get(token) or self._token_info(token)
+            pieces |= info[0]
+            candidates |= info[1]
+        found = pieces & self._single
+        rest = self._multi_rest
+        found.update(term for term in candidates if rest[term] <= pieces and term in text)
+        return frozenset(found)
+
+
+# ============================================================================
+# EXTRACTOR
+# ============================================================================
+
+class MessageFindings:
+    """What one user message says: severity, symptoms (in rule order), duration and denial phrases."""
+
+    __slots__ = ("severity", "symptoms", "duration", "denial_only", "denials")
+
+    def __init__(self, severity: Optional[str], symptoms: List[str], duration: Optional[str], denial_only: bool,
+                 denials: Sequence[str] = ()):
+        self.severity = severity
+        self.symptoms = symptoms
+        self.duration = duration
+        self.denial_only = denial_only
+        self.denials = denials
+
+
+class SymptomExtractor:
+    """All intake keyword tables compiled into one KeywordMatcher."""
+
+    def __init__(self, rules=SYMPTOM_RULES, severity_levels=SEVERITY_LEVELS,
+                 conversation_flags: Dict[str, Sequence[str]] = CONVERSATION_FLAGS,
+                 max_cached_findings: int = 20000):
+        self.rules = rules
+        self.severity_levels = severity_levels
+        self.conversation_flags = conversation_flags
+
+        terms = set(DENIAL_ONLY_TERMS) | set(SYMPTOM_MENTION_TERMS) | set(DURATION_TERMS)
+        for _, levels in severity_levels:
+            terms.update(levels)
+        for symptom, triggers, denials in rules:
+            terms.update(denials)
+            for trigger in list(triggers) + UNNEGATED_TRIGGERS.get(symptom, []):
+                terms.update(trigger)
+        self.matcher = KeywordMatcher(terms)
+
+        # Rules as set operations: single-term triggers share one isdisjoint() test
+        self._compiled_rules = []
+        for symptom, triggers, denials in rules:
+            unnegated = UNNEGATED_TRIGGERS.get(symptom, [])
+            self._compiled_rules.append((
+                symptom,
+                frozenset(t[0] for t in triggers if len(t) == 1),
+                [frozenset(t) for t in triggers if len(t) > 1],
+                frozenset(denials),
+                frozenset(t[0] for t in unnegated),
+            ))
+        self.max_cached_findings = max_cached_findings
+        self._classified: Dict[FrozenSet[str], Tuple] = {}
+        # Every denial phrase, in table order, for MessageFindings.denials
+        self._denial_terms = tuple(dict.fromkeys(
+            list(DENIAL_ONLY_TERMS) + [denial for _, _, denials in rules for denial in denials]))
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """Table terms present in `text` (already lower-cased)."""
+        return self.matcher.find(text)
+
+    def _classify(self, found: FrozenSet[str]) -> Tuple[Optional[str], Tuple[str, ...], bool, bool, Tuple[str, ...]]:
+        """(severity, symptoms, denial_only, mentions_duration, denials) for a set of found terms."""
+        severity = None
+        for level, level_terms in self.severity_levels:
+            if not found.isdisjoint(level_terms):
+                severity = level
+                break
+
+        # A message that only denies symptoms contributes its severity and nothing else
+        denials = tuple(term for term in self._denial_terms if term in found)
+        if not found.isdisjoint(DENIAL_ONLY_TERMS) and found.isdisjoint(SYMPTOM_MENTION_TERMS):
+            return severity, (), True, False, denials
+
+        symptoms = []
+        for symptom, single, combined, rule_denials, unnegated in self._compiled_rules:
+            triggered = not found.isdisjoint(single) or any(found.issuperset(terms) for terms in combined)
+            if (triggered and found.isdisjoint(rule_denials)) or not found.isdisjoint(unnegated):
+                symptoms.append(symptom)
+        return severity, tuple(symptoms), False, not found.isdisjoint(DURATION_TERMS), denials
+
+    def analyze_message(self, text: str) -> MessageFindings:
+        """Findings for one lower-cased user message."""
+        found = self.scan(text)
+        # Everything but the duration value depends only on which terms were found,
+        # and the same few combinations keep coming back
+        classified = self._classified.get(found)
+        if classified is None:
+            if len(self._classified) >= self.max_cached_findings:
+                self._classified.clear()
+            classified = self._classified[found] = self._classify(found)
+        severity, symptoms, denial_only, mentions_duration, denials = classified
+
+        duration = None
+        if mentions_duration:
+            match = DURATION_PATTERN.search(text)
+            if match:
+                duration = f"{match.group(1)} {match.group(2)}"
+
+        return MessageFindings(severity, list(symptoms), duration, denial_only, denials)
+
+    def extract(self, history: Sequence[Dict], severity: str = "mild",
+                duration: str = "unknown") -> Tuple[List[str], str, str]:
+        """
+        (symptoms, duration, severity) from the user messages of `history`, in
+        Gemini message format. Symptoms keep repeats across messages (callers
+        de-duplicate); later messages override duration and severity.
+        """
+        symptoms: List[str] = []
+        for msg in history:
+            if msg.get("role", "") != "user":
+                continue
+            findings = self.analyze_message(msg.get("parts", [{}])[0].get("text", "").lower())
+            if findings.severity:
+                severity = findings.severity
+            symptoms.extend(findings.symptoms)
+            if findings.duration:
+                duration = findings.duration
+        return symptoms, duration, severity
+
+    def conversation_flags_for(self, text: str) -> Dict[str, bool]:
+        """Each CONVERSATION_FLAGS entry: does the lower-cased conversation text mention any of its terms."""
+        # One boolean per flag: plain substring checks that stop at the first hit beat
+        # collecting every term of the (long, growing) conversation text
+        return {flag: any(term in text for term in terms) for flag, terms in self.conversation_flags.items()}
+
+
+# Shared, compiled once per process
+symptom_extractor = SymptomExtractor()
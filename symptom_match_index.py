@@ -0,0 +1,141 @@
+# symptom_match_index.py - Inverted-index Jaccard matcher for PredictionValidator
+"""
+Precomputed engine behind PredictionValidator._find_exact_matches.
+
+The original implementation scanned every training record per validation,
+rebuilding lower-cased symptom lists and Python sets before computing the
+Jaccard overlap. This index does that work once:
+
+ - symptoms and severities are interned to integer ids
+ - each record keeps only its distinct-symptom count, severity id and label id
+ - a CSR posting list maps symptom id -> sorted record ids (the record-level
+   counterpart of PredictionValidator.symptom_disease_map)
+
+A query only touches records that share at least one symptom (anything else has
+overlap 0 and can never reach the 0.6 threshold). Intersection sizes, Jaccard
+overlap and the severity weight are computed with NumPy over those candidates.
+
+top_matches() returns exactly what the scan returned: the same weights (the
+same float64 operations in the same order) and the same tie order (a stable
+sort over candidates in record order).
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+MATCH_THRESHOLD = 0.6
+SEVERITY_MISMATCH_WEIGHT = 0.8
+TOP_K = 3
+
+
+class SymptomMatchIndex:
+    """Symptom -> record inverted index with vectorized Jaccard scoring."""
+
+    def __init__(self, records: Sequence[Dict]):
+        symptom_ids: Dict[str, int] = {}
+        severity_ids: Dict[str, int] = {}
+        label_ids: Dict[str, int] = {}
+        labels: List[str] = []
+
+        record_sizes = np.zeros(len(records), dtype=np.int32)
+        record_severity = np.zeros(len(records), dtype=np.int32)
+        record_label = np.zeros(len(records), dtype=np.int32)
+        posting_symptoms: List[int] = []
+        posting_records: List[int] = []
+
+        for record_id, record in enumerate(records):
+            # Same cleaning as the original scan (first-seen order, so ids follow the data)
+            distinct = dict.fromkeys(s.strip().lower() for s in record.get("symptoms", []))
+            severity = record.get("severity", "").strip().lower()
+            label = record.get("label", "").strip()
+
+            record_sizes[record_id] = len(distinct)
+            record_severity[record_id] = severity_ids.setdefault(severity, len(severity_ids))
+            if label not in label_ids:
+                label_ids[label] = len(labels)
+                labels.append(label)
+            record_label[record_id] = label_ids[label]
+
+            for symptom in distinct:
+                posting_symptoms.append(symptom_ids.setdefault(symptom, len(symptom_ids)))
+                posting_records.append(record_id)
+
+        # CSR postings: records of symptom s are indices[indptr[s]:indptr[s + 1]], ascending
+        posting_symptoms = np.asarray(posting_symptoms, dtype=np.int32)
+        posting_records = np.asarray(posting_records, dtype=np.int32)
+        order = np.lexsort((posting_records, posting_symptoms))
+        self.indices = posting_records[order]
+        self.indptr = np.zeros(len(symptom_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_symptoms, minlength=len(symptom_ids)), out=self.indptr[1:])
+
+        self.symptom_ids = symptom_ids
+        self.severity_ids = severity_ids
+        self.labels = labels
+        self.record_sizes = record_sizes
+        self.record_severity = record_severity
+        self.record_label = record_label
+        self.num_records = len(records)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """The index arrays, for validator_index to persist."""
+        return {
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "record_sizes": self.record_sizes,
+            "record_severity": self.record_severity,
+            "record_label": self.record_label,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], symptoms: Sequence[str],
+                    severities: Sequence[str], labels: Sequence[str]) -> "SymptomMatchIndex":
+        """Rebuild an index from to_arrays() output (possibly memory-mapped) and its vocabularies."""
+        index = cls.__new__(cls)
+        index.indptr = arrays["indptr"]
+        index.indices = arrays["indices"]
+        index.record_sizes = arrays["record_sizes"]
+        index.record_severity = arrays["record_severity"]
+        index.record_label = arrays["record_label"]
+        index.symptom_ids = {symptom: i for i, symptom in enumerate(symptoms)}
+        index.severity_ids = {severity: i for i, severity in enumerate(severities)}
+        index.labels = list(labels)
+        index.num_records = len(index.record_sizes)
+        return index
+
+    def _candidates(self, query_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Record ids sharing at least one query symptom (ascending), with intersection sizes."""
+        postings = [self.indices[self.indptr[s]:self.indptr[s + 1]] for s in query_ids]
+        if not postings:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+        if len(postings) == 1:
+            return postings[0], np.ones(len(postings[0]), dtype=np.int64)
+        hits = np.concatenate(postings)
+        if len(hits) * 16 < self.num_records:
+            # Few hits: sorting them is cheaper than a dense count over every record
+            return np.unique(hits, return_counts=True)
+        counts = np.bincount(hits, minlength=self.num_records)
+        candidates = np.flatnonzero(counts)
+        return candidates, counts[candidates]
+
+    def top_matches(self, symptoms: List[str], severity: str, top_k: int = TOP_K) -> List[Tuple[str, float]]:
+        """
+        Records whose Jaccard overlap with `symptoms`, times 0.8 on a severity
+        mismatch, is at least 0.6. Returns up to top_k (label, weight) pairs,
+        best first, ties in training-data order.
+        """
+        query = set(symptoms)
+        query_ids = [self.symptom_ids[s] for s in query if s in self.symptom_ids]
+        candidates, intersection = self._candidates(query_ids)
+        if len(candidates) == 0:
+            return []
+
+        union = len(query) + self.record_sizes[candidates].astype(np.int64) - intersection
+        overlap = intersection / union
+        severity_id = self.severity_ids.get(severity, -1)
+        weight = overlap * np.where(self.record_severity[candidates] == severity_id, 1.0, SEVERITY_MISMATCH_WEIGHT)
+
+        keep = weight >= MATCH_THRESHOLD
+        candidates, weight = candidates[keep], weight[keep]
+        best = np.argsort(-weight, kind="stable")[:top_k]
+        return [(self.labels[self.record_label[candidates[i]]], float(weight[i])) for i in best]
@@ -0,0 +1,187 @@
+# token_cache.py - Cached, length-bucketed tokenization for the classifier and NER models
+"""
+The texts the models see are highly repetitive: llm_process_conversation builds
+"Patient presents with X and Y for N days. Symptoms are mild in severity." from
+a small vocabulary, and the same summary is classified again on every re-check
+of a conversation. CachedTokenizer sits in front of a Hugging Face (fast)
+tokenizer and:
+
+ - keeps an LRU of encodings keyed by (text, max_length): token ids, plus the
+   word ids and character offsets NER needs to map tags back to the text; only
+   the texts of a batch that are not cached go through the tokenizer, in one call
+ - pads a batch to the smallest length bucket (TOKEN_PAD_BUCKETS) that fits its
+   longest text instead of to that text's exact length, so the forward pass sees
+   a handful of shapes rather than one per length (backends that specialise or
+   cache per shape reuse their work); a single text is not padded at all
+
+Attention masks are built from the lengths, so the padded positions are
+ignored exactly as with the tokenizer's own padding=True.
+
+Buckets cost extra padding, which is pure overhead for eager PyTorch, so
+DiseaseModel only uses them with the TorchScript and ONNX backends (a runner's
+bucketed_padding); the encoding cache is on for every backend.
+
+Used by model_registry.DiseaseModel.predict and combined_inference.py (NER and
+classifier). bench_tokenization.py measures the tokenizer's share of
+end-to-end latency with and without it.
+
+Metrics (service_metrics):
+ - tokenizer.<name>.hits / misses   counters, per text
+ - tokenizer.<name>.entries         gauge, cached encodings
+ - tokenizer.<name>.seconds         histogram, time per call (cache lookups, tokenizing, padding)
+
+Config (env):
+ - TOKEN_CACHE               1 / 0 (0: every call goes to the tokenizer with padding=True)
+ - TOKEN_CACHE_MAX_ENTRIES   encodings kept per tokenizer (default 8192)
+ - TOKEN_PAD_BUCKETS         comma-separated padded lengths (default 16,32,64,128,256; "" = pad to longest)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from service_metrics import metrics
+
+# --- CONFIG ---
+TOKEN_CACHE = os.getenv("TOKEN_CACHE", "1") == "1"
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "8192"))
+TOKEN_PAD_BUCKETS = tuple(int(b) for b in os.getenv("TOKEN_PAD_BUCKETS", "16,32,64,128,256").split(",") if b.strip())
+
+# Histogram buckets for tokenizer.<name>.seconds (tokenizing is microseconds to milliseconds)
+SECONDS_BUCKETS = (1e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1)
+
+
+class Encoding(NamedTuple):
+    """One text, tokenized and truncated, special tokens included."""
+    ids: np.ndarray                                # int64 token ids
+    word_ids: Tuple[Optional[int], ...]            # word index per token, None for special tokens
+    offsets: Tuple[Tuple[int, int], ...]           # (start, end) character span per token
+
+
+class CachedTokenizer:
+    """LRU of encodings in front of a tokenizer, with length-bucketed padding for batches."""
+
+    def __init__(self, tokenizer, name: str, max_length: int = 128, max_entries: int = TOKEN_CACHE_MAX_ENTRIES,
+                 buckets: Sequence[int] = TOKEN_PAD_BUCKETS, enabled: bool = TOKEN_CACHE):
+        self.tokenizer = tokenizer
+        self.name = name
+        self.max_length = max_length
+        self.max_entries = max_entries
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # A fast tokenizer's Rust backend is not safe to call from several threads at once
+        # with truncation settings, so misses are tokenized one call at a time
+        self._tokenize_lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int], Encoding]" = OrderedDict()  # LRU first
+        self.input_names = [n for n in ("input_ids", "token_type_ids", "attention_mask")
+                            if n in getattr(tokenizer, "model_input_names", ("input_ids", "attention_mask"))]
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
+    # ---- encodings ----
+
+    def _tokenize(self, texts: List[str], max_length: int) -> List[Encoding]:
+        is_fast = getattr(self.tokenizer, "is_fast", False)
+        with self._tokenize_lock:
+            enc = self.tokenizer(texts, truncation=True, max_length=max_length, return_offsets_mapping=is_fast)
+        encodings = []
+        for i, ids in enumerate(enc["input_ids"]):
+            word_ids = tuple(enc.word_ids(i)) if is_fast else (None,) * len(ids)
+            offsets = tuple(map(tuple, enc["offset_mapping"][i])) if is_fast else ((0, 0),) * len(ids)
+            encodings.append(Encoding(np.asarray(ids, dtype=np.int64), word_ids, offsets))
+        return encodings
+
+    def encode_batch(self, texts: Sequence[str], max_length: Optional[int] = None) -> List[Encoding]:
+        """Encoding per text; cached ones come from the LRU, the rest are tokenized together."""
+        max_length = max_length or self.max_length
+        if not self.enabled:
+            return self._tokenize(list(texts), max_length)
+        found: Dict[int, Encoding] = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                entry = self._entries.get((text, max_length))
+                if entry is not None:
+                    self._entries.move_to_end((text, max_length))
+                    found[i] = entry
+        missing = sorted({text for i, text in enumerate(texts) if i not in found})
+        hits = len(found)
+        if missing:
+            new = dict(zip(missing, self._tokenize(missing, max_length)))
+            with self._lock:
+                for text, entry in new.items():
+                    self._entries[(text, max_length)] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                size = len(self._entries)
+            metrics.set_gauge(f"tokenizer.{self.name}.entries", size)
+            for i, text in enumerate(texts):
+                if i not in found:
+                    found[i] = new[text]
+        metrics.inc(f"tokenizer.{self.name}.hits", hits)
+        metrics.inc(f"tokenizer.{self.name}.misses", len(texts) - hits)
+        return [found[i] for i in range(len(texts))]
+
+    def encode(self, text: str, max_length: Optional[int] = None) -> Encoding:
+        return self.encode_batch([text], max_length)[0]
+
+    # ---- model inputs ----
+
+    def padded_length(self, longest: int, max_length: Optional[int] = None) -> int:
+        """Smallest bucket that fits longest, but never past max_length (or longest if that is more)."""
+        limit = max(longest, max_length or self.max_length)
+        for bucket in self.buckets:
+            if bucket >= longest:
+                return min(bucket, limit)
+        return longest
+
+    def pad(self, encodings: Sequence[Encoding], return_tensors: str = "pt", max_length: Optional[int] = None) -> Dict:
+        """input_ids / attention_mask (/ token_type_ids) for encodings, padded to their length bucket."""
+        longest = max(len(e.ids) for e in encodings)
+        # A single text needs no padding; making it longer would only add work
+        length = longest if len(encodings) == 1 else self.padded_length(longest, max_length)
+        input_ids = np.full((len(encodings), length), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        left = getattr(self.tokenizer, "padding_side", "right") == "left"
+        for row, encoding in enumerate(encodings):
+            n = len(encoding.ids)
+            span = slice(length - n, length) if left else slice(0, n)
+            input_ids[row, span] = encoding.ids
+            attention_mask[row, span] = 1
+        arrays = {"input_ids": input_ids, "attention_mask": attention_mask,
+                  "token_type_ids": np.zeros_like(input_ids)}
+        inputs = {name: arrays[name] for name in self.input_names}
+        if return_tensors == "pt":
+            import torch
+
+            inputs = {name: torch.from_numpy(array) for name, array in inputs.items()}
+        return inputs
+
+    def __call__(self, texts: Sequence[str], return_tensors: str = "pt", max_length: Optional[int] = None) -> Dict:
+        """Model inputs for texts (the drop-in for tokenizer(texts, truncation=True, padding=True, ...))."""
+        with metrics.timer(f"tokenizer.{self.name}.seconds", SECONDS_BUCKETS):
+            if not self.enabled:
+                return dict(self.tokenizer(list(texts), return_tensors=return_tensors, truncation=True, padding=True,
+                                           max_length=max_length or self.max_length))
+            return self.pad(self.encode_batch(texts, max_length), return_tensors, max_length)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        metrics.set_gauge(f"tokenizer.{self.name}.entries", 0)
+
+    def stats(self) -> Dict:
+        hits = metrics.get_counter(f"tokenizer.{self.name}.hits")
+        misses = metrics.get_counter(f"tokenizer.{self.name}.misses")
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "buckets": list(self.buckets),
+        }
@@ -290,4 +290,11 @@ with open(os.path.join(MODEL_OUT, "metrics_summary.json"), "w", encoding="utf-8"
     json.dump(metrics_summary, fh, indent=2)
 print("Saved metrics summary to:", os.path.join(MODEL_OUT, "metrics_summary.json"))
 
-print("🔥 Training + evaluation complete.")
\ No newline at end of file
+print("🔥 Training + evaluation complete.")
+
+# ---------------------------
+# Export CPU inference artifacts (TorchScript / ONNX, with a parity check)
+# ---------------------------
+if os.getenv("EXPORT_AFTER_TRAINING", "1") == "1":
+    from export_disease_model import export
+    export(MODEL_OUT, tokenizer=tokenizer, model=trainer.model)
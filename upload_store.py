@@ -0,0 +1,323 @@
+# upload_store.py - Streamed file uploads, spooled to disk and referenced by id
+"""
+Attachments used to travel inside the chat JSON as base64 strings: a third
+larger on the wire, parsed into one multi-megabyte Python string by Pydantic,
+decoded again in memory for every turn they were sent with. POST /files
+(backend_service.py) streams the upload straight to a file instead and hands
+back an id; /chat_with_ai and /chat_with_ai_stream take {"file_id": ...} in
+ChatRequest.files.
+
+ - multipart/form-data (field "file") is parsed incrementally with
+   python-multipart, the file part written to disk chunk by chunk as it
+   arrives; any other content type is taken as the raw file (name from the
+   ?name= query parameter)
+ - the size limit is enforced while streaming: the upload is aborted and the
+   partial file deleted as soon as it passes UPLOAD_MAX_BYTES (a declared
+   Content-Length over the limit is refused before reading)
+ - the SHA-256 is computed on the way through
+ - files live in UPLOAD_DIR as <id>.bin with an <id>.json sidecar, so every
+   uvicorn worker on the host can resolve an id; ids are random and an id only
+   resolves for the user who uploaded it
+ - files expire UPLOAD_TTL_SECONDS after the upload (swept at most once a minute)
+
+Readers get the path (document_ingest.py extracts PDFs from it directly, the
+pool processes open the file themselves) or, for small text files, the bytes.
+
+Metrics (service_metrics):
+ - uploads.files / uploads.bytes      counters, stored uploads
+ - uploads.rejected                   counter, over the limit or malformed
+ - uploads.seconds                    histogram, time from first to last byte
+ - uploads.bytes_per_second           histogram, throughput per upload
+
+Config (env):
+ - UPLOAD_DIR            directory for uploaded files (default <tmp>/medimate_uploads)
+ - UPLOAD_MAX_BYTES      largest file accepted (default 20 MB)
+ - UPLOAD_TTL_SECONDS    lifetime of an upload (default 86400)
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+
+from service_metrics import metrics
+
+# --- CONFIG ---
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "medimate_uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_TTL_SECONDS = float(os.getenv("UPLOAD_TTL_SECONDS", "86400"))
+
+SWEEP_INTERVAL_SECONDS = 60
+# Histogram buckets for uploads.bytes_per_second (1 KB/s .. 1 GB/s)
+THROUGHPUT_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9)
+
+
+class UploadError(ValueError):
+    """Malformed upload (bad multipart body, no file part, ...)."""
+
+
+class UploadTooLarge(UploadError):
+    """The file is over UPLOAD_MAX_BYTES."""
+
+
+class StoredFile(NamedTuple):
+    file_id: str
+    user_id: int
+    name: str
+    content_type: str
+    size: int
+    sha256: str
+    path: str
+    created: float           # epoch seconds
+
+    def public(self) -> Dict:
+        """What the client sees (no server path, no owner)."""
+        return {"file_id": self.file_id, "name": self.name, "type": self.content_type,
+                "size": self.size, "sha256": self.sha256}
+
+
+class _Spool:
+    """Destination of one upload: writes chunks to <id>.bin, hashing and counting as it goes."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.file_id = secrets.token_urlsafe(16)
+        self.path = os.path.join(directory, f"{self.file_id}.bin")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"file is over the {self.max_bytes / 1e6:.1f} MB limit")
+        self.digest.update(data)
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _MultipartFile:
+    """python-multipart callbacks that send the (single) file part of a form to a _Spool."""
+
+    def __init__(self, new_spool):
+        self.new_spool = new_spool
+        self.spool: Optional[_Spool] = None
+        self.name: Optional[str] = None
+        self.content_type = "application/octet-stream"
+        self._headers: Dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+        self._writing = False
+
+    def callbacks(self) -> Dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._field = self._value = b""
+
+    def on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def on_headers_finished(self):
+        from python_multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") != b"file" or b"filename" not in options:
+            return  # other form fields are ignored
+        if self.spool is not None:
+            raise UploadError("one file per upload")
+        self.name = options[b"filename"].decode("utf-8", errors="replace")
+        self.content_type = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+        self.spool = self.new_spool()
+        self._writing = True
+
+    def on_part_data(self, data, start, end):
+        if self._writing:
+            self.spool.write(data[start:end])
+
+    def on_part_end(self):
+        self._writing = False
+
+
+class UploadStore:
+    """Uploaded files on disk, by id, per user, with a size limit and a lifetime."""
+
+    def __init__(self, directory: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES,
+                 ttl_seconds: float = UPLOAD_TTL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    # ---- writing ----
+
+    async def save(self, user_id: int, content_type: str, chunks: AsyncIterator[bytes],
+                   name: Optional[str] = None) -> StoredFile:
+        """
+        Store the upload in chunks (a request body): multipart/form-data with a "file"
+        field, or the raw file. Raises UploadTooLarge / UploadError; nothing is kept then.
+        """
+        self.sweep()
+        started = None
+        multipart = content_type.lower().startswith("multipart/form-data")
+        if multipart:
+            from python_multipart.multipart import MultipartParser, parse_options_header
+
+            _, params = parse_options_header(content_type)
+            if b"boundary" not in params:
+                metrics.inc("uploads.rejected")
+                raise UploadError("missing multipart boundary")
+            form = _MultipartFile(lambda: _Spool(self.directory, self.max_bytes))
+            parser = MultipartParser(params[b"boundary"], form.callbacks())
+        else:
+            raw = _Spool(self.directory, self.max_bytes)
+        try:
+            async for chunk in chunks:
+                if started is None:
+                    started = time.perf_counter()
+                if multipart:
+                    parser.write(chunk)
+                else:
+                    raw.write(chunk)
+            if multipart:
+                parser.finalize()
+                if form.spool is None:
+                    raise UploadError('no file in the form (expected a "file" field)')
+                spool, name, kind = form.spool, form.name, form.content_type
+            else:
+                spool, kind = raw, content_type or "application/octet-stream"
+            spool.close()
+        except Exception as e:
+            metrics.inc("uploads.rejected")
+            spool = form.spool if multipart else raw
+            if spool is not None:
+                spool.discard()
+            if isinstance(e, UploadError):
+                raise
+            raise UploadError(f"invalid upload: {e}") from e
+
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        stored = StoredFile(spool.file_id, user_id, os.path.basename(name or "upload"), kind,
+                            spool.size, spool.digest.hexdigest(), spool.path, time.time())
+        meta_path = os.path.join(self.directory, f"{stored.file_id}.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in stored._asdict().items() if k != "path"}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        metrics.inc("uploads.files")
+        metrics.inc("uploads.bytes", stored.size)
+        metrics.observe("uploads.seconds", seconds)
+        if seconds > 0:
+            metrics.observe("uploads.bytes_per_second", stored.size / seconds, THROUGHPUT_BUCKETS)
+        print(f"[UPLOAD] {stored.name}: {stored.size} bytes in {seconds * 1000:.0f} ms (id {stored.file_id})")
+        return stored
+
+    # ---- reading ----
+
+    def get(self, file_id: str, user_id: int) -> Optional[StoredFile]:
+        """The user's upload with this id, or None (unknown, someone else's, or expired)."""
+        if not file_id or not all(c.isalnum() or c in "-_" for c in file_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{file_id}.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stored = StoredFile(path=os.path.join(self.directory, f"{file_id}.bin"), **meta)
+        if stored.user_id != user_id or self._expired(stored) or not os.path.exists(stored.path):
+            return None
+        return stored
+
+    def read_bytes(self, stored: StoredFile) -> bytes:
+        with open(stored.path, "rb") as f:
+            return f.read()
+
+    # ---- removal ----
+
+    def _expired(self, stored: StoredFile) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored.created > self.ttl_seconds
+
+    def _remove(self, file_id: str):
+        for suffix in (".bin", ".json"):
+            try:
+                os.remove(os.path.join(self.directory, file_id + suffix))
+            except OSError:
+                pass
+
+    def delete(self, file_id: str, user_id: int) -> bool:
+        stored = self.get(file_id, user_id)
+        if stored is None:
+            return False
+        self._remove(file_id)
+        return True
+
+    def sweep(self, force: bool = False) -> int:
+        """Delete expired uploads (and orphaned partial files); at most once a minute unless forced."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+                return 0
+            self._last_sweep = now
+        if self.ttl_seconds <= 0:
+            return 0
+        removed = 0
+        try:
+            entries: List[os.DirEntry] = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            file_id, ext = os.path.splitext(entry.name)
+            try:
+                old = now - entry.stat().st_mtime > self.ttl_seconds
+            except OSError:
+                continue
+            if old and ext in (".json", ".bin"):
+                self._remove(file_id)
+                removed += ext == ".json"
+        return removed
+
+    def stats(self) -> Dict:
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "files": metrics.get_counter("uploads.files"),
+            "bytes": metrics.get_counter("uploads.bytes"),
+            "rejected": metrics.get_counter("uploads.rejected"),
+            "throughput": metrics.histogram("uploads.bytes_per_second"),
+        }
+
+
+# Shared instance for the backend process
+upload_store = UploadStore()
@@ -1,5 +1,5 @@
 # user_model.py – SQLite tables (Ensure the engine variable is correctly named/exported)
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import datetime
@@ -28,6 +28,14 @@ class HealthRecord(Base):
     raw_ehr_text = Column(Text)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
+class ConversationState(Base):
+    # Chat state per user, for CONVERSATION_STORE=sqlite (conversation_store.py)
+    __tablename__ = "conversation_states"
+    user_id = Column(Integer, primary_key=True)
+    state = Column(Text)  # JSON: history, diagnosis, file_content
+    size_bytes = Column(Integer)
+    updated_at = Column(Float, index=True)  # unix time of the last save
+
 def create_db_tables():
     Base.metadata.create_all(bind=Engine)
 
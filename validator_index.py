@@ -0,0 +1,287 @@
+# validator_index.py - Compiled, memory-mapped index for PredictionValidator
+"""
+On-disk form of everything PredictionValidator derives from its JSONL datasets.
+
+Building a validator used to mean json.loads on every line of the train / val /
+test files, then rebuilding symptom_disease_map, disease_symptom_map,
+disease_severity_map and the O(n*k^2) symptom_pairs_map. That work now happens
+once per dataset version. The result is written to a directory keyed on a
+SHA-256 of the dataset files' contents:
+
+    <VALIDATOR_INDEX_DIR>/<fingerprint>/
+        meta.json                    vocabularies (symptoms, severities, diseases), dataset sizes
+        match_indptr.npy             SymptomMatchIndex CSR: symptom -> training records
+        match_indices.npy
+        record_sizes.npy             per-record distinct-symptom count, severity id, label id
+        record_severity.npy
+        record_label.npy
+        symptom_disease_{keys,indptr,indices}.npy   CSR symptom x disease matrix
+        disease_symptom_{keys,indptr,indices}.npy   its transpose, disease -> symptoms
+        pair_symptoms.npy            (n_pairs, 2) symptom ids of each co-occurring pair
+        pair_disease_indptr.npy      CSR pair -> diseases
+        pair_disease_indices.npy
+        severity_counts.npy          disease x severity record counts
+
+Arrays are opened with np.load(mmap_mode="r"), so every process and worker on
+the host shares the same page-cache copy and loading costs milliseconds. Editing
+any dataset file changes the fingerprint and the next validator rebuilds the
+index. Directories are written under a temporary name and renamed into place,
+so concurrent workers never see a half-written index.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from severity_table import SeverityCountTable
+from symptom_match_index import SymptomMatchIndex
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+VALIDATOR_INDEX_CACHE = os.getenv("VALIDATOR_INDEX_CACHE", "true").lower() == "true"
+# Empty: a .validator_index directory next to the dataset files
+VALIDATOR_INDEX_DIR = os.getenv("VALIDATOR_INDEX_DIR", "")
+
+FORMAT_VERSION = 1
+_READ_CHUNK_BYTES = 1 << 20
+
+ARRAY_NAMES = (
+    "match_indptr", "match_indices", "record_sizes", "record_severity", "record_label",
+    "symptom_disease_keys", "symptom_disease_indptr", "symptom_disease_indices",
+    "disease_symptom_keys", "disease_symptom_indptr", "disease_symptom_indices",
+    "pair_symptoms", "pair_disease_indptr", "pair_disease_indices",
+    "severity_counts",
+)
+
+
+def dataset_fingerprint(paths: Dict[str, str]) -> str:
+    """SHA-256 over the format version and the bytes of each dataset file (by dataset type)."""
+    digest = hashlib.sha256(f"validator-index-v{FORMAT_VERSION}".encode())
+    for dataset_type in sorted(paths):
+        digest.update(f"\0{dataset_type}\0".encode())
+        with open(paths[dataset_type], "rb") as f:
+            for chunk in iter(lambda: f.read(_READ_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_root(paths: Dict[str, str]) -> str:
+    """Directory holding compiled indices for these dataset files."""
+    if VALIDATOR_INDEX_DIR:
+        return VALIDATOR_INDEX_DIR
+    first = paths.get("training") or next(iter(paths.values()))
+    return os.path.join(os.path.dirname(os.path.abspath(first)), ".validator_index")
+
+
+def _ordered_csr(rows: Dict):
+    """(indptr, indices) for an insertion-ordered {key: {value id: None}} mapping, rows in key order."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in rows.values()], out=indptr[1:])
+    indices = np.fromiter((i for values in rows.values() for i in values), dtype=np.int32, count=int(indptr[-1]))
+    return indptr, indices
+
+
+class CompiledValidatorIndex:
+    """The arrays and vocabularies of one compiled index, plus the dict views PredictionValidator uses."""
+
+    def __init__(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        self.meta = meta
+        self.arrays = arrays
+        self.symptoms: List[str] = meta["symptoms"]
+        self.diseases: List[str] = meta["diseases"]
+        self.raw_severities: List[str] = meta["raw_severities"]
+        self.dataset_sizes: Dict[str, int] = meta["dataset_sizes"]
+
+    # ----------------------------------------------------------------- build
+
+    @classmethod
+    def from_validator(cls, validator, dataset_sizes: Dict[str, int]) -> "CompiledValidatorIndex":
+        """
+        Compile the indices of a validator that has just parsed its datasets.
+
+        Walks training_data once more, the way _build_symptom_indices does, to
+        record first-seen order: the restored sets and dicts are then filled in
+        the same order as freshly built ones and iterate identically (ties in
+        _find_pair_matches / _find_symptom_matches come out the same).
+        """
+        match_index = validator.match_index
+        match_arrays = match_index.to_arrays()
+
+        # Interned vocabularies; match-index ids come first and are shared
+        symptom_ids = dict(match_index.symptom_ids)
+        disease_ids = {disease: i for i, disease in enumerate(match_index.labels)}
+        symptom_diseases: Dict[int, Dict[int, None]] = {}   # ordered sets
+        disease_symptoms: Dict[int, Dict[int, None]] = {}
+        pair_diseases: Dict[tuple, Dict[int, None]] = {}
+
+        for record in validator.training_data:
+            disease = disease_ids.setdefault(record.get("label", "").strip(), len(disease_ids))
+            symptoms = record.get("symptoms", [])
+
+            for symptom in symptoms:
+                symptom_id = symptom_ids.setdefault(symptom.strip().lower(), len(symptom_ids))
+                symptom_diseases.setdefault(symptom_id, {})[disease] = None
+                disease_symptoms.setdefault(disease, {})[symptom_id] = None
+
+            if len(symptoms) >= 2:
+                for i in range(len(symptoms)):
+                    for j in range(i + 1, len(symptoms)):
+                        pair = tuple(sorted([symptoms[i].lower().strip(), symptoms[j].lower().strip()]))
+                        key = (symptom_ids.setdefault(pair[0], len(symptom_ids)),
+                               symptom_ids.setdefault(pair[1], len(symptom_ids)))
+                        pair_diseases.setdefault(key, {})[disease] = None
+
+        table = validator.severity_table
+        severity_counts = table.counts[[table.disease_ids[d] for d in disease_ids]].astype(np.int32)
+
+        sd_keys = np.array(list(symptom_diseases), dtype=np.int32)
+        sd_indptr, sd_indices = _ordered_csr(symptom_diseases)
+        ds_keys = np.array(list(disease_symptoms), dtype=np.int32)
+        ds_indptr, ds_indices = _ordered_csr(disease_symptoms)
+        pair_keys = np.array(list(pair_diseases), dtype=np.int32).reshape(len(pair_diseases), 2)
+        pair_indptr, pair_indices = _ordered_csr(pair_diseases)
+
+        arrays = {
+            "match_indptr": match_arrays["indptr"],
+            "match_indices": match_arrays["indices"],
+            "record_sizes": match_arrays["record_sizes"],
+            "record_severity": match_arrays["record_severity"],
+            "record_label": match_arrays["record_label"],
+            "symptom_disease_keys": sd_keys,
+            "symptom_disease_indptr": sd_indptr,
+            "symptom_disease_indices": sd_indices,
+            "disease_symptom_keys": ds_keys,
+            "disease_symptom_indptr": ds_indptr,
+            "disease_symptom_indices": ds_indices,
+            "pair_symptoms": pair_keys,
+            "pair_disease_indptr": pair_indptr,
+            "pair_disease_indices": pair_indices,
+            "severity_counts": severity_counts,
+        }
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "symptoms": list(symptom_ids),
+            "match_severities": list(match_index.severity_ids),
+            "diseases": list(disease_ids),
+            "raw_severities": list(table.severity_ids),
+            "dataset_sizes": dict(dataset_sizes),
+        }
+        return cls(meta, arrays)
+
+    # ------------------------------------------------------------ disk format
+
+    def save(self, directory: str):
+        """Write the index to `directory` atomically (temp dir + rename). Loses a race quietly."""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+        try:
+            for name in ARRAY_NAMES:
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(self.arrays[name]))
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+            os.rename(tmp, directory)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(directory):  # not just another worker finishing first
+                raise
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["CompiledValidatorIndex"]:
+        """Memory-map a compiled index, or None if it is missing or from another format version."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("format_version") != FORMAT_VERSION:
+                return None
+            arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ARRAY_NAMES}
+        except (OSError, ValueError):
+            return None
+        return cls(meta, arrays)
+
+    # --------------------------------------------------------------- views
+
+    def match_index(self) -> SymptomMatchIndex:
+        num_symptoms = len(self.arrays["match_indptr"]) - 1
+        return SymptomMatchIndex.from_arrays(
+            {
+                "indptr": self.arrays["match_indptr"],
+                "indices": self.arrays["match_indices"],
+                "record_sizes": self.arrays["record_sizes"],
+                "record_severity": self.arrays["record_severity"],
+                "record_label": self.arrays["record_label"],
+            },
+            symptoms=self.symptoms[:num_symptoms],
+            severities=self.meta["match_severities"],
+            labels=self.diseases,
+        )
+
+    def _ordered_map(self, name: str, key_names: List[str], value_names: List[str]):
+        """defaultdict(set) from a <name>_keys / _indptr / _indices CSR, filled in compiled order."""
+        result = defaultdict(set)
+        keys = self.arrays[f"{name}_keys"].tolist()
+        indptr = self.arrays[f"{name}_indptr"].tolist()
+        indices = self.arrays[f"{name}_indices"].tolist()
+        for row, key in enumerate(keys):
+            result[key_names[key]] = {value_names[i] for i in indices[indptr[row]:indptr[row + 1]]}
+        return result
+
+    def symptom_disease_map(self):
+        return self._ordered_map("symptom_disease", self.symptoms, self.diseases)
+
+    def disease_symptom_map(self):
+        return self._ordered_map("disease_symptom", self.diseases, self.symptoms)
+
+    def symptom_pairs_map(self):
+        pairs_map = defaultdict(set)
+        indptr = self.arrays["pair_disease_indptr"].tolist()
+        indices = self.arrays["pair_disease_indices"].tolist()
+        for pair_id, (a, b) in enumerate(self.arrays["pair_symptoms"].tolist()):
+            pairs_map[(self.symptoms[a], self.symptoms[b])] = {
+                self.diseases[d] for d in indices[indptr[pair_id]:indptr[pair_id + 1]]
+            }
+        return pairs_map
+
+    def severity_table(self) -> SeverityCountTable:
+        return SeverityCountTable(self.diseases, self.raw_severities, np.asarray(self.arrays["severity_counts"]))
+
+    def disease_severity_map(self):
+        """disease -> list of severities, with the training counts (record order within a list is not kept)."""
+        severity_map = defaultdict(list)
+        counts = self.arrays["severity_counts"]
+        for disease_id, severity_id in zip(*np.nonzero(counts)):
+            severity_map[self.diseases[disease_id]].extend(
+                [self.raw_severities[severity_id]] * int(counts[disease_id, severity_id]))
+        return severity_map
+
+
+def load_or_compile(paths: Dict[str, str], build) -> Optional[CompiledValidatorIndex]:
+    """
+    The compiled index for these dataset files, or None after calling build().
+
+    On a miss, build() must load the datasets and build the validator's indices
+    and return (validator, dataset_sizes); the result is compiled and saved for
+    the next process. Failures to write the cache are logged, not raised.
+    """
+    fingerprint = dataset_fingerprint(paths)
+    directory = os.path.join(index_root(paths), fingerprint)
+    compiled = CompiledValidatorIndex.load(directory)
+    if compiled is not None:
+        print(f"[OK] Loaded compiled validator index {fingerprint[:12]} from {directory}")
+        return compiled
+
+    validator, dataset_sizes = build()
+    try:
+        CompiledValidatorIndex.from_validator(validator, dataset_sizes).save(directory)
+        print(f"[OK] Compiled validator index {fingerprint[:12]} to {directory}")
+    except OSError as e:
+        print(f"[WARNING] Could not write validator index to {directory}: {e}")
+    return None